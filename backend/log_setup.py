@@ -0,0 +1,139 @@
+"""后台日志写入
+
+所有日志记录先放入内存队列（QueueHandler），由 QueueListener 的后台线程写入控制台和按大小轮转的日志文件，
+事件循环中的调用只做一次入队，不再同步等待磁盘 I/O。
+
+高频调用点（100 ms 周期的监控循环、每个 WebSocket 通知帧、每次状态广播）按调用位置
+（文件路径 + 行号）限流：每个位置使用令牌桶，超出速率的 INFO/DEBUG 记录在入队前直接丢弃并计数，
+该位置下一条被放行的记录后附上被抑制的条数。WARNING 及以上级别不限流。
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from collections import Counter
+
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    """按调用位置 (pathname, lineno) 限流的过滤器"""
+
+    def __init__(self, rate=2.0, burst=10, max_level=logging.INFO):
+        """
+        Args:
+            rate: 每个调用位置每秒允许的记录数（令牌补充速率）
+            burst: 每个调用位置允许的突发条数（令牌桶容量）
+            max_level: 高于该级别的记录不限流
+        """
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_level = max_level
+        self._buckets = {}      # (pathname, lineno) -> [令牌数, 上次更新时间, 未报告的抑制条数]
+        self._lock = threading.Lock()
+        self.suppressed = Counter()
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            tokens = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1.0:
+                bucket[0] = tokens
+                bucket[2] += 1
+                self.suppressed[key] += 1
+                return False
+            bucket[0] = tokens - 1.0
+            pending, bucket[2] = bucket[2], 0
+        if pending:
+            record.msg = f"{record.getMessage()}（此前已抑制该位置 {pending} 条日志）"
+            record.args = None
+        return True
+
+    @property
+    def suppressed_total(self):
+        return sum(self.suppressed.values())
+
+    def stats(self, top=10):
+        """被抑制最多的调用位置 [(\"文件:行号\", 条数), ...]"""
+        with self._lock:
+            return [(f"{path}:{lineno}", count) for (path, lineno), count in self.suppressed.most_common(top)]
+
+
+_listener = None
+_rate_filter = None
+_queue_handler = None
+_direct_handlers = []   # stop_logging 后直接挂在根日志记录器上的写入处理器
+
+
+def setup_logging(log_file, level=logging.INFO, max_bytes=5 * 1024 * 1024, backup_count=5,
+                  rate=2.0, burst=10, fmt=DEFAULT_FORMAT, console=True):
+    """配置根日志记录器：队列 + 后台写入线程 + 轮转文件 + 按位置限流
+
+    重复调用时先停止之前的后台线程。
+
+    Returns:
+        RateLimitFilter: 限流过滤器（可读取 suppressed / stats()）
+    """
+    global _listener, _rate_filter, _queue_handler, _direct_handlers
+    stop_logging()
+
+    formatter = logging.Formatter(fmt)
+    handlers = [logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    _rate_filter = RateLimitFilter(rate=rate, burst=burst)
+    queue_handler.addFilter(_rate_filter)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in _direct_handlers:
+        handler.close()
+    _direct_handlers = []
+    root.addHandler(queue_handler)
+    _queue_handler = queue_handler
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _rate_filter
+
+
+def stop_logging():
+    """写出被抑制日志的汇总，等待后台线程把队列中的记录写完，再把写入处理器直接挂回根日志记录器
+
+    之后的记录（如 uvicorn 关闭时的日志）同步写出，不经过队列和限流；处理器由 logging.shutdown 关闭。
+    """
+    global _listener, _queue_handler, _direct_handlers
+    if _listener is None:
+        return
+    if _rate_filter is not None and _rate_filter.suppressed_total:
+        sites = ", ".join(f"{site} ×{count}" for site, count in _rate_filter.stats(5))
+        logging.getLogger(__name__).warning(f"运行期间共抑制 {_rate_filter.suppressed_total} 条高频日志，最多的位置: {sites}")
+    _listener.stop()
+    root = logging.getLogger()
+    if _queue_handler is not None:
+        root.removeHandler(_queue_handler)
+        _queue_handler = None
+    _direct_handlers = list(_listener.handlers)
+    for handler in _direct_handlers:
+        root.addHandler(handler)
+    _listener = None
+
+
+atexit.register(stop_logging)
@@ -4,8 +4,17 @@ from typing import List
 import json
 import logging
 
+from core_api import metrics
+
 logger = logging.getLogger(__name__)
 
+WS_CONNECTIONS = metrics.gauge("websocket_connections", "前端WebSocket连接数")
+BROADCAST_IN_FLIGHT = metrics.gauge("broadcast_in_flight", "正在发送的广播数（广播积压）")
+BROADCAST_SECONDS = metrics.histogram(
+    "broadcast_seconds", "一次广播发送给所有连接的耗时（秒）",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+BROADCAST_SEND_FAILURES = metrics.counter("broadcast_send_failures_total", "向WebSocket连接发送失败次数")
+
 # 创建PubSub终端
 pubsub_endpoint = PubSubEndpoint()
 
@@ -14,6 +23,7 @@ class Broadcaster:
     def __init__(self):
         self.subscriptions = {}  # 存储订阅信息
         self.active_connections: List[WebSocket] = []  # 存储活跃的WebSocket连接
+        WS_CONNECTIONS.set_function(lambda: len(self.active_connections))
         
     async def connect(self, websocket: WebSocket):
         """
@@ -35,12 +45,14 @@ class Broadcaster:
         广播消息给所有连接的客户端
         """
         disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"向WebSocket发送消息失败: {e}")
-                disconnected.append(connection)
+        with BROADCAST_IN_FLIGHT.track_inprogress(), BROADCAST_SECONDS.time():
+            for connection in self.active_connections:
+                try:
+                    await connection.send_text(json.dumps(message))
+                except Exception as e:
+                    BROADCAST_SEND_FAILURES.inc()
+                    logger.error(f"向WebSocket发送消息失败: {e}")
+                    disconnected.append(connection)
         
         # 清理断开连接
         for conn in disconnected:
@@ -1,13 +1,53 @@
-from .base_adapter import BaseAdapter
-from .printer_adapter import PrinterAdapter
-from .pump_adapter import PumpAdapter
-from .chi_adapter import CHIAdapter
-from .relay_adapter import RelayAdapter
-
-__all__ = [
-    'BaseAdapter',
-    'PrinterAdapter',
-    'PumpAdapter',
-    'CHIAdapter',
-    'RelayAdapter'
-] 
\ No newline at end of file
+"""设备适配器
+
+适配器模块在首次访问时才导入（PEP 562 模块级 __getattr__），
+服务启动时不会因为导入本包而加载 CHI 控制、泵/继电器代理等依赖。
+按设备类型创建适配器请使用 create_adapter()。
+"""
+import importlib
+
+# 导出名 -> (模块, 类名)
+_LAZY_EXPORTS = {
+    'BaseAdapter': ('.base_adapter', 'BaseAdapter'),
+    'PrinterAdapter': ('.printer_adapter', 'PrinterAdapter'),
+    'PumpAdapter': ('.pump_adapter', 'PumpAdapter'),
+    'CHIAdapter': ('.chi_adapter', 'CHIAdapter'),
+    'RelayAdapter': ('.relay_adapter', 'RelayAdapter'),
+}
+
+# 设备类型 -> 适配器导出名
+ADAPTER_REGISTRY = {
+    'printer': 'PrinterAdapter',
+    'pump': 'PumpAdapter',
+    'relay': 'RelayAdapter',
+    'chi': 'CHIAdapter',
+}
+
+__all__ = list(_LAZY_EXPORTS) + ['ADAPTER_REGISTRY', 'get_adapter_class', 'create_adapter']
+
+
+def __getattr__(name):
+    if name not in _LAZY_EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attr = _LAZY_EXPORTS[name]
+    value = getattr(importlib.import_module(module_name, __name__), attr)
+    globals()[name] = value  # 之后的访问不再经过 __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+def get_adapter_class(device_type):
+    """按设备类型（printer/pump/relay/chi）返回适配器类，首次调用时导入对应模块"""
+    try:
+        export_name = ADAPTER_REGISTRY[device_type]
+    except KeyError:
+        raise ValueError(f"未知的设备类型: {device_type}，可用: {', '.join(ADAPTER_REGISTRY)}") from None
+    return __getattr__(export_name) if export_name not in globals() else globals()[export_name]
+
+
+def create_adapter(device_type, **kwargs):
+    """按设备类型创建适配器实例"""
+    return get_adapter_class(device_type)(**kwargs)
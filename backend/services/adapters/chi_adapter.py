@@ -5,6 +5,7 @@ import logging
 import time
 import tempfile
 from typing import Dict, Any, Optional, List, Callable
+from functools import partialmethod
 from datetime import datetime
 from pathlib import Path
 import json
@@ -15,10 +16,17 @@ from .base_adapter import BaseAdapter
 
 # 添加项目根目录到系统路径，以便导入device_control
 # sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../'))) # REMOVED
-from device_control.control_chi import Setup, CV, LSV, CA, IT, OCP, EIS, DPV, SCV, CP, ACV, stop_all
+from device_control.chi_registry import TECHNIQUES, get_technique
+from device_control.chi_runtime import RuntimeEstimator
+from core_api import metrics
 
 logger = logging.getLogger(__name__)
 
+CHI_RUN_SECONDS = metrics.histogram(
+    "chi_run_seconds", "CHI测试实测耗时（秒，按数据文件写入时间计）", ["technique"],
+    buckets=(5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200))
+CHI_RUNS = metrics.counter("chi_runs_total", "CHI测试次数", ["technique", "result"])
+
 class CHIStatus:
     """CHI状态常量定义"""
     IDLE = "idle"
@@ -54,9 +62,23 @@ class CHIAdapter(BaseAdapter):
         self.file_name = None          # 文件名
         self.project_name = None       # 项目名称
         self.result_files = []         # 生成的结果文件
+        self.batch_steps = []          # 批处理宏的步骤状态列表
+        self.batch_index = 0           # 当前等待完成的批处理步骤索引
         
         # 文件监控间隔（秒）
         self.file_check_interval = 2.0
+        # 预计结束前后的快速轮询间隔与远离结束时的最长轮询间隔（秒）
+        self.fast_check_interval = 0.5
+        self.max_check_interval = 10.0
+        # 数据文件大小保持不变多久视为写入完成（秒）
+        self.file_settle_time = 1.0
+        self._settle_state = {}        # 文件路径 -> (大小, 首次观察到该大小的时间)
+        
+        # 测试时长估算（按参数签名记录实测耗时并在线修正）
+        self.runtime_estimator = RuntimeEstimator(
+            os.path.join(self.results_base_dir, "chi_runtime_history.json")
+        )
+        self.expected_duration = None  # 当前测试的预计时长（秒）
     
     async def initialize(self) -> bool:
         """初始化CHI连接
@@ -65,7 +87,8 @@ class CHIAdapter(BaseAdapter):
             连接是否成功
         """
         try:
-            # 创建Setup实例
+            # 创建Setup实例（control_chi 在首次使用时才导入）
+            from device_control.control_chi import Setup
             self.chi_setup = Setup(path=self.chi_path, folder=self.results_base_dir)
             
             # 确保结果目录存在
@@ -87,152 +110,44 @@ class CHIAdapter(BaseAdapter):
         """
         status = self._status.copy()
         
-        # 如果正在运行测试，添加测试时间信息
+        # 如果正在运行测试，添加测试时间和预计进度信息
         if self.start_time and self._status.get("status") == CHIStatus.RUNNING:
             elapsed = (datetime.now() - self.start_time).total_seconds()
             status["elapsed_seconds"] = elapsed
+            if self.expected_duration:
+                # 超出预计时长时进度停在99%，直到检测到结果文件
+                status["progress"] = min(elapsed / self.expected_duration, 0.99)
+                status["eta_seconds"] = max(self.expected_duration - elapsed, 0.0)
             
         return status
     
-    async def run_cv_test(self, file_name: str, params: Dict[str, Any]) -> bool:
-        """运行循环伏安法测试
+    def estimate_duration(self, technique: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """估算测试时长，供调度器和界面显示ETA
         
         Args:
-            file_name: 保存结果的文件名
-            params: 测试参数字典，包含CV所需的所有参数
+            technique: 技术名称
+            params: 测试参数字典
             
         Returns:
-            测试是否成功启动
+            包含 estimated_seconds、model_seconds 和 source 的字典
         """
-        if not self.chi_setup:
-            logger.error("CHI未初始化")
-            return False
-            
-        try:
-            # 如果当前有测试正在运行，先停止
-            if self._status.get("status") == CHIStatus.RUNNING:
-                await self.stop_test()
-            
-            # 设置测试参数
-            self.current_test = "CV"
-            self.file_name = file_name
-            self.test_params = params
-            self.start_time = datetime.now()
-            self.result_files = []
-            
-            # 创建CV实例
-            cv = CV(
-                ei=params.get("ei", 0),
-                eh=params.get("eh", 1),
-                el=params.get("el", -1),
-                v=params.get("v", 0.1),
-                si=params.get("si", 0.001),
-                cl=params.get("cl", 2),
-                sens=params.get("sens", 1e-5),
-                qt=params.get("qt", 2),
-                pn=params.get("pn", 'p'),
-                fileName=file_name,
-                autosens=params.get("autosens", False)
-            )
-            
-            # 保存技术实例，用于后续停止
-            self.current_technique = cv
-            
-            # 启动测试
-            cv.run()
-            
-            # 更新状态
-            await self.update_status({
-                "status": CHIStatus.RUNNING,
-                "test_type": "CV",
-                "file_name": file_name,
-                "params": params,
-                "start_time": self.start_time.isoformat()
-            })
-            
-            logger.info(f"CV测试启动成功: {file_name}")
-            
-            # 启动监控循环
-            asyncio.create_task(self._monitor_loop())
-            return True
-        except Exception as e:
-            self._last_error = str(e)
-            logger.error(f"CV测试启动失败: {e}", exc_info=True)
-            await self.update_status({
-                "status": CHIStatus.ERROR,
-                "error": str(e)
-            })
-            return False
+        estimated, source = self.runtime_estimator.estimate(technique, params)
+        return {
+            "technique": get_technique(technique).name,
+            "estimated_seconds": estimated,
+            "model_seconds": self.runtime_estimator.model_estimate(technique, params),
+            "source": source
+        }
     
-    async def run_lsv_test(self, file_name: str, params: Dict[str, Any]) -> bool:
-        """运行线性扫描伏安法测试
+    async def run_test(self, technique: str, file_name: str, params: Dict[str, Any]) -> bool:
+        """运行单个电化学测试
         
-        Args:
-            file_name: 保存结果的文件名
-            params: 测试参数字典，包含LSV所需的所有参数
-            
-        Returns:
-            测试是否成功启动
-        """
-        if not self.chi_setup:
-            logger.error("CHI未初始化")
-            return False
-            
-        try:
-            # 如果当前有测试正在运行，先停止
-            if self._status.get("status") == CHIStatus.RUNNING:
-                await self.stop_test()
-            
-            # 设置测试参数
-            self.current_test = "LSV"
-            self.file_name = file_name
-            self.test_params = params
-            self.start_time = datetime.now()
-            self.result_files = []
-            
-            # 创建LSV实例
-            lsv = LSV(
-                ei=params.get("ei", 0),
-                ef=params.get("ef", 1),
-                v=params.get("v", 0.1),
-                si=params.get("si", 0.001),
-                sens=params.get("sens", 1e-5),
-                qt=params.get("qt", 2),
-                fileName=file_name
-            )
-            
-            # 保存技术实例，用于后续停止
-            self.current_technique = lsv
-            
-            # 启动测试
-            lsv.run()
-            
-            # 更新状态
-            await self.update_status({
-                "status": CHIStatus.RUNNING,
-                "test_type": "LSV",
-                "file_name": file_name,
-                "params": params,
-                "start_time": self.start_time.isoformat()
-            })
-            
-            logger.info(f"LSV测试启动成功: {file_name}")
-            return True
-        except Exception as e:
-            self._last_error = str(e)
-            logger.error(f"LSV测试启动失败: {e}", exc_info=True)
-            await self.update_status({
-                "status": CHIStatus.ERROR,
-                "error": str(e)
-            })
-            return False
-    
-    async def run_it_test(self, file_name: str, params: Dict[str, Any]) -> bool:
-        """运行i-t曲线测试
+        技术参数、默认值和宏模板均来自技术注册表，run_cv_test 等方法由此生成。
         
         Args:
+            technique: 技术名称，如 "CV"、"IT"
             file_name: 保存结果的文件名
-            params: 测试参数字典，包含IT所需的所有参数
+            params: 测试参数字典
             
         Returns:
             测试是否成功启动
@@ -241,349 +156,71 @@ class CHIAdapter(BaseAdapter):
             logger.error("CHI未初始化")
             return False
             
+        spec = None
         try:
-            # 如果当前有测试正在运行，先停止
-            if self._status.get("status") == CHIStatus.RUNNING:
-                await self.stop_test()
-            
-            # 设置测试参数
-            self.current_test = "IT"
-            self.file_name = file_name
-            self.test_params = params
-            self.start_time = datetime.now()
-            self.result_files = []
-            
-            # 创建IT实例
-            it = IT(
-                ei=params.get("ei", 0),
-                si=params.get("si", 0.05),
-                st=params.get("st", 60),
-                sens=params.get("sens", 1e-5),
-                qt=params.get("qt", 2),
-                fileName=file_name
-            )
-            
-            # 保存技术实例，用于后续停止
-            self.current_technique = it
-            
-            # 启动测试
-            it.run()
-            
-            # 更新状态
-            await self.update_status({
-                "status": CHIStatus.RUNNING,
-                "test_type": "IT",
-                "file_name": file_name,
-                "params": params,
-                "start_time": self.start_time.isoformat()
-            })
-            
-            logger.info(f"IT测试启动成功: {file_name}")
-            return True
-        except Exception as e:
-            self._last_error = str(e)
-            logger.error(f"IT测试启动失败: {e}", exc_info=True)
-            await self.update_status({
-                "status": CHIStatus.ERROR,
-                "error": str(e)
-            })
-            return False
-    
-    async def run_ca_test(self, file_name: str, params: Dict[str, Any]) -> bool:
-        """运行计时安培法测试
-        
-        Args:
-            file_name: 保存结果的文件名
-            params: 测试参数字典，包含CA所需的所有参数
-            
-        Returns:
-            测试是否成功启动
-        """
-        if not self.chi_setup:
-            logger.error("CHI未初始化")
-            return False
-            
-        try:
-            # 如果当前有测试正在运行，先停止
-            if self._status.get("status") == CHIStatus.RUNNING:
-                await self.stop_test()
-            
-            # 设置测试参数
-            self.current_test = "CA"
-            self.file_name = file_name
-            self.test_params = params
-            self.start_time = datetime.now()
-            self.result_files = []
-            
-            # 创建CA实例
-            ca = CA(
-                ei=params.get("ei", 0),
-                eh=params.get("eh", 0.5),
-                el=params.get("el", -0.5),
-                cl=params.get("cl", 2),
-                pw=params.get("pw", 0.5),
-                si=params.get("si", 0.001),
-                sens=params.get("sens", 1e-5),
-                qt=params.get("qt", 2),
-                pn=params.get("pn", 'p'),
-                fileName=file_name,
-                autosens=params.get("autosens", False)
-            )
-            
-            # 保存技术实例，用于后续停止
-            self.current_technique = ca
-            
-            # 启动测试
-            ca.run()
-            
-            # 更新状态
-            await self.update_status({
-                "status": CHIStatus.RUNNING,
-                "test_type": "CA",
-                "file_name": file_name,
-                "params": params,
-                "start_time": self.start_time.isoformat()
-            })
-            
-            logger.info(f"CA测试启动成功: {file_name}")
-            
-            # 启动监控循环
-            asyncio.create_task(self._monitor_loop())
-            return True
-        except Exception as e:
-            self._last_error = str(e)
-            logger.error(f"CA测试启动失败: {e}", exc_info=True)
-            await self.update_status({
-                "status": CHIStatus.ERROR,
-                "error": str(e)
-            })
-            return False
-    
-    async def run_eis_test(self, file_name: str, params: Dict[str, Any]) -> bool:
-        """运行电化学阻抗谱测试
-        
-        Args:
-            file_name: 保存结果的文件名
-            params: 测试参数字典，包含EIS所需的所有参数
-            
-        Returns:
-            测试是否成功启动
-        """
-        if not self.chi_setup:
-            logger.error("CHI未初始化")
-            return False
-            
-        try:
-            # 如果当前有测试正在运行，先停止
-            if self._status.get("status") == CHIStatus.RUNNING:
-                await self.stop_test()
-            
-            # 设置测试参数
-            self.current_test = "EIS"
-            self.file_name = file_name
-            self.test_params = params
-            self.start_time = datetime.now()
-            self.result_files = []
-            
-            # 创建EIS实例
-            eis = EIS(
-                ei=params.get("ei", 0),
-                fl=params.get("fl", 0.1),
-                fh=params.get("fh", 100000),
-                amp=params.get("amp", 0.01),
-                sens=params.get("sens", 1e-5),
-                qt=params.get("qt", 2),
-                fileName=file_name
-            )
-            
-            # 保存技术实例，用于后续停止
-            self.current_technique = eis
-            
-            # 启动测试
-            eis.run()
-            
-            # 更新状态
-            await self.update_status({
-                "status": CHIStatus.RUNNING,
-                "test_type": "EIS",
-                "file_name": file_name,
-                "params": params,
-                "start_time": self.start_time.isoformat()
-            })
-            
-            logger.info(f"EIS测试启动成功: {file_name}")
-            return True
-        except Exception as e:
-            self._last_error = str(e)
-            logger.error(f"EIS测试启动失败: {e}", exc_info=True)
-            await self.update_status({
-                "status": CHIStatus.ERROR,
-                "error": str(e)
-            })
-            return False
-    
-    async def run_ocp_test(self, file_name: str, params: Dict[str, Any]) -> bool:
-        """运行开路电位测试 (OCP)
-        
-        Args:
-            file_name: 保存结果的文件名
-            params: 测试参数字典，包含OCP所需的所有参数
-            
-        Returns:
-            测试是否成功启动
-        """
-        if not self.chi_setup:
-            logger.error("CHI未初始化")
-            return False
+            spec = get_technique(technique)
             
-        try:
             # 如果当前有测试正在运行，先停止
             if self._status.get("status") == CHIStatus.RUNNING:
                 await self.stop_test()
             
-            # 设置测试参数
-            self.current_test = "OCP"
-            self.file_name = file_name
-            self.test_params = params
-            self.start_time = datetime.now()
-            self.result_files = []
-            
-            # 从params中提取OCP参数，如果不存在则使用OCP类中的默认值
-            ocp_params = {
-                "st": params["st"], # st 是必需的
-                "si": params["si"], # si 是必需的
-            }
-            if "eh" in params and params["eh"] is not None:
-                ocp_params["eh"] = params["eh"]
-            if "el" in params and params["el"] is not None:
-                ocp_params["el"] = params["el"]
-            
-            ocp_params["fileName"] = file_name
-
-            # 创建OCP实例
-            logger.debug(f"Creating OCP instance with params: {ocp_params}") # DEBUG LOG
-            ocp_instance = OCP(**ocp_params)
-            
-            # 保存技术实例，用于后续停止
-            self.current_technique = ocp_instance
-            
-            # 启动测试
-            logger.info(f"Calling run() on OCP instance for {file_name}") # DEBUG LOG
-            self.current_technique.run() # 使用 self.current_technique.run()
-            logger.info(f"OCP instance run() method called for {file_name}") # DEBUG LOG
-            
-            # 更新状态
-            await self.update_status({
-                "status": CHIStatus.RUNNING,
-                "test_type": "OCP",
-                "file_name": file_name,
-                "params": params, # 使用原始传入的params记录
-                "start_time": self.start_time.isoformat()
-            })
-            
-            logger.info(f"OCP测试启动成功: {file_name}")
-            # 启动监控循环
-            asyncio.create_task(self._monitor_loop())
-            return True
-        except KeyError as e:
-            error_msg = f"OCP测试启动失败: 缺少必要参数 {e}"
-            logger.error(error_msg, exc_info=True)
-            await self.update_status({
-                "status": CHIStatus.ERROR,
-                "error": error_msg
-            })
-            return False
-        except Exception as e:
-            self._last_error = str(e)
-            logger.error(f"OCP测试启动失败: {e}", exc_info=True)
-            await self.update_status({
-                "status": CHIStatus.ERROR,
-                "error": str(e)
-            })
-            return False
-            
-    async def run_dpv_test(self, file_name: str, params: Dict[str, Any]) -> bool:
-        """运行差分脉冲伏安法测试 (DPV)
-        
-        Args:
-            file_name: 保存结果的文件名
-            params: 测试参数字典，包含DPV所需的所有参数
-            
-        Returns:
-            测试是否成功启动
-        """
-        if not self.chi_setup:
-            logger.error("CHI未初始化")
-            return False
-            
-        try:
-            # 如果当前有测试正在运行，先停止
-            if self._status.get("status") == CHIStatus.RUNNING:
-                await self.stop_test()
+            # 生成默认文件名（如果未提供）
+            if not file_name:
+                file_name = f"{spec.name}_Test_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
             
             # 设置测试参数
-            self.current_test = "DPV"
+            self.current_test = spec.name
             self.file_name = file_name
             self.test_params = params
             self.start_time = datetime.now()
             self.result_files = []
+            self.batch_steps = []
+            self._settle_state = {}
+            self.expected_duration, estimate_source = self.runtime_estimator.estimate(spec.name, params)
             
-            # 处理参数
-            dpv_params = {
-                "ei": params.get("ei", 0),
-                "ef": params.get("ef", 0.5),
-                "incre": params.get("incre", 0.004),
-                "amp": params.get("amp", 0.05),
-                "pw": params.get("pw", 0.05),
-                "sw": params.get("sw", 0.001),
-                "prod": params.get("prod", 0.2),
-                "sens": params.get("sens", 1e-5),
-                "qt": params.get("qt", 2.0),
-                "fileName": file_name,
-                "autosens": params.get("autosens", False)
-            }
-            
-            # 创建DPV实例
-            dpv = DPV(**dpv_params)
-            
-            # 保存技术实例，用于后续停止
-            self.current_technique = dpv
+            # 创建技术实例并保存，用于后续停止
+            from device_control.control_chi import build_technique
+            self.current_technique = build_technique(spec.name, file_name, params)
             
             # 启动测试
-            dpv.run()
+            self.current_technique.run()
             
             # 更新状态
             await self.update_status({
                 "status": CHIStatus.RUNNING,
-                "test_type": "DPV",
+                "test_type": spec.name,
                 "file_name": file_name,
                 "params": params,
-                "start_time": self.start_time.isoformat()
+                "start_time": self.start_time.isoformat(),
+                "estimated_duration": self.expected_duration,
+                "estimate_source": estimate_source
             })
             
-            logger.info(f"DPV测试启动成功: {file_name}")
+            logger.info(f"{spec.label}测试启动成功: {file_name}，预计耗时 {self.expected_duration or 0:.1f}s ({estimate_source})")
             
-            # 启动监控循环
-            asyncio.create_task(self._monitor_loop())
+            # 启动文件监控
+            self._start_file_watch()
             return True
         except Exception as e:
             self._last_error = str(e)
-            logger.error(f"DPV测试启动失败: {e}", exc_info=True)
+            # 只用注册表中的技术名作标签，避免任意请求字符串产生新的时间序列
+            CHI_RUNS.labels(spec.name if spec is not None else "unknown", "start_failed").inc()
+            logger.error(f"{technique}测试启动失败: {e}", exc_info=True)
             await self.update_status({
                 "status": CHIStatus.ERROR,
                 "error": str(e)
             })
             return False
     
-    async def run_scv_test(self, file_name: str, params: Dict[str, Any]) -> bool:
-        """运行阶梯伏安法测试 (SCV)
+    async def run_batch_test(self, batch_name: str, steps: List[Dict[str, Any]]) -> bool:
+        """将多个技术合并为一个批处理宏运行，只启动一次CHI软件
         
         Args:
-            file_name: 保存结果的文件名
-            params: 测试参数字典，包含SCV所需的所有参数
+            batch_name: 批处理宏的文件名
+            steps: 步骤列表，每项包含 technique（如 "CV"）、file_name 和 params（技术构造参数）
             
         Returns:
-            测试是否成功启动
+            批处理测试是否成功启动
         """
         if not self.chi_setup:
             logger.error("CHI未初始化")
@@ -594,204 +231,77 @@ class CHIAdapter(BaseAdapter):
             if self._status.get("status") == CHIStatus.RUNNING:
                 await self.stop_test()
             
-            # 设置测试参数
-            self.current_test = "SCV"
-            self.file_name = file_name
-            self.test_params = params
-            self.start_time = datetime.now()
-            self.result_files = []
+            from device_control.control_chi import MacroBatch, build_technique
+            techniques = []
+            step_estimates = []
+            for index, step in enumerate(steps):
+                spec = get_technique(step.get("technique", ""))
+                step_file = step.get("file_name") or f"{batch_name}_{index + 1:02d}_{spec.name}"
+                techniques.append(build_technique(spec.name, step_file, step.get("params", {})))
+                step_estimates.append(self.runtime_estimator.estimate(spec.name, step.get("params", {}))[0])
             
-            # 处理参数
-            scv_params = {
-                "ei": params.get("ei", 0),
-                "ef": params.get("ef", 0.5),
-                "incre": params.get("incre", 0.004),
-                "sw": params.get("sw", 0.001),
-                "prod": params.get("prod", 0.2),
-                "sens": params.get("sens", 1e-5),
-                "qt": params.get("qt", 2.0),
-                "fileName": file_name,
-                "autosens": params.get("autosens", False)
-            }
-            
-            # 创建SCV实例
-            scv = SCV(**scv_params)
-            
-            # 保存技术实例，用于后续停止
-            self.current_technique = scv
-            
-            # 启动测试
-            scv.run()
-            
-            # 更新状态
-            await self.update_status({
-                "status": CHIStatus.RUNNING,
-                "test_type": "SCV",
-                "file_name": file_name,
-                "params": params,
-                "start_time": self.start_time.isoformat()
-            })
-            
-            logger.info(f"SCV测试启动成功: {file_name}")
-            
-            # 启动监控循环
-            asyncio.create_task(self._monitor_loop())
-            return True
-        except Exception as e:
-            self._last_error = str(e)
-            logger.error(f"SCV测试启动失败: {e}", exc_info=True)
-            await self.update_status({
-                "status": CHIStatus.ERROR,
-                "error": str(e)
-            })
-            return False
-    
-    async def run_cp_test(self, file_name: str, params: Dict[str, Any]) -> bool:
-        """运行计时电位法测试 (CP)
-        
-        Args:
-            file_name: 保存结果的文件名
-            params: 测试参数字典，包含CP所需的所有参数
-            
-        Returns:
-            测试是否成功启动
-        """
-        if not self.chi_setup:
-            logger.error("CHI未初始化")
-            return False
-            
-        try:
-            # 如果当前有测试正在运行，先停止
-            if self._status.get("status") == CHIStatus.RUNNING:
-                await self.stop_test()
+            batch = MacroBatch(techniques, fileName=batch_name)
             
             # 设置测试参数
-            self.current_test = "CP"
-            self.file_name = file_name
-            self.test_params = params
+            self.current_test = "BATCH"
+            self.file_name = batch_name
+            self.test_params = {"steps": steps}
             self.start_time = datetime.now()
             self.result_files = []
-            
-            # 生成默认文件名（如果未提供）
-            if not file_name:
-                file_name = f"CP_Test_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                self.file_name = file_name
-                
-            # 创建CP实例
-            cp = CP(
-                ic=params.get("ic"),
-                ia=params.get("ia"),
-                tc=params.get("tc"),
-                ta=params.get("ta"),
-                eh=params.get("eh", 10.0),
-                el=params.get("el", -10.0),
-                pn=params.get("pn", 'p'),
-                si=params.get("si", 0.1),
-                cl=params.get("cl", 1),
-                priority=params.get("priority", 'time'),
-                fileName=file_name
-            )
+            self._settle_state = {}
+            self.batch_index = 0
+            self.batch_steps = [
+                {
+                    "technique": technique.spec.name,
+                    "test_type": technique.technique,
+                    "file_name": technique.fileName,
+                    "params": step.get("params", {}),
+                    "estimated_duration": estimate,
+                    "completed": False
+                }
+                for technique, step, estimate in zip(techniques, steps, step_estimates)
+            ]
+            self.expected_duration = sum(step_estimates) if all(step_estimates) else None
             
             # 保存技术实例，用于后续停止
-            self.current_technique = cp
+            self.current_technique = batch
             
-            # 启动测试
-            cp.run()
+            # 启动批处理宏
+            batch.run()
             
             # 更新状态
             await self.update_status({
                 "status": CHIStatus.RUNNING,
-                "test_type": "CP",
-                "file_name": file_name,
-                "params": params,
-                "start_time": self.start_time.isoformat()
+                "test_type": "BATCH",
+                "file_name": batch_name,
+                "steps": [{"test_type": s["test_type"], "file_name": s["file_name"]} for s in self.batch_steps],
+                "completed_steps": 0,
+                "start_time": self.start_time.isoformat(),
+                "estimated_duration": self.expected_duration
             })
             
-            logger.info(f"CP测试启动成功: {file_name}")
+            logger.info(f"CHI批处理宏启动成功: {batch_name}，共{len(techniques)}个步骤")
             
-            # 启动监控循环
-            asyncio.create_task(self._monitor_loop())
+            # 启动文件监控
+            self._start_file_watch()
             return True
         except Exception as e:
             self._last_error = str(e)
-            logger.error(f"CP测试过程中发生错误: {e}", exc_info=True)
+            CHI_RUNS.labels("BATCH", "start_failed").inc()
+            logger.error(f"CHI批处理宏启动失败: {e}", exc_info=True)
+            self.batch_steps = []
             await self.update_status({
                 "status": CHIStatus.ERROR,
                 "error": str(e)
             })
             return False
     
-    async def run_acv_test(self, file_name: str, params: Dict[str, Any]) -> bool:
-        """运行交流伏安法测试 (ACV)
-        
-        Args:
-            file_name: 保存结果的文件名
-            params: 测试参数字典，包含ACV所需的所有参数
-            
-        Returns:
-            测试是否成功启动
-        """
-        if not self.chi_setup:
-            logger.error("CHI未初始化")
-            return False
-            
-        try:
-            # 如果当前有测试正在运行，先停止
-            if self._status.get("status") == CHIStatus.RUNNING:
-                await self.stop_test()
-                
-            # 设置测试参数
-            self.current_test = "ACV"
-            self.file_name = file_name
-            self.test_params = params
-            self.start_time = datetime.now()
-            self.result_files = []
-            
-            # 生成默认文件名（如果未提供）
-            if not file_name:
-                file_name = f"ACV_Test_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                self.file_name = file_name
-                
-            # 创建ACV实例
-            acv = ACV(
-                ei=params.get("ei"),
-                ef=params.get("ef"),
-                incre=params.get("incre"),
-                amp=params.get("amp"),
-                freq=params.get("freq"),
-                quiet=params.get("quiet", 2.0),
-                sens=params.get("sens", 1e-5),
-                fileName=file_name
-            )
-            
-            # 保存技术实例，用于后续停止
-            self.current_technique = acv
-            
-            # 启动测试
-            acv.run()
-            
-            # 更新状态
-            await self.update_status({
-                "status": CHIStatus.RUNNING,
-                "test_type": "ACV",
-                "file_name": file_name,
-                "params": params,
-                "start_time": self.start_time.isoformat()
-            })
-            
-            logger.info(f"ACV测试启动成功: {file_name}")
-            
-            # 启动监控循环
-            asyncio.create_task(self._monitor_loop())
-            return True
-        except Exception as e:
-            self._last_error = str(e)
-            logger.error(f"ACV测试过程中发生错误: {e}", exc_info=True)
-            await self.update_status({
-                "status": CHIStatus.ERROR,
-                "error": str(e)
-            })
-            return False
+    def _start_file_watch(self):
+        """确保结果文件监控循环在运行（无需调用start_monitoring）"""
+        if self._monitoring_task and not self._monitoring_task.done():
+            return
+        self.monitoring = True
+        self._monitoring_task = asyncio.create_task(self._monitor_loop())
     
     async def stop_test(self) -> bool:
         """停止当前CHI测试
@@ -805,8 +315,10 @@ class CHIAdapter(BaseAdapter):
                 self.current_technique.stop()
             else:
                 # 否则使用全局stop_all
+                from device_control.control_chi import stop_all
                 stop_all()
                 
+            CHI_RUNS.labels(self.current_test or "unknown", "stopped").inc()
             logger.info("CHI测试已停止")
             
             # 更新状态
@@ -818,6 +330,8 @@ class CHIAdapter(BaseAdapter):
             # 清理当前测试信息
             self.current_test = None
             self.current_technique = None
+            self.batch_steps = []
+            self.expected_duration = None
             
             return True
         except Exception as e:
@@ -837,11 +351,48 @@ class CHIAdapter(BaseAdapter):
             except Exception as e:
                 logger.error(f"CHI状态监控异常: {e}", exc_info=True)
                 
-            # 文件检查间隔
-            await asyncio.sleep(self.file_check_interval)
+            # 文件检查间隔（根据预计结束时间自适应）
+            await asyncio.sleep(self._next_check_interval())
             
         logger.info("CHI状态监控停止")
     
+    def _next_check_interval(self) -> float:
+        """根据预计结束时间计算下一次文件检查的间隔
+        
+        远离预计结束时稀疏轮询，接近或刚超过预计结束时快速轮询以减少完成检测延迟；
+        大幅超时（估算失准）后恢复默认间隔。
+        """
+        if self._status.get("status") != CHIStatus.RUNNING or not self.start_time or not self.expected_duration:
+            return self.file_check_interval
+        
+        elapsed = (datetime.now() - self.start_time).total_seconds()
+        remaining = self.expected_duration - elapsed
+        if remaining > 0:
+            return min(max(remaining / 2, self.fast_check_interval), self.max_check_interval)
+        if -remaining < max(10.0, 0.2 * self.expected_duration):
+            return self.fast_check_interval
+        return self.file_check_interval
+    
+    def _file_settled(self, path: str) -> bool:
+        """判断数据文件是否已写入完成（非空且大小在 file_settle_time 内保持不变）"""
+        size = os.path.getsize(path)
+        now = time.time()
+        last_size, since = self._settle_state.get(path, (None, now))
+        if size != last_size:
+            self._settle_state[path] = (size, now)
+            return False
+        return size > 0 and now - since >= self.file_settle_time
+    
+    def _record_runtime(self, technique: str, params: Dict[str, Any], started: float, txt_file: str):
+        """以数据文件的修改时间计算实测耗时并记录到估算器"""
+        try:
+            measured = os.path.getmtime(txt_file) - started
+            CHI_RUN_SECONDS.labels(technique).observe(measured)
+            CHI_RUNS.labels(technique, "completed").inc()
+            self.runtime_estimator.record(technique, params, measured)
+        except Exception as e:
+            logger.warning(f"记录CHI测试耗时失败: {e}")
+    
     async def _check_result_files(self):
         """检查结果文件变化
         
@@ -853,6 +404,10 @@ class CHIAdapter(BaseAdapter):
             return
             
         logger.debug(f"_check_result_files: Monitoring for test '{self.current_test}', file_name '{self.file_name}'") # DEBUG LOG
+        
+        if self.batch_steps:
+            await self._check_batch_steps()
+            return
             
         try:
             # 检查.txt文件（原始数据）
@@ -861,6 +416,10 @@ class CHIAdapter(BaseAdapter):
             txt_files = glob.glob(txt_pattern)
             
             for txt_file in txt_files:
+                # 忽略本次测试启动前遗留的同名旧文件
+                if self.start_time and os.path.getmtime(txt_file) < self.start_time.timestamp():
+                    continue
+                
                 # 检查是否是新文件
                 if txt_file not in self.result_files:
                     self.result_files.append(txt_file)
@@ -880,33 +439,29 @@ class CHIAdapter(BaseAdapter):
                     
                     await self.broadcaster.publish(f"{self.topic}:event", event_data)
                     logger.info(f"检测到CHI数据文件: {txt_file}")
+                
+                # 文件非空且大小稳定后认为测试已完成
+                if self._status.get("status") == CHIStatus.RUNNING and self._file_settled(txt_file):
+                    logger.info(f"CHI测试已完成，文件大小稳定: {txt_file}")
+                    self._record_runtime(self.current_test, self.test_params, self.start_time.timestamp(), txt_file)
+                    
+                    # 更新状态
+                    await self.update_status({
+                        "status": CHIStatus.COMPLETED,
+                        "end_time": datetime.now().isoformat(),
+                        "result_file": os.path.basename(txt_file)
+                    })
+                    
+                    # 发布测试完成事件
+                    completion_data = {
+                        "event_type": "test_completed",
+                        "test_type": self.current_test,
+                        "file_name": os.path.basename(txt_file),
+                        "elapsed_seconds": (datetime.now() - self.start_time).total_seconds() if self.start_time else None,
+                        "estimated_duration": self.expected_duration
+                    }
                     
-                    # 如果文件非空且大小稳定，认为测试可能已完成
-                    if file_size > 0:
-                        # 等待一段时间，确认文件大小不再变化
-                        await asyncio.sleep(2)
-                        current_size = os.path.getsize(txt_file)
-                        
-                        if current_size == file_size:
-                            # 测试可能已完成
-                            logger.info(f"CHI测试可能已完成，文件大小稳定: {txt_file}")
-                            
-                            # 更新状态
-                            await self.update_status({
-                                "status": CHIStatus.COMPLETED,
-                                "end_time": datetime.now().isoformat(),
-                                "result_file": os.path.basename(txt_file)
-                            })
-                            
-                            # 发布测试完成事件
-                            completion_data = {
-                                "event_type": "test_completed",
-                                "test_type": self.current_test,
-                                "file_name": os.path.basename(txt_file),
-                                "elapsed_seconds": (datetime.now() - self.start_time).total_seconds() if self.start_time else None
-                            }
-                            
-                            await self.broadcaster.publish(f"{self.topic}:event", completion_data)
+                    await self.broadcaster.publish(f"{self.topic}:event", completion_data)
             
             # 检查.png文件（图表）
             png_pattern = os.path.join(self.results_base_dir, f"{self.file_name}*.png")
@@ -932,6 +487,82 @@ class CHIAdapter(BaseAdapter):
         except Exception as e:
             logger.error(f"检查结果文件异常: {e}", exc_info=True)
     
+    async def _check_batch_steps(self):
+        """检查批处理宏各步骤的结果文件，逐步发布步骤完成事件
+        
+        CHI按顺序执行步骤：后一步的数据文件出现即说明前一步已保存完毕；
+        最后一步则以文件大小稳定作为完成依据。各步骤实测耗时（相邻数据文件的
+        修改时间之差）会记录到时长估算器。
+        """
+        start_ts = self.start_time.timestamp() if self.start_time else 0
+        
+        def fresh_size(step):
+            # 仅统计本次批处理启动后写入的文件，忽略同名旧文件
+            path = os.path.join(self.results_base_dir, f"{step['file_name']}.txt")
+            if not os.path.exists(path) or os.path.getmtime(path) < start_ts:
+                return None
+            return os.path.getsize(path)
+        
+        while self.batch_index < len(self.batch_steps):
+            step = self.batch_steps[self.batch_index]
+            size = fresh_size(step)
+            if not size:
+                return
+            
+            txt_file = os.path.join(self.results_base_dir, f"{step['file_name']}.txt")
+            is_last = self.batch_index == len(self.batch_steps) - 1
+            if is_last:
+                if not self._file_settled(txt_file):
+                    return
+            elif fresh_size(self.batch_steps[self.batch_index + 1]) is None:
+                return
+            
+            step["completed"] = True
+            if txt_file not in self.result_files:
+                self.result_files.append(txt_file)
+            
+            # 步骤起点为上一步数据文件的写入时间（第一步为批处理启动时间）
+            step_started = start_ts
+            if self.batch_index > 0:
+                previous = self.batch_steps[self.batch_index - 1]
+                step_started = os.path.getmtime(os.path.join(self.results_base_dir, f"{previous['file_name']}.txt"))
+            self._record_runtime(step["technique"], step["params"], step_started, txt_file)
+            
+            event_data = {
+                "event_type": "step_completed",
+                "test_type": step["test_type"],
+                "file_name": os.path.basename(txt_file),
+                "file_path": txt_file,
+                "file_size": size,
+                "step_index": self.batch_index,
+                "total_steps": len(self.batch_steps),
+                "batch_name": self.file_name,
+                "elapsed_seconds": (datetime.now() - self.start_time).total_seconds() if self.start_time else None,
+                "estimated_duration": step["estimated_duration"]
+            }
+            await self.broadcaster.publish(f"{self.topic}:event", event_data)
+            logger.info(f"CHI批处理步骤完成 ({self.batch_index + 1}/{len(self.batch_steps)}): {txt_file}")
+            
+            self.batch_index += 1
+            await self.update_status({"completed_steps": self.batch_index})
+        
+        # 全部步骤完成
+        logger.info(f"CHI批处理宏已完成: {self.file_name}")
+        await self.update_status({
+            "status": CHIStatus.COMPLETED,
+            "end_time": datetime.now().isoformat(),
+            "result_files": [os.path.basename(f) for f in self.result_files]
+        })
+        completion_data = {
+            "event_type": "test_completed",
+            "test_type": "BATCH",
+            "file_name": self.file_name,
+            "step_files": [os.path.basename(f) for f in self.result_files],
+            "elapsed_seconds": (datetime.now() - self.start_time).total_seconds() if self.start_time else None
+        }
+        await self.broadcaster.publish(f"{self.topic}:event", completion_data)
+        self.batch_steps = []
+    
     async def update_status(self, status_data: Dict[str, Any], topic: Optional[str] = None):
         """更新状态并广播
         
@@ -943,4 +574,9 @@ class CHIAdapter(BaseAdapter):
         self._status.update(status_data)
         
         # 广播到WebSocket
-        await self.broadcaster.publish(topic or self.topic, status_data) 
\ No newline at end of file
+        await self.broadcaster.publish(topic or self.topic, status_data) 
+
+
+# 为注册表中的每种技术生成 run_<技术>_test(file_name, params) 方法
+for _spec in TECHNIQUES.values():
+    setattr(CHIAdapter, f"run_{_spec.route}_test", partialmethod(CHIAdapter.run_test, _spec.name))
@@ -9,23 +9,26 @@ from .base_adapter import BaseAdapter
 # 添加项目根目录到系统路径，以便导入device_control
 # sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../'))) # REMOVED
 from device_control.control_printer import PrinterControl
+from core_api.moonraker_listener import TOOLHEAD_OBJECTS
 
 logger = logging.getLogger(__name__)
 
 class PrinterAdapter(BaseAdapter):
     """打印机适配器，控制打印头移动并监控位置"""
     
-    def __init__(self, moonraker_addr: str, broadcaster: Broadcaster, polling_interval: float = 1.0):
+    def __init__(self, moonraker_addr: str, broadcaster: Broadcaster, polling_interval: float = 1.0, ws_listener = None):
         """初始化打印机适配器
         
         Args:
             moonraker_addr: Moonraker API地址，格式为 "http://ip:port" 或 "ip:port"
             broadcaster: WebSocket广播器
             polling_interval: 位置状态轮询间隔（秒）
+            ws_listener: MoonrakerWebsocketListener实例，已订阅toolhead时直接使用推送的坐标
         """
         super().__init__("3D打印机")
         self.broadcaster = broadcaster
         self.polling_interval = polling_interval
+        self.ws_listener = ws_listener
         
         # 解析Moonraker地址，确保有完整URL格式
         if moonraker_addr.startswith("http://") or moonraker_addr.startswith("https://"):
@@ -66,7 +69,8 @@ class PrinterAdapter(BaseAdapter):
             self.printer = PrinterControl(
                 ip=self.printer_ip,
                 port=self.printer_port,
-                move_speed=150  # 默认移动速度
+                move_speed=150,  # 默认移动速度
+                status_listener=self.ws_listener
             )
             
             # 尝试获取当前位置，验证连接
@@ -216,6 +220,16 @@ class PrinterAdapter(BaseAdapter):
             logger.error(f"启动归位操作失败: {e}", exc_info=True)
             return False
     
+    async def emergency_stop(self) -> bool:
+        """紧急停止：正在等待的移动/归位立即返回，并停止 Klipper"""
+        if not self.printer:
+            logger.error("打印机未初始化")
+            return False
+        result = await asyncio.to_thread(self.printer.emergency_stop)
+        self.is_moving = False
+        await self.update_status({"is_moving": False, "emergency_stop": True})
+        return result
+
     async def _execute_move(self, x: float, y: float, z: float):
         """执行移动的后台任务
         
@@ -225,9 +239,8 @@ class PrinterAdapter(BaseAdapter):
             z: Z坐标
         """
         try:
-            # 调用PrinterControl的move_to方法
-            # 注意：该方法可能是阻塞的，所以在单独的任务中运行
-            result = self.printer.move_to(x, y, z)
+            # PrinterControl.move_to 阻塞到移动完成（可被 emergency_stop 立即中止），在线程中执行以免阻塞事件循环
+            result = await asyncio.to_thread(self.printer.move_to, x, y, z)
             
             # 更新完成状态
             self.is_moving = False
@@ -284,8 +297,8 @@ class PrinterAdapter(BaseAdapter):
                 "target_grid": grid_number
             })
             
-            # 调用PrinterControl的move_to_grid_position方法
-            result = self.printer.move_to_grid_position(grid_number)
+            # 调用PrinterControl的move_to_grid_position方法（在线程中执行）
+            result = await asyncio.to_thread(self.printer.move_to_grid_position, grid_number)
             
             # 更新完成状态
             self.is_moving = False
@@ -336,8 +349,8 @@ class PrinterAdapter(BaseAdapter):
                 "homing": True
             })
             
-            # 调用PrinterControl的home方法
-            result = self.printer.home()
+            # 调用PrinterControl的home方法（在线程中执行）
+            result = await asyncio.to_thread(self.printer.home)
             
             # 更新完成状态
             self.is_moving = False
@@ -381,48 +394,80 @@ class PrinterAdapter(BaseAdapter):
             })
     
     async def _monitor_loop(self):
-        """打印机状态监控循环，定期获取并广播当前位置"""
+        """打印机状态监控循环
+
+        监听器已连接时由 toolhead / motion_report 等订阅的状态增量触发广播，不再轮询；
+        否则定期获取并广播当前位置。
+        """
         logger.info("打印机状态监控开始")
         
-        while self.monitoring:
-            try:
-                if self.printer:
-                    # 获取当前位置
-                    position = self.printer.get_current_position()
-                    if position:
+        changed = asyncio.Event()
+        
+        def on_status(status):
+            if any(name in status for name in TOOLHEAD_OBJECTS):
+                changed.set()
+        
+        if self.ws_listener is not None:
+            self.ws_listener.add_status_callback(on_status)
+        
+        last_broadcast = None
+        try:
+            while self.monitoring:
+                changed.clear()
+                try:
+                    snapshot = self.ws_listener.toolhead if self.ws_listener is not None and self.ws_listener.connected else None
+                    if snapshot is not None and snapshot.position is not None:
+                        # 订阅模式：只在状态变化时广播
+                        position = snapshot.live_position or snapshot.position
+                        status_update = {
+                            "position": {"x": position[0], "y": position[1], "z": position[2]},
+                            "is_moving": self.is_moving or snapshot.is_moving,
+                            "homed_axes": snapshot.homed_axes,
+                            "state": snapshot.state,
+                        }
+                    elif self.printer:
+                        # 获取当前位置
+                        position = self.printer.get_current_position()
+                        status_update = None
+                        if position:
+                            status_update = {
+                                "position": {"x": position[0], "y": position[1], "z": position[2]},
+                                "is_moving": self.is_moving
+                            }
+                    else:
+                        position = status_update = None
+                    
+                    if status_update is not None:
                         # 更新内部状态
-                        self.last_position = position
+                        self.last_position = tuple(position)
                         
                         # 计算已完成的移动进度
-                        progress = None
                         if self.is_moving and self.target_position and self.move_start_time:
                             elapsed = time.time() - self.move_start_time
                             
                             # 这里可以实现一个简单的进度模拟
                             # 假设典型移动需要3秒完成
-                            progress = min(1.0, elapsed / 3.0)
+                            status_update["progress"] = min(1.0, elapsed / 3.0)
                         
-                        # 更新状态
-                        status_update = {
-                            "position": {
-                                "x": position[0],
-                                "y": position[1],
-                                "z": position[2]
-                            },
-                            "is_moving": self.is_moving
-                        }
-                        
-                        if progress is not None:
-                            status_update["progress"] = progress
+                        # 广播状态（与上次相同时跳过）
+                        if status_update != last_broadcast:
+                            await self.update_status(status_update)
+                            last_broadcast = status_update
                             
-                        # 广播状态
-                        await self.update_status(status_update)
-                        
-            except Exception as e:
-                logger.error(f"打印机状态监控异常: {e}", exc_info=True)
-                
-            # 等待下一个轮询周期
-            await asyncio.sleep(self.polling_interval)
+                except Exception as e:
+                    logger.error(f"打印机状态监控异常: {e}", exc_info=True)
+                    
+                # 订阅模式等待下一次状态增量（移动进度模拟仍按轮询周期刷新）；否则等待下一个轮询周期
+                if self.ws_listener is not None and self.ws_listener.connected and not self.is_moving:
+                    try:
+                        await asyncio.wait_for(changed.wait(), timeout=self.polling_interval * 30)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(self.polling_interval)
+        finally:
+            if self.ws_listener is not None:
+                self.ws_listener.remove_status_callback(on_status)
             
         logger.info("打印机状态监控停止")
     
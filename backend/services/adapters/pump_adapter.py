@@ -13,6 +13,8 @@ from .base_adapter import BaseAdapter
 # 添加项目根目录到系统路径，以便导入core_api
 # sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../'))) # REMOVED
 from core_api.pump_proxy import PumpProxy, MoonrakerError
+from core_api.pump_calibration import get_calibration_store
+from core_api.pump_progress import PumpProgressTracker
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +41,8 @@ class PumpAdapter(BaseAdapter):
         self.broadcaster = broadcaster
         self.polling_interval = polling_interval
         self.ws_listener = ws_listener  # 保存WebSocket监听器引用
+        # 有泵对象状态时按实际圈数计算进度和完成，否则按时间估算
+        self.progress_tracker = PumpProgressTracker(ws_listener)
         
         # 解析Moonraker地址
         if not moonraker_addr.startswith("http://") and not moonraker_addr.startswith("https://"):
@@ -60,7 +64,7 @@ class PumpAdapter(BaseAdapter):
         self.flow_rate = None          # 流速（毫升/秒）
         
         # 加载泵校准数据
-        self.calibration_data = {}
+        self.calibration = get_calibration_store()
         self.pump_config = {}
         self.speed_rules = {
             0.5: 20.0,   # 默认值，小于0.5ml使用20 RPM
@@ -91,21 +95,10 @@ class PumpAdapter(BaseAdapter):
                         self.speed_rules = rules
                         logger.info(f"已加载转速规则: {self.speed_rules}")
             
-            # 尝试加载校准文件
-            calibration_files = [f for f in os.listdir("calibration_cache") if f.startswith("calibration_") and f.endswith(".json")]
-            for cal_file in calibration_files:
-                try:
-                    with open(f"calibration_cache/{cal_file}", 'r') as f:
-                        cal_data = json.load(f)
-                    
-                    # 提取端口和单元号
-                    parts = cal_file.replace("calibration_", "").replace(".json", "").split("_")
-                    if len(parts) >= 1:
-                        unit = int(parts[0])
-                        self.calibration_data[unit] = cal_data
-                        logger.info(f"已加载校准数据: unit={unit}, file={cal_file}")
-                except Exception as e:
-                    logger.warning(f"加载校准文件失败 {cal_file}: {e}")
+            # 校准曲线由共享的 CalibrationStore 按单元加载，文件变化时自动重新加载
+            units = self.calibration.units()
+            if units:
+                logger.info(f"可用的泵校准单元: {units}")
         except Exception as e:
             logger.warning(f"加载泵配置或校准数据失败: {e}")
     
@@ -157,28 +150,10 @@ class PumpAdapter(BaseAdapter):
         # 假设100RPM约等于5ml/s（这是一个非常粗略的估计）
         estimated_rate = rpm * 0.05  # ml/s
         
-        # 尝试从校准数据中获取更准确的估算
-        if self.current_unit in self.calibration_data:
-            cal_data = self.calibration_data[self.current_unit]
-            # 校准数据通常是RPM到ml/min的映射
-            # 找到最接近的RPM值
-            rpm_values = sorted([float(r) for r in cal_data.keys()])
-            
-            if rpm_values:
-                # 找到小于等于目标RPM的最大值
-                closest_rpm = None
-                for val in rpm_values:
-                    if float(val) <= rpm and (closest_rpm is None or float(val) > closest_rpm):
-                        closest_rpm = float(val)
-                
-                # 如果没有找到小于等于的值，取最小值
-                if closest_rpm is None and rpm_values:
-                    closest_rpm = min(rpm_values)
-                
-                if closest_rpm is not None:
-                    # 获取流速 (ml/min) 并转换为 ml/s
-                    flow_mlpm = float(cal_data[str(closest_rpm)])
-                    estimated_rate = flow_mlpm / 60.0  # 转换为ml/s
+        # 尝试从校准曲线中获取更准确的估算（按转速插值）
+        curve = self.calibration.curve(self.current_unit)
+        if curve is not None:
+            estimated_rate = curve.flow_ml_per_s(rpm)
         
         # 计算时间
         if estimated_rate > 0:
@@ -196,6 +171,7 @@ class PumpAdapter(BaseAdapter):
         try:
             # 创建PumpProxy实例，传入WebSocket监听器
             self.pump_proxy = PumpProxy(self.moonraker_addr, listener=self.ws_listener)
+            await self.progress_tracker.subscribe()
             
             # 尝试发送一个简单的命令测试连接
             try:
@@ -280,6 +256,7 @@ class PumpAdapter(BaseAdapter):
             # 默认使用单元0，端口0
             self.current_unit = 0
             self.current_port = 0
+            self.progress_tracker.begin(self.calibration.revolutions(self.current_unit, self.target_volume, rpm))
             
             # 更新状态为运行中
             await self.update_status({
@@ -363,6 +340,7 @@ class PumpAdapter(BaseAdapter):
             # 默认使用单元0，端口0
             self.current_unit = 0
             self.current_port = 0
+            self.progress_tracker.begin(self.calibration.revolutions(self.current_unit, self.target_volume, rpm))
             
             # 更新状态为运行中
             await self.update_status({
@@ -401,6 +379,9 @@ class PumpAdapter(BaseAdapter):
                 # 重置操作状态
                 self._reset_operation_state()
                 return False
+            if isinstance(result, dict) and result.get("revolutions"):
+                # 以泵服务实际执行的圈数为目标
+                self.progress_tracker.target_revolutions = float(result["revolutions"])
             
             # 由_monitor_loop根据计时决定何时将状态更新为完成
             
@@ -464,10 +445,11 @@ class PumpAdapter(BaseAdapter):
         self.flow_rate = None
     
     async def _monitor_loop(self):
-        """泵状态监控循环，基于时间模拟泵进度"""
+        """泵状态监控循环：有泵对象状态时按实际圈数计算进度，否则基于时间模拟"""
         logger.info("泵状态监控启动")
         
         while self.monitoring:
+            actual = None
             try:
                 # 检查是否有正在进行的操作
                 if self.current_operation and self.start_time and self.total_duration:
@@ -475,8 +457,14 @@ class PumpAdapter(BaseAdapter):
                     elapsed = now - self.start_time
                     
                     # 计算进度
-                    progress = min(1.0, elapsed / self.total_duration)
-                    remaining = max(0, self.total_duration - elapsed)
+                    actual = self.progress_tracker.snapshot()
+                    if actual is not None and actual["progress"] is not None:
+                        progress = 1.0 if actual["stopped"] else min(actual["progress"], 0.999)
+                        remaining = 0 if actual["stopped"] else max(0, self.total_duration - elapsed)
+                    else:
+                        actual = None
+                        progress = min(1.0, elapsed / self.total_duration)
+                        remaining = max(0, self.total_duration - elapsed)
                     
                     if progress < 1.0:
                         # 操作进行中，更新进度
@@ -491,7 +479,10 @@ class PumpAdapter(BaseAdapter):
                         
                         # 估算已泵送的体积
                         pumped_volume = self.target_volume
-                        if self.current_operation == "dispense_timed" and self.flow_rate:
+                        if actual is not None:
+                            pumped_volume = actual["revolutions_done"] * self.calibration.ml_per_rev(
+                                self.current_unit, self._status.get("rpm") or self._get_speed_for_volume(self.target_volume))
+                        elif self.current_operation == "dispense_timed" and self.flow_rate:
                             # 根据实际运行时间计算体积
                             pumped_volume = self.flow_rate * min(elapsed, self.total_duration)
                         
@@ -499,7 +490,7 @@ class PumpAdapter(BaseAdapter):
                         await self.update_status({
                             "status": PumpStatus.COMPLETED,
                             "progress": 1.0,
-                            "elapsed_seconds": self.total_duration,
+                            "elapsed_seconds": elapsed if actual is not None else self.total_duration,
                             "remaining_seconds": 0,
                             "pumped_volume_ml": pumped_volume,
                             "completed": True,
@@ -512,8 +503,11 @@ class PumpAdapter(BaseAdapter):
             except Exception as e:
                 logger.error(f"泵状态监控异常: {e}", exc_info=True)
                 
-            # 等待下一个轮询周期
-            await asyncio.sleep(self.polling_interval)
+            # 等待下一个轮询周期；跟踪实际圈数时泵一停止就立即进入下一轮并标记完成
+            if actual is not None and not actual["stopped"]:
+                await self.progress_tracker.wait_until_stopped(timeout=self.polling_interval)
+            else:
+                await asyncio.sleep(self.polling_interval)
             
         logger.info("泵状态监控停止")
     
@@ -14,16 +14,18 @@ logger = logging.getLogger(__name__)
 class RelayAdapter(BaseAdapter):
     """继电器适配器，控制继电器状态并通过WebSocket广播"""
     
-    def __init__(self, moonraker_addr: str, broadcaster: Broadcaster, relay_count: int = 4):
+    def __init__(self, moonraker_addr: str, broadcaster: Broadcaster, relay_count: int = 4, ws_listener = None):
         """初始化继电器适配器
         
         Args:
             moonraker_addr: Moonraker API地址，格式为 "http://ip:port" 或 "ip:port"
             broadcaster: WebSocket广播器
             relay_count: 继电器数量，默认为4
+            ws_listener: MoonrakerWebsocketListener实例，订阅output_pin后由推送更新继电器状态
         """
         super().__init__("继电器/阀门")
         self.broadcaster = broadcaster
+        self.ws_listener = ws_listener
         
         # 解析Moonraker地址，确保有完整URL格式
         if moonraker_addr.startswith("http://") or moonraker_addr.startswith("https://"):
@@ -48,13 +50,25 @@ class RelayAdapter(BaseAdapter):
             # 创建RelayProxy实例
             self.relay_proxy = RelayProxy(self.moonraker_addr)
             
-            # 测试连接，尝试查询状态（这里没有专门的状态查询方法，可以考虑实际情况）
-            # 在这里，我们简单地假设如果创建实例没有异常，则连接成功
-            logger.info("继电器连接成功")
+            # 通过output_pin回读实际状态，同时测试连接；回读失败时状态记为未知
+            indices = list(range(1, self.relay_count + 1))
+            try:
+                actual = await asyncio.to_thread(self.relay_proxy.query_states, indices)
+                logger.info(f"继电器连接成功，当前状态: {actual}")
+            except Exception as e:
+                actual = {}
+                logger.warning(f"回读继电器状态失败: {e}")
+            
+            for i in indices:
+                if i in actual:
+                    await self.update_relay_status(i, actual[i], "on" if actual[i] else "off")
+                else:
+                    await self.update_relay_status(i, None, "unknown")
             
-            # 初始化每个继电器的状态为未知
-            for i in range(1, self.relay_count + 1):
-                await self.update_relay_status(i, None, "unknown")
+            # 之后的状态变化由订阅推送
+            if self.ws_listener is not None:
+                self.ws_listener.add_status_callback(self._on_listener_status)
+                await self.ws_listener.subscribe_objects(self.relay_proxy.pin_objects(indices))
                 
             return True
         except Exception as e:
@@ -62,6 +76,40 @@ class RelayAdapter(BaseAdapter):
             logger.error(f"继电器初始化失败: {e}", exc_info=True)
             return False
     
+    def _on_listener_status(self, status: Dict[str, Any]):
+        """订阅推送的output_pin状态与记录不同时更新并广播"""
+        if not self.relay_proxy:
+            return
+        actual = self.relay_proxy.parse_states(status, self.relay_states.keys())
+        for idx, on in actual.items():
+            if self.relay_states.get(idx, {}).get("state") != on:
+                asyncio.get_running_loop().create_task(self.update_relay_status(idx, on, "on" if on else "off"))
+    
+    async def set_many(self, states: Dict[int, Any]) -> bool:
+        """一次请求设置多个继电器
+        
+        Args:
+            states: {继电器索引: True/False/"on"/"off"}，按给定顺序执行
+            
+        Returns:
+            操作是否成功
+        """
+        if not self.relay_proxy:
+            logger.error("继电器未初始化")
+            return False
+            
+        try:
+            applied = await asyncio.to_thread(self.relay_proxy.set_many, states)
+            for idx, on in applied.items():
+                await self.update_relay_status(idx, on, "on" if on else "off")
+            return True
+        except Exception as e:
+            self._last_error = str(e)
+            logger.error(f"继电器批量设置失败 {states}: {e}", exc_info=True)
+            for idx in states:
+                await self.update_relay_status(int(idx), None, "error", str(e))
+            return False
+    
     async def get_status(self) -> Dict[str, Any]:
         """获取当前继电器状态
         
@@ -75,8 +123,7 @@ class RelayAdapter(BaseAdapter):
     async def get_relay_state(self, relay_id: int) -> Dict[str, Any]:
         """获取特定继电器的状态
         
-        由于relay_proxy.py没有提供状态查询方法，
-        该方法返回最后一次操作后记录的本地状态
+        返回最近一次回读、订阅推送或操作后记录的状态
         
         Args:
             relay_id: 继电器ID
@@ -227,26 +274,22 @@ class RelayAdapter(BaseAdapter):
     async def _monitor_loop(self):
         """继电器状态监控循环
         
-        注意：由于继电器通常没有状态反馈机制，所以这里监控循环
-        主要用于定期广播当前已知的继电器状态
+        监听器已连接时状态变化由订阅推送，这里不做任何事；
+        未连接时每30秒回读一次output_pin，只广播与记录不同的继电器。
         """
         logger.info("继电器状态监控开始")
         
         while self.monitoring:
+            # 监控间隔较长，如每30秒检查一次
+            await asyncio.sleep(30)
+            if not self.relay_proxy or (self.ws_listener is not None and self.ws_listener.connected):
+                continue
             try:
-                # 广播所有继电器的当前状态
-                for idx, state in self.relay_states.items():
-                    topic = f"{self.base_topic}:{idx}"
-                    await self.broadcaster.publish(topic, state)
-                    
-                # 同时发送汇总状态
-                await self.broadcaster.publish(self.base_topic, {
-                    "relays": self.relay_states
-                })
+                actual = await asyncio.to_thread(self.relay_proxy.query_states, list(self.relay_states.keys()))
+                for idx, on in actual.items():
+                    if self.relay_states.get(idx, {}).get("state") != on:
+                        await self.update_relay_status(idx, on, "on" if on else "off")
             except Exception as e:
-                logger.error(f"继电器状态广播异常: {e}", exc_info=True)
-                
-            # 监控间隔较长，如每30秒广播一次
-            await asyncio.sleep(30)
+                logger.error(f"继电器状态回读异常: {e}", exc_info=True)
             
-        logger.info("继电器状态监控停止") 
\ No newline at end of file
+        logger.info("继电器状态监控停止")
@@ -0,0 +1,126 @@
+"""前端页面静态资源缓存
+
+device_tester.html 只在文件修改（mtime/大小变化）后重新读取，读取时：
+- 内联的 <style> 和 <script> 块拆分为独立资源，文件名带内容哈希（如 device_tester.3fa2c1d09b7e.js），
+  页面中替换为对应的 <link>/<script src>，这些资源可以长期缓存；
+- 每个资源预先压缩为 gzip（安装了 brotli 时同时生成 br），请求时按 Accept-Encoding 选择；
+- 每个资源按内容计算强 ETag，浏览器带 If-None-Match 重新验证时可直接返回 304。
+"""
+import gzip
+import hashlib
+import logging
+import os
+import re
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+HTML_CACHE_CONTROL = "no-cache"                              # 页面每次都重新验证（内容变化时才下载）
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"  # 带哈希的资源长期缓存
+
+_INLINE_BLOCK = re.compile(r"<(style|script)>(.*?)</\1>", re.IGNORECASE | re.DOTALL)
+
+
+class CompressedAsset:
+    """一个资源的原始内容、预压缩内容和 ETag"""
+
+    def __init__(self, content: bytes, media_type: str):
+        self.media_type = media_type
+        self.digest = hashlib.sha256(content).hexdigest()
+        self.bodies = {"identity": content, "gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(content, quality=11)
+
+    def etag(self, encoding: str) -> str:
+        # 不同编码的字节不同，强 ETag 也必须不同
+        suffix = "" if encoding == "identity" else f"-{encoding}"
+        return f'"{self.digest[:32]}{suffix}"'
+
+    def select(self, accept_encoding: str):
+        """按 Accept-Encoding 选择编码，返回 (编码, 内容, ETag)"""
+        accepted = _parse_accept_encoding(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding, self.bodies[encoding], self.etag(encoding)
+        return "identity", self.bodies["identity"], self.etag("identity")
+
+    def matches(self, if_none_match: str) -> bool:
+        """If-None-Match 是否与任一编码的 ETag 相同"""
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or any(self.etag(encoding) in tags for encoding in self.bodies)
+
+
+def _parse_accept_encoding(header: str) -> dict:
+    accepted = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    return accepted
+
+
+class HtmlBundle:
+    """按 mtime 失效的页面缓存（线程安全）"""
+
+    def __init__(self, html_path, asset_url_prefix="/assets"):
+        self.html_path = str(html_path)
+        self.asset_url_prefix = asset_url_prefix.rstrip("/")
+        self.page = None
+        self.assets = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """文件有变化时重新加载，返回页面资源（文件不存在时抛出 FileNotFoundError）"""
+        stat = os.stat(self.html_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return self.page
+        with self._lock:
+            if signature != self._signature:
+                self._load()
+                self._signature = signature
+        return self.page
+
+    def asset(self, name):
+        """按带哈希的文件名查找拆分出的资源"""
+        self.refresh()
+        return self.assets.get(name)
+
+    def _load(self):
+        with open(self.html_path, "r", encoding="utf-8") as f:
+            html = f.read()
+        stem = os.path.splitext(os.path.basename(self.html_path))[0]
+        assets = {}
+
+        def extract(match):
+            tag, body = match.group(1).lower(), match.group(2)
+            extension, media_type = ("css", "text/css") if tag == "style" else ("js", "application/javascript")
+            asset = CompressedAsset(body.encode("utf-8"), f"{media_type}; charset=utf-8")
+            name = f"{stem}.{asset.digest[:12]}.{extension}"
+            assets[name] = asset
+            url = f"{self.asset_url_prefix}/{name}"
+            if tag == "style":
+                return f'<link rel="stylesheet" href="{url}">'
+            return f'<script src="{url}"></script>'
+
+        html = _INLINE_BLOCK.sub(extract, html)
+        page = CompressedAsset(html.encode("utf-8"), "text/html; charset=utf-8")
+        self.page, self.assets = page, assets
+        sizes = ", ".join(f"{encoding} {len(body) / 1024:.1f} KB" for encoding, body in page.bodies.items())
+        logger.info(f"已加载前端页面 {self.html_path}（{sizes}，拆分资源 {len(assets)} 个）")
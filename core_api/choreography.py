@@ -0,0 +1,131 @@
+"""choreography.py – 定时动作序列编译为单个 Klipper 脚本
+
+把“打开阀门 1，等 250 ms，启动泵，t+X 关闭阀门”这类定时动作编译成一个多行 G-code 脚本，
+动作之间用 G4 P<毫秒> 停顿，一次 POST /printer/gcode/script 发送。
+停顿由 Klipper 按打印时间调度，动作间隔不再受 HTTP 往返和 Python sleep 抖动影响。
+
+注意:
+- 每个动作应立即返回（RELAY_ON_/RELAY_OFF_ 宏、DISPENSE_FLUID_SPEED 启动泵），
+  时间偏移从脚本开始执行算起；会阻塞 G-code 队列的命令会把后续动作整体推迟；
+- 脚本执行期间 G-code 队列被占用，Moonraker 在最后一个 G4 结束后才返回，
+  所以请求超时按序列总时长放宽，并限制单个序列的最长时长。
+
+用法:
+    sequence = (ValveSequence()
+                .relay(1, True, at=0.0)
+                .pump(2.0, 60, direction=1, at=0.25)
+                .relay(1, False, at=5.0))
+    result = run_sequence(RelayProxy("http://192.168.51.168:7125"), sequence)
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+MAX_DURATION = 600.0       # 单个序列最长时长（秒），避免长时间占用 G-code 队列
+REQUEST_MARGIN = 30.0      # 请求超时 = 序列时长 + 余量
+
+
+class SequenceEvent:
+    __slots__ = ("at", "command", "label")
+
+    def __init__(self, at, command, label=None):
+        self.at = at
+        self.command = command
+        self.label = label or command
+
+    def to_dict(self):
+        return {"at": self.at, "command": self.command, "label": self.label}
+
+
+class ValveSequence:
+    """按时间偏移（秒）排列的动作序列，同一时刻的动作保持添加顺序"""
+
+    def __init__(self, max_duration=MAX_DURATION):
+        self.max_duration = max_duration
+        self.events = []
+
+    def add(self, at, command, label=None):
+        at = float(at)
+        if at < 0:
+            raise ValueError(f"动作时间不能为负: {at}")
+        if at > self.max_duration:
+            raise ValueError(f"动作时间 {at:g} 秒超过序列最长时长 {self.max_duration:g} 秒")
+        command = str(command).strip()
+        if not command or "\n" in command:
+            raise ValueError(f"无效的 G-code 命令: {command!r}")
+        self.events.append(SequenceEvent(at, command, label))
+        return self
+
+    def relay(self, idx, on, at=0.0):
+        idx = int(idx)
+        return self.add(at, f"RELAY_{'ON' if on else 'OFF'}_{idx}", f"继电器 {idx} {'ON' if on else 'OFF'}")
+
+    def pump(self, volume_ml, speed_rpm, direction=1, at=0.0):
+        """定速泵送，参数格式与 PumpProxy.dispense_speed 一致"""
+        command = f"DISPENSE_FLUID_SPEED V={volume_ml} S={speed_rpm} DIR={0 if direction == 0 else 1}"
+        return self.add(at, command, f"泵送 {volume_ml} mL @ {speed_rpm} RPM")
+
+    def gcode(self, command, at=0.0):
+        return self.add(at, command)
+
+    def ordered(self):
+        return sorted(self.events, key=lambda event: event.at)   # sorted 稳定，同时刻保持添加顺序
+
+    @property
+    def duration(self):
+        return max((event.at for event in self.events), default=0.0)
+
+    def compile(self):
+        """编译为多行脚本：相邻动作之间插入 G4 P<毫秒>"""
+        lines = []
+        elapsed_ms = 0
+        for event in self.ordered():
+            at_ms = int(round(event.at * 1000))
+            if at_ms > elapsed_ms:
+                lines.append(f"G4 P{at_ms - elapsed_ms}")
+                elapsed_ms = at_ms
+            lines.append(event.command)
+        return "\n".join(lines)
+
+    @classmethod
+    def from_events(cls, events, max_duration=MAX_DURATION):
+        """从配置列表构建序列
+
+        每项包含 at（秒）和以下之一:
+            {"relay_id": 1, "state": "on"}
+            {"pump": {"volume_ml": 2.0, "speed_rpm": 60, "direction": 1}}
+            {"gcode": "SET_PIN PIN=led VALUE=1"}
+        """
+        from core_api.relay_proxy import _parse_state
+
+        sequence = cls(max_duration=max_duration)
+        for index, event in enumerate(events):
+            at = event.get("at", 0.0)
+            if "relay_id" in event:
+                sequence.relay(event["relay_id"], _parse_state(event.get("state", "on")), at=at)
+            elif "pump" in event:
+                pump = event["pump"]
+                sequence.pump(float(pump["volume_ml"]), float(pump["speed_rpm"]),
+                              direction=int(pump.get("direction", 1)), at=at)
+            elif "gcode" in event:
+                sequence.gcode(event["gcode"], at=at)
+            else:
+                raise ValueError(f"第 {index + 1} 个动作缺少 relay_id / pump / gcode: {event}")
+        return sequence
+
+    def describe(self):
+        return [event.to_dict() for event in self.ordered()]
+
+
+def run_sequence(relay_proxy, sequence):
+    """一次请求执行整个序列（阻塞到 Klipper 执行完最后一个动作）
+
+    Returns:
+        dict: script、duration、events 和 Moonraker 响应 response
+    """
+    if not sequence.events:
+        raise ValueError("动作序列为空")
+    script = sequence.compile()
+    log.info(f"执行动作序列: {len(sequence.events)} 个动作，时长 {sequence.duration:.3f} 秒")
+    response = relay_proxy.send_script(script, timeout=sequence.duration + REQUEST_MARGIN)
+    return {"script": script, "duration": sequence.duration, "events": sequence.describe(), "response": response}
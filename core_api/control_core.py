@@ -0,0 +1,175 @@
+"""control_core.py – 可中止的等待与紧急停止
+
+AbortToken 基于 threading.Event，取代 time.sleep(0.1) 轮询标志的等待方式:
+- wait(seconds)：线程中阻塞在事件上（不轮询，空闲时不占 CPU），abort() 后立即返回；
+- sleep(seconds)：协程版本，等待 asyncio.Event，abort() 可从任意线程调用；
+- wait_for(awaitable, timeout)：设备条件（如 listener.wait_for_condition）与中止竞争，中止时取消条件并抛出 Aborted；
+- on_abort(callback)：中止时的回调（如发送紧急停止命令、联动其他 AbortToken）。
+
+键盘急停为可选功能：install_keyboard_hook() 在 keyboard 未安装或无权限时返回 False。
+
+用法:
+    token = AbortToken("experiment")
+    if not token.wait(5.0):            # 等待 5 秒，中止时返回 False
+        return False
+    await token.sleep(1.0)             # 协程中等待
+    token.abort("紧急停止")             # 任意线程，所有等待立即返回
+"""
+import asyncio
+import logging
+import threading
+
+from core_api import metrics
+
+log = logging.getLogger(__name__)
+
+ABORTS = metrics.counter("control_aborts_total", "AbortToken 中止次数", ["name"])
+
+
+class Aborted(RuntimeError):
+    """等待被 AbortToken 中止"""
+
+
+class AbortToken:
+    """线程安全的中止信号"""
+
+    def __init__(self, name="default"):
+        self.name = name
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._async_waiters = set()     # (loop, asyncio.Event)
+
+    @property
+    def aborted(self):
+        return self._event.is_set()
+
+    def abort(self, reason="中止"):
+        """触发中止；已中止时不重复执行回调
+
+        Returns:
+            bool: 本次调用是否触发了中止
+        """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            waiters = list(self._async_waiters)
+            callbacks = list(self._callbacks)
+        ABORTS.labels(self.name).inc()
+        log.warning(f"[{self.name}] 中止: {reason}")
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass    # 事件循环已关闭
+        for callback in callbacks:
+            try:
+                callback(reason)
+            except Exception as e:
+                log.error(f"[{self.name}] 中止回调出错: {e}", exc_info=True)
+        return True
+
+    def reset(self):
+        with self._lock:
+            self._event.clear()
+            self.reason = None
+
+    def raise_if_aborted(self):
+        if self._event.is_set():
+            raise Aborted(self.reason)
+
+    def on_abort(self, callback):
+        """注册中止回调 callback(reason)"""
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def wait(self, seconds=None):
+        """等待 seconds 秒（None 表示一直等到中止）
+
+        Returns:
+            bool: True 表示等满，False 表示被中止
+        """
+        if seconds is not None:
+            seconds = max(0.0, seconds)
+        return not self._event.wait(seconds)
+
+    async def sleep(self, seconds=None):
+        """协程中等待 seconds 秒（None 表示一直等到中止）
+
+        Returns:
+            bool: True 表示等满，False 表示被中止
+        """
+        event = asyncio.Event()
+        entry = (asyncio.get_running_loop(), event)
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._async_waiters.add(entry)
+        try:
+            await asyncio.wait_for(event.wait(), None if seconds is None else max(0.0, seconds))
+            return False
+        except asyncio.TimeoutError:
+            return True
+        finally:
+            with self._lock:
+                self._async_waiters.discard(entry)
+
+    async def wait_for(self, awaitable, timeout=None):
+        """等待设备条件，与中止竞争
+
+        Raises:
+            Aborted: 等待期间被中止（条件任务会被取消）
+            asyncio.TimeoutError: 超时
+        """
+        self.raise_if_aborted()
+        condition = asyncio.ensure_future(awaitable)
+        stop = asyncio.ensure_future(self.sleep(None))
+        try:
+            done, _ = await asyncio.wait({condition, stop}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (condition, stop):
+                if not task.done():
+                    task.cancel()
+        if condition in done:
+            return condition.result()
+        if stop in done:
+            raise Aborted(self.reason)
+        raise asyncio.TimeoutError()
+
+
+_keyboard_hooks = []
+
+
+def install_keyboard_hook(callback, key="esc"):
+    """按键时调用 callback(event)；keyboard 未安装或无权限（如 Linux 非 root）时返回 False"""
+    try:
+        import keyboard
+    except ImportError:
+        log.info("未安装 keyboard，键盘急停不可用")
+        return False
+    try:
+        _keyboard_hooks.append(keyboard.on_press_key(key, callback))
+    except Exception as e:
+        log.warning(f"注册键盘急停失败: {e}")
+        return False
+    return True
+
+
+def remove_keyboard_hooks():
+    if not _keyboard_hooks:
+        return
+    import keyboard
+    for hook in _keyboard_hooks:
+        try:
+            keyboard.unhook(hook)
+        except Exception:
+            pass
+    _keyboard_hooks.clear()
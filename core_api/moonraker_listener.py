@@ -18,7 +18,7 @@ import logging
 import re
 import time
 import uuid
-from typing import Dict, Any, Optional, List, Callable, Awaitable, Union
+from typing import Dict, Any, Optional, List, Callable, Awaitable, Union, NamedTuple, Tuple
 
 # 尝试导入websockets，如果无法导入，记录错误但不立即退出
 try:
@@ -27,9 +27,54 @@ except ImportError:
     logging.error("缺少必要的依赖：websockets。请安装：pip install websockets")
     # 不抛出异常，让实际使用时再报错，便于调试
 
+from core_api import metrics, tracing
+
 # 配置日志
 log = logging.getLogger(__name__)
 
+LISTENER_MESSAGES = metrics.counter("listener_messages_total", "收到的Moonraker WebSocket消息数", ["method"])
+LISTENER_CONNECTED = metrics.gauge("listener_connected", "Moonraker WebSocket是否已连接")
+LISTENER_RECONNECTS = metrics.counter("listener_reconnects_total", "Moonraker WebSocket重连次数")
+LISTENER_PENDING = metrics.gauge("listener_pending_requests", "等待泵参数的请求数")
+LISTENER_STATUS_WAITERS = metrics.gauge("listener_status_waiters", "等待对象状态条件的请求数")
+
+# 默认订阅的打印机对象（None 表示订阅该对象的全部字段）
+DEFAULT_SUBSCRIBED_OBJECTS = {
+    "toolhead": None,
+    "gcode_move": None,
+    "print_stats": None,
+    "motion_report": ["live_position", "live_velocity"],
+    "idle_timeout": ["state"],
+}
+
+# 变化时需要重建打印头快照的对象
+TOOLHEAD_OBJECTS = ("toolhead", "gcode_move", "motion_report", "idle_timeout")
+
+
+class ToolheadSnapshot(NamedTuple):
+    """打印头状态快照（不可变，每次相关对象更新时整体替换，读取无需加锁）"""
+    position: Optional[Tuple[float, float, float]]        # toolhead.position：规划器中的目标坐标
+    live_position: Optional[Tuple[float, float, float]]   # motion_report.live_position：当前实际坐标
+    live_velocity: float
+    homed_axes: str
+    state: str                                            # idle_timeout.state: Idle / Ready / Printing
+    updated_at: float                                     # time.monotonic()
+
+    @property
+    def is_moving(self) -> bool:
+        return self.live_velocity > 0 or self.state == "Printing"
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = self._asdict()
+        data["is_moving"] = self.is_moving
+        return data
+
+
+def _xyz(values) -> Optional[Tuple[float, float, float]]:
+    if not values or len(values) < 3:
+        return None
+    return float(values[0]), float(values[1]), float(values[2])
+
 
 class MoonrakerWebsocketListener:
     """Moonraker WebSocket监听器
@@ -48,6 +93,7 @@ class MoonrakerWebsocketListener:
         self.websocket = None
         self.running = False
         self.connected = False
+        self.loop = None    # start() 所在的事件循环，其他线程经 run_coroutine_threadsafe 等待状态条件
         
         # 用于存储解析出的参数
         self.parsed_data = {}
@@ -55,6 +101,16 @@ class MoonrakerWebsocketListener:
         
         # 参数缓存：因为RPM和圈数可能在不同消息中
         self._parameter_cache = {}
+
+        # 订阅的打印机对象状态：对象名 -> 字段字典，由订阅响应和 notify_status_update 增量合并
+        self.subscribed_objects = dict(DEFAULT_SUBSCRIBED_OBJECTS)
+        self.object_status: Dict[str, Dict[str, Any]] = {}
+        self.status_updated_at = None
+        self.object_updated_at: Dict[str, float] = {}   # 对象名 -> 最近一次收到更新的 time.monotonic()
+        self.toolhead: Optional[ToolheadSnapshot] = None  # 尚未收到 toolhead 状态时为 None
+        self._subscribe_request_id = None
+        self._status_callbacks: List[Callable[[Dict[str, Any]], None]] = []
+        self._status_waiters: List[tuple] = []   # [(predicate, future), ...]
         
         # 更新正则表达式以匹配更通用的日志格式，并忽略大小写
         # 例如: "选择转速: 5.0 RPM", "PumpService - INFO - ... 选择转速: 5.0 RPM", "已设置转速: 5.0 RPM"
@@ -69,6 +125,9 @@ class MoonrakerWebsocketListener:
             return
             
         self.running = True
+        self.loop = asyncio.get_running_loop()
+        LISTENER_PENDING.set_function(lambda: len(self.pending_requests))
+        LISTENER_STATUS_WAITERS.set_function(lambda: len(self._status_waiters))
         
         while self.running:
             try:
@@ -80,6 +139,7 @@ class MoonrakerWebsocketListener:
                 ) as websocket:
                     self.websocket = websocket
                     self.connected = True
+                    LISTENER_CONNECTED.set(1)
                     log.info("已连接到Moonraker WebSocket")
                     
                     await self._subscribe()
@@ -101,9 +161,11 @@ class MoonrakerWebsocketListener:
                 self.connected = False
                 log.error(f"WebSocket监听器出错: {e}", exc_info=True)
             finally:
+                LISTENER_CONNECTED.set(0)
                 if self.running:
                     self.websocket = None
                     self.connected = False
+                    LISTENER_RECONNECTS.inc()
                     log.info("等待5秒后重新连接...")
                     await asyncio.sleep(5)
     
@@ -137,25 +199,19 @@ class MoonrakerWebsocketListener:
                 "id": int(time.time() * 1000) # 使用时间戳作为ID
             }
             
-            # 订阅打印机对象状态，特别是toolhead和gcode_move，可能也包含间接日志或状态
+            # 订阅打印机对象状态（toolhead、gcode_move 以及通过 subscribe_objects 添加的泵状态对象等）
+            self._subscribe_request_id = int(time.time() * 1000) + 1
             subscribe_printer_objects = {
                 "jsonrpc": "2.0",
                 "method": "printer.objects.subscribe",
-                "params": {
-                    "objects": {
-                        "toolhead": None, 
-                        "gcode_move": None,
-                        "print_stats": None, # 或许print_stats中也可能包含相关信息
-                        # "extruder": None, # 如果泵被模拟为挤出机
-                    }
-                },
-                "id": int(time.time() * 1000) + 1
+                "params": {"objects": dict(self.subscribed_objects)},
+                "id": self._subscribe_request_id
             }
             
             await self.websocket.send(json.dumps(subscribe_gcode_store))
             log.info(f"已发送订阅请求: server.gcode_store")
             await self.websocket.send(json.dumps(subscribe_printer_objects))
-            log.info(f"已发送订阅请求: printer.objects.subscribe")
+            log.info(f"已发送订阅请求: printer.objects.subscribe {list(self.subscribed_objects)}")
             
         except Exception as e:
             log.error(f"发送WebSocket订阅请求失败: {e}")
@@ -166,10 +222,19 @@ class MoonrakerWebsocketListener:
             return
         try:
             data = json.loads(message)
+            LISTENER_MESSAGES.labels(data.get("method", "response")).inc()
+
+            # printer.objects.subscribe 的响应包含订阅对象的完整初始状态
+            if self._subscribe_request_id is not None and data.get("id") == self._subscribe_request_id:
+                result = data.get("result")
+                if isinstance(result, dict) and isinstance(result.get("status"), dict):
+                    self._merge_status(result["status"])
+                return
             
             # 通用日志记录，查看所有通知类型的方法和参数
             if "method" in data and data["method"].startswith("notify_"):
-                log.info(f"WS NOTIFY method: {data['method']}, params: {data.get('params')}")
+                # 每个通知帧都会经过这里：使用惰性格式化，被限流丢弃的记录不会格式化参数
+                log.info("WS NOTIFY method: %s, params: %s", data['method'], data.get('params'))
 
             # 处理G-code相关的响应或日志
             # server.gcode_store 订阅通常通过 notify_gcode_response 返回G-code的stdout
@@ -181,6 +246,8 @@ class MoonrakerWebsocketListener:
             
             # printer.objects.subscribe 的更新通常通过 notify_status_update
             elif data.get("method") == "notify_status_update":
+                if data.get("params") and isinstance(data["params"][0], dict):
+                    self._merge_status(data["params"][0])
                 # status更新可能包含多项内容，我们需要查找与泵相关的日志或状态
                 # 这部分比较复杂，取决于Klipper如何将PumpService的日志或状态通过此通道暴露
                 # 暂时只记录，后续根据实际日志内容决定是否从中解析参数
@@ -203,6 +270,103 @@ class MoonrakerWebsocketListener:
         except Exception as e:
             log.error(f"处理WebSocket消息时出错: {e}", exc_info=True)
     
+    # --- 对象状态存储 ---
+    def _merge_status(self, status: Dict[str, Any]):
+        """把状态增量合并到 object_status，并通知回调和等待中的条件"""
+        now = time.monotonic()
+        for name, fields in status.items():
+            if isinstance(fields, dict):
+                self.object_status.setdefault(name, {}).update(fields)
+            else:
+                self.object_status[name] = fields
+            self.object_updated_at[name] = now
+        self.status_updated_at = now
+        if any(name in status for name in TOOLHEAD_OBJECTS):
+            self.toolhead = self._build_toolhead_snapshot(now)
+
+        for callback in list(self._status_callbacks):
+            try:
+                callback(status)
+            except Exception as e:
+                log.error(f"对象状态回调出错: {e}", exc_info=True)
+
+        if self._status_waiters:
+            remaining = []
+            for predicate, future in self._status_waiters:
+                if future.done():
+                    continue
+                try:
+                    matched = predicate(self.object_status)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+                if matched:
+                    future.set_result(self.object_status)
+                else:
+                    remaining.append((predicate, future))
+            self._status_waiters = remaining
+
+    def _build_toolhead_snapshot(self, now: float) -> Optional[ToolheadSnapshot]:
+        toolhead = self.object_status.get("toolhead")
+        if not toolhead:
+            return None
+        motion = self.object_status.get("motion_report") or {}
+        return ToolheadSnapshot(
+            position=_xyz(toolhead.get("position")),
+            live_position=_xyz(motion.get("live_position")),
+            live_velocity=float(motion.get("live_velocity") or 0.0),
+            homed_axes=toolhead.get("homed_axes", ""),
+            state=(self.object_status.get("idle_timeout") or {}).get("state", ""),
+            updated_at=now,
+        )
+
+    def get_object_status(self, name: str) -> Optional[Dict[str, Any]]:
+        """某个订阅对象的最新状态（尚未收到时返回 None）"""
+        return self.object_status.get(name)
+
+    def add_status_callback(self, callback: Callable[[Dict[str, Any]], None]):
+        """每次收到状态增量时调用 callback(增量字典)"""
+        self._status_callbacks.append(callback)
+
+    def remove_status_callback(self, callback: Callable[[Dict[str, Any]], None]):
+        if callback in self._status_callbacks:
+            self._status_callbacks.remove(callback)
+
+    async def subscribe_objects(self, objects: Dict[str, Optional[List[str]]]):
+        """追加订阅打印机对象（如 "manual_stepper pump"、"gcode_macro _PUMP_STATUS"）
+
+        Moonraker 的订阅会替换之前的对象集合，所以每次发送完整集合；
+        未连接时只记录，连接（或重连）后自动订阅。
+        """
+        new_objects = {name: fields for name, fields in objects.items() if self.subscribed_objects.get(name, ()) != fields}
+        if not new_objects:
+            return
+        self.subscribed_objects.update(new_objects)
+        if self.connected:
+            await self._subscribe()
+
+    async def wait_for_condition(self, predicate: Callable[[Dict[str, Dict[str, Any]]], bool],
+                                 timeout: Optional[float] = None) -> Optional[Dict[str, Dict[str, Any]]]:
+        """等待对象状态满足条件
+
+        predicate 接收完整的 object_status，在当前状态和之后每次状态更新时检查。
+
+        Returns:
+            满足条件时的 object_status；超时返回 None
+        """
+        if predicate(self.object_status):
+            return self.object_status
+        future = asyncio.get_running_loop().create_future()
+        entry = (predicate, future)
+        self._status_waiters.append(entry)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if entry in self._status_waiters:
+                self._status_waiters.remove(entry)
+
     def _parse_pump_parameters(self, message: str):
         """从消息中解析泵参数"""
         if not message or not isinstance(message, str):
@@ -282,6 +446,7 @@ class MoonrakerWebsocketListener:
             if request_id in self.pending_requests:
                 del self.pending_requests[request_id]
     
+    @tracing.traced("listener.wait_for_parsed_data")
     async def wait_for_parsed_data(self, request_id: str, timeout: float = 5.0) -> Optional[Dict[str, Any]]:
         """等待解析出的泵参数"""
         if not self.connected:
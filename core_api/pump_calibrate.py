@@ -0,0 +1,247 @@
+"""pump_calibrate.py – 泵校准流程
+
+在若干转速下各执行一次（或多次）定速泵送（PumpProxy.dispense_speed），称量每次泵出液体的质量，
+按密度换算为体积后除以实际圈数得到每圈体积，再用 NumPy 最小二乘拟合 mL/rev 与 RPM 的关系，
+结果原子写入 calibration_cache/calibration_<unit>.json（新格式，见 core_api.pump_calibration），
+运行中的 PumpAdapter / PumpProxy 会在下次估算时自动加载。
+
+质量来源:
+- ConsoleBalance：每次泵送后在终端输入天平读数（g）；
+- SimulatedBalance：按给定的真实每圈体积加噪声生成读数，用于不接设备时演练流程。
+
+--simulate 时同时使用 SimulatedPump 代替 PumpProxy，不发送任何请求，整个流程离线运行。
+
+用法:
+    python -m core_api.pump_calibrate http://192.168.51.168:7125 --unit 0 --rpm 20 45 90 --volume 1.0
+    python -m core_api.pump_calibrate --simulate 0.085 --dry-run
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from core_api.pump_calibration import DEFAULT_DIRECTORY, CalibrationCurve, get_calibration_store
+
+log = logging.getLogger(__name__)
+
+# 只有来自泵服务本身的圈数才是实际转过的圈数；"estimate" 是按旧校准值推算的
+MEASURED_SOURCES = ("websocket", "response_log")
+SIMULATED_SOURCE = "simulated"
+
+
+class ConsoleBalance:
+    """在终端输入天平读数"""
+
+    def read_mass(self, rpm, volume_ml, revolutions):
+        while True:
+            text = input(f"转速 {rpm:g} RPM、目标 {volume_ml:g} mL 泵送完成，请输入称得的质量 (g，输入 s 跳过): ").strip()
+            if text.lower() == "s":
+                return None
+            try:
+                return float(text)
+            except ValueError:
+                print("请输入数字")
+
+
+class SimulatedBalance:
+    """模拟天平：质量 = 圈数 × 真实每圈体积 × 密度 × (1 + 噪声)"""
+
+    def __init__(self, true_ml_per_rev, density=1.0, noise=0.01, slope_per_rpm=0.0, seed=None):
+        self.true_ml_per_rev = true_ml_per_rev
+        self.density = density
+        self.noise = noise
+        self.slope_per_rpm = slope_per_rpm      # 模拟高转速下每圈体积的变化
+        self.random = np.random.default_rng(seed)
+
+    def read_mass(self, rpm, volume_ml, revolutions):
+        ml_per_rev = self.true_ml_per_rev + self.slope_per_rpm * rpm
+        return revolutions * ml_per_rev * self.density * (1.0 + self.random.normal(0.0, self.noise))
+
+
+class SimulatedPump:
+    """离线演练用的泵：不发送请求，按当前校准值估算圈数，泵送立即完成"""
+
+    def __init__(self, calibration_unit=0):
+        self.calibration_unit = calibration_unit
+        self.calibration = get_calibration_store()
+
+    async def dispense_speed(self, volume_ml, speed_rpm, direction=1):
+        return {
+            "success": True,
+            "rpm": speed_rpm,
+            "revolutions": self.calibration.revolutions(self.calibration_unit, volume_ml, speed_rpm),
+            "estimated_duration": 0.0,
+            "source": SIMULATED_SOURCE,
+        }
+
+
+async def run_dispenses(proxy, rpms, volume_ml, balance, repeats=1, settle=2.0, density=1.0, direction=1):
+    """依次在每个转速下泵送并读取质量
+
+    Returns:
+        list[dict]: 每次测量的 rpm、revolutions、mass_g、volume_ml、ml_per_rev、source
+    """
+    measurements = []
+    for rpm in rpms:
+        for attempt in range(repeats):
+            log.info(f"校准泵送: {rpm:g} RPM, 目标 {volume_ml:g} mL（第 {attempt + 1}/{repeats} 次）")
+            result = await proxy.dispense_speed(volume_ml, rpm, direction=direction)
+            if not result.get("success"):
+                log.error(f"{rpm:g} RPM 泵送失败: {result.get('error')}")
+                continue
+            revolutions = float(result.get("revolutions") or 0.0)
+            source = result.get("source")
+            if source not in MEASURED_SOURCES and source != SIMULATED_SOURCE:
+                log.warning(f"{rpm:g} RPM 未从泵服务获得实际圈数（来源: {source}），使用估算圈数 {revolutions:.2f}")
+
+            # 等待泵送结束并让液滴落下
+            await asyncio.sleep(float(result.get("estimated_duration") or 0.0) + settle)
+
+            mass = await asyncio.to_thread(balance.read_mass, rpm, volume_ml, revolutions)
+            if mass is None:
+                log.info(f"跳过 {rpm:g} RPM 的这次测量")
+                continue
+            if revolutions <= 0 or mass <= 0:
+                log.warning(f"忽略无效测量: 圈数={revolutions}, 质量={mass}")
+                continue
+            measured_volume = mass / density
+            measurements.append({
+                "rpm": float(rpm),
+                "revolutions": revolutions,
+                "mass_g": mass,
+                "volume_ml": measured_volume,
+                "ml_per_rev": measured_volume / revolutions,
+                "source": source,
+            })
+            log.info(f"{rpm:g} RPM: {revolutions:.2f} 圈 → {measured_volume:.4f} mL, 每圈 {measured_volume / revolutions:.5f} mL")
+    return measurements
+
+
+def fit_flow_curve(measurements, degree=1):
+    """最小二乘拟合 ml_per_rev = c0 + c1·rpm (+ c2·rpm² ...)
+
+    不同转速少于 degree+1 个时自动降阶。
+
+    Returns:
+        dict: coefficients（升幂）、degree、rmse、r2
+    """
+    rpms = np.array([m["rpm"] for m in measurements], dtype=float)
+    values = np.array([m["ml_per_rev"] for m in measurements], dtype=float)
+    if values.size == 0:
+        raise ValueError("没有有效的测量数据")
+    degree = max(0, min(degree, np.unique(rpms).size - 1))
+    design = np.vander(rpms, degree + 1, increasing=True)
+    coefficients, _, _, _ = np.linalg.lstsq(design, values, rcond=None)
+    residuals = values - design @ coefficients
+    total = float(np.sum((values - values.mean()) ** 2))
+    return {
+        "degree": degree,
+        "coefficients": [float(c) for c in coefficients],
+        "rmse": float(np.sqrt(np.mean(residuals ** 2))),
+        "r2": 1.0 - float(np.sum(residuals ** 2)) / total if total > 0 else 1.0,
+    }
+
+
+def evaluate_fit(fit, rpm):
+    return float(sum(c * rpm ** i for i, c in enumerate(fit["coefficients"])))
+
+
+def build_calibration(unit, measurements, fit, density=1.0, point_rpms=None):
+    """生成校准文件内容：在测量转速处取拟合值作为插值标定点"""
+    if point_rpms is None:
+        point_rpms = sorted({m["rpm"] for m in measurements})
+    points = [{"rpm": float(rpm), "ml_per_rev": round(evaluate_fit(fit, rpm), 6)} for rpm in point_rpms]
+    data = {
+        "unit": unit,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "density_g_per_ml": density,
+        "points": points,
+        "fit": fit,
+        "measurements": measurements,
+    }
+    CalibrationCurve.from_dict(data)    # 拟合结果为负值等无效时在写入前报错
+    return data
+
+
+def write_calibration(data, directory=DEFAULT_DIRECTORY):
+    """原子写入 calibration_<unit>.json（先写临时文件再替换）"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"calibration_{data['unit']}.json")
+    fd, tmp_path = tempfile.mkstemp(prefix=".calibration_", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def format_report(data):
+    fit = data["fit"]
+    terms = " + ".join(f"{c:.6g}·rpm^{i}" if i else f"{c:.6g}" for i, c in enumerate(fit["coefficients"]))
+    lines = [f"单元 {data['unit']}: ml_per_rev = {terms}  (RMSE={fit['rmse']:.2e}, R²={fit['r2']:.4f})",
+             f"{'RPM':>8} {'实测 mL/rev':>12} {'拟合 mL/rev':>12}"]
+    for m in data["measurements"]:
+        lines.append(f"{m['rpm']:8g} {m['ml_per_rev']:12.5f} {evaluate_fit(fit, m['rpm']):12.5f}")
+    return "\n".join(lines)
+
+
+async def calibrate(args):
+    if args.simulate is not None:
+        balance = SimulatedBalance(args.simulate, density=args.density, seed=0)
+        proxy = SimulatedPump(calibration_unit=args.unit)
+    else:
+        from core_api.pump_proxy import PumpProxy
+
+        balance = ConsoleBalance()
+        proxy = PumpProxy(args.moonraker, calibration_unit=args.unit)
+    started = time.time()
+    measurements = await run_dispenses(proxy, args.rpm, args.volume, balance,
+                                       repeats=args.repeats, settle=args.settle, density=args.density)
+    log.info(f"测量完成，共 {len(measurements)} 个有效数据点，用时 {time.time() - started:.0f} 秒")
+    if not measurements:
+        print("错误：没有有效的测量数据（泵送全部失败或被跳过），未生成校准")
+        return 1
+    fit = fit_flow_curve(measurements, degree=args.degree)
+    data = build_calibration(args.unit, measurements, fit, density=args.density)
+    print(format_report(data))
+    if args.dry_run:
+        print("--dry-run：未写入校准文件")
+    else:
+        print(f"已写入 {write_calibration(data, args.output_dir)}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="泵校准：定速泵送 + 称重 + 拟合 mL/rev 曲线")
+    parser.add_argument("moonraker", nargs="?", help="Moonraker 地址，如 http://192.168.51.168:7125（--simulate 时不需要）")
+    parser.add_argument("--unit", type=int, default=0, help="泵单元号")
+    parser.add_argument("--rpm", type=float, nargs="+", default=[20.0, 45.0, 60.0, 90.0, 120.0], help="校准转速")
+    parser.add_argument("--volume", type=float, default=1.0, help="每次泵送的目标体积 (mL)")
+    parser.add_argument("--repeats", type=int, default=1, help="每个转速的重复次数")
+    parser.add_argument("--settle", type=float, default=2.0, help="泵送结束后等待液滴落下的时间 (秒)")
+    parser.add_argument("--density", type=float, default=1.0, help="液体密度 (g/mL)")
+    parser.add_argument("--degree", type=int, default=1, help="拟合多项式阶数")
+    parser.add_argument("--output-dir", default=DEFAULT_DIRECTORY, help="校准文件目录")
+    parser.add_argument("--simulate", type=float, default=None, metavar="ML_PER_REV", help="使用模拟天平（给定真实每圈体积）")
+    parser.add_argument("--dry-run", action="store_true", help="只显示拟合结果，不写入文件")
+    args = parser.parse_args(argv)
+    if args.moonraker is None and args.simulate is None:
+        parser.error("需要 Moonraker 地址（或使用 --simulate 离线演练）")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return asyncio.run(calibrate(args))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
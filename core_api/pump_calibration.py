@@ -0,0 +1,204 @@
+"""pump_calibration.py – 泵校准模型
+
+每个泵单元的校准文件 calibration_cache/calibration_<unit>[_<备注>].json 加载一次，
+转为按转速排序的数组（RPM → 每圈体积 mL/rev），查询时 bisect 定位区间后分段线性插值，
+超出标定范围时取端点值。
+
+支持两种文件格式:
+    {"20": 1.6, "60": 4.9}                                   # 旧格式: RPM -> 流量 (mL/min)
+    {"unit": 0, "points": [{"rpm": 20, "ml_per_rev": 0.08}]}  # 新格式: 标定点列表
+
+文件按 (mtime, size) 判断是否变化，查询时最多每 check_interval 秒扫描一次目录，
+修改或新增的文件自动重新加载，删除的文件对应的模型随之移除。
+
+用法:
+    from core_api.pump_calibration import get_calibration_store
+
+    store = get_calibration_store()
+    ml_per_rev = store.ml_per_rev(unit=0, rpm=45)
+    seconds = store.duration(unit=0, volume_ml=2.0, rpm=45)
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = "calibration_cache"
+DEFAULT_ML_PER_REV = 0.08   # 没有校准数据时使用的每圈体积
+
+
+class CalibrationCurve:
+    """单个泵单元的 mL/rev - RPM 曲线"""
+
+    __slots__ = ("unit", "source", "rpms", "ml_per_revs")
+
+    def __init__(self, points, unit=None, source=None):
+        """
+        Args:
+            points: [(rpm, ml_per_rev), ...]，顺序任意，同一转速取最后一个值
+        """
+        merged = {}
+        for rpm, ml_per_rev in points:
+            rpm, ml_per_rev = float(rpm), float(ml_per_rev)
+            if rpm > 0 and ml_per_rev > 0:
+                merged[rpm] = ml_per_rev
+        if not merged:
+            raise ValueError("校准数据中没有有效的标定点")
+        self.unit = unit
+        self.source = source
+        self.rpms = sorted(merged)
+        self.ml_per_revs = [merged[rpm] for rpm in self.rpms]
+
+    @classmethod
+    def from_dict(cls, data, unit=None, source=None):
+        """解析校准文件内容（新旧两种格式）"""
+        if isinstance(data, dict) and "points" in data:
+            points = [(point["rpm"], point["ml_per_rev"]) for point in data["points"]]
+            return cls(points, unit=data.get("unit", unit), source=source)
+        points = []
+        for key, flow_ml_per_min in data.items():
+            try:
+                rpm = float(key)
+            except (TypeError, ValueError):
+                continue    # 跳过非转速字段（如备注）
+            if rpm > 0:
+                points.append((rpm, float(flow_ml_per_min) / rpm))
+        return cls(points, unit=unit, source=source)
+
+    def ml_per_rev(self, rpm):
+        """指定转速下的每圈体积（分段线性插值，范围外取端点值）"""
+        rpms = self.rpms
+        index = bisect.bisect_left(rpms, rpm)
+        if index == 0:
+            return self.ml_per_revs[0]
+        if index == len(rpms):
+            return self.ml_per_revs[-1]
+        left, right = rpms[index - 1], rpms[index]
+        weight = (rpm - left) / (right - left)
+        return self.ml_per_revs[index - 1] + weight * (self.ml_per_revs[index] - self.ml_per_revs[index - 1])
+
+    def flow_ml_per_s(self, rpm):
+        return self.ml_per_rev(rpm) * rpm / 60.0
+
+    def revolutions(self, volume_ml, rpm):
+        return volume_ml / self.ml_per_rev(rpm)
+
+    def duration(self, volume_ml, rpm):
+        """泵送指定体积所需时间（秒）"""
+        return self.revolutions(volume_ml, rpm) / rpm * 60.0 if rpm > 0 else 0.0
+
+    def __repr__(self):
+        return f"CalibrationCurve(unit={self.unit}, rpm={self.rpms[0]:g}-{self.rpms[-1]:g}, points={len(self.rpms)})"
+
+
+def unit_from_filename(name):
+    """calibration_<unit>[_<备注>].json -> unit；不符合命名规则时返回 None"""
+    if not (name.startswith("calibration_") and name.endswith(".json")):
+        return None
+    head = name[len("calibration_"):-len(".json")].split("_")[0]
+    try:
+        return int(head)
+    except ValueError:
+        return None
+
+
+class CalibrationStore:
+    """按单元缓存校准曲线，文件变化时自动重新加载"""
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, default_ml_per_rev=DEFAULT_ML_PER_REV, check_interval=1.0):
+        self.directory = directory
+        self.default_ml_per_rev = default_ml_per_rev
+        self.check_interval = check_interval
+        self._curves = {}        # unit -> CalibrationCurve
+        self._by_file = {}       # 文件名 -> CalibrationCurve
+        self._signatures = {}    # 文件名 -> (mtime_ns, size)
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        """扫描目录，只重新解析变化的文件"""
+        try:
+            entries = {entry.name: entry for entry in os.scandir(self.directory)
+                       if unit_from_filename(entry.name) is not None and entry.is_file()}
+        except FileNotFoundError:
+            entries = {}
+
+        changed = False
+        for name in list(self._signatures):
+            if name not in entries:
+                del self._signatures[name]
+                self._by_file.pop(name, None)
+                log.info(f"校准文件已删除: {name}")
+                changed = True
+        for name, entry in entries.items():
+            stat = entry.stat()
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self._signatures.get(name) == signature:
+                continue
+            self._signatures[name] = signature
+            changed = True
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    curve = CalibrationCurve.from_dict(json.load(f), unit=unit_from_filename(name), source=path)
+            except Exception as e:
+                self._by_file.pop(name, None)
+                log.warning(f"加载校准文件失败 {name}: {e}")
+                continue
+            self._by_file[name] = curve
+            log.info(f"已加载校准数据: unit={curve.unit}, file={name}, {curve!r}")
+        if not changed:
+            return
+
+        # 同一单元有多个文件时使用最新修改的一个
+        curves = {}
+        for name in sorted(self._by_file, key=lambda n: self._signatures[n][0]):
+            curve = self._by_file[name]
+            curves[curve.unit] = curve
+        self._curves = curves
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if force or self._last_check is None or now - self._last_check >= self.check_interval:
+                self._last_check = now
+                self._scan()
+
+    def curve(self, unit):
+        """单元的校准曲线，没有时返回 None"""
+        self.refresh()
+        return self._curves.get(unit)
+
+    def units(self):
+        self.refresh()
+        return sorted(self._curves)
+
+    def ml_per_rev(self, unit, rpm):
+        curve = self.curve(unit)
+        return curve.ml_per_rev(rpm) if curve is not None else self.default_ml_per_rev
+
+    def revolutions(self, unit, volume_ml, rpm):
+        ml_per_rev = self.ml_per_rev(unit, rpm)
+        return volume_ml / ml_per_rev if ml_per_rev > 0 else 0.0
+
+    def duration(self, unit, volume_ml, rpm):
+        """泵送指定体积所需时间（秒）"""
+        return self.revolutions(unit, volume_ml, rpm) / rpm * 60.0 if rpm > 0 else 0.0
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_calibration_store(directory=DEFAULT_DIRECTORY):
+    """同一目录在进程内共享一个 CalibrationStore"""
+    key = os.path.abspath(directory)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = CalibrationStore(directory)
+        return store
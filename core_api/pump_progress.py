@@ -0,0 +1,111 @@
+"""pump_progress.py – 基于实际圈数的泵进度与完成检测
+
+通过 MoonrakerWebsocketListener 订阅泵的对象状态（printer.objects.subscribe），
+按实际转过的圈数计算进度，泵停止时立即判定完成，不再依赖 elapsed / estimated_duration。
+
+状态来源为宏变量：[gcode_macro _PUMP_STATUS] 中声明 variable_revolutions_done / variable_target_revolutions /
+variable_running，泵服务通过 SET_GCODE_VARIABLE 更新。
+
+不支持 manual_stepper：其状态中的 position 是指令位置，移动一入队就跳到目标值，
+据此判断会在泵送开始时就报告 100% 并判定完成。
+
+宏变量不可用（未订阅到状态）时 snapshot() 返回 None，调用方回退到按时间估算。
+"""
+import logging
+import time
+from typing import Any, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+MACRO_OBJECT = "gcode_macro _PUMP_STATUS"
+
+
+class PumpProgressTracker:
+    """跟踪一次泵送的实际圈数"""
+
+    def __init__(self, listener, macro_object: str = MACRO_OBJECT, tolerance: float = 0.01):
+        """
+        Args:
+            listener: MoonrakerWebsocketListener 实例
+            macro_object: 发布泵状态变量的宏对象名
+            tolerance: 宏未提供 running 时，圈数达到目标的 (1 - tolerance) 即视为完成
+        """
+        self.listener = listener
+        self.macro_object = macro_object
+        self.tolerance = tolerance
+        self.target_revolutions = None
+        self.started_at = None
+        self._start_done = None
+        self._seen_running = False
+
+    async def subscribe(self):
+        """让监听器订阅泵状态对象（重复调用无副作用）"""
+        if self.listener is not None:
+            await self.listener.subscribe_objects({self.macro_object: None})
+
+    def begin(self, target_revolutions: Optional[float]):
+        """开始一次泵送：记录目标圈数和宏变量中上一次泵送的圈数"""
+        self.target_revolutions = target_revolutions
+        self.started_at = time.monotonic()
+        macro = self._status(self.macro_object)
+        self._start_done = macro.get("revolutions_done") if macro else None
+        self._seen_running = False
+
+    def _status(self, name) -> Optional[Dict[str, Any]]:
+        if self.listener is None:
+            return None
+        return self.listener.get_object_status(name)
+
+    def _read(self, object_status) -> Optional[Dict[str, Any]]:
+        macro = object_status.get(self.macro_object)
+        if macro and "revolutions_done" in macro:
+            target = macro.get("target_revolutions") or self.target_revolutions
+            done = float(macro["revolutions_done"])
+            running = bool(macro.get("running", target is None or done < target * (1 - self.tolerance)))
+            if running or done != self._start_done:
+                self._seen_running = True    # 宏变量仍是上一次泵送的值时不能据此判定完成
+            if not self._seen_running:
+                done = 0.0                   # 上一次泵送的圈数不计入本次进度
+            return {"revolutions_done": done, "target_revolutions": target, "running": running,
+                    "stopped": not running and self._seen_running, "source": "macro"}
+        return None
+
+    def snapshot(self) -> Optional[Dict[str, Any]]:
+        """当前实际进度；没有可用的状态来源时返回 None
+
+        Returns:
+            dict: revolutions_done、target_revolutions、progress（0-1，无目标时为 None）、running、
+                  stopped（本次泵送已结束）、source
+        """
+        if self.listener is None:
+            return None
+        state = self._read(self.listener.object_status)
+        if state is None:
+            return None
+        target = state["target_revolutions"]
+        state["progress"] = min(max(state["revolutions_done"] / target, 0.0), 1.0) if target else None
+        return state
+
+    @property
+    def available(self) -> bool:
+        return self.snapshot() is not None
+
+    async def wait_until_stopped(self, timeout: Optional[float] = None) -> bool:
+        """等待泵停止（状态中 running 变为 False）
+
+        Returns:
+            True 表示检测到停止，False 表示超时或没有状态来源
+        """
+        if self.listener is None:
+            return False
+
+        def stopped(object_status):
+            state = self._read(object_status)
+            return state is not None and state["stopped"]
+
+        result = await self.listener.wait_for_condition(stopped, timeout)
+        if result is not None:
+            elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+            log.info(f"检测到泵停止: {self.snapshot()}，用时 {elapsed:.2f} 秒")
+            return True
+        return False
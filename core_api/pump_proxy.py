@@ -8,11 +8,31 @@ import logging
 import re
 import json
 import uuid
+import time
 import asyncio
+import functools
 from typing import Dict, Any, Optional
 
+from core_api import metrics, tracing
+from core_api.pump_calibration import get_calibration_store
+
 log = logging.getLogger(__name__)
 
+PUMP_PARAM_SOURCE = metrics.counter(
+    "pump_param_source_total", "泵送参数来源（websocket/response_log/fallback 等）", ["operation", "source"])
+
+
+def _count_param_source(operation):
+    """按返回结果中的 source 字段计数"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            result = await func(*args, **kwargs)
+            PUMP_PARAM_SOURCE.labels(operation, result.get("source", "unknown")).inc()
+            return result
+        return wrapper
+    return decorator
+
 # 如果MoonrakerWebsocketListener类在单独文件中
 try:
     from core_api.moonraker_listener import MoonrakerWebsocketListener
@@ -26,17 +46,21 @@ class MoonrakerError(RuntimeError):
 
 
 class PumpProxy:
-    def __init__(self, base_url: str, listener: Optional[MoonrakerWebsocketListener] = None):
+    def __init__(self, base_url: str, listener: Optional[MoonrakerWebsocketListener] = None, calibration_unit: int = 0):
         """初始化泵代理
 
         Args:
             base_url: Moonraker HTTP API基础URL，例如 "http://192.168.1.100:7125"
             listener: MoonrakerWebsocketListener实例，用于接收泵服务的参数。如果为None，将使用传统方式估算参数。
+            calibration_unit: 回退估算时使用的校准单元号（calibration_cache/calibration_<unit>*.json）
         """
         self.base = base_url.rstrip('/')
         self.listener = listener  # WebSocket监听器
+        self.calibration_unit = calibration_unit
+        self.calibration = get_calibration_store()
         
         # 泵校准基准值，用于估算时间（仅在无法从WebSocket获取精确值时使用）
+        # 有校准文件时 ml_per_rev 按校准曲线插值，这里的值只在没有校准数据时使用
         self.fallback_calibration = {
             'slow': {'rpm': 5.0, 'ml_per_rev': 0.08},
             'normal': {'rpm': 20.0, 'ml_per_rev': 0.08},
@@ -58,11 +82,14 @@ class PumpProxy:
         """
         url = f"{self.base}/printer/gcode/script"
         log.debug("POST (async) %s | %s", url, script)
+        with tracing.start_span("moonraker.gcode_script", script=script):
+            return await self._send_async_untraced(url, script)
+
+    async def _send_async_untraced(self, url: str, script: str):
         try:
             loop = asyncio.get_event_loop()
             # 使用 functools.partial 将参数绑定到同步函数
             # This makes self._blocking_post suitable for run_in_executor
-            import functools
             partial_blocking_post = functools.partial(self._blocking_post, url, script)
             
             # 在executor中运行阻塞的requests调用
@@ -72,15 +99,21 @@ class PumpProxy:
             log.info(">> G-code Script (async): %s -> Moonraker Response: %s", script, data)
             return data.get('result', '')
         except requests.exceptions.RequestException as e:
+            metrics.MOONRAKER_GCODE_FAILURES.labels("pump", "request").inc()
             log.error(f"Moonraker API request failed (async) for script '{script}': {e}")
             raise MoonrakerError(f"Failed to send command to Moonraker (async): {e}")
         except json.JSONDecodeError as e:
+            metrics.MOONRAKER_GCODE_FAILURES.labels("pump", "invalid_json").inc()
             log.error(f"Failed to decode JSON response from Moonraker (async) for script '{script}': {e}. Response text: {raw_response_text if 'raw_response_text' in locals() else 'Unknown'}")
             raise MoonrakerError(f"Invalid JSON response from Moonraker (async): {e}")
 
     def _blocking_post(self, url: str, script: str) -> str:
         """实际执行阻塞的POST请求的辅助方法"""
-        r = requests.post(url, json={"script": script}, timeout=180)
+        started = time.perf_counter()
+        try:
+            r = requests.post(url, json={"script": script}, timeout=180)
+        finally:
+            metrics.MOONRAKER_REQUEST_SECONDS.labels("pump", "gcode").observe(time.perf_counter() - started)
         r.raise_for_status()
         return r.text
 
@@ -118,6 +151,11 @@ class PumpProxy:
                 
         return rpm, revolutions
 
+    def _ml_per_rev(self, rpm: float, default: float) -> float:
+        """校准曲线在该转速下的每圈体积，没有校准数据时返回 default"""
+        curve = self.calibration.curve(self.calibration_unit)
+        return curve.ml_per_rev(rpm) if curve is not None else default
+
     def _estimate_parameters_fallback(self, volume_ml: float, speed: str = "normal") -> Dict[str, Any]:
         """估算泵参数（回退方法）
 
@@ -135,7 +173,7 @@ class PumpProxy:
         
         # 获取对应速度的RPM和ml_per_rev
         rpm = self.fallback_calibration[speed_key]['rpm']
-        ml_per_rev = self.fallback_calibration[speed_key]['ml_per_rev']
+        ml_per_rev = self._ml_per_rev(rpm, self.fallback_calibration[speed_key]['ml_per_rev'])
         
         # 估算圈数
         revolutions = volume_ml / ml_per_rev if ml_per_rev > 0 else 0
@@ -156,6 +194,8 @@ class PumpProxy:
         return result
 
     # --- public API ---
+    @_count_param_source("dispense_auto")
+    @tracing.traced("pump_proxy.dispense_auto")
     async def dispense_auto(self, volume_ml: float, speed: str = "normal", direction: int = 1) -> Dict[str, Any]:
         """自动泵送指定体积
 
@@ -196,6 +236,7 @@ class PumpProxy:
         # 使用asyncio.gather同时启动两个任务
         
         # 命令发送任务 - 设置超时
+        @tracing.traced("pump_proxy.send_command")
         async def send_command_with_timeout():
             try:
                 # 为_send_async设置超时，避免无限等待
@@ -204,10 +245,12 @@ class PumpProxy:
                     timeout=2.0  # 2秒超时 - 只为获取命令确认，非常快
                 )
             except asyncio.TimeoutError:
+                metrics.MOONRAKER_GCODE_FAILURES.labels("pump", "timeout").inc()
                 log.warning(f"任务 {task_id} G-code命令发送超时，但命令可能已发送。继续执行...")
                 return "Command sent, but response timed out"
             
         # WebSocket参数获取任务 - 设置超时
+        @tracing.traced("pump_proxy.wait_ws_params")
         async def get_ws_params_with_timeout():
             if not self.listener:
                 log.info(f"任务 {task_id} 未提供WebSocket监听器，返回None")
@@ -320,6 +363,8 @@ class PumpProxy:
             "raw_response": str(raw_response) if raw_response else "Unknown response"
             }
 
+    @_count_param_source("dispense_speed")
+    @tracing.traced("pump_proxy.dispense_speed")
     async def dispense_speed(self, volume_ml: float, speed_rpm: float, direction: int = 1) -> Dict[str, Any]:
         """使用固定速度泵送（定时泵送的底层方法）
 
@@ -397,7 +442,7 @@ class PumpProxy:
                 }
             
             # 回退估算
-            ml_per_rev = 0.08 # 默认值
+            ml_per_rev = self._ml_per_rev(speed_rpm, self.fallback_calibration['normal']['ml_per_rev'])
             revolutions_fallback = volume_ml / ml_per_rev if ml_per_rev > 0 else 0
             estimated_duration_fallback = (revolutions_fallback / speed_rpm) * 60 if speed_rpm > 0 else 0
             log.info(f"估算参数: 体积={volume_ml}ml, RPM={speed_rpm}, "
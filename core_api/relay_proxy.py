@@ -1,8 +1,13 @@
 """relay_proxy.py – v3
 gcode_macro 名称格式: RELAY_ON_<idx> / RELAY_OFF_<idx> / RELAY_TOGGLE_<idx>
+继电器输出引脚: [output_pin relay_<idx>]（名称格式可通过 pin_name_format 修改），
+用于状态回读（printer.objects.query）和订阅推送（printer.objects.subscribe）。
 """
 import requests
 import logging
+import time
+
+from core_api import metrics
 
 log = logging.getLogger(__name__)
 
@@ -11,16 +16,37 @@ class MoonrakerError(RuntimeError):
     pass
 
 
+def _parse_state(state) -> bool:
+    """True/False、"on"/"off"、1/0 -> bool"""
+    if isinstance(state, str):
+        value = state.strip().lower()
+        if value in ("on", "1", "true"):
+            return True
+        if value in ("off", "0", "false"):
+            return False
+        raise ValueError(f"无效的继电器状态: {state}")
+    return bool(state)
+
+
 class RelayProxy:
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, pin_name_format: str = "relay_{idx}"):
         self.base = base_url.rstrip('/')
+        self.pin_name_format = pin_name_format
 
     # internal
-    def _send(self, script: str):
+    def _send(self, script: str, timeout: float = 30):
         url = f"{self.base}/printer/gcode/script"
         log.debug("POST %s | %s", url, script)
-        r = requests.post(url, json={"script": script}, timeout=30)
+        started = time.perf_counter()
+        try:
+            r = requests.post(url, json={"script": script}, timeout=timeout)
+        except requests.exceptions.RequestException:
+            metrics.MOONRAKER_GCODE_FAILURES.labels("relay", "request").inc()
+            raise
+        finally:
+            metrics.MOONRAKER_REQUEST_SECONDS.labels("relay", "gcode").observe(time.perf_counter() - started)
         if r.status_code != 200:
+            metrics.MOONRAKER_GCODE_FAILURES.labels("relay", f"http_{r.status_code}").inc()
             raise MoonrakerError(f"{r.status_code}: {r.text}")
         data = r.json()
         # 改用普通字符替代特殊Unicode箭头，避免GBK编码错误
@@ -28,6 +54,10 @@ class RelayProxy:
         return data
 
     # public
+    def send_script(self, script: str, timeout: float = 30):
+        """发送多行脚本（如 core_api.choreography 编译的定时序列）；含 G4 时按总时长放宽 timeout"""
+        return self._send(script, timeout=timeout)
+
     def on(self, idx: int):
         return self._send(f"RELAY_ON_{idx}")
 
@@ -38,3 +68,53 @@ class RelayProxy:
         if state:
             return self._send(f"RELAY_TOGGLE_{idx} STATE={state.upper()}")
         return self._send(f"RELAY_TOGGLE_{idx}")
+
+    def set_many(self, states: dict):
+        """一次请求设置多个继电器：{idx: True/False/"on"/"off"} 按顺序合并为一个多行 G-code 脚本
+
+        Returns:
+            dict[int, bool]: 请求设置的状态
+        """
+        parsed = {int(idx): _parse_state(state) for idx, state in states.items()}
+        if not parsed:
+            return {}
+        script = "\n".join(f"RELAY_{'ON' if on else 'OFF'}_{idx}" for idx, on in parsed.items())
+        self._send(script)
+        return parsed
+
+    # 状态回读
+    def pin_object(self, idx: int) -> str:
+        return f"output_pin {self.pin_name_format.format(idx=idx)}"
+
+    def pin_objects(self, indices) -> dict:
+        """订阅/查询用的对象字典 {"output_pin relay_1": ["value"], ...}"""
+        return {self.pin_object(idx): ["value"] for idx in indices}
+
+    def parse_states(self, status: dict, indices) -> dict:
+        """从对象状态中取出继电器状态 {idx: bool}，状态中没有的继电器不返回"""
+        states = {}
+        for idx in indices:
+            pin = status.get(self.pin_object(idx))
+            if isinstance(pin, dict) and pin.get("value") is not None:
+                states[idx] = float(pin["value"]) > 0
+        return states
+
+    def query_states(self, indices) -> dict:
+        """通过 printer.objects.query 读取 output_pin 的实际状态
+
+        Returns:
+            dict[int, bool]: 查询到的继电器状态（Klipper 中不存在的引脚不返回）
+        """
+        url = f"{self.base}/printer/objects/query"
+        started = time.perf_counter()
+        try:
+            r = requests.post(url, json={"objects": self.pin_objects(indices)}, timeout=10)
+        except requests.exceptions.RequestException:
+            metrics.MOONRAKER_GCODE_FAILURES.labels("relay", "query").inc()
+            raise
+        finally:
+            metrics.MOONRAKER_REQUEST_SECONDS.labels("relay", "query").observe(time.perf_counter() - started)
+        if r.status_code != 200:
+            raise MoonrakerError(f"{r.status_code}: {r.text}")
+        status = r.json().get("result", {}).get("status", {})
+        return self.parse_states(status, indices)
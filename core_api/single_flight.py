@@ -0,0 +1,144 @@
+"""single_flight.py – 设备状态查询合并
+
+同一个 key 的查询：
+- 结果在 max_age 秒内有效时直接返回缓存（hit）；
+- 已有相同查询在进行时等待它的结果，不再发起新请求（shared）；
+- 否则由当前调用者执行查询（miss），结果写入缓存并交给所有等待者。
+查询抛出的异常同样交给所有等待者，但不缓存。
+
+SingleFlight 用于同步代码（多线程调用），AsyncSingleFlight 用于同一事件循环内的协程。
+
+用法:
+    flight = SingleFlight("printer_position")
+    position = flight.do("toolhead", query_position, max_age=0.25)
+    flight.invalidate("toolhead")     # 发送移动 G-code 后使缓存失效
+"""
+import asyncio
+import threading
+import time
+
+from core_api import metrics
+
+SINGLE_FLIGHT_CALLS = metrics.counter(
+    "single_flight_calls_total", "状态查询合并结果（hit=缓存命中，shared=等待进行中的查询，miss=实际查询）",
+    ["name", "result"])
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "generation")
+
+    def __init__(self, generation):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.generation = generation
+
+
+class SingleFlight:
+    """线程安全的查询合并与短时缓存"""
+
+    def __init__(self, name="default"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}        # key -> _Call（进行中）
+        self._cache = {}        # key -> (完成时间, 结果)
+        self._generation = {}   # key -> 失效次数，失效前发起的查询结果不写入缓存
+
+    def do(self, key, function, max_age=0.0):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and now - cached[0] <= max_age:
+                SINGLE_FLIGHT_CALLS.labels(self.name, "hit").inc()
+                return cached[1]
+            call = self._calls.get(key)
+            if call is not None:
+                owner = False
+            else:
+                owner = True
+                call = self._calls[key] = _Call(self._generation.get(key, 0))
+
+        if not owner:
+            SINGLE_FLIGHT_CALLS.labels(self.name, "shared").inc()
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        SINGLE_FLIGHT_CALLS.labels(self.name, "miss").inc()
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+                if call.error is None and call.generation == self._generation.get(key, 0):
+                    self._cache[key] = (time.monotonic(), call.result)
+            call.event.set()
+        return call.result
+
+    def invalidate(self, key=None):
+        """使缓存失效（key 为 None 时全部失效）；进行中的查询结果不会写入缓存"""
+        with self._lock:
+            keys = list(self._cache) + list(self._calls) if key is None else [key]
+            for item in keys:
+                self._cache.pop(item, None)
+                self._generation[item] = self._generation.get(item, 0) + 1
+
+    def peek(self, key):
+        """(结果, 已缓存秒数)；没有缓存时返回 None"""
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        return cached[1], time.monotonic() - cached[0]
+
+
+class AsyncSingleFlight:
+    """协程版本：function 为返回 awaitable 的可调用对象"""
+
+    def __init__(self, name="default"):
+        self.name = name
+        self._calls = {}        # key -> (Future, generation)
+        self._cache = {}
+        self._generation = {}
+
+    async def do(self, key, function, max_age=0.0):
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] <= max_age:
+            SINGLE_FLIGHT_CALLS.labels(self.name, "hit").inc()
+            return cached[1]
+        in_flight = self._calls.get(key)
+        if in_flight is not None:
+            SINGLE_FLIGHT_CALLS.labels(self.name, "shared").inc()
+            # shield：某个等待者被取消时不影响查询本身和其他等待者
+            return await asyncio.shield(in_flight[0])
+
+        SINGLE_FLIGHT_CALLS.labels(self.name, "miss").inc()
+        generation = self._generation.get(key, 0)
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = (future, generation)
+        try:
+            result = await function()
+        except BaseException as e:
+            if not future.done():
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+                    future.exception()   # 没有等待者时不报 "exception was never retrieved"
+            raise
+        else:
+            if generation == self._generation.get(key, 0):
+                self._cache[key] = (time.monotonic(), result)
+            future.set_result(result)
+            return result
+        finally:
+            self._calls.pop(key, None)
+
+    def invalidate(self, key=None):
+        keys = list(self._cache) + list(self._calls) if key is None else [key]
+        for item in keys:
+            self._cache.pop(item, None)
+            self._generation[item] = self._generation.get(item, 0) + 1
@@ -0,0 +1,364 @@
+"""tracing.py – 轻量级调用链追踪
+
+用 contextvars 保存当前 span，trace ID 随调用自动向下传递：
+- 同一协程内嵌套的 start_span()/@traced 自动成为子 span；
+- asyncio.create_task() 创建任务时复制上下文，并行任务和后台监控循环也挂在发起它们的 span 下；
+- 线程池中执行的阻塞调用不继承上下文，应在提交前的协程中开 span。
+
+结束的 span 放入队列，由后台线程批量写出：
+- JsonlExporter：每行一个 span 的本地 JSON-lines 文件，超过大小上限时轮转；
+- OtlpHttpExporter：按 OTLP/HTTP JSON 格式（/v1/traces）发送到兼容的 collector。
+未配置导出器时 span 只在内存中计时，不产生 I/O。
+
+命令行查看某次运行的时间线:
+    python -m core_api.tracing list device_tester_traces.jsonl
+    python -m core_api.tracing timeline device_tester_traces.jsonl [--trace <trace_id>] [--width 60]
+"""
+import argparse
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+
+log = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """一次操作的计时区间；作为（异步）上下文管理器使用时自动设为当前 span"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status", "_token")
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None, start_ns=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes) if attributes else {}
+        self.status = "ok"
+        self._token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, end_ns=None):
+        if self.end_ns is None:
+            self.end_ns = end_ns if end_ns is not None else time.time_ns()
+            _export(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.status = "error"
+            self.attributes.setdefault("error", f"{exc_type.__name__}: {exc}")
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+        self.end()
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+def new_trace_id():
+    return f"{random.getrandbits(128):032x}"
+
+
+def current_span():
+    return _current_span.get()
+
+
+def current_trace_id():
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def start_span(name, **attributes):
+    """创建当前 span 的子 span（没有当前 span 时开始新的 trace）"""
+    parent = _current_span.get()
+    if parent is None:
+        return Span(name, new_trace_id(), None, attributes)
+    return Span(name, parent.trace_id, parent.span_id, attributes)
+
+
+def traced(name=None, **attributes):
+    """装饰器：函数（同步或协程）每次调用记录一个 span"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with start_span(span_name, **attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with start_span(span_name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ---------- 导出 ----------
+
+class JsonlExporter:
+    """追加写入本地 JSON-lines 文件，超过 max_bytes 时轮转（path.1 … path.<backup_count>）"""
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def _rotate(self):
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def export(self, spans):
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+class OtlpHttpExporter:
+    """以 OTLP/HTTP JSON 格式发送到 collector（如 http://localhost:4318）"""
+
+    def __init__(self, endpoint, service_name="device_tester", timeout=2.0):
+        self.url = endpoint.rstrip("/") + ("" if endpoint.rstrip("/").endswith("/v1/traces") else "/v1/traces")
+        self.service_name = service_name
+        self.timeout = timeout
+
+    @staticmethod
+    def _attribute(key, value):
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def payload(self, spans):
+        return {"resourceSpans": [{
+            "resource": {"attributes": [self._attribute("service.name", self.service_name)]},
+            "scopeSpans": [{
+                "scope": {"name": "core_api.tracing"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [self._attribute(key, value) for key, value in span.attributes.items()],
+                    "status": {"code": 2 if span.status == "error" else 1},
+                } for span in spans],
+            }],
+        }]}
+
+    def export(self, spans):
+        body = json.dumps(self.payload(spans)).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class _ExportWorker:
+    """后台线程：从队列批量取出 span 交给各导出器"""
+
+    def __init__(self, exporters, batch_size=64):
+        self.exporters = exporters
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._flush(batch)
+                    return
+                batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        for exporter in self.exporters:
+            try:
+                exporter.export(batch)
+            except Exception as e:
+                log.warning(f"导出追踪数据失败 ({type(exporter).__name__}): {e}")
+
+    def stop(self, timeout=5.0):
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+
+_worker = None
+
+
+def _export(span):
+    if _worker is not None:
+        _worker.queue.put(span)
+
+
+def configure(jsonl_path=None, otlp_endpoint=None, service_name="device_tester",
+              jsonl_max_bytes=10 * 1024 * 1024, jsonl_backup_count=3):
+    """配置导出器（都不提供时关闭导出）"""
+    global _worker
+    shutdown()
+    exporters = []
+    if jsonl_path:
+        exporters.append(JsonlExporter(jsonl_path, max_bytes=jsonl_max_bytes, backup_count=jsonl_backup_count))
+    if otlp_endpoint:
+        exporters.append(OtlpHttpExporter(otlp_endpoint, service_name=service_name))
+    if exporters:
+        _worker = _ExportWorker(exporters)
+        log.info(f"调用链追踪已启用: {', '.join(type(exporter).__name__ for exporter in exporters)}")
+
+
+def shutdown():
+    """写出队列中剩余的 span 并停止后台线程"""
+    global _worker
+    if _worker is not None:
+        _worker.stop()
+        _worker = None
+
+
+# ---------- 时间线命令行 ----------
+
+def load_spans(path):
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return spans
+
+
+def group_traces(spans):
+    """按 trace_id 分组，按每个 trace 的开始时间排序"""
+    traces = {}
+    for span in spans:
+        traces.setdefault(span["trace_id"], []).append(span)
+    return sorted(traces.items(), key=lambda item: min(span["start_ns"] for span in item[1]))
+
+
+def render_timeline(spans, width=60, name_width=40):
+    """把一个 trace 的 span 渲染为按层级缩进的火焰式时间线"""
+    start = min(span["start_ns"] for span in spans)
+    end = max(span["end_ns"] for span in spans)
+    total = max(end - start, 1)
+    by_parent = {}
+    ids = {span["span_id"] for span in spans}
+    for span in sorted(spans, key=lambda s: s["start_ns"]):
+        parent = span["parent_id"] if span["parent_id"] in ids else None
+        by_parent.setdefault(parent, []).append(span)
+
+    lines = [f"trace {spans[0]['trace_id']}  总耗时 {total / 1e6:.1f} ms  ({len(spans)} 个 span)"]
+
+    def walk(parent, depth):
+        for span in by_parent.get(parent, []):
+            left = int((span["start_ns"] - start) / total * width)
+            right = max(left + 1, int(round((span["end_ns"] - start) / total * width)))
+            bar = " " * left + "█" * (right - left) + " " * (width - right)
+            label = ("  " * depth + span["name"])[:name_width].ljust(name_width)
+            marker = " !" if span.get("status") == "error" else ""
+            lines.append(f"{label} |{bar[:width]}| {(span['end_ns'] - span['start_ns']) / 1e6:9.1f} ms{marker}")
+            walk(span["span_id"], depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查看调用链追踪文件")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    list_parser = subparsers.add_parser("list", help="列出文件中的 trace")
+    list_parser.add_argument("path")
+    timeline_parser = subparsers.add_parser("timeline", help="显示一个 trace 的时间线")
+    timeline_parser.add_argument("path")
+    timeline_parser.add_argument("--trace", default=None, help="trace ID（可只写前缀），默认最近一个")
+    timeline_parser.add_argument("--width", type=int, default=60, help="时间条宽度（字符）")
+    args = parser.parse_args(argv)
+
+    traces = group_traces(load_spans(args.path))
+    if not traces:
+        print("文件中没有追踪数据")
+        return 1
+
+    if args.command == "list":
+        for trace_id, spans in traces:
+            root = min(spans, key=lambda span: span["start_ns"])
+            duration = (max(span["end_ns"] for span in spans) - root["start_ns"]) / 1e6
+            started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(root["start_ns"] / 1e9))
+            print(f"{trace_id}  {started}  {duration:10.1f} ms  {len(spans):3d} span  {root['name']}")
+        return 0
+
+    if args.trace:
+        matches = [spans for trace_id, spans in traces if trace_id.startswith(args.trace)]
+        if not matches:
+            print(f"未找到 trace: {args.trace}")
+            return 1
+        spans = matches[0]
+    else:
+        spans = traces[-1][1]
+    print(render_timeline(spans, width=args.width))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
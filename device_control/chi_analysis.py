@@ -0,0 +1,508 @@
+# chi_analysis.py
+"""CHI 测试结果的向量化分析
+
+- 读取 CHI 导出的 .txt 数据（列名统一为 potential/current/time/freq/z_real/z_imag/...），
+  首次读取后缓存为 .npy，之后以内存映射方式打开，不再重复解析文本；
+- 电荷积分、CV/DPV 峰识别、由扫速序列提取双电层电容 Cdl、LSV 的 Tafel 斜率、EIS 的 Nyquist/Bode 变换；
+- 批量接口一次处理多个文件：不等长的 i-t 曲线拼接后用 np.add.reduceat 一次完成全部积分。
+"""
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# CHI 列名 -> 统一列名
+COLUMN_ALIASES = {
+    'potential/v': 'potential',
+    'current/a': 'current',
+    'time/sec': 'time',
+    'time/s': 'time',
+    'charge/c': 'charge',
+    'freq/hz': 'freq',
+    "z'/ohm": 'z_real',
+    'z"/ohm': 'z_imag',
+    "z''/ohm": 'z_imag',
+    'z/ohm': 'z_mod',
+    'phase/deg': 'phase',
+}
+
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+
+class ChiData:
+    """一个 CHI 数据文件的数值列
+
+    Attributes:
+        path: 源文件路径
+        columns: 统一后的列名列表
+        values: (行数, 列数) 的数组，可能是只读的内存映射
+    """
+
+    def __init__(self, path, columns, values):
+        self.path = path
+        self.columns = list(columns)
+        self.values = values
+
+    def __getitem__(self, name):
+        return self.values[:, self.columns.index(name)]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    @property
+    def kind(self):
+        """根据列推断数据类型：'eis'、'it'、'sweep'（CV/LSV/DPV 等）、'potential_time' 或 'unknown'"""
+        if 'freq' in self.columns:
+            return 'eis'
+        if 'time' in self.columns and 'current' in self.columns:
+            return 'it'
+        if 'potential' in self.columns and 'current' in self.columns:
+            return 'sweep'
+        if 'time' in self.columns and 'potential' in self.columns:
+            return 'potential_time'
+        return 'unknown'
+
+
+def _normalize_column(name):
+    key = name.strip().lower().replace(' ', '')
+    return COLUMN_ALIASES.get(key, key)
+
+
+def parse_chi_text(path):
+    """解析 CHI 导出的文本文件
+
+    数据头是数据块之前最后一个包含 '/' 的逗号分隔行；数据块在第一个无法解析为数字的行处结束。
+
+    Returns:
+        ChiData: 解析结果，未找到数据时 values 为空数组
+    """
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        lines = f.read().splitlines()
+
+    header = None
+    start = None
+    for index, line in enumerate(lines):
+        if '/' in line and (',' in line or '\t' in line) and any(ch.isalpha() for ch in line):
+            header = line
+            start = index + 1
+        elif header is not None and line.strip():
+            try:
+                float(line.replace(',', ' ').split()[0])
+                break
+            except ValueError:
+                header = None
+    if header is None:
+        logger.warning(f"在文件中未找到可识别的数据头: {path}")
+        return ChiData(path, [], np.empty((0, 0)))
+
+    delimiter = ',' if ',' in header else None
+    columns = [_normalize_column(name) for name in (header.split(',') if delimiter else header.split())]
+    end = start
+    while end < len(lines):
+        stripped = lines[end].strip()
+        if stripped:
+            try:
+                float(stripped.replace(',', ' ').split()[0])
+            except ValueError:
+                break
+        end += 1
+
+    rows = [line for line in lines[start:end] if line.strip()]
+    if not rows:
+        return ChiData(path, columns, np.empty((0, len(columns))))
+    values = np.loadtxt(rows, delimiter=delimiter, ndmin=2, usecols=range(len(columns)))
+    return ChiData(path, columns, values)
+
+
+class ChiDataCache:
+    """以 .npy 内存映射缓存解析后的数据
+
+    缓存键由源文件绝对路径、大小和修改时间决定，源文件改变后自动重新解析。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_paths(self, path):
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+        base = os.path.join(self.cache_dir, digest)
+        return base + '.npy', base + '.json'
+
+    def load(self, path):
+        """读取数据文件（命中缓存时以只读内存映射打开）"""
+        array_path, meta_path = self._cache_paths(path)
+        if os.path.exists(array_path) and os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                columns = json.load(f)['columns']
+            return ChiData(path, columns, np.load(array_path, mmap_mode='r'))
+
+        data = parse_chi_text(path)
+        if len(data):
+            tmp_path = array_path + '.tmp.npy'
+            np.save(tmp_path, np.ascontiguousarray(data.values, dtype=np.float64))
+            os.replace(tmp_path, array_path)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'source': os.path.abspath(path), 'columns': data.columns}, f, ensure_ascii=False)
+            data.values = np.load(array_path, mmap_mode='r')
+        return data
+
+
+def load(path, cache=None):
+    """读取 CHI 数据文件，提供 cache 时使用内存映射缓存"""
+    return cache.load(path) if cache is not None else parse_chi_text(path)
+
+
+# ---------- 电荷 ----------
+
+def integrate_charge(time, current):
+    """i-t 曲线的电荷量（梯形积分，取绝对值）
+
+    时间已单调递增时不排序（CHI 导出的数据通常如此）。
+    """
+    time = np.asarray(time, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
+    if time.size < 2:
+        return 0.0
+    if np.any(np.diff(time) < 0):
+        order = np.argsort(time, kind='stable')
+        time, current = time[order], current[order]
+    return float(abs(_trapezoid(current, time)))
+
+
+def batch_charge(curves):
+    """批量计算多条 i-t 曲线的电荷量
+
+    Args:
+        curves: [(time, current), ...]，各曲线长度可以不同
+
+    Returns:
+        np.ndarray: 每条曲线的电荷量（点数不足 2 的曲线为 0）
+    """
+    if not curves:
+        return np.empty(0)
+    lengths = np.array([len(t) for t, _ in curves])
+    time = np.concatenate([np.asarray(t, dtype=np.float64) for t, _ in curves])
+    current = np.concatenate([np.asarray(i, dtype=np.float64) for _, i in curves])
+
+    # 相邻点的梯形面积；跨越曲线边界的面积置零
+    areas = np.zeros(time.size)
+    areas[:-1] = 0.5 * (current[1:] + current[:-1]) * np.diff(time)
+    ends = np.cumsum(lengths)
+    boundaries = ends[(ends > 0) & (ends < time.size)] - 1
+    areas[boundaries] = 0.0
+
+    starts = ends - lengths
+    valid = lengths >= 2
+    charges = np.zeros(len(curves))
+    if np.any(valid):
+        # 有效曲线的起点严格递增，两起点之间的无效曲线面积均为 0
+        charges[valid] = np.abs(np.add.reduceat(areas, starts[valid]))
+
+    # 时间非单调的曲线逐条回退到排序后积分
+    decreasing = np.diff(time) < 0
+    decreasing[boundaries] = False
+    if np.any(decreasing):
+        curve_of_point = np.repeat(np.arange(len(curves)), lengths)
+        for index in np.unique(curve_of_point[:-1][decreasing]):
+            charges[index] = integrate_charge(*curves[index])
+    return charges
+
+
+# ---------- 峰识别 ----------
+
+def find_peaks(y, min_prominence=0.0, min_distance=1):
+    """一维局部极大值识别
+
+    Args:
+        y: 数据
+        min_prominence: 最小峰突出度（峰值减去两侧到更高点之间的较高最低点）
+        min_distance: 峰之间的最小点数间隔，间隔内保留较高的峰
+
+    Returns:
+        tuple: (峰下标数组, 突出度数组)
+    """
+    y = np.asarray(y, dtype=np.float64)
+    if y.size < 3:
+        return np.empty(0, dtype=int), np.empty(0)
+    candidates = np.flatnonzero((y[1:-1] > y[:-2]) & (y[1:-1] >= y[2:])) + 1
+    if candidates.size == 0:
+        return candidates, np.empty(0)
+
+    # 突出度：向左/右找到第一个更高的点，取区间最小值中较大的一个作为基线
+    prominences = np.empty(candidates.size)
+    for n, peak in enumerate(candidates):
+        left = y[:peak][::-1]
+        higher = np.flatnonzero(left > y[peak])
+        left_min = left[:higher[0]].min() if higher.size else left.min()
+        right = y[peak + 1:]
+        higher = np.flatnonzero(right > y[peak])
+        right_min = right[:higher[0]].min() if higher.size else right.min()
+        prominences[n] = y[peak] - max(left_min, right_min)
+
+    keep = prominences >= min_prominence
+    candidates, prominences = candidates[keep], prominences[keep]
+    if min_distance > 1 and candidates.size > 1:
+        order = np.argsort(-y[candidates])
+        selected = np.zeros(candidates.size, dtype=bool)
+        taken = np.zeros(y.size, dtype=bool)
+        for index in order:
+            peak = candidates[index]
+            if not taken[peak]:
+                selected[index] = True
+                taken[max(0, peak - min_distance + 1):peak + min_distance] = True
+        candidates, prominences = candidates[selected], prominences[selected]
+    return candidates, prominences
+
+
+def _sweep_segments(potential):
+    """按扫描方向把 CV 数据切分为若干段，返回 [(起始下标, 结束下标, 方向)]"""
+    direction = np.sign(np.diff(potential))
+    # 零步长沿用前一个方向
+    nonzero = direction != 0
+    if not np.any(nonzero):
+        return [(0, potential.size, 0)]
+    index = np.where(nonzero, np.arange(direction.size), 0)
+    np.maximum.accumulate(index, out=index)
+    direction = direction[index]
+    turns = np.flatnonzero(direction[1:] != direction[:-1]) + 1
+    bounds = np.concatenate(([0], turns, [direction.size]))
+    return [(int(a), int(b) + 1, int(direction[a])) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def cv_peaks(potential, current, min_prominence=None):
+    """CV 的氧化峰（正扫方向的电流极大值）与还原峰（负扫方向的电流极小值）
+
+    Args:
+        min_prominence: 最小突出度，默认取电流范围的 5%
+
+    Returns:
+        dict: {"anodic": [(电位, 电流), ...], "cathodic": [(电位, 电流), ...]}
+    """
+    potential = np.asarray(potential, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
+    if min_prominence is None:
+        min_prominence = 0.05 * float(np.ptp(current)) if current.size else 0.0
+
+    result = {"anodic": [], "cathodic": []}
+    for start, end, direction in _sweep_segments(potential):
+        segment_current = current[start:end]
+        if direction >= 0:
+            peaks, _ = find_peaks(segment_current, min_prominence)
+            result["anodic"].extend((float(potential[start + p]), float(segment_current[p])) for p in peaks)
+        else:
+            peaks, _ = find_peaks(-segment_current, min_prominence)
+            result["cathodic"].extend((float(potential[start + p]), float(segment_current[p])) for p in peaks)
+    return result
+
+
+def dpv_peak(potential, current):
+    """DPV 峰：扣除首尾连线基线后的最大电流
+
+    Returns:
+        dict: {"potential", "current"（扣除基线后的峰高）, "raw_current"}
+    """
+    potential = np.asarray(potential, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
+    if potential.size < 3:
+        return None
+    span = potential[-1] - potential[0]
+    fraction = (potential - potential[0]) / span if span != 0 else np.linspace(0.0, 1.0, potential.size)
+    baseline = current[0] + (current[-1] - current[0]) * fraction
+    corrected = current - baseline
+    index = int(np.argmax(np.abs(corrected)))
+    return {"potential": float(potential[index]), "current": float(corrected[index]), "raw_current": float(current[index])}
+
+
+# ---------- 双电层电容 ----------
+
+def _linear_fit(x, y):
+    """最小二乘直线拟合，返回 (斜率, 截距, R²)"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    slope, intercept = np.polyfit(x, y, 1)
+    residual = y - (slope * x + intercept)
+    total = np.sum((y - y.mean()) ** 2)
+    r2 = 1.0 - np.sum(residual ** 2) / total if total > 0 else 1.0
+    return float(slope), float(intercept), float(r2)
+
+
+def double_layer_capacitance(scan_rates, delta_currents):
+    """由扫速序列提取双电层电容
+
+    Args:
+        scan_rates: 扫速 (V/s)
+        delta_currents: 各扫速下同一电位处的 (i_anodic - i_cathodic) / 2 (A)
+
+    Returns:
+        dict: {"cdl": 电容 (F), "intercept", "r2"}
+    """
+    slope, intercept, r2 = _linear_fit(scan_rates, delta_currents)
+    return {"cdl": slope, "intercept": intercept, "r2": r2}
+
+
+def cdl_from_cvs(cvs, scan_rates, potential=None):
+    """由一组不同扫速的 CV 曲线提取双电层电容
+
+    Args:
+        cvs: [(potential, current), ...]
+        scan_rates: 与 cvs 对应的扫速 (V/s)
+        potential: 取电流的电位，默认取各曲线电位窗口的中点
+
+    Returns:
+        dict: double_layer_capacitance 的结果，另含 "potential" 和 "delta_currents"
+    """
+    deltas = []
+    for cv_potential, cv_current in cvs:
+        cv_potential = np.asarray(cv_potential, dtype=np.float64)
+        cv_current = np.asarray(cv_current, dtype=np.float64)
+        at = potential if potential is not None else float((cv_potential.min() + cv_potential.max()) / 2)
+        anodic, cathodic = [], []
+        for start, end, direction in _sweep_segments(cv_potential):
+            seg_potential = cv_potential[start:end]
+            seg_current = cv_current[start:end]
+            if seg_potential.min() <= at <= seg_potential.max():
+                order = np.argsort(seg_potential)
+                value = np.interp(at, seg_potential[order], seg_current[order])
+                (anodic if direction >= 0 else cathodic).append(value)
+        if not anodic or not cathodic:
+            raise ValueError(f"CV 曲线在 {at} V 处缺少正扫或负扫数据")
+        deltas.append((np.mean(anodic) - np.mean(cathodic)) / 2)
+        potential = at
+    result = double_layer_capacitance(scan_rates, deltas)
+    result.update({"potential": potential, "delta_currents": [float(d) for d in deltas]})
+    return result
+
+
+# ---------- Tafel ----------
+
+def tafel_slope(potential, current, window=None, equilibrium_potential=None):
+    """LSV 的 Tafel 斜率
+
+    在电位窗口内拟合 E = a + b·log10|i|。
+
+    Args:
+        window: (E_min, E_max) 拟合区间，默认使用全部数据
+        equilibrium_potential: 平衡电位，给出时同时外推交换电流
+
+    Returns:
+        dict: {"slope_mv_dec", "intercept", "r2", "exchange_current"（未给平衡电位时为 None）, "points"}
+    """
+    potential = np.asarray(potential, dtype=np.float64)
+    current = np.abs(np.asarray(current, dtype=np.float64))
+    mask = current > 0
+    if window is not None:
+        mask &= (potential >= min(window)) & (potential <= max(window))
+    if np.count_nonzero(mask) < 2:
+        raise ValueError("Tafel 拟合区间内的数据点不足")
+    log_current = np.log10(current[mask])
+    slope, intercept, r2 = _linear_fit(log_current, potential[mask])
+    exchange_current = None
+    if equilibrium_potential is not None and slope != 0:
+        exchange_current = float(10 ** ((equilibrium_potential - intercept) / slope))
+    return {
+        "slope_mv_dec": slope * 1000.0,
+        "intercept": intercept,
+        "r2": r2,
+        "exchange_current": exchange_current,
+        "points": int(np.count_nonzero(mask)),
+    }
+
+
+# ---------- EIS ----------
+
+def nyquist(z_real, z_imag):
+    """Nyquist 图坐标：(Z', -Z'')"""
+    return np.asarray(z_real, dtype=np.float64), -np.asarray(z_imag, dtype=np.float64)
+
+
+def bode(freq, z_real, z_imag):
+    """Bode 图数据：(频率, |Z|, 相位角 (deg))"""
+    impedance = np.asarray(z_real, dtype=np.float64) + 1j * np.asarray(z_imag, dtype=np.float64)
+    return np.asarray(freq, dtype=np.float64), np.abs(impedance), np.degrees(np.angle(impedance))
+
+
+def solution_resistance(freq, z_real, z_imag):
+    """溶液电阻 Rs：高频端 -Z'' 过零处的 Z'（无过零时取最高频率点的 Z'）"""
+    freq = np.asarray(freq, dtype=np.float64)
+    order = np.argsort(-freq)
+    z_real = np.asarray(z_real, dtype=np.float64)[order]
+    minus_imag = -np.asarray(z_imag, dtype=np.float64)[order]
+    crossings = np.flatnonzero(np.signbit(minus_imag[:-1]) != np.signbit(minus_imag[1:]))
+    if crossings.size == 0:
+        return float(z_real[0])
+    i = crossings[0]
+    fraction = minus_imag[i] / (minus_imag[i] - minus_imag[i + 1])
+    return float(z_real[i] + fraction * (z_real[i + 1] - z_real[i]))
+
+
+# ---------- 批量汇总 ----------
+
+def summarize(data):
+    """按数据类型给出单个文件的关键指标"""
+    summary = {"file": os.path.basename(data.path), "kind": data.kind, "points": len(data)}
+    if not len(data):
+        return summary
+    if data.kind == 'it':
+        summary["charge"] = integrate_charge(data['time'], data['current'])
+        summary["final_current"] = float(data['current'][-1])
+    elif data.kind == 'sweep':
+        peaks = cv_peaks(data['potential'], data['current'])
+        summary["anodic_peaks"] = peaks["anodic"]
+        summary["cathodic_peaks"] = peaks["cathodic"]
+        summary["max_current"] = float(np.max(data['current']))
+        summary["min_current"] = float(np.min(data['current']))
+    elif data.kind == 'eis':
+        summary["rs"] = solution_resistance(data['freq'], data['z_real'], data['z_imag'])
+        _, modulus, phase = bode(data['freq'], data['z_real'], data['z_imag'])
+        summary["max_modulus"] = float(modulus.max())
+        summary["min_phase"] = float(phase.min())
+    elif data.kind == 'potential_time':
+        summary["final_potential"] = float(data['potential'][-1])
+    return summary
+
+
+def summarize_files(paths, cache=None):
+    """批量汇总多个数据文件，i-t 曲线的电荷一次性批量积分
+
+    Returns:
+        list[dict]: 每个文件一项，解析失败的文件带 "error"
+    """
+    loaded = []
+    results = []
+    for path in paths:
+        try:
+            loaded.append(load(path, cache))
+            results.append(None)
+        except Exception as e:
+            logger.warning(f"读取数据文件失败 {path}: {e}")
+            loaded.append(None)
+            results.append({"file": os.path.basename(path), "error": str(e)})
+
+    it_indices = [n for n, data in enumerate(loaded) if data is not None and data.kind == 'it' and len(data)]
+    charges = batch_charge([(loaded[n]['time'], loaded[n]['current']) for n in it_indices])
+    charge_by_index = dict(zip(it_indices, charges))
+
+    for n, data in enumerate(loaded):
+        if data is None:
+            continue
+        if n in charge_by_index:
+            results[n] = {
+                "file": os.path.basename(data.path),
+                "kind": "it",
+                "points": len(data),
+                "charge": float(charge_by_index[n]),
+                "final_current": float(data['current'][-1]),
+            }
+        else:
+            results[n] = summarize(data)
+    return results
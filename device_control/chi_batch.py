@@ -0,0 +1,222 @@
+# chi_batch.py
+"""批量重新分析结果目录中的 CHI 数据
+
+遍历结果目录下的所有 .txt 文件，在进程池中解析并分析（device_control.chi_analysis），
+输出一个汇总 CSV 或 Parquet 文件。每个文件的分析结果按内容 SHA-1 缓存在
+<结果目录>/.chi_analysis_cache/index.json 中，再次运行时只重新计算内容有变化的文件
+（大小和修改时间都未变化的文件不重新计算哈希）。
+
+用法:
+    python -m device_control.chi_batch D:/results/MyProject -o summary.csv
+    python -m device_control.chi_batch D:/results -o summary.parquet --workers 8
+"""
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from device_control.chi_analysis import parse_chi_text, summarize
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_NAME = ".chi_analysis_cache"
+CACHE_VERSION = 1
+
+SUMMARY_COLUMNS = [
+    "file", "kind", "points", "charge", "final_current",
+    "anodic_peak_potential", "anodic_peak_current", "cathodic_peak_potential", "cathodic_peak_current",
+    "anodic_peaks", "cathodic_peaks", "max_current", "min_current",
+    "rs", "max_modulus", "min_phase", "final_potential", "sha1", "error",
+]
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def discover_files(root, pattern_suffix='.txt'):
+    """递归查找数据文件（跳过缓存目录），返回排序后的相对路径列表"""
+    found = []
+    for directory, subdirs, files in os.walk(root):
+        subdirs[:] = [d for d in subdirs if d != CACHE_DIR_NAME]
+        for name in files:
+            if name.lower().endswith(pattern_suffix):
+                found.append(os.path.relpath(os.path.join(directory, name), root))
+    return sorted(found)
+
+
+def analyse_file(path):
+    """解析并分析单个文件（在工作进程中执行）"""
+    try:
+        data = parse_chi_text(path)
+        return summarize(data)
+    except Exception as e:
+        return {"file": os.path.basename(path), "error": f"{type(e).__name__}: {e}"}
+
+
+def flatten_summary(relative_path, sha1, summary):
+    """把分析结果展开为汇总表的一行"""
+    row = {column: None for column in SUMMARY_COLUMNS}
+    row.update({key: value for key, value in summary.items() if key in row})
+    row["file"] = relative_path
+    row["sha1"] = sha1
+    for side in ("anodic", "cathodic"):
+        peaks = summary.get(f"{side}_peaks")
+        if peaks:
+            # 取电流绝对值最大的峰
+            potential, current = max(peaks, key=lambda peak: abs(peak[1]))
+            row[f"{side}_peak_potential"] = potential
+            row[f"{side}_peak_current"] = current
+        row[f"{side}_peaks"] = len(peaks) if peaks is not None else None
+    return row
+
+
+class AnalysisCache:
+    """按内容哈希缓存每个文件的分析结果"""
+
+    def __init__(self, root):
+        self.path = os.path.join(root, CACHE_DIR_NAME, "index.json")
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get("version") == CACHE_VERSION:
+                    self.entries = data.get("files", {})
+            except Exception as e:
+                logger.warning(f"读取分析缓存失败，将全部重新计算: {e}")
+
+    def lookup(self, relative_path, full_path):
+        """返回 (sha1, 缓存的分析结果或 None)"""
+        stat = os.stat(full_path)
+        entry = self.entries.get(relative_path)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha1"], entry["summary"]
+        sha1 = file_sha1(full_path)
+        if entry and entry["sha1"] == sha1:
+            # 内容未变（例如文件被复制或 touch），只更新时间戳
+            entry.update({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+            return sha1, entry["summary"]
+        return sha1, None
+
+    def store(self, relative_path, full_path, sha1, summary):
+        stat = os.stat(full_path)
+        self.entries[relative_path] = {
+            "sha1": sha1, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "summary": summary,
+        }
+
+    def prune(self, keep):
+        for relative_path in set(self.entries) - set(keep):
+            del self.entries[relative_path]
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({"version": CACHE_VERSION, "files": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def reanalyse(root, workers=None, include_unknown=False):
+    """重新分析结果目录
+
+    Returns:
+        tuple: (汇总行列表, 统计信息字典)
+    """
+    cache = AnalysisCache(root)
+    files = discover_files(root)
+    hashes = {}
+    summaries = {}
+    pending = []
+    for relative_path in files:
+        sha1, summary = cache.lookup(relative_path, os.path.join(root, relative_path))
+        hashes[relative_path] = sha1
+        if summary is None:
+            pending.append(relative_path)
+        else:
+            summaries[relative_path] = summary
+
+    if pending:
+        logger.info(f"共 {len(files)} 个文件，{len(pending)} 个需要重新分析")
+        if workers == 1 or len(pending) == 1:
+            for relative_path in pending:
+                summaries[relative_path] = analyse_file(os.path.join(root, relative_path))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(analyse_file, os.path.join(root, path)): path for path in pending}
+                for future in as_completed(futures):
+                    summaries[futures[future]] = future.result()
+        for relative_path in pending:
+            cache.store(relative_path, os.path.join(root, relative_path), hashes[relative_path], summaries[relative_path])
+    cache.prune(files)
+    cache.save()
+
+    rows = []
+    for relative_path in files:
+        summary = summaries[relative_path]
+        if not include_unknown and summary.get("kind") == "unknown" and not summary.get("error"):
+            continue
+        rows.append(flatten_summary(relative_path, hashes[relative_path], summary))
+    stats = {"files": len(files), "analysed": len(pending), "cached": len(files) - len(pending), "rows": len(rows)}
+    return rows, stats
+
+
+def parquet_available():
+    """写 Parquet 需要 pandas 以及 pyarrow 或 fastparquet"""
+    import importlib.util
+    return importlib.util.find_spec("pandas") is not None and any(
+        importlib.util.find_spec(engine) is not None for engine in ("pyarrow", "fastparquet"))
+
+
+def write_summary(rows, output_path):
+    """按扩展名写出 CSV 或 Parquet（Parquet 需要 pandas 和 pyarrow/fastparquet）"""
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    if output_path.lower().endswith('.parquet'):
+        import pandas as pd
+        pd.DataFrame(rows, columns=SUMMARY_COLUMNS).to_parquet(output_path, index=False)
+        return
+    with open(output_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量重新分析结果目录中的CHI数据文件")
+    parser.add_argument("root", help="结果目录")
+    parser.add_argument("-o", "--output", default=None, help="汇总文件路径（.csv 或 .parquet），默认 <结果目录>/chi_summary.csv")
+    parser.add_argument("--workers", type=int, default=None, help="分析进程数，默认为CPU核数")
+    parser.add_argument("--all", action="store_true", help="汇总中包含无法识别数据类型的 .txt 文件")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not os.path.isdir(args.root):
+        logger.error(f"结果目录不存在: {args.root}")
+        return 1
+    output = args.output or os.path.join(args.root, "chi_summary.csv")
+    if output.lower().endswith('.parquet') and not parquet_available():
+        logger.error("输出 Parquet 需要安装 pandas 和 pyarrow（或 fastparquet），也可以改用 .csv 输出")
+        return 1
+
+    started = time.perf_counter()
+    rows, stats = reanalyse(args.root, workers=args.workers, include_unknown=args.all)
+    write_summary(rows, output)
+    logger.info(f"分析完成：{stats['files']} 个文件，重新计算 {stats['analysed']} 个，使用缓存 {stats['cached']} 个，"
+                f"汇总 {stats['rows']} 行，耗时 {time.perf_counter() - started:.2f}s -> {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,393 @@
+# chi_registry.py
+"""CHI760E 电化学技术注册表
+
+每种技术以一条声明式记录描述：参数表（类型、默认值、前端别名）、宏模板和时长估算。
+control_chi 中的技术类、后端适配器的 run_*_test 方法、device_tester 的 API 模型和路由
+都由这里生成，新增技术只需添加一条 TechniqueSpec。
+"""
+import functools
+import inspect
+import math
+
+# 必需参数的占位默认值
+REQUIRED = inspect.Parameter.empty
+
+# 宏文件头，{magic} 为首字节（CV 宏历来使用小写 'c'）
+MACRO_HEADER = '{magic}\x02\0\0\nfolder: {folder}\nfileoverride\nheader: CHI760E {label}\n\n'
+MACRO_FOOTER = 'forcequit: yesiamsure\n'
+
+
+class ParamSpec:
+    """技术参数声明"""
+
+    def __init__(self, name, type=float, default=REQUIRED, alias=None, help=''):
+        """
+        Args:
+            name: 参数名（与 CHI 宏命令及技术类构造参数一致）
+            type: 参数类型，用于生成 API 校验模型
+            default: 默认值，REQUIRED 表示必需参数
+            alias: 前端使用的别名（如 EIS 的 voltage -> ei）
+            help: 参数说明
+        """
+        self.name = name
+        self.type = type
+        self.default = default
+        self.alias = alias
+        self.help = help
+
+    @property
+    def required(self):
+        return self.default is REQUIRED
+
+
+def _sens_line(values):
+    """灵敏度行：autosens 为真时使用自动灵敏度"""
+    return 'autosens' if values.get('autosens') else f"sens={values['sens']}"
+
+
+def _priority_line(values):
+    """CP 优先模式行：时间优先 priot，电位优先 prioe"""
+    return 'priot' if str(values['priority']).lower() == 'time' else 'prioe'
+
+
+class TechniqueSpec:
+    """电化学技术声明"""
+
+    def __init__(self, name, tech, label, description, params, lines, derived=None,
+                 estimator=None, magic='C'):
+        """
+        Args:
+            name: 注册名（大写，如 "CV"），同时作为技术类名和 API 路由名
+            tech: CHI 宏中的 tech= 取值
+            label: 宏文件头和日志中使用的技术名称
+            description: 技术说明
+            params: ParamSpec 列表，顺序即技术类构造参数的位置顺序
+            lines: 宏中 tech= 与 run 之间的参数行模板
+            derived: 派生模板字段 {字段名: 函数(values)}，如 sens_line
+            estimator: 时长估算函数(values) -> 秒
+            magic: 宏文件头首字节
+        """
+        self.name = name
+        self.tech = tech
+        self.label = label
+        self.description = description
+        self.params = list(params)
+        self.lines = list(lines)
+        self.derived = derived or {}
+        self.estimator = estimator
+        self.magic = magic
+
+    @property
+    def route(self):
+        """API 路由名（小写）"""
+        return self.name.lower()
+
+    @property
+    def body_template(self):
+        """tech= 到 tsave: 的宏段模板（批处理宏拼接使用）"""
+        return _compiled_body(self.name)
+
+    @property
+    def macro_template(self):
+        """包含文件头和 forcequit 的完整宏模板"""
+        return _compiled_macro(self.name)
+
+    def resolve_params(self, params):
+        """将参数字典规范化为完整的参数值
+
+        处理前端别名、填充默认值并忽略未声明的键。
+
+        Args:
+            params: 原始参数字典
+
+        Returns:
+            dict: 按参数表顺序排列的参数值
+
+        Raises:
+            ValueError: 缺少必需参数
+        """
+        params = params or {}
+        values = {}
+        missing = []
+        for p in self.params:
+            if p.name in params and params[p.name] is not None:
+                values[p.name] = params[p.name]
+            elif p.alias and params.get(p.alias) is not None:
+                values[p.name] = params[p.alias]
+            elif p.required:
+                missing.append(p.name)
+            else:
+                values[p.name] = p.default
+        if missing:
+            raise ValueError(f"{self.name} 缺少必需参数: {', '.join(missing)}")
+        return values
+
+    def _fields(self, values, file_name):
+        fields = dict(values)
+        for key, func in self.derived.items():
+            fields[key] = func(values)
+        fields['fileName'] = file_name
+        return fields
+
+    def render_body(self, values, file_name):
+        """生成不含文件头和 forcequit 的宏段"""
+        return self.body_template.format_map(self._fields(values, file_name))
+
+    def render_macro(self, values, file_name, folder):
+        """生成完整宏文本"""
+        fields = self._fields(values, file_name)
+        fields['folder'] = folder
+        return self.macro_template.format_map(fields)
+
+    def estimate_duration(self, values):
+        """估算测试时长（秒），无法估算时返回 None"""
+        if self.estimator is None:
+            return None
+        try:
+            return max(0.0, float(self.estimator(values)))
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            return None
+
+    def signature(self):
+        """技术类构造函数签名：技术参数在前，文件名参数为仅关键字参数"""
+        parameters = [inspect.Parameter('self', inspect.Parameter.POSITIONAL_OR_KEYWORD)]
+        for p in self.params:
+            parameters.append(inspect.Parameter(p.name, inspect.Parameter.POSITIONAL_OR_KEYWORD, default=p.default))
+        for name in ('fileName', 'prefix', 'suffix'):
+            parameters.append(inspect.Parameter(name, inspect.Parameter.KEYWORD_ONLY, default=None))
+        return inspect.Signature(parameters)
+
+
+@functools.lru_cache(maxsize=None)
+def _compiled_body(name):
+    spec = TECHNIQUES[name]
+    body = f'tech={spec.tech}\n'
+    body += ''.join(f'{line}\n' for line in spec.lines)
+    body += 'run\nsave:{fileName}\ntsave:{fileName}\n'
+    return body
+
+
+@functools.lru_cache(maxsize=None)
+def _compiled_macro(name):
+    spec = TECHNIQUES[name]
+    header = MACRO_HEADER.replace('{magic}', spec.magic).replace('{label}', spec.label)
+    return header + _compiled_body(name) + MACRO_FOOTER
+
+
+# ---------- 时长估算 ----------
+
+def _sweep_time(values, span):
+    return values.get('qt', 0) + abs(span) / values['v']
+
+
+def _estimate_cv(values):
+    # cl 为扫描段数，每段在 eh 与 el 之间扫描一次
+    return _sweep_time(values, (values['eh'] - values['el']) * values['cl'])
+
+
+def _estimate_steps(values):
+    # DPV/SCV：电位台阶数 × 每台阶周期
+    steps = abs(values['ef'] - values['ei']) / values['incre']
+    return values.get('qt', 0) + steps * values['prod']
+
+
+def _estimate_eis(values):
+    # 每十倍频程约 12 个频点，每点至少测量数个周期
+    decades = abs(math.log10(values['fh'] / values['fl']))
+    points = max(1, int(decades * 12) + 1)
+    total = 0.0
+    for k in range(points):
+        freq = values['fh'] * 10 ** (-k / 12)
+        total += max(3.0 / freq, 0.2)
+    return values.get('qt', 0) + total
+
+
+def _estimate_acv(values):
+    steps = abs(values['ef'] - values['ei']) / values['incre']
+    return values.get('quiet', 0) + steps * max(3.0 / values['freq'], 0.1)
+
+
+TECHNIQUES = {}
+
+
+def register(spec):
+    """注册技术声明"""
+    TECHNIQUES[spec.name] = spec
+    _compiled_body.cache_clear()
+    _compiled_macro.cache_clear()
+    return spec
+
+
+def get_technique(name):
+    """按名称（不区分大小写）获取技术声明
+
+    Raises:
+        ValueError: 未注册的技术
+    """
+    key = str(name).upper().replace('-', '')
+    if key not in TECHNIQUES:
+        raise ValueError(f"不支持的CHI技术: {name}")
+    return TECHNIQUES[key]
+
+
+register(TechniqueSpec(
+    'CV', 'cv', 'CV', '循环伏安法 (CV)',
+    params=[
+        ParamSpec('ei', help='初始电位'),
+        ParamSpec('eh', help='高电位'),
+        ParamSpec('el', help='低电位'),
+        ParamSpec('v', help='扫描速率'),
+        ParamSpec('si', help='采样间隔'),
+        ParamSpec('cl', int, help='扫描段数'),
+        ParamSpec('sens', default=1e-5, help='灵敏度'),
+        ParamSpec('qt', default=2.0, help='静置时间'),
+        ParamSpec('pn', str, default='p', help='初始扫描方向'),
+        ParamSpec('autosens', bool, default=False, help='是否自动灵敏度'),
+    ],
+    lines=['ei={ei}', 'eh={eh}', 'el={el}', 'pn={pn}', 'cl={cl}', 'si={si}', 'qt={qt}', 'v={v}', '{sens_line}'],
+    derived={'sens_line': _sens_line},
+    estimator=_estimate_cv,
+    magic='c',
+))
+
+register(TechniqueSpec(
+    'LSV', 'lsv', 'LSV', '线性扫描伏安法 (LSV)',
+    params=[
+        ParamSpec('ei', alias='initial_v', help='初始电位'),
+        ParamSpec('ef', alias='final_v', help='最终电位'),
+        ParamSpec('v', alias='scan_rate', help='扫描速率'),
+        ParamSpec('si', default=0.001, alias='interval', help='采样间隔'),
+        ParamSpec('sens', default=1e-5, help='灵敏度'),
+        ParamSpec('qt', default=2, help='静置时间'),
+    ],
+    lines=['ei={ei}', 'ef={ef}', 'v={v}', 'si={si}', 'qt={qt}', 'sens={sens}'],
+    estimator=lambda values: _sweep_time(values, values['ef'] - values['ei']),
+))
+
+register(TechniqueSpec(
+    'CA', 'ca', 'CA', '计时安培法 (CA)',
+    params=[
+        ParamSpec('ei', help='初始电位'),
+        ParamSpec('eh', help='高电位'),
+        ParamSpec('el', help='低电位'),
+        ParamSpec('cl', int, help='阶跃数'),
+        ParamSpec('pw', help='脉冲宽度'),
+        ParamSpec('si', help='采样间隔'),
+        ParamSpec('sens', default=1e-5, help='灵敏度'),
+        ParamSpec('qt', default=2.0, help='静置时间'),
+        ParamSpec('pn', str, default='p', help='初始极性'),
+        ParamSpec('autosens', bool, default=False, help='是否自动灵敏度'),
+    ],
+    lines=['ei={ei}', 'eh={eh}', 'el={el}', 'pn={pn}', 'cl={cl}', 'pw={pw}', 'si={si}', 'qt={qt}', '{sens_line}'],
+    derived={'sens_line': _sens_line},
+    estimator=lambda values: values['qt'] + values['cl'] * values['pw'],
+))
+
+register(TechniqueSpec(
+    'IT', 'i-t', 'i-t', 'i-t 曲线 (Amperometric i-t Curve)',
+    params=[
+        ParamSpec('ei', help='恒定电位'),
+        ParamSpec('si', help='采样间隔'),
+        ParamSpec('st', help='总采样时间'),
+        ParamSpec('sens', default=1e-5, help='灵敏度'),
+        ParamSpec('qt', default=2, help='静置时间'),
+    ],
+    lines=['ei={ei}', 'si={si}', 'st={st}', 'qt={qt}', 'sens={sens}'],
+    estimator=lambda values: values['qt'] + values['st'],
+))
+
+register(TechniqueSpec(
+    'OCP', 'ocpt', 'OCP', '开路电位 (OCP)',
+    params=[
+        ParamSpec('st', help='运行时间'),
+        ParamSpec('si', help='采样间隔'),
+        ParamSpec('eh', default=10.0, help='高电位限制'),
+        ParamSpec('el', default=-10.0, help='低电位限制'),
+    ],
+    lines=['st={st}', 'eh={eh}', 'el={el}', 'si={si}'],
+    estimator=lambda values: values['st'],
+))
+
+register(TechniqueSpec(
+    'DPV', 'dpv', 'DPV', '差分脉冲伏安法 (DPV)',
+    params=[
+        ParamSpec('ei', help='初始电位'),
+        ParamSpec('ef', help='最终电位'),
+        ParamSpec('incre', help='电位增量'),
+        ParamSpec('amp', help='脉冲振幅'),
+        ParamSpec('pw', help='脉冲宽度'),
+        ParamSpec('sw', help='采样宽度'),
+        ParamSpec('prod', help='脉冲周期'),
+        ParamSpec('sens', default=1e-5, help='灵敏度'),
+        ParamSpec('qt', default=2.0, help='静置时间'),
+        ParamSpec('autosens', bool, default=False, help='是否自动灵敏度'),
+    ],
+    lines=['ei={ei}', 'ef={ef}', 'incre={incre}', 'amp={amp}', 'pw={pw}', 'sw={sw}', 'prod={prod}', 'qt={qt}', '{sens_line}'],
+    derived={'sens_line': _sens_line},
+    estimator=_estimate_steps,
+))
+
+register(TechniqueSpec(
+    'SCV', 'scv', 'SCV', '阶梯伏安法 (SCV)',
+    params=[
+        ParamSpec('ei', help='初始电位'),
+        ParamSpec('ef', help='最终电位'),
+        ParamSpec('incre', help='电位增量'),
+        ParamSpec('sw', help='采样宽度'),
+        ParamSpec('prod', help='台阶周期'),
+        ParamSpec('sens', default=1e-5, help='灵敏度'),
+        ParamSpec('qt', default=2.0, help='静置时间'),
+        ParamSpec('autosens', bool, default=False, help='是否自动灵敏度'),
+    ],
+    lines=['ei={ei}', 'ef={ef}', 'incre={incre}', 'sw={sw}', 'prod={prod}', 'qt={qt}', '{sens_line}'],
+    derived={'sens_line': _sens_line},
+    estimator=_estimate_steps,
+))
+
+register(TechniqueSpec(
+    'CP', 'cp', 'CP', '计时电位法 (CP)',
+    params=[
+        ParamSpec('ic', help='阴极电流'),
+        ParamSpec('ia', help='阳极电流'),
+        ParamSpec('tc', help='阴极时间'),
+        ParamSpec('ta', help='阳极时间'),
+        ParamSpec('eh', default=10.0, help='高电位限制'),
+        ParamSpec('el', default=-10.0, help='低电位限制'),
+        ParamSpec('pn', str, default='p', help='第一步电流极性'),
+        ParamSpec('si', default=0.1, help='数据存储间隔'),
+        ParamSpec('cl', int, default=1, help='段数'),
+        ParamSpec('priority', str, default='time', help="优先模式，'time'或'potential'"),
+    ],
+    lines=['ic={ic}', 'ia={ia}', 'tc={tc}', 'ta={ta}', 'eh={eh}', 'el={el}', 'pn={pn}', 'si={si}', 'cl={cl}', '{priority_line}'],
+    derived={'priority_line': _priority_line},
+    estimator=lambda values: values['cl'] * (values['tc'] + values['ta']) / 2,
+))
+
+register(TechniqueSpec(
+    'EIS', 'imp', 'EIS', '电化学阻抗谱 (EIS)',
+    params=[
+        ParamSpec('ei', alias='voltage', help='直流电位'),
+        ParamSpec('fl', alias='freq_final', help='低频（结束频率）'),
+        ParamSpec('fh', alias='freq_init', help='高频（起始频率）'),
+        ParamSpec('amp', alias='amplitude', help='交流振幅'),
+        ParamSpec('sens', default=1e-5, help='灵敏度'),
+        ParamSpec('qt', default=2, help='静置时间'),
+    ],
+    lines=['ei={ei}', 'fl={fl}', 'fh={fh}', 'amp={amp}', 'sens={sens}', 'qt={qt}'],
+    estimator=_estimate_eis,
+))
+
+register(TechniqueSpec(
+    'ACV', 'acv', 'ACV', '交流伏安法 (ACV)',
+    params=[
+        ParamSpec('ei', help='初始电位'),
+        ParamSpec('ef', help='最终电位'),
+        ParamSpec('incre', help='电位增量'),
+        ParamSpec('amp', help='交流振幅'),
+        ParamSpec('freq', help='交流频率'),
+        ParamSpec('quiet', default=2.0, help='静息时间'),
+        ParamSpec('sens', default=1e-5, help='灵敏度'),
+    ],
+    lines=['ei={ei}', 'ef={ef}', 'incre={incre}', 'amp={amp}', 'freq={freq}', 'qt={quiet}', 'sens={sens}'],
+    estimator=_estimate_acv,
+))
@@ -0,0 +1,154 @@
+# chi_runtime.py
+"""CHI 测试时长估算
+
+以技术注册表中的参数模型（扫描范围/扫速×段数、i-t 的 st、EIS 各频点积分时间等）为先验，
+再用实测耗时在线修正：
+- 同一参数签名重复运行时，直接使用该签名实测耗时的指数滑动平均；
+- 新参数组合使用按技术拟合的线性修正 实测 ≈ a + b × 模型估算（a 主要是软件启动开销）。
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from device_control.chi_registry import get_technique
+
+logger = logging.getLogger(__name__)
+
+
+class RuntimeEstimator:
+    """按技术和参数签名估算 CHI 测试时长，并根据实测耗时在线修正"""
+
+    def __init__(self, history_path=None, alpha=0.3, min_fit_samples=3):
+        """
+        Args:
+            history_path: 历史记录 JSON 文件路径，为 None 时仅在内存中保存
+            alpha: 同签名实测耗时的指数滑动平均系数
+            min_fit_samples: 启用线性修正所需的最少样本数
+        """
+        self.history_path = history_path
+        self.alpha = alpha
+        self.min_fit_samples = min_fit_samples
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()     # 串行化写文件+替换，避免旧快照覆盖新快照
+        self._signatures = {}   # 签名 -> {"mean": 秒, "count": 次数}
+        self._techniques = {}   # 技术 -> 线性拟合累积量 {"n", "sx", "sy", "sxx", "sxy"}
+        self._load()
+
+    @staticmethod
+    def signature(technique, values):
+        """参数签名：技术名 + 排序后的参数值"""
+        return technique + '|' + '|'.join(f"{key}={values[key]!r}" for key in sorted(values))
+
+    def model_estimate(self, technique, params):
+        """仅根据参数模型估算时长（秒），无法估算时返回 None"""
+        spec = get_technique(technique)
+        return spec.estimate_duration(spec.resolve_params(params))
+
+    def estimate(self, technique, params):
+        """估算测试时长
+
+        Args:
+            technique: 技术名称
+            params: 参数字典
+
+        Returns:
+            tuple: (秒数或 None, 来源 "history"/"fitted"/"model")
+        """
+        spec = get_technique(technique)
+        values = spec.resolve_params(params)
+        with self._lock:
+            record = self._signatures.get(self.signature(spec.name, values))
+            if record:
+                return record["mean"], "history"
+            model = spec.estimate_duration(values)
+            if model is None:
+                return None, "model"
+            fitted = self._fitted(spec.name, model)
+        if fitted is not None:
+            return fitted, "fitted"
+        return model, "model"
+
+    def _fitted(self, technique, model):
+        stats = self._techniques.get(technique)
+        if not stats or stats["n"] < 1:
+            return None
+        n, sx, sy, sxx, sxy = stats["n"], stats["sx"], stats["sy"], stats["sxx"], stats["sxy"]
+        denominator = n * sxx - sx * sx
+        if n >= self.min_fit_samples and denominator > 1e-9:
+            slope = (n * sxy - sx * sy) / denominator
+            intercept = (sy - slope * sx) / n
+            if slope > 0:
+                return max(0.0, intercept + slope * model)
+        # 样本不足或模型值没有变化时，只修正比例
+        return model * sy / sx if sx > 0 else None
+
+    def record(self, technique, params, measured_seconds):
+        """记录一次实测耗时
+
+        Args:
+            technique: 技术名称
+            params: 参数字典
+            measured_seconds: 实测耗时（秒）
+        """
+        if measured_seconds is None or measured_seconds <= 0:
+            return
+        spec = get_technique(technique)
+        values = spec.resolve_params(params)
+        key = self.signature(spec.name, values)
+        model = spec.estimate_duration(values)
+
+        with self._lock:
+            record = self._signatures.get(key)
+            if record:
+                record["mean"] += self.alpha * (measured_seconds - record["mean"])
+                record["count"] += 1
+            else:
+                self._signatures[key] = {"mean": float(measured_seconds), "count": 1}
+
+            if model:
+                stats = self._techniques.setdefault(spec.name, {"n": 0, "sx": 0.0, "sy": 0.0, "sxx": 0.0, "sxy": 0.0})
+                stats["n"] += 1
+                stats["sx"] += model
+                stats["sy"] += measured_seconds
+                stats["sxx"] += model * model
+                stats["sxy"] += model * measured_seconds
+
+        logger.info(f"{spec.label} 实测耗时 {measured_seconds:.1f}s（模型估算 {model if model is None else round(model, 1)}s）")
+        self._save()
+
+    def _load(self):
+        if not self.history_path or not os.path.exists(self.history_path):
+            return
+        try:
+            with open(self.history_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._signatures = data.get("signatures", {})
+            self._techniques = data.get("techniques", {})
+        except Exception as e:
+            logger.warning(f"读取CHI时长历史失败，将重新记录: {e}")
+
+    def _save(self):
+        if not self.history_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.history_path))
+        with self._save_lock:
+            # 在持有 _save_lock 时取快照，保证后写入的总是较新的状态；record() 会原地修改嵌套字典，需在 _lock 内序列化
+            with self._lock:
+                text = json.dumps({"signatures": self._signatures, "techniques": self._techniques},
+                                  ensure_ascii=False, indent=2)
+            tmp_path = None
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(tmp_path, self.history_path)
+            except Exception as e:
+                logger.warning(f"保存CHI时长历史失败: {e}")
+                if tmp_path and os.path.exists(tmp_path):
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
@@ -2,7 +2,8 @@
 import subprocess
 import os
 import time
-import psutil
+
+from device_control.chi_registry import TECHNIQUES, get_technique
 
 # 全局变量
 folder_save = '.'
@@ -32,6 +33,16 @@ class Technique:
         self.technique = technique
         self.process = None
 
+    @property
+    def body(self):
+        """返回去掉宏文件头和 forcequit 的技术段落，供批处理宏拼接使用"""
+        spec = getattr(self, 'spec', None)
+        if spec is not None:
+            return spec.render_body(self.params, self.fileName)
+        start = self.text.find('\n\n')
+        body = self.text[start + 2:] if start >= 0 else self.text
+        return body.replace('forcequit: yesiamsure\n', '')
+
     def writeToFile(self):
         """将宏命令写入 .mcr 文件"""
         # 确保保存目录存在
@@ -61,237 +72,106 @@ class Technique:
                 print(f"停止 {self.technique} 实验时出错: {e}")
 
 
-class CV(Technique):
-    """循环伏安法 (CV)"""
-
-    def __init__(self, ei, eh, el, v, si, cl, sens=1e-5, qt=2.0, pn='p', fileName=None, prefix=None, suffix=None, autosens=False):
-        # 处理文件名参数
-        if prefix is not None and suffix is not None:
-            # 使用前缀和后缀构建文件名
-            finalFileName = f"{prefix}_{suffix}"
-        elif fileName is not None:
-            # 使用提供的文件名
-            finalFileName = fileName
-        else:
-            # 默认文件名
-            finalFileName = 'CV'
-
-        header = f"CHI760E CV"
-        text = f'c\x02\0\0\nfolder: {folder_save}\nfileoverride\nheader: {header}\n\n'
-        text += f'tech=cv\nei={ei}\neh={eh}\nel={el}\npn={pn}\ncl={cl}\n'
-        text += f'si={si}\nqt={qt}\nv={v}\n'
-        
-        # 处理灵敏度设置
-        if autosens:
-            text += 'autosens\n'
-        else:
-            text += f'sens={sens}\n'
-            
-        text += 'run\n'
-        text += f'save:{finalFileName}\ntsave:{finalFileName}\nforcequit: yesiamsure\n'
-        Technique.__init__(self, text, finalFileName, 'CV')
-
-
-class LSV(Technique):
-    """线性扫描伏安法 (LSV)"""
-
-    def __init__(self, ei, ef, v, si, sens, qt=2, fileName=None, prefix=None, suffix=None):
-        # 处理文件名参数
-        if prefix is not None and suffix is not None:
-            finalFileName = f"{prefix}_{suffix}"
-        elif fileName is not None:
-            finalFileName = fileName
-        else:
-            finalFileName = 'LSV'
-
-        header = f"CHI760E LSV"
-        text = f'C\x02\0\0\nfolder: {folder_save}\nfileoverride\nheader: {header}\n\n'
-        text += f'tech=lsv\nei={ei}\nef={ef}\nv={v}\nsi={si}\nqt={qt}\nsens={sens}\n'
-        text += 'run\n'
-        text += f'save:{finalFileName}\ntsave:{finalFileName}\nforcequit: yesiamsure\n'
-        Technique.__init__(self, text, finalFileName, 'LSV')
+def _final_file_name(spec, fileName, prefix, suffix):
+    """确定结果文件名：优先使用前缀_后缀，其次使用fileName，否则使用技术名"""
+    if prefix is not None and suffix is not None:
+        return f"{prefix}_{suffix}"
+    if fileName is not None:
+        return fileName
+    return spec.name
 
 
-class CA(Technique):
-    """计时安培法 (CA)"""
+def _technique_class(spec):
+    """根据注册表中的技术声明生成 Technique 子类"""
+    signature = spec.signature()
 
-    def __init__(self, ei, eh, el, cl, pw, si, sens=1e-5, qt=2.0, pn='p', fileName=None, prefix=None, suffix=None, autosens=False):
-        # 处理文件名参数
-        if prefix is not None and suffix is not None:
-            finalFileName = f"{prefix}_{suffix}"
-        elif fileName is not None:
-            finalFileName = fileName
-        else:
-            finalFileName = 'CA'
+    def __init__(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        arguments.pop('self')
+        finalFileName = _final_file_name(spec, arguments.pop('fileName'), arguments.pop('prefix'), arguments.pop('suffix'))
 
-        header = f"CHI760E CA"
-        text = f'C\x02\0\0\nfolder: {folder_save}\nfileoverride\nheader: {header}\n\n'
-        text += f'tech=ca\nei={ei}\neh={eh}\nel={el}\npn={pn}\ncl={cl}\npw={pw}\nsi={si}\nqt={qt}\n'
-        
-        # 处理灵敏度设置
-        if autosens:
-            text += 'autosens\n'
-        else:
-            text += f'sens={sens}\n'
-            
-        text += 'run\n'
-        text += f'save:{finalFileName}\ntsave:{finalFileName}\nforcequit: yesiamsure\n'
-        Technique.__init__(self, text, finalFileName, 'CA')
-
-
-class IT(Technique):
-    """i-t 曲线 (Amperometric i-t Curve)"""
-
-    def __init__(self, ei, si, st, sens, qt=2, fileName=None, prefix=None, suffix=None):
-        # 处理文件名参数
-        if prefix is not None and suffix is not None:
-            finalFileName = f"{prefix}_{suffix}"
-        elif fileName is not None:
-            finalFileName = fileName
-        else:
-            finalFileName = 'IT'
-
-        header = f"CHI760E i-t"
-        text = f'C\x02\0\0\nfolder: {folder_save}\nfileoverride\nheader: {header}\n\n'
-        text += f'tech=i-t\nei={ei}\nsi={si}\nst={st}\nqt={qt}\nsens={sens}\n'
-        text += 'run\n'
-        text += f'save:{finalFileName}\ntsave:{finalFileName}\nforcequit: yesiamsure\n'
-        Technique.__init__(self, text, finalFileName, 'i-t')
+        self.spec = spec
+        self.params = arguments
+        text = spec.render_macro(arguments, finalFileName, folder_save)
+        Technique.__init__(self, text, finalFileName, spec.label)
 
+    __init__.__signature__ = signature
+    return type(spec.name, (Technique,), {
+        '__init__': __init__,
+        '__doc__': spec.description,
+        '__module__': __name__,
+    })
 
-class OCP(Technique):
-    """开路电位 (OCP)"""
 
-    def __init__(self, st, si, eh=10.0, el=-10.0, fileName='OCP'):
-        # fileName 参数现在有默认值 'OCP'，并且 prefix/suffix 已移除
-        # finalFileName 直接使用传入的 fileName (其默认值为 'OCP')
-        finalFileName = fileName
+# 由注册表生成的技术类
+TECHNIQUE_CLASSES = {name: _technique_class(spec) for name, spec in TECHNIQUES.items()}
 
-        header = f"CHI760E OCP"
-        text = f'C\x02\0\0\nfolder: {folder_save}\nfileoverride\nheader: {header}\n\n'
-        text += f'tech=ocpt\nst={st}\neh={eh}\nel={el}\nsi={si}\n'  # si is included as per existing and TASKCHI.md table
-        text += 'run\n'
-        text += f'save:{finalFileName}\ntsave:{finalFileName}\nforcequit: yesiamsure\n'
-        Technique.__init__(self, text, finalFileName, 'OCP')
+CV = TECHNIQUE_CLASSES['CV']
+LSV = TECHNIQUE_CLASSES['LSV']
+CA = TECHNIQUE_CLASSES['CA']
+IT = TECHNIQUE_CLASSES['IT']
+OCP = TECHNIQUE_CLASSES['OCP']
+DPV = TECHNIQUE_CLASSES['DPV']
+SCV = TECHNIQUE_CLASSES['SCV']
+CP = TECHNIQUE_CLASSES['CP']
+EIS = TECHNIQUE_CLASSES['EIS']
+ACV = TECHNIQUE_CLASSES['ACV']
 
 
-class DPV(Technique):
-    """差分脉冲伏安法 (DPV)"""
+def build_technique(name, file_name, params):
+    """按技术名称和参数字典创建技术实例
 
-    def __init__(self, ei, ef, incre, amp, pw, sw, prod, sens, qt=2.0, fileName=None, autosens=False):
-        # 处理文件名参数
-        if fileName is not None:
-            finalFileName = fileName
-        else:
-            finalFileName = 'DPV'
+    参数会先经过注册表规范化（别名映射、默认值填充），未声明的键被忽略。
 
-        header = f"CHI760E DPV"
-        text = f'C\x02\0\0\nfolder: {folder_save}\nfileoverride\nheader: {header}\n\n'
-        text += f'tech=dpv\nei={ei}\nef={ef}\nincre={incre}\namp={amp}\n'
-        text += f'pw={pw}\nsw={sw}\nprod={prod}\nqt={qt}\n'
-        
-        # 处理灵敏度设置
-        if autosens:
-            text += 'autosens\n'
-        else:
-            text += f'sens={sens}\n'
-            
-        text += 'run\n'
-        text += f'save:{finalFileName}\ntsave:{finalFileName}\nforcequit: yesiamsure\n'
-        Technique.__init__(self, text, finalFileName, 'DPV')
-
-
-class SCV(Technique):
-    """阶梯伏安法 (SCV)"""
-
-    def __init__(self, ei, ef, incre, sw, prod, sens, qt=2.0, fileName=None, autosens=False):
-        # 处理文件名参数
-        if fileName is not None:
-            finalFileName = fileName
-        else:
-            finalFileName = 'SCV'
-
-        header = f"CHI760E SCV"
-        text = f'C\x02\0\0\nfolder: {folder_save}\nfileoverride\nheader: {header}\n\n'
-        text += f'tech=scv\nei={ei}\nef={ef}\nincre={incre}\nsw={sw}\nprod={prod}\nqt={qt}\n'
-        
-        # 处理灵敏度设置
-        if autosens:
-            text += 'autosens\n'
-        else:
-            text += f'sens={sens}\n'
-            
-        text += 'run\n'
-        text += f'save:{finalFileName}\ntsave:{finalFileName}\nforcequit: yesiamsure\n'
-        Technique.__init__(self, text, finalFileName, 'SCV')
-
-
-class CP(Technique):
-    """计时电位法 (CP)"""
-
-    def __init__(self, ic, ia, tc, ta, eh=10.0, el=-10.0, pn='p', si=0.1, cl=1, priority='time', fileName=None):
-        # 处理文件名参数
-        if fileName is not None:
-            finalFileName = fileName
-        else:
-            finalFileName = 'CP'
-
-        header = f"CHI760E CP"
-        text = f'C\x02\0\0\nfolder: {folder_save}\nfileoverride\nheader: {header}\n\n'
-        text += f'tech=cp\nic={ic}\nia={ia}\ntc={tc}\nta={ta}\neh={eh}\nel={el}\npn={pn}\nsi={si}\ncl={cl}\n'
-        
-        # 根据priority参数添加相应命令
-        if priority.lower() == 'time':
-            text += 'priot\n'
-        else:  # priority == 'potential'
-            text += 'prioe\n'
-            
-        text += 'run\n'
-        text += f'save:{finalFileName}\ntsave:{finalFileName}\nforcequit: yesiamsure\n'
-        Technique.__init__(self, text, finalFileName, 'CP')
-
-
-class EIS(Technique):
-    """电化学阻抗谱 (EIS)"""
-
-    def __init__(self, ei, fl, fh, amp, sens, qt=2, fileName=None, prefix=None, suffix=None):
-        # 处理文件名参数
-        if prefix is not None and suffix is not None:
-            finalFileName = f"{prefix}_{suffix}"
-        elif fileName is not None:
-            finalFileName = fileName
-        else:
-            finalFileName = 'EIS'
-
-        header = f"CHI760E EIS"
-        text = f'C\x02\0\0\nfolder: {folder_save}\nfileoverride\nheader: {header}\n\n'
-        text += f'tech=imp\nei={ei}\nfl={fl}\nfh={fh}\namp={amp}\nsens={sens}\nqt={qt}\n'
-        text += 'run\n'
-        text += f'save:{finalFileName}\ntsave:{finalFileName}\nforcequit: yesiamsure\n'
-        Technique.__init__(self, text, finalFileName, 'EIS')
+    Args:
+        name: 技术名称，如 "CV"、"IT"
+        file_name: 结果文件名
+        params: 参数字典
+
+    Returns:
+        Technique: 技术实例
+    """
+    spec = get_technique(name)
+    return TECHNIQUE_CLASSES[spec.name](fileName=file_name, **spec.resolve_params(params))
 
 
-class ACV(Technique):
-    """交流伏安法 (ACV)"""
+class MacroBatch(Technique):
+    """批处理宏：将多个技术拼接为一个宏，只启动一次 CHI760E 依次执行
+
+    每个步骤保留自己的 save:/tsave: 文件名，整个宏只在末尾 forcequit 一次，
+    避免每个测试都重新启动 CHI 软件。
+    """
 
-    def __init__(self, ei, ef, incre, amp, freq, quiet=2.0, sens=1e-5, fileName=None):
-        # 处理文件名参数
-        if fileName is not None:
-            finalFileName = fileName
-        else:
-            finalFileName = 'ACV'
+    def __init__(self, techniques, fileName='BATCH'):
+        if not techniques:
+            raise ValueError("批处理宏至少需要一个技术步骤")
 
-        header = f"CHI760E ACV"
+        step_files = [technique.fileName for technique in techniques]
+        duplicates = {name for name in step_files if step_files.count(name) > 1}
+        if duplicates:
+            raise ValueError(f"批处理宏中的步骤文件名重复: {sorted(duplicates)}")
+
+        self.steps = list(techniques)
+
+        header = f"CHI760E BATCH"
         text = f'C\x02\0\0\nfolder: {folder_save}\nfileoverride\nheader: {header}\n\n'
-        text += f'tech=acv\nei={ei}\nef={ef}\nincre={incre}\namp={amp}\nfreq={freq}\nqt={quiet}\nsens={sens}\n'
-        text += 'run\n'
-        text += f'save:{finalFileName}\ntsave:{finalFileName}\nforcequit: yesiamsure\n'
-        Technique.__init__(self, text, finalFileName, 'ACV')
+        for technique in self.steps:
+            text += technique.body
+        text += 'forcequit: yesiamsure\n'
+        Technique.__init__(self, text, fileName, 'BATCH')
+
+    @property
+    def step_files(self):
+        """各步骤的结果文件名（不含扩展名），按执行顺序排列"""
+        return [technique.fileName for technique in self.steps]
 
 
 # 全局函数
 def stop_all():
     """停止所有正在运行的 CHI760E 实验"""
+    import psutil  # 仅在停止实验时需要，避免导入本模块时加载
     try:
         for proc in psutil.process_iter(['pid', 'name']):
             if 'chi760e' in proc.info['name'].lower():
@@ -311,12 +191,22 @@ def stop_all():
 
 
 # 运行多个实验的帮助函数
-def run_sequence(techniques):
+def run_sequence(techniques, batch=False, batch_name='BATCH'):
     """按顺序运行多个电化学技术实验
 
     Args:
         techniques: 包含电化学技术实例的列表
+        batch: 为 True 时将所有技术合并为一个批处理宏，只启动一次 CHI760E
+        batch_name: 批处理宏的文件名
     """
+    if batch:
+        macro = MacroBatch(techniques, fileName=batch_name)
+        print(f"以批处理宏运行 {len(techniques)} 个实验: {', '.join(t.technique for t in techniques)}")
+        process = macro.run()
+        process.wait()
+        print(f"批处理宏 {batch_name} 已完成")
+        return
+
     for i, technique in enumerate(techniques):
         print(f"正在运行实验 {i + 1}/{len(techniques)}: {technique.technique}")
         process = technique.run()
@@ -1,15 +1,27 @@
+import asyncio
 import requests
 import time
 import math
-import keyboard
 import threading
 
+from core_api import metrics
+from core_api.control_core import AbortToken, Aborted, install_keyboard_hook, remove_keyboard_hooks
+from core_api.single_flight import SingleFlight
+from device_control.grid_model import GridModel
+from device_control.motion_planner import HOP_HEIGHT, MotionProfile, order_wells, plan_hop
+
+# 网格移动的固定安全范围（与配置无关，网格模型的孔位坐标必须落在其中）
+GRID_SAFE_MIN_POS = (6, 100, 75)
+GRID_SAFE_MAX_POS = (174, 173, 75)
+
 
 class PrinterControl:
     def __init__(self, ip="192.168.51.168", port=7125, move_speed=150,
                  general_min_pos=(0, 0, 75), general_max_pos=(215, 190, 200),
-                 grid_min_pos=(6, 100, 75), grid_max_pos=(174, 173, 75),
-                 min_pos=None, max_pos=None):
+                 grid_min_pos=GRID_SAFE_MIN_POS, grid_max_pos=GRID_SAFE_MAX_POS,
+                 min_pos=None, max_pos=None, position_max_age=0.25, status_listener=None,
+                 hop_height=HOP_HEIGHT, max_accel=3000, grid_model=None,
+                 abort_token=None, keyboard_stop=True):
         """初始化打印机控制对象。
 
         参数:
@@ -18,17 +30,31 @@ class PrinterControl:
             move_speed (float): 移动速度 (mm/s)，默认值为 150
             general_min_pos (tuple): 一般移动安全范围最小坐标 (x, y, z)，默认值为 (0, 0, 75)
             general_max_pos (tuple): 一般移动安全范围最大坐标 (x, y, z)，默认值为 (215, 190, 200)
-            grid_min_pos (tuple): 网格移动安全范围最小坐标 (x, y, z)，默认值为 (4, 105, 75)
-            grid_max_pos (tuple): 网格移动安全范围最大坐标 (x, y, z)，默认值为 (174, 177, 75)
+            grid_min_pos (tuple): 网格移动安全范围最小坐标 (x, y, z)，默认值为 (6, 100, 75)
+            grid_max_pos (tuple): 网格移动安全范围最大坐标 (x, y, z)，默认值为 (174, 173, 75)
             min_pos (tuple): 自定义安全范围最小坐标 (x, y, z)，如果提供则覆盖grid_min_pos
             max_pos (tuple): 自定义安全范围最大坐标 (x, y, z)，如果提供则覆盖grid_max_pos
+            position_max_age (float): 坐标查询结果的复用时间 (秒)，同时发起的查询合并为一次请求
+            status_listener: MoonrakerWebsocketListener 实例，已订阅 toolhead 时直接使用推送的坐标
+            hop_height (float): 网格间移动时高于工作高度的抬升量 (mm)，默认值为 10（即安全高度 85）
+            max_accel (float): 估算移动时间用的加速度 (mm/s²)，应与 Klipper 的 max_accel 一致
+            grid_model (GridModel): 孔位坐标表，默认使用 5×10 默认网格；所有孔位必须在网格安全范围内，否则抛出 ValueError
+            abort_token (AbortToken): 紧急停止信号，所有等待在其上阻塞，触发后立即返回；默认新建
+            keyboard_stop (bool): 是否注册 ESC 键急停（需要 keyboard 库，不可用时忽略）
         """
         self.ip = ip
         self.port = port
         self.move_speed = move_speed
         self.general_min_pos = general_min_pos
         self.general_max_pos = general_max_pos
-        self.emergency_stop_flag = False
+        self.abort_token = abort_token if abort_token is not None else AbortToken("printer")
+        self.position_max_age = position_max_age
+        self.status_listener = status_listener
+        self._position_flight = SingleFlight("printer_position")
+        self._gcode_sent_at = 0.0
+        self.hop_height = hop_height
+        self.motion_profile = MotionProfile(max_velocity=move_speed, max_accel=max_accel)
+        self.grid_model = grid_model if grid_model is not None else GridModel()
 
         # 如果提供了min_pos和max_pos，则使用它们来覆盖grid_min_pos和grid_max_pos
         if min_pos is not None:
@@ -41,30 +67,55 @@ class PrinterControl:
         else:
             self.grid_max_pos = grid_max_pos
 
+        self._check_grid_model()
+
         # 设置紧急停止键监听
-        self._setup_emergency_stop()
+        if keyboard_stop:
+            self._setup_emergency_stop()
+
+    def _check_grid_model(self):
+        """网格模型的孔位坐标必须在网格安全范围和一般移动范围内（配置笔误不能绕过安全检查）"""
+        model_min_pos, model_max_pos = self.grid_model.bounds()
+        for name, low, high in (("网格安全范围", self.grid_min_pos, self.grid_max_pos),
+                                ("一般移动安全范围", self.general_min_pos, self.general_max_pos)):
+            if not (self.is_position_safe(*model_min_pos, low, high) and self.is_position_safe(*model_max_pos, low, high)):
+                raise ValueError(f"网格模型的孔位坐标范围 {model_min_pos}-{model_max_pos} 超出{name} {tuple(low)}-{tuple(high)}，"
+                                 f"请检查 first_well/last_well/offsets 配置")
 
     def _setup_emergency_stop(self):
-        """设置紧急停止键监听"""
-        keyboard.on_press_key("esc", self._emergency_stop_callback)
-        print("紧急停止功能已启用，按下ESC键可停止移动")
+        """设置紧急停止键监听（keyboard 不可用时仅能通过 emergency_stop() 停止）"""
+        if install_keyboard_hook(self._emergency_stop_callback, "esc"):
+            print("紧急停止功能已启用，按下ESC键可停止移动")
+
+    @property
+    def emergency_stop_flag(self):
+        return self.abort_token.aborted
 
     def _emergency_stop_callback(self, e):
         """ESC键回调函数"""
         self.emergency_stop()
 
     def emergency_stop(self):
-        """紧急停止所有移动"""
-        self.emergency_stop_flag = True
+        """紧急停止所有移动：所有等待立即返回，并通过 Moonraker 紧急停止接口停止 Klipper"""
+        self.abort_token.abort("紧急停止")
         print("\n紧急停止被触发！停止所有移动...")
-        # 立即发送停止命令
-        self.send_gcode_command("M112")  # 紧急停止
-        print("已发送紧急停止命令")
+        # 紧急停止接口不经过 G-code 队列，正在执行的脚本（如 G4 停顿）不会阻塞它
+        url = f"http://{self.ip}:{self.port}/printer/emergency_stop"
+        try:
+            response = requests.post(url, timeout=5)
+            if response.status_code == 200:
+                print("已发送紧急停止命令")
+                return True
+            print(f"紧急停止接口返回状态码 {response.status_code}，改用 M112")
+        except Exception as e:
+            print(f"调用紧急停止接口出错: {e}，改用 M112")
+        return self.send_gcode_command("M112")
 
     def reset_emergency_stop(self):
         """重置紧急停止标志"""
-        self.emergency_stop_flag = False
-        print("紧急停止状态已重置")
+        if self.abort_token.aborted:
+            self.abort_token.reset()
+            print("紧急停止状态已重置")
 
     def send_gcode_command(self, command):
         """发送 G-code 命令到打印机。
@@ -74,12 +125,19 @@ class PrinterControl:
         """
         url = f"http://{self.ip}:{self.port}/printer/gcode/script"
         payload = {"script": command}
+        # 命令可能改变坐标：发送前后都使缓存失效，发送期间开始的查询结果也不会被复用
+        self._gcode_sent_at = time.monotonic()
+        self._position_flight.invalidate()
+        started = time.perf_counter()
         try:
             response = requests.post(url, json=payload)
+            self._position_flight.invalidate()
+            metrics.MOONRAKER_REQUEST_SECONDS.labels("printer", "gcode").observe(time.perf_counter() - started)
             if response.status_code == 200:
                 print("命令发送成功")
                 return True
             else:
+                metrics.MOONRAKER_GCODE_FAILURES.labels("printer", f"http_{response.status_code}").inc()
                 print(f"命令发送失败，状态码: {response.status_code}")
                 # 尝试解析错误信息
                 try:
@@ -94,18 +152,45 @@ class PrinterControl:
                     
                 return False
         except Exception as e:
+            metrics.MOONRAKER_GCODE_FAILURES.labels("printer", "request").inc()
             print(f"发送命令时出错: {e}")
             return False
 
-    def get_current_position(self):
+    def get_current_position(self, max_age=None):
         """获取打印头的当前坐标。
 
+        优先使用 WebSocket 推送的 toolhead 状态（最近一条 G-code 之后收到过更新时）；
+        否则查询 Moonraker，position_max_age 内的结果直接复用，并发的查询共享同一次请求。
+
+        参数:
+            max_age (float): 本次可接受的缓存时间 (秒)，默认使用 position_max_age，0 表示强制查询
+
         返回:
             tuple: (x, y, z) 当前坐标，若失败则返回 None
         """
+        position = self._position_from_listener()
+        if position is not None:
+            return position
+        return self._position_flight.do("toolhead", self._query_position,
+                                        self.position_max_age if max_age is None else max_age)
+
+    def _position_from_listener(self):
+        listener = self.status_listener
+        if listener is None or not listener.connected:
+            return None
+        snapshot = listener.toolhead
+        if snapshot is None or snapshot.position is None:
+            return None
+        if listener.object_updated_at.get("toolhead", 0.0) < self._gcode_sent_at:
+            return None
+        return snapshot.position
+
+    def _query_position(self):
+        """向 Moonraker 查询坐标（每次调用一个 HTTP 请求）"""
         url = f"http://{self.ip}:{self.port}/printer/objects/query?toolhead=position"
         try:
-            response = requests.get(url)
+            with metrics.MOONRAKER_REQUEST_SECONDS.labels("printer", "query").time():
+                response = requests.get(url)
             if response.status_code == 200:
                 data = response.json()
                 position = data["result"]["status"]["toolhead"]["position"]
@@ -160,36 +245,81 @@ class PrinterControl:
                 min_pos[1] <= y <= max_pos[1] and
                 min_pos[2] <= z <= max_pos[2])
 
-    def wait_for_move_completion(self, expected_time):
+    def wait_for_move_completion(self, expected_time, target=None):
         """等待移动完成，支持紧急停止。
 
+        监听器已连接（且调用方不在监听器的事件循环线程中）时，等待推送的 motion_report 实际坐标到达 target
+        且速度为 0；否则发送 M400，Moonraker 在运动队列执行完后才返回。
+        紧急停止时两种方式都立即结束（紧急停止接口会中断正在执行的 M400）。
+
         参数:
-            expected_time (float): 预计移动时间 (秒)
+            expected_time (float): 预计移动时间 (秒)，仅用于确定等待超时
+            target (tuple): 目标坐标 (x, y, z)，用于判断移动是否到位
 
         返回:
             bool: 如果正常完成返回 True，如果被紧急停止返回 False
         """
-        start_time = time.time()
-        print(f"预计移动时间: {expected_time:.2f} 秒，等待中...")
-
-        # 分段等待，以便能响应紧急停止
-        interval = 0.1  # 检查间隔（秒）
-        elapsed = 0
-
-        while elapsed < expected_time:
-            if self.emergency_stop_flag:
+        print(f"预计移动时间: {expected_time:.2f} 秒，等待移动完成...")
+        timeout = expected_time * 2 + 5.0
+        if target is not None and self._listener_loop() is not None:
+            done = self._wait_for_status(self._move_done_predicate(target), timeout)
+            if done is None:
+                print("等待实际坐标到位超时，改用 M400 等待运动队列完成")
+            elif not done:
                 print("移动被紧急停止！")
                 return False
+            else:
+                print("移动完成")
+                return True
 
-            time.sleep(interval)
-            elapsed = time.time() - start_time
+        completed = self.send_gcode_command("M400")
+        if self.abort_token.aborted:
+            print("移动被紧急停止！")
+            return False
+        if completed:
+            print("移动完成")
+        return completed
+
+    def _listener_loop(self):
+        """可以从当前线程等待状态条件的监听器事件循环；不可用时返回 None"""
+        listener = self.status_listener
+        loop = getattr(listener, "loop", None)
+        if listener is None or not listener.connected or loop is None or loop.is_closed():
+            return None
+        try:
+            if asyncio.get_running_loop() is loop:
+                return None     # 在事件循环线程中同步等待会死锁
+        except RuntimeError:
+            pass
+        return loop
+
+    @staticmethod
+    def _move_done_predicate(target, tolerance=0.05):
+        target = tuple(round(float(v), 2) for v in target)   # 与发送的 G-code 精度一致
+
+        def predicate(object_status):
+            motion = object_status.get("motion_report") or {}
+            live = motion.get("live_position")
+            if not live or len(live) < 3:
+                return False
+            if any(abs(float(live[axis]) - target[axis]) > tolerance for axis in range(3)):
+                return False
+            state = (object_status.get("idle_timeout") or {}).get("state")
+            return float(motion.get("live_velocity") or 0.0) == 0.0 and state != "Printing"
+        return predicate
 
-            # 打印进度（每秒更新一次）
-            if int(elapsed) > int(elapsed - interval):
-                print(f"移动进度: {min(100, int(elapsed / expected_time * 100))}%", end="\r")
+    def _wait_for_status(self, predicate, timeout):
+        """在监听器的事件循环中等待状态条件，与紧急停止竞争
 
-        print("移动完成                ")  # 额外的空格用于覆盖进度百分比
-        return True
+        返回:
+            True 条件满足，False 被紧急停止，None 超时
+        """
+        coroutine = self.abort_token.wait_for(self.status_listener.wait_for_condition(predicate, timeout))
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._listener_loop())
+        try:
+            return True if future.result() is not None else None
+        except Aborted:
+            return False
 
     def move_to(self, x, y, z, use_general_safety=True):
         """移动打印头到指定位置，并等待移动完成。
@@ -225,99 +355,104 @@ class PrinterControl:
         formatted_y = f"{y:.2f}"
         formatted_z = f"{z:.2f}"
 
-        # 发送移动命令前设置速度
-        self.send_gcode_command(f"G1 F{self.move_speed * 60}")  # 转换为mm/min
-        self.send_gcode_command(f"G1 X{formatted_x} Y{formatted_y} Z{formatted_z}")
+        # 速度和移动合并为一个脚本发送（F 转换为mm/min）
+        if not self.send_gcode_command(f"G1 F{self.move_speed * 60}\nG1 X{formatted_x} Y{formatted_y} Z{formatted_z}"):
+            return False
         print(f"移动到: ({formatted_x}, {formatted_y}, {formatted_z})")
 
         move_time = self.calculate_move_time(current_pos, x, y, z)
-        return self.wait_for_move_completion(move_time)
+        return self.wait_for_move_completion(move_time, (x, y, z))
 
     def move_to_grid_position(self, grid_number):
-        """移动打印头到指定的网格位置（1-50），使用安全移动逻辑。
+        """移动打印头到指定的网格位置，使用安全移动逻辑。
 
         参数:
-            grid_number (int): 网格位置编号（1-50）
+            grid_number (int | str): 网格位置编号（1-50）或标签（A1-E10）
 
         返回:
             bool: 如果移动成功完成返回 True，如果被紧急停止返回 False
         """
-        if not 1 <= grid_number <= 50:
-            print("错误：网格编号必须在1到50之间！")
-            return False
-
-        # 计算行和列
-        row = (grid_number - 1) // 10 + 1  # 1-5
-        col = (grid_number - 1) % 10 + 1  # 1-10
-
-        # 计算坐标 - 新的网格定义
-        # 右上角(1号位置): (174,173,75)
-        # 左上角(10号位置): (6,173,75)
-        # 右下角(41号位置): (174,100,75)
-        # 左下角(50号位置): (6,100,75)
-        x_min, x_max = 6, 174
-        y_min, y_max = 100, 173
-        z_height = 75
+        # 重置紧急停止标志
+        self.reset_emergency_stop()
 
-        # 网格从右到左，从上到下排列
-        col_offset = col - 1  # 列偏移(0-9)
-        x = x_max - col_offset * (x_max - x_min) / 9  # 从右到左
-        y = y_max - (row - 1) * (y_max - y_min) / 4  # 从上到下
+        try:
+            x, y, z_height = self.grid_model.coordinates(grid_number)
+        except ValueError as e:
+            print(f"错误：{e}")
+            return False
 
         # 显示计算出的坐标
         print(f"网格位置 {grid_number} 的计算坐标: ({x:.2f}, {y:.2f}, {z_height:.2f})")
 
-        # 开始安全移动过程
         current_pos = self.get_current_position()
         if current_pos is None:
             print("无法获取当前位置，移动取消")
             return False
 
-        # 1. 首先Z轴上升到固定安全高度（85mm），而不是累加高度
-        safe_z = 85  # 固定安全高度
-        print(f"第1步：Z轴上升到安全高度 {safe_z:.2f}")
-        if not self.move_to(current_pos[0], current_pos[1], safe_z, use_general_safety=True):
-            return False
+        # 规划路径：低于安全高度时先抬升，已在安全高度或更高时直接平移（从高处出发时平移与下降合并），最后下降
+        safe_z = z_height + self.hop_height
+        segments = plan_hop(current_pos, (x, y, z_height), safe_z)
+        for index, (sx, sy, sz) in enumerate(segments):
+            final = index == len(segments) - 1
+            if final and not self.is_position_safe(sx, sy, sz):
+                print(f"错误：目标位置 ({sx:.2f}, {sy:.2f}, {sz:.2f}) 超出网格安全范围！")
+                return False
+            if not final and not self.is_position_safe(sx, sy, sz, self.general_min_pos, self.general_max_pos):
+                print(f"错误：中间位置 ({sx:.2f}, {sy:.2f}, {sz:.2f}) 超出一般安全范围！")
+                return False
 
-        # 2. 移动到目标XY位置，保持Z轴在安全高度
-        print(f"第2步：在安全高度移动到目标XY位置 ({x:.2f}, {y:.2f}, {safe_z:.2f})")
-        if not self.move_to(x, y, safe_z, use_general_safety=True):
+        # 所有分段合并为一个脚本发送，按规划路径估算等待时间
+        lines = [f"G1 F{self.move_speed * 60}"]
+        lines += [f"G1 X{sx:.2f} Y{sy:.2f} Z{sz:.2f}" for sx, sy, sz in segments]
+        if not self.send_gcode_command("\n".join(lines)):
             return False
-
-        # 3. 最后降低Z轴到目标高度
-        print(f"第3步：Z轴下降到目标高度 {z_height:.2f}")
-        if not self.move_to(x, y, z_height, use_general_safety=False):
+        for index, (sx, sy, sz) in enumerate(segments, 1):
+            print(f"第{index}步：移动到 ({sx:.2f}, {sy:.2f}, {sz:.2f})")
+
+        move_time = 0.0
+        position = current_pos
+        for segment in segments:
+            move_time += self.motion_profile.segment_time(position, segment)
+            position = segment
+        if not self.wait_for_move_completion(move_time, (x, y, z_height)):
             return False
 
         print(f"成功移动到网格位置 {grid_number}: ({x:.2f}, {y:.2f}, {z_height:.2f})")
         return True
 
-    def home(self, wait_time=10):
-        """执行归位操作，并等待指定时间。
+    def order_grid_positions(self, grid_numbers, start=None):
+        """访问顺序不限时，按最短路径（最近邻 + 2-opt）排列网格编号
 
         参数:
-            wait_time (int): 等待时间（秒）
+            grid_numbers (list): 网格编号（或标签）列表
+            start (tuple): 起始坐标，默认使用当前坐标（获取失败时以第一个网格为起点）
 
         返回:
-            bool: 如果归位成功完成返回 True，如果被紧急停止返回 False
+            list: 重新排列后的网格编号
         """
-        # 重置紧急停止标志
-        self.reset_emergency_stop()
+        if start is None:
+            start = self.get_current_position()
+        return order_wells(grid_numbers, self.grid_model.coordinates, start=start)
 
-        self.send_gcode_command("G28")  # 归位
-        print(f"执行归位，等待 {wait_time} 秒...")
+    def home(self):
+        """执行归位操作。
 
-        # 分段等待，以便能响应紧急停止
-        interval = 0.1  # 检查间隔（秒）
-        elapsed = 0
+        Moonraker 的 /printer/gcode/script 在 G28 执行完（归位结束）后才返回，不再额外固定等待。
 
-        while elapsed < wait_time:
-            if self.emergency_stop_flag:
-                print("归位操作被紧急停止！")
-                return False
+        返回:
+            bool: 如果归位成功完成返回 True，失败或被紧急停止返回 False
+        """
+        # 重置紧急停止标志
+        self.reset_emergency_stop()
 
-            time.sleep(interval)
-            elapsed += interval
+        print("执行归位...")
+        completed = self.send_gcode_command("G28")  # 归位，阻塞到归位完成
+        if self.abort_token.aborted:
+            print("归位操作被紧急停止！")
+            return False
+        if not completed:
+            print("归位失败")
+            return False
 
         print("归位完成")
         return True
@@ -347,4 +482,4 @@ if __name__ == "__main__":
         print("\n程序已退出")
     finally:
         # 清理键盘监听
-        keyboard.unhook_all()
\ No newline at end of file
+        remove_keyboard_hooks()
\ No newline at end of file
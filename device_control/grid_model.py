@@ -0,0 +1,119 @@
+"""grid_model.py – 网格孔位坐标表
+
+从配置加载一次，生成所有孔位坐标的 NumPy 数组 (rows*cols, 3)，之后按编号（1 起）或标签（A1…E10）
+O(1) 查表，不再每次移动时从角点重新计算。
+
+布局由三个孔位的坐标确定（可以是任意角点起始、带旋转/倾斜的规则阵列）:
+    first_well: 1 号（A1）孔位
+    row_end:    第一行最后一个孔位（A10），省略时与 first_well 同一 Y、与 last_well 同一 X（轴对齐）
+    last_well:  最后一个孔位（E10）
+编号按行优先：第一行 1…cols，第二行 cols+1…，行用字母 A、B…，列用数字 1、2…
+
+每个孔位可配置实测偏移（按编号或标签），trusted=True 表示坐标表已实测校准，
+移动后可跳过位置回读验证。
+
+配置示例（实验配置文件中的 "grid_model"）:
+    {"rows": 5, "cols": 10,
+     "first_well": [174, 173, 75], "last_well": [6, 100, 75],
+     "offsets": {"A1": [-0.3, -0.2, 0.0], "17": [0.0, 0.5, 0.0]},
+     "trusted": false}
+
+所有孔位（含偏移）必须落在 PrinterControl 的网格安全范围内（默认 (6, 100, 75)-(174, 173, 75)），
+否则创建 PrinterControl 时抛出 ValueError。
+"""
+import string
+
+import numpy as np
+
+# 默认网格（与 PrinterControl 原来的硬编码角点一致）：1 号在右上角，从右到左、从上到下
+GRID_ROWS = 5
+GRID_COLS = 10
+GRID_FIRST_WELL = (174.0, 173.0, 75.0)
+GRID_LAST_WELL = (6.0, 100.0, 75.0)
+GRID_Z = GRID_FIRST_WELL[2]
+
+
+class GridModel:
+    """规则孔位阵列的坐标表"""
+
+    def __init__(self, rows=GRID_ROWS, cols=GRID_COLS, first_well=GRID_FIRST_WELL, last_well=GRID_LAST_WELL,
+                 row_end=None, offsets=None, trusted=False):
+        if not 1 <= rows <= len(string.ascii_uppercase) or cols < 1:
+            raise ValueError(f"无效的网格尺寸: {rows}×{cols}")
+        self.rows = rows
+        self.cols = cols
+        self.trusted = trusted
+        first = np.asarray(first_well, dtype=float)
+        last = np.asarray(last_well, dtype=float)
+        if row_end is None:
+            row_end = (last[0], first[1], first[2])
+        row_end = np.asarray(row_end, dtype=float)
+
+        col_step = (row_end - first) / (cols - 1) if cols > 1 else np.zeros(3)
+        row_step = (last - row_end) / (rows - 1) if rows > 1 else np.zeros(3)
+        row_index, col_index = np.divmod(np.arange(rows * cols), cols)
+        self.nominal = first + col_index[:, None] * col_step + row_index[:, None] * row_step
+
+        self.labels = [f"{string.ascii_uppercase[r]}{c + 1}" for r, c in zip(row_index, col_index)]
+        self._label_index = {label: i for i, label in enumerate(self.labels)}
+
+        self.offsets = np.zeros_like(self.nominal)
+        for key, offset in (offsets or {}).items():
+            self.offsets[self.index(key)] = np.asarray(offset, dtype=float)
+        self.coordinates_array = self.nominal + self.offsets
+        self._table = [tuple(float(v) for v in row) for row in self.coordinates_array]
+
+    @classmethod
+    def from_config(cls, config):
+        """从配置字典创建（缺省项使用默认网格）"""
+        config = config or {}
+        return cls(
+            rows=int(config.get("rows", GRID_ROWS)),
+            cols=int(config.get("cols", GRID_COLS)),
+            first_well=config.get("first_well", GRID_FIRST_WELL),
+            last_well=config.get("last_well", GRID_LAST_WELL),
+            row_end=config.get("row_end"),
+            offsets=config.get("offsets"),
+            trusted=bool(config.get("trusted", False)),
+        )
+
+    def __len__(self):
+        return self.rows * self.cols
+
+    def index(self, key):
+        """编号（int 或数字字符串，1 起）或标签（"A1"）-> 数组下标"""
+        if isinstance(key, str):
+            text = key.strip().upper()
+            if text in self._label_index:
+                return self._label_index[text]
+            try:
+                key = int(float(text))
+            except ValueError:
+                raise ValueError(f"未知的孔位: {key}") from None
+        number = int(key)
+        if not 1 <= number <= len(self):
+            raise ValueError(f"网格编号必须在1到{len(self)}之间: {key}")
+        return number - 1
+
+    def number(self, key):
+        return self.index(key) + 1
+
+    def label(self, key):
+        return self.labels[self.index(key)]
+
+    def coordinates(self, key):
+        """孔位坐标 (x, y, z)，已包含实测偏移"""
+        return self._table[self.index(key)]
+
+    def bounds(self):
+        """所有孔位坐标的 (最小, 最大)，用作网格安全范围"""
+        low = self.coordinates_array.min(axis=0)
+        high = self.coordinates_array.max(axis=0)
+        return tuple(float(v) for v in low), tuple(float(v) for v in high)
+
+    def offset_from_measurement(self, key, measured):
+        """实测坐标相对名义坐标的偏移，可写回配置的 offsets"""
+        return [round(float(v), 3) for v in np.asarray(measured, dtype=float) - self.nominal[self.index(key)]]
+
+    def __repr__(self):
+        return f"GridModel({self.rows}×{self.cols}, trusted={self.trusted})"
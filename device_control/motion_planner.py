@@ -0,0 +1,216 @@
+"""motion_planner.py – 网格孔位的移动路径规划
+
+孔位之间的抬升-平移-下降路径、访问顺序优化（最近邻 + 2-opt），以及按梯形速度曲线估算的移动时间。
+孔位坐标来自 device_control.grid_model.GridModel（默认 5×10 网格）。
+
+与 PrinterControl 原来的移动方式相比:
+- 已在安全高度（或更高）时不再重复抬升，从更高处出发时平移与下降合并为一段斜线移动；
+- 一次移动的所有分段合并为一个 G-code 脚本发送，不再每段查询一次坐标、发送两次命令；
+- 顺序不要求时按最短路径重新排列孔位。
+
+用法:
+    python -m device_control.motion_planner                    # 全板 1-50 对比报告
+    python -m device_control.motion_planner --wells 2 17 33 8 --start 0 0 120
+"""
+import argparse
+import math
+
+import numpy as np
+
+from device_control.grid_model import GRID_Z, GridModel
+
+HOP_HEIGHT = 10.0               # 安全高度 = 工作高度 + HOP_HEIGHT（即原来固定的 85）
+
+
+class MotionProfile:
+    """移动时间模型：梯形速度曲线，Z 分量受 max_z_velocity 限制；每次 HTTP 往返计 request_overhead 秒"""
+
+    def __init__(self, max_velocity=150.0, max_accel=3000.0, max_z_velocity=None, request_overhead=0.05):
+        self.max_velocity = max_velocity
+        self.max_accel = max_accel
+        self.max_z_velocity = max_z_velocity
+        self.request_overhead = request_overhead
+
+    def segment_time(self, start, end):
+        """一段直线移动的时间（秒）"""
+        delta = np.subtract(end, start, dtype=float)
+        distance = float(np.linalg.norm(delta))
+        if distance == 0.0:
+            return 0.0
+        velocity = self.max_velocity
+        if self.max_z_velocity and delta[2] != 0.0:
+            velocity = min(velocity, self.max_z_velocity * distance / abs(delta[2]))
+        accel = self.max_accel
+        if not accel:
+            return distance / velocity
+        ramp = velocity * velocity / accel      # 加速 + 减速所需距离
+        if distance <= ramp:
+            return 2.0 * math.sqrt(distance / accel)
+        return (distance - ramp) / velocity + 2.0 * velocity / accel
+
+
+def plan_hop(start, target, safe_z):
+    """从 start 到 target 的分段路径（不含起点）
+
+    - start 低于安全高度时先竖直抬升，已在安全高度或更高时不抬升；
+    - 从高于安全高度处出发时，平移与下降到安全高度合并为一段；
+    - 目标低于安全高度时最后竖直下降，否则平移直接到目标。
+    """
+    sx, sy, sz = start
+    tx, ty, tz = target
+    if math.isclose(sx, tx, abs_tol=1e-6) and math.isclose(sy, ty, abs_tol=1e-6):
+        return [] if math.isclose(sz, tz, abs_tol=1e-6) else [(tx, ty, tz)]
+
+    segments = []
+    if sz < safe_z:
+        segments.append((sx, sy, safe_z))
+    if tz >= safe_z:
+        segments.append((tx, ty, tz))
+    else:
+        segments.append((tx, ty, safe_z))
+        segments.append((tx, ty, tz))
+    return segments
+
+
+def legacy_hop(start, target, safe_z):
+    """原来的移动方式：总是 抬升到安全高度 -> 平移 -> 下降"""
+    sx, sy, _ = start
+    tx, ty, tz = target
+    return [(sx, sy, safe_z), (tx, ty, safe_z), (tx, ty, tz)]
+
+
+def _path_length(points):
+    return float(np.sum(np.linalg.norm(np.diff(np.asarray(points, dtype=float), axis=0), axis=1))) if len(points) > 1 else 0.0
+
+
+def order_wells(wells, coordinates, start=None, two_opt=True):
+    """按 XY 距离排列访问顺序：最近邻构造 + 2-opt 改进（开放路径，起点固定）
+
+    Args:
+        wells: 需要访问的网格编号（或 GridModel 标签）
+        coordinates: 网格编号 -> (x, y, z) 的函数或字典，如 GridModel.coordinates
+        start: 起始坐标 (x, y, z)，None 时以第一个孔位为起点
+    """
+    wells = list(dict.fromkeys(wells))      # 去重并保持顺序
+    if len(wells) <= 2 and start is None:
+        return wells
+    lookup = coordinates if callable(coordinates) else coordinates.__getitem__
+    points = np.array([lookup(well)[:2] for well in wells], dtype=float)
+
+    # 节点 0 为起点（start 或第一个孔位）
+    if start is not None:
+        nodes = np.vstack([np.asarray(start[:2], dtype=float), points])
+        offset = 1
+    else:
+        nodes = points
+        offset = 0
+    distance = np.linalg.norm(nodes[:, None, :] - nodes[None, :, :], axis=2)
+
+    # 最近邻
+    path = [0]
+    remaining = set(range(1, len(nodes)))
+    while remaining:
+        last = path[-1]
+        nearest = min(remaining, key=lambda node: (distance[last, node], node))
+        path.append(nearest)
+        remaining.remove(nearest)
+
+    # 2-opt：反转 path[i..j]，起点 path[0] 不动
+    if two_opt:
+        improved = True
+        n = len(path)
+        while improved:
+            improved = False
+            for i in range(1, n - 1):
+                for j in range(i + 1, n):
+                    a, b = path[i - 1], path[i]
+                    c = path[j]
+                    d = path[j + 1] if j + 1 < n else None
+                    before = distance[a, b] + (distance[c, d] if d is not None else 0.0)
+                    after = distance[a, c] + (distance[b, d] if d is not None else 0.0)
+                    if after < before - 1e-9:
+                        path[i:j + 1] = reversed(path[i:j + 1])
+                        improved = True
+
+    return [wells[node - offset] for node in path if node >= offset]
+
+
+def route_time(start, wells, coordinates, profile, hop=plan_hop, hop_height=HOP_HEIGHT, requests_per_well=2):
+    """按给定顺序依次移动到各孔位的总时间与路径长度
+
+    Returns:
+        dict: time（秒）、distance（mm）、segments（分段数）
+    """
+    lookup = coordinates if callable(coordinates) else coordinates.__getitem__
+    position = tuple(start)
+    total_time = 0.0
+    points = [position]
+    segment_count = 0
+    for well in wells:
+        target = lookup(well)
+        safe_z = target[2] + hop_height
+        for segment in hop(position, target, safe_z):
+            total_time += profile.segment_time(position, segment)
+            points.append(segment)
+            position = segment
+            segment_count += 1
+        total_time += requests_per_well * profile.request_overhead
+    return {"time": total_time, "distance": _path_length(points), "segments": segment_count}
+
+
+def compare_strategies(wells, start=(0.0, 0.0, GRID_Z + HOP_HEIGHT), coordinates=None,
+                       profile=None, hop_height=HOP_HEIGHT):
+    """原移动方式（配置顺序、固定抬升、每段单独请求）与规划方式的时间对比
+
+    原方式每个孔位 3 次 move_to，每次一次坐标查询 + 两条 G-code（另有一次初始查询），共 10 次往返；
+    规划方式每个孔位一次坐标查询 + 一个合并脚本，共 2 次往返。
+    """
+    profile = profile or MotionProfile()
+    coordinates = coordinates or GridModel().coordinates
+    legacy = route_time(start, wells, coordinates, profile, hop=legacy_hop, hop_height=hop_height, requests_per_well=10)
+    same_order = route_time(start, wells, coordinates, profile, hop_height=hop_height)
+    order = order_wells(wells, coordinates, start=start)
+    planned = route_time(start, order, coordinates, profile, hop_height=hop_height)
+    return {
+        "wells": len(wells),
+        "legacy": legacy,
+        "same_order": same_order,
+        "planned": planned,
+        "order": order,
+        "speedup": legacy["time"] / planned["time"] if planned["time"] > 0 else float("inf"),
+    }
+
+
+def format_comparison(title, result, show_order=True):
+    lines = [f"{title}（{result['wells']} 个孔位）"]
+    for key, name in (("legacy", "原方式（配置顺序）"), ("same_order", "合并移动（配置顺序）"), ("planned", "合并移动 + 路径优化")):
+        item = result[key]
+        lines.append(f"  {name:<16} {item['time']:8.2f} 秒  {item['distance']:9.1f} mm  {item['segments']:4d} 段")
+    lines.append(f"  加速比 {result['speedup']:.2f}x" + (f"，访问顺序: {result['order']}" if show_order else ""))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="网格孔位移动路径规划与时间对比")
+    parser.add_argument("--wells", type=int, nargs="+", default=None, help="访问的网格编号，默认全板 1-50")
+    parser.add_argument("--start", type=float, nargs=3, default=(0.0, 0.0, GRID_Z + HOP_HEIGHT), help="起始坐标 X Y Z")
+    parser.add_argument("--velocity", type=float, default=150.0, help="最大速度 (mm/s)")
+    parser.add_argument("--accel", type=float, default=3000.0, help="最大加速度 (mm/s²)")
+    parser.add_argument("--z-velocity", type=float, default=None, help="Z 轴最大速度 (mm/s)")
+    parser.add_argument("--overhead", type=float, default=0.05, help="每次 HTTP 往返的时间 (秒)")
+    parser.add_argument("--shuffled", type=int, default=5, help="额外对比的随机顺序全板运行次数")
+    args = parser.parse_args(argv)
+
+    profile = MotionProfile(args.velocity, args.accel, args.z_velocity, args.overhead)
+    wells = args.wells or list(range(1, len(GridModel()) + 1))
+    print(format_comparison("指定顺序", compare_strategies(wells, tuple(args.start), profile=profile)))
+    rng = np.random.default_rng(0)
+    for run in range(args.shuffled if args.wells is None else 0):
+        shuffled = [int(well) for well in rng.permutation(wells)]
+        print(format_comparison(f"随机顺序 #{run + 1}", compare_strategies(shuffled, tuple(args.start), profile=profile),
+                                show_order=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
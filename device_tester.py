@@ -24,8 +24,8 @@ if sys.platform.startswith('win'):
     except:
         pass
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, BackgroundTasks, HTTPException, Depends, Query
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Query, Request
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import uvicorn
@@ -34,127 +34,74 @@ import logging
 import json
 import time
 from typing import Dict, Any, List, Optional, Union
-from datetime import datetime
 from pathlib import Path
 import glob
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field, create_model
 
-# 引入适配器
+# 引入适配器（backend 适配器模块在首次初始化对应设备时才导入）
 from backend.pubsub import Broadcaster
-from backend.services.adapters.printer_adapter import PrinterAdapter
-from backend.services.adapters.pump_adapter import PumpAdapter
-from backend.services.adapters.relay_adapter import RelayAdapter
-from backend.services.adapters.chi_adapter import CHIAdapter
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("device_tester.log"),
-        logging.StreamHandler()
-    ]
-)
+from backend.log_setup import setup_logging, stop_logging
+from core_api import metrics, tracing
+from backend.static_assets import HtmlBundle, HTML_CACHE_CONTROL, ASSET_CACHE_CONTROL
+from backend.services.adapters import get_adapter_class
+from device_control.chi_registry import TECHNIQUES as CHI_TECHNIQUES
+
+# 配置日志（后台线程写入，按大小轮转，高频调用点按位置限流）
+log_rate_filter = setup_logging("device_tester.log", level=logging.INFO, max_bytes=10 * 1024 * 1024, backup_count=5)
 logger = logging.getLogger("device_tester")
 
+# 调用链追踪（默认关闭）：设置 TRACE_JSONL 环境变量时写入该 JSON-lines 文件（按大小轮转），
+# 设置 OTLP_ENDPOINT 环境变量时发送到 OTLP collector
+# 查看: TRACE_JSONL=device_tester_traces.jsonl 运行后 python -m core_api.tracing timeline device_tester_traces.jsonl
+tracing.configure(jsonl_path=os.environ.get("TRACE_JSONL"), otlp_endpoint=os.environ.get("OTLP_ENDPOINT"))
+
 # 引入新的WebSocket监听器
 try:
-    from core_api.moonraker_listener import MoonrakerWebsocketListener
+    from core_api.moonraker_listener import MoonrakerWebsocketListener, TOOLHEAD_OBJECTS
     logger.info("成功导入MoonrakerWebsocketListener，将使用WebSocket获取精确泵参数")
 except ImportError:
     logger.warning("无法导入MoonrakerWebsocketListener，将使用传统方式估算泵参数")
     MoonrakerWebsocketListener = None
+    TOOLHEAD_OBJECTS = ()
 
 # FastAPI 应用
 app = FastAPI(title="设备测试器")
 
 # Pydantic Models for API requests
-class OCPAPIParams(BaseModel):
-    st: float
-    si: float
-    eh: Optional[float] = None
-    el: Optional[float] = None
-    file_name: Optional[str] = None
-
-class DPVAPIParams(BaseModel):
-    ei: float
-    ef: float
-    incre: float
-    amp: float
-    pw: float
-    sw: float
-    prod: float
-    sens: Optional[float] = None
-    qt: Optional[float] = 2.0
-    file_name: Optional[str] = None
-    autosens: Optional[bool] = False
-
-class SCVAPIParams(BaseModel):
-    ei: float
-    ef: float
-    incre: float
-    sw: float
-    prod: float
-    sens: Optional[float] = None
-    qt: Optional[float] = 2.0
-    file_name: Optional[str] = None
-    autosens: Optional[bool] = False
-
-class CPAPIParams(BaseModel):
-    ic: float  # 阴极电流
-    ia: float  # 阳极电流
-    tc: float  # 阴极时间
-    ta: float  # 阳极时间
-    eh: Optional[float] = 10.0  # 高电位限制
-    el: Optional[float] = -10.0  # 低电位限制
-    pn: Optional[str] = 'p'  # 第一步电流极性
-    si: Optional[float] = 0.1  # 数据存储间隔
-    cl: Optional[int] = 1  # 段数/循环数
-    priority: Optional[str] = 'time'  # 优先模式，'time'或'potential'
-    file_name: Optional[str] = None
-
-class ACVAPIParams(BaseModel):
-    ei: float  # 初始电位
-    ef: float  # 最终电位
-    incre: float  # 电位增量
-    amp: float  # 交流振幅
-    freq: float  # 交流频率
-    quiet: Optional[float] = 2.0  # 静息时间
-    sens: Optional[float] = 1e-5  # 灵敏度
-    file_name: Optional[str] = None
-
-class CAAPIParams(BaseModel):
-    ei: float  # 初始电位
-    eh: float  # 高电位
-    el: float  # 低电位
-    cl: int  # 阶跃数
-    pw: float  # 脉冲宽度
-    si: float  # 采样间隔
-    sens: Optional[float] = 1e-5  # 灵敏度
-    qt: Optional[float] = 2.0  # 静置时间
-    pn: Optional[str] = 'p'  # 初始极性
-    file_name: Optional[str] = None  # 文件名
-    autosens: Optional[bool] = False  # 是否自动灵敏度
-
-class CVAPIParams(BaseModel):
-    ei: float  # 初始电位
-    eh: float  # 高电位
-    el: float  # 低电位
-    v: float  # 扫描速率
-    si: float  # 采样间隔
-    cl: int  # 循环次数
-    sens: Optional[float] = 1e-5  # 灵敏度
-    qt: Optional[float] = 2.0  # 静置时间
-    pn: Optional[str] = 'p'  # 初始扫描方向
-    file_name: Optional[str] = None  # 文件名
-    autosens: Optional[bool] = False  # 是否自动灵敏度
-
-class ITAPIParams(BaseModel):
-    ei: float  # 恒定电位
-    st: float  # 总采样时间
-    si: float  # 采样间隔
-    sens: Optional[float] = 1e-5  # 灵敏度
-    file_name: Optional[str] = None  # 文件名
+# 原 /api/chi/lsv、/api/chi/eis 接口对这些参数有默认值，API 层保留（技术类本身仍要求显式传入）
+CHI_API_DEFAULTS = {
+    "LSV": {"ei": -0.5, "ef": 0.5, "v": 0.1},
+    "EIS": {"ei": 0.0, "fl": 0.1, "fh": 100000.0, "amp": 10.0},
+}
+
+def _build_chi_api_model(spec):
+    """根据技术注册表生成CHI测试请求模型（前端别名与参数名均可使用）"""
+    api_defaults = CHI_API_DEFAULTS.get(spec.name, {})
+    fields = {}
+    for param in spec.params:
+        if param.name in api_defaults:
+            fields[param.name] = (param.type, Field(api_defaults[param.name], alias=param.alias, description=param.help))
+        elif param.required:
+            fields[param.name] = (param.type, Field(..., alias=param.alias, description=param.help))
+        else:
+            fields[param.name] = (Optional[param.type], Field(param.default, alias=param.alias, description=param.help))
+    fields["file_name"] = (Optional[str], Field(None, description="文件名"))
+    return create_model(
+        f"{spec.name}APIParams",
+        __config__=ConfigDict(populate_by_name=True),
+        **fields
+    )
+
+CHI_API_MODELS = {name: _build_chi_api_model(spec) for name, spec in CHI_TECHNIQUES.items()}
+
+class CHIBatchStep(BaseModel):
+    technique: str  # 技术名称，如 CV、LSV、EIS
+    params: Dict[str, Any] = {}  # 技术构造参数
+    file_name: Optional[str] = None  # 该步骤的结果文件名
+
+class CHIBatchAPIParams(BaseModel):
+    steps: List[CHIBatchStep]  # 按顺序执行的步骤
+    batch_name: Optional[str] = None  # 批处理宏文件名
 
 # Pydantic Models for Printer Info API
 class GeneralLimits(BaseModel):
@@ -214,22 +161,42 @@ moonraker_listener = None
 # 确保结果目录存在
 os.makedirs(config["results_dir"], exist_ok=True)
 
-# HTML前端
+# HTML前端（页面和拆分出的JS/CSS在内存中缓存并预压缩，文件修改后自动重新加载）
+html_bundle = HtmlBundle(Path(__file__).parent.absolute() / "device_tester.html", asset_url_prefix="/assets")
+
+def _cached_asset_response(asset, request: Request, cache_control: str):
+    """按 Accept-Encoding 返回预压缩内容，If-None-Match 命中时返回 304"""
+    encoding, body, etag = asset.select(request.headers.get("accept-encoding", ""))
+    headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding", "ETag": etag}
+    if asset.matches(request.headers.get("if-none-match", "")):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=asset.media_type, headers=headers)
+
 @app.get("/", response_class=HTMLResponse)
-async def get_html():
+async def get_html(request: Request):
     try:
-        html_path = Path(__file__).parent.absolute() / "device_tester.html"
-        if html_path.exists():
-            with open(html_path, "r", encoding="utf-8") as f:
-                html = f.read()
-            return HTMLResponse(content=html)
-        else:
-            logger.error(f"HTML文件不存在: {html_path}")
-            return HTMLResponse(content=f"<html><body><h1>错误: HTML文件不存在</h1><p>{html_path}</p></body></html>")
+        page = html_bundle.refresh()
+        return _cached_asset_response(page, request, HTML_CACHE_CONTROL)
+    except FileNotFoundError:
+        logger.error(f"HTML文件不存在: {html_bundle.html_path}")
+        return HTMLResponse(content=f"<html><body><h1>错误: HTML文件不存在</h1><p>{html_bundle.html_path}</p></body></html>")
     except Exception as e:
         logger.error(f"读取HTML文件失败: {e}")
         return HTMLResponse(content=f"<html><body><h1>错误: {str(e)}</h1></body></html>")
 
+# 页面拆分出的JS/CSS，文件名带内容哈希，可长期缓存
+@app.get("/assets/{asset_name}")
+async def get_asset(asset_name: str, request: Request):
+    try:
+        asset = html_bundle.asset(asset_name)
+    except FileNotFoundError:
+        asset = None
+    if asset is None:
+        raise HTTPException(status_code=404, detail=f"资源不存在: {asset_name}")
+    return _cached_asset_response(asset, request, ASSET_CACHE_CONTROL)
+
 # WebSocket连接
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -345,6 +312,22 @@ def is_chi_initialized():
     """
     return devices["chi"] is not None and hasattr(devices["chi"], "chi_setup") and devices["chi"].chi_setup is not None
 
+metrics.counter("log_suppressed_lines_total", "被限流抑制的日志条数").set_function(lambda: log_rate_filter.suppressed_total)
+
+# Prometheus 文本格式指标
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render_text(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/logging/stats")
+async def get_logging_stats():
+    """被限流抑制的日志条数（按调用位置）"""
+    return {
+        "error": False,
+        "suppressed_total": log_rate_filter.suppressed_total,
+        "top_sites": [{"site": site, "suppressed": count} for site, count in log_rate_filter.stats(20)],
+    }
+
 @app.get("/api/status")
 async def get_status():
     """获取所有设备状态"""
@@ -367,9 +350,11 @@ async def initialize_printer():
         await devices["printer"].close()
     
     try:
-        devices["printer"] = PrinterAdapter(
+        devices["printer"] = create_adapter(
+            "printer",
             moonraker_addr=config["moonraker_addr"],
-            broadcaster=broadcaster
+            broadcaster=broadcaster,
+            ws_listener=moonraker_listener
         )
         await devices["printer"].initialize()
         return {"error": False, "message": "打印机已初始化"}
@@ -505,7 +490,8 @@ async def initialize_pump():
                 logger.info(f"已初始化WebSocket监听器，连接到: {ws_url}")
         
         # 创建新的泵适配器实例，传入WebSocket监听器
-        devices["pump"] = PumpAdapter(
+        devices["pump"] = create_adapter(
+            "pump",
             moonraker_addr=config["moonraker_addr"],
             broadcaster=broadcaster,
             ws_listener=moonraker_listener
@@ -532,13 +518,14 @@ async def dispense_auto(data: Dict[str, Any]):
         speed_map = {"slow": "slow", "medium": "normal", "fast": "fast"}
         speed_value = speed_map.get(speed, "normal")
         
-        await devices["pump"].dispense_auto(
-            pump_index=pump_index,
-            volume=volume,
-            speed=speed_value,
-            direction=direction
-        )
-        return {"error": False, "message": f"泵 {pump_index} 正在自动泵送 {volume} μL"}
+        with tracing.start_span("POST /api/pump/dispense_auto", pump_index=pump_index, volume_ul=volume, speed=speed_value) as span:
+            await devices["pump"].dispense_auto(
+                pump_index=pump_index,
+                volume=volume,
+                speed=speed_value,
+                direction=direction
+            )
+        return {"error": False, "message": f"泵 {pump_index} 正在自动泵送 {volume} μL", "trace_id": span.trace_id}
     except Exception as e:
         logger.error(f"自动泵送失败: {e}")
         return {"error": True, "message": f"自动泵送失败: {e}"}
@@ -594,6 +581,17 @@ async def get_pump_status(pump_index: int = 0):
         logger.error(f"获取泵状态失败: {e}")
         return {"error": True, "message": f"获取泵状态失败: {e}"}
 
+# 等待当前泵送结束（泵停止即返回），供前端或脚本串联后续步骤
+@app.post("/api/pump/wait")
+async def wait_pump(data: Dict[str, Optional[float]] = None):
+    if devices["pump"] is None or not devices["pump"].initialized:
+        return {"error": True, "message": "泵未初始化"}
+    
+    timeout = (data or {}).get("timeout")
+    if await devices["pump"].wait_until_done(timeout):
+        return {"error": False, "message": "泵送已结束", "status": await devices["pump"].get_status()}
+    return {"error": True, "message": f"等待泵送结束超时 ({timeout} 秒)"}
+
 # =========== 继电器API ===========
 
 # 初始化继电器
@@ -606,9 +604,11 @@ async def initialize_relay():
         await devices["relay"].close()
     
     try:
-        devices["relay"] = RelayAdapter(
+        devices["relay"] = create_adapter(
+            "relay",
             moonraker_addr=config["moonraker_addr"],
-            broadcaster=broadcaster
+            broadcaster=broadcaster,
+            ws_listener=moonraker_listener
         )
         await devices["relay"].initialize()
         return {"error": False, "message": "继电器已初始化"}
@@ -632,15 +632,51 @@ async def toggle_relay(data: Dict[str, Any]):
         logger.error(f"切换继电器失败: {e}")
         return {"error": True, "message": f"切换继电器失败: {e}"}
 
+# 批量设置继电器（一次G-code请求）
+@app.post("/api/relay/set_many")
+async def set_many_relays(data: Dict[str, Any]):
+    if devices["relay"] is None or not devices["relay"].initialized:
+        return {"error": True, "message": "继电器未初始化"}
+    
+    try:
+        states = {int(relay_id): state for relay_id, state in (data.get("states") or {}).items()}
+        if not states:
+            return {"error": True, "message": "未提供继电器状态"}
+        applied = await devices["relay"].set_many(states)
+        formatted_states = {str(key): "on" if value else "off" for key, value in applied.items()}
+        return {"error": False, "message": f"已设置 {len(applied)} 个继电器", "states": formatted_states}
+    except Exception as e:
+        logger.error(f"批量设置继电器失败: {e}")
+        return {"error": True, "message": f"批量设置继电器失败: {e}"}
+
+# 定时动作序列（阀门/泵，G4 停顿，一次G-code请求）
+@app.post("/api/relay/sequence")
+async def run_relay_sequence(data: Dict[str, Any]):
+    if devices["relay"] is None or not devices["relay"].initialized:
+        return {"error": True, "message": "继电器未初始化"}
+    
+    try:
+        events = data.get("events") or []
+        if not events:
+            return {"error": True, "message": "未提供动作序列"}
+        result = await devices["relay"].run_sequence(events)
+        return {"error": False, "message": f"动作序列已执行，时长 {result['duration']:.3f} 秒",
+                "script": result["script"], "events": result["events"]}
+    except ValueError as e:
+        return {"error": True, "message": f"动作序列无效: {e}"}
+    except Exception as e:
+        logger.error(f"执行动作序列失败: {e}")
+        return {"error": True, "message": f"执行动作序列失败: {e}"}
+
 # 获取继电器状态
 @app.get("/api/relay/status")
-async def get_relay_status():
+async def get_relay_status(refresh: bool = False):
     if devices["relay"] is None or not devices["relay"].initialized:
         return {"error": True, "message": "继电器未初始化"}
     
     try:
-        # 获取继电器状态字典
-        states_dict = await devices["relay"].get_status()
+        # 获取继电器状态字典（refresh=true 时从硬件回读）
+        states_dict = await devices["relay"].get_status(refresh=refresh)
         
         # 转换布尔值为字符串格式，使前端更容易解析
         formatted_states = {}
@@ -653,17 +689,36 @@ async def get_relay_status():
         logger.error(f"获取继电器状态失败: {e}")
         return {"error": True, "message": f"获取继电器状态失败: {e}"}
 
-# =========== CHI API ===========
+# 紧急停止所有设备（打印机急停、停泵、停止CHI测试）
+@app.post("/api/emergency_stop")
+async def emergency_stop_all():
+    results = {}
+    if devices["printer"] is not None:
+        try:
+            results["printer"] = bool(await devices["printer"].emergency_stop())
+        except Exception as e:
+            logger.error(f"打印机紧急停止失败: {e}")
+            results["printer"] = False
+    if devices["pump"] is not None:
+        try:
+            results["pump"] = await devices["pump"].emergency_stop()
+        except Exception as e:
+            logger.error(f"紧急停泵失败: {e}")
+            results["pump"] = False
+    if devices["chi"] is not None and is_chi_initialized():
+        try:
+            await devices["chi"].stop_test()
+            results["chi"] = True
+        except Exception as e:
+            logger.error(f"紧急停止CHI测试失败: {e}")
+            results["chi"] = False
+    
+    failed = [name for name, ok in results.items() if not ok]
+    if failed:
+        return {"error": True, "message": f"部分设备紧急停止失败: {', '.join(failed)}", "results": results}
+    return {"error": False, "message": "已紧急停止所有设备", "results": results}
 
-# 当前CHI测试状态
-chi_test_state = {
-    "status": "idle",      # idle, initializing, running, completed, error
-    "test_type": None,     # CV, CA, EIS, etc.
-    "start_time": None,
-    "progress": 0.0,       # 0.0 - 1.0
-    "elapsed_time": 0,
-    "result_file": None
-}
+# =========== CHI API ===========
 
 # CHI测试调用锁定
 chi_test_lock = asyncio.Lock()
@@ -678,9 +733,9 @@ async def initialize_chi():
         await devices["chi"].close()
     
     try:
-        # 修改：使用从backend.services.adapters.chi_adapter导入的CHIAdapter类
-        # 并确保参数符合backend.services.adapters.chi_adapter.CHIAdapter的__init__方法
-        devices["chi"] = CHIAdapter(
+        # 参数需与 backend.services.adapters.chi_adapter.CHIAdapter 的 __init__ 一致
+        devices["chi"] = create_adapter(
+            "chi",
             broadcaster=broadcaster,
             results_base_dir=config["results_dir"],  # 注意：改为results_base_dir（与导入的CHIAdapter参数名一致）
             chi_path=config["chi_path"]
@@ -691,323 +746,71 @@ async def initialize_chi():
         logger.error(f"初始化CHI工作站失败: {e}")
         return {"error": True, "message": f"初始化CHI工作站失败: {e}"}
 
-# 运行CV测试
-@app.post("/api/chi/cv")
-async def run_cv_test(payload: CVAPIParams, background_tasks: BackgroundTasks):
-    if devices["chi"] is None or not is_chi_initialized():
-        return {"error": True, "message": "CHI未初始化"}
-    
-    try:
-        # 提取文件名
-        file_name = payload.file_name or f"CV_{int(time.time())}"
-        
-        # 创建参数字典
-        params = {
-            "ei": payload.ei,
-            "eh": payload.eh,
-            "el": payload.el,
-            "v": payload.v,
-            "si": payload.si,
-            "cl": payload.cl,
-            "sens": payload.sens,
-            "qt": payload.qt,
-            "pn": payload.pn,
-            "autosens": payload.autosens
-        }
-        
-        # 后台运行测试
-        background_tasks.add_task(devices["chi"].run_cv_test, file_name=file_name, params=params)
-        
-        logger.info(f"CV测试已在后台启动: {file_name}")
-        return {"error": False, "message": f"CV测试已在后台启动", "file_name": file_name}
-    except Exception as e:
-        logger.error(f"运行CV测试失败: {e}")
-        return {"error": True, "message": f"运行CV测试失败: {e}"}
+# 运行单项CHI测试（路由由技术注册表生成，如 /api/chi/cv、/api/chi/eis）
+def _register_chi_test_route(spec):
+    model = CHI_API_MODELS[spec.name]
 
-# 运行CA测试
-@app.post("/api/chi/ca")
-async def run_ca_test(payload: CAAPIParams, background_tasks: BackgroundTasks):
-    if devices["chi"] is None or not is_chi_initialized():
-        return {"error": True, "message": "CHI工作站未初始化"}
-    
-    try:
-        # 提取文件名，从数据中移除
-        file_name = payload.file_name or f"CA_{int(time.time())}"
+    async def run_chi_test_endpoint(payload: model):
+        if devices["chi"] is None or not is_chi_initialized():
+            return {"error": True, "message": "CHI工作站未初始化"}
         
-        # 创建参数字典
-        params = {
-            "ei": payload.ei,
-            "eh": payload.eh,
-            "el": payload.el,
-            "cl": payload.cl,
-            "pw": payload.pw,
-            "si": payload.si,
-            "sens": payload.sens,
-            "qt": payload.qt,
-            "pn": payload.pn,
-            "autosens": payload.autosens
-        }
-        
-        # 后台运行测试
-        background_tasks.add_task(devices["chi"].run_ca_test, file_name=file_name, params=params)
-        
-        logger.info(f"CA测试已在后台启动: {file_name}")
-        return {"error": False, "message": f"CA测试已在后台启动", "file_name": file_name}
-    except Exception as e:
-        logger.error(f"运行CA测试失败: {e}")
-        return {"error": True, "message": f"运行CA测试失败: {e}"}
+        try:
+            file_name = payload.file_name or f"{spec.name}_{int(time.time())}"
+            params = payload.model_dump(exclude={"file_name"})
+            logger.info(f"{spec.label}测试参数: {params}")
+            
+            result = await devices["chi"].run_test(spec.name, file_name, params)
+            
+            if result:
+                logger.info(f"{spec.label}测试已启动: {file_name}")
+                return {"error": False, "message": f"{spec.label}测试已启动", "file_name": file_name}
+            else:
+                return {"error": True, "message": f"{spec.label}测试启动失败"}
+        except Exception as e:
+            logger.error(f"运行{spec.label}测试失败: {e}", exc_info=True)
+            return {"error": True, "message": f"运行{spec.label}测试失败: {e}"}
 
-# 运行EIS测试
-@app.post("/api/chi/eis")
-async def run_eis_test(data: Dict[str, Any], background_tasks: BackgroundTasks):
-    if devices["chi"] is None or not is_chi_initialized():
-        return {"error": True, "message": "CHI工作站未初始化"}
-    
-    try:
-        # 提取文件名，从数据中移除
-        file_name = data.pop("file_name", f"EIS_{int(time.time())}")
-        
-        # 创建参数字典，与backend.services.adapters.chi_adapter.run_eis_test方法所需参数一致
-        params = {
-            "ei": float(data.get("voltage", 0)),            # 直流电位
-            "fl": float(data.get("freq_final", 0.1)),       # 低频（结束频率）
-            "fh": float(data.get("freq_init", 100000)),     # 高频（起始频率）
-            "amp": float(data.get("amplitude", 10)),        # 交流振幅
-            "sens": float(data.get("sens", 1e-5)),          # 灵敏度
-            "impautosens": bool(data.get("impautosens", True))  # 自动灵敏度
-        }
-        
-        # 获取模式参数，默认为'impsf'
-        mode = data.get("mode", "impsf")
-        if mode in ["impsf", "impft"]:
-            params["mode"] = mode
-        
-        # 后台运行测试
-        background_tasks.add_task(devices["chi"].run_eis_test, file_name=file_name, params=params)
-        
-        logger.info(f"EIS测试已在后台启动: {file_name}")
-        return {"error": False, "message": f"EIS测试已在后台启动", "file_name": file_name}
-    except Exception as e:
-        logger.error(f"运行EIS测试失败: {e}")
-        return {"error": True, "message": f"运行EIS测试失败: {e}"}
+    run_chi_test_endpoint.__doc__ = f"运行{spec.description}测试"
+    app.post(f"/api/chi/{spec.route}", name=f"run_{spec.route}_test")(run_chi_test_endpoint)
 
-# 运行LSV测试
-@app.post("/api/chi/lsv")
-async def run_lsv_test(data: Dict[str, Any], background_tasks: BackgroundTasks):
-    if devices["chi"] is None or not is_chi_initialized():
-        return {"error": True, "message": "CHI未初始化"}
-    
-    try:
-        # 提取文件名，从数据中移除
-        file_name = data.pop("file_name", f"LSV_{int(time.time())}")
-        
-        # 创建参数字典，与backend.services.adapters.chi_adapter.run_lsv_test方法所需参数一致
-        params = {
-            "ei": float(data.get("initial_v", -0.5)),    # 初始电位
-            "ef": float(data.get("final_v", 0.5)),       # 最终电位
-            "v": float(data.get("scan_rate", 0.1)),      # 扫描速率
-            "si": float(data.get("interval", 0.001)),    # 采样间隔
-            "sens": float(data.get("sens", 1e-5))        # 灵敏度
-        }
-        
-        # 后台运行测试
-        background_tasks.add_task(devices["chi"].run_lsv_test, file_name=file_name, params=params)
-        
-        logger.info(f"LSV测试已在后台启动: {file_name}")
-        return {"error": False, "message": f"LSV测试已在后台启动", "file_name": file_name}
-    except Exception as e:
-        logger.error(f"运行LSV测试失败: {e}")
-        return {"error": True, "message": f"运行LSV测试失败: {e}"}
+for _spec in CHI_TECHNIQUES.values():
+    _register_chi_test_route(_spec)
 
-# 运行IT测试
-@app.post("/api/chi/it")
-async def run_it_test(payload: ITAPIParams, background_tasks: BackgroundTasks):
+# 运行CHI批处理宏（多个技术一次启动）
+@app.post("/api/chi/batch")
+async def run_chi_batch_endpoint(payload: CHIBatchAPIParams):
+    """将多个技术合并为一个宏运行，每个步骤完成时通过WebSocket发布step_completed事件"""
     if devices["chi"] is None or not is_chi_initialized():
-        logger.error("CHI未初始化，无法运行i-t测试")
-        raise HTTPException(status_code=503, detail="CHI设备未初始化")
+        return {"error": True, "message": "CHI工作站未初始化"}
     
     try:
-        # 确定要传递给适配器的文件名
-        effective_file_name = payload.file_name if payload.file_name is not None else f'IT_{int(time.time())}'
-        
-        # 创建参数字典，与backend.services.adapters.chi_adapter.run_it_test方法所需参数一致
-        params = {
-            "ei": payload.ei,     # 恒定电位
-            "si": payload.si,     # 采样间隔
-            "st": payload.st,     # 总采样时间
-            "sens": payload.sens  # 灵敏度
-        }
+        batch_name = payload.batch_name or f"BATCH_{int(time.time())}"
+        steps = [step.dict() for step in payload.steps]
         
-        # 记录完整参数信息，便于调试
-        logger.info(f"i-t测试参数: {params}")
-        
-        # 后台运行测试
-        background_tasks.add_task(devices["chi"].run_it_test, file_name=effective_file_name, params=params)
-        
-        logger.info(f"i-t测试已在后台启动: {effective_file_name}")
-        return {"error": False, "message": "i-t测试已在后台启动", "file_name": effective_file_name}
-    except Exception as e:
-        logger.error(f"运行i-t测试失败: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"运行i-t测试失败: {str(e)}")
-
-# 运行OCP测试
-@app.post("/api/chi/ocp")
-async def run_ocp_test_endpoint(payload: OCPAPIParams, background_tasks: BackgroundTasks):
-    if devices["chi"] is None or not is_chi_initialized():
-        logger.error("CHI未初始化，无法运行OCP测试")
-        raise HTTPException(status_code=503, detail="CHI设备未初始化")
-
-    try:
-        # 确定要传递给适配器的文件名
-        effective_file_name = payload.file_name if payload.file_name is not None else 'OCP'
-        
-        # 创建参数字典，与backend.services.adapters.chi_adapter.run_ocp_test方法所需参数一致
-        params = {
-            "st": payload.st,  # 运行时间 (必需)
-            "si": payload.si,  # 采样间隔 (必需)
-        }
-        # 只有当提供了eh和el参数时才添加到params字典中
-        if payload.eh is not None:
-            params["eh"] = payload.eh
-        if payload.el is not None:
-            params["el"] = payload.el
-        
-        # 在后台运行测试
-        background_tasks.add_task(
-            devices["chi"].run_ocp_test, 
-            file_name=effective_file_name, 
-            params=params
-        )
-        
-        logger.info(f"OCP测试已在后台启动: {effective_file_name}")
-        return {"error": False, "message": "OCP测试已在后台启动", "file_name": effective_file_name}
-    except Exception as e:
-        logger.error(f"运行OCP测试失败: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"运行OCP测试失败: {str(e)}")
-
-# 运行DPV测试
-@app.post("/api/chi/dpv")
-async def run_dpv_test_endpoint(payload: DPVAPIParams, background_tasks: BackgroundTasks):
-    if devices["chi"] is None or not is_chi_initialized():
-        logger.error("CHI未初始化，无法运行DPV测试")
-        raise HTTPException(status_code=503, detail="CHI设备未初始化")
-
-    try:
-        # 确定要传递给适配器的文件名
-        effective_file_name = payload.file_name if payload.file_name is not None else f'DPV_{int(time.time())}'
-        
-        # 创建参数字典
-        params = {
-            "ei": payload.ei,
-            "ef": payload.ef,
-            "incre": payload.incre,
-            "amp": payload.amp,
-            "pw": payload.pw,
-            "sw": payload.sw,
-            "prod": payload.prod,
-            "qt": payload.qt,
-            "autosens": payload.autosens
-        }
-        # 只有当未使用autosens且提供了sens参数时才添加sens
-        if not payload.autosens and payload.sens is not None:
-            params["sens"] = payload.sens
-        
-        # 在后台运行测试
-        background_tasks.add_task(
-            devices["chi"].run_dpv_test, 
-            file_name=effective_file_name, 
-            params=params
-        )
-        
-        logger.info(f"DPV测试已在后台启动: {effective_file_name}")
-        return {"error": False, "message": "DPV测试已在后台启动", "file_name": effective_file_name}
-    except Exception as e:
-        logger.error(f"运行DPV测试失败: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"运行DPV测试失败: {str(e)}")
-
-# 运行SCV测试
-@app.post("/api/chi/scv")
-async def run_scv_test_endpoint(payload: SCVAPIParams, background_tasks: BackgroundTasks):
-    if devices["chi"] is None or not is_chi_initialized():
-        logger.error("CHI未初始化，无法运行SCV测试")
-        raise HTTPException(status_code=503, detail="CHI设备未初始化")
-
-    try:
-        # 确定要传递给适配器的文件名
-        effective_file_name = payload.file_name if payload.file_name is not None else f'SCV_{int(time.time())}'
-        
-        # 创建参数字典
-        params = {
-            "ei": payload.ei,
-            "ef": payload.ef,
-            "incre": payload.incre,
-            "sw": payload.sw,
-            "prod": payload.prod,
-            "qt": payload.qt,
-            "autosens": payload.autosens
-        }
-        # 只有当未使用autosens且提供了sens参数时才添加sens
-        if not payload.autosens and payload.sens is not None:
-            params["sens"] = payload.sens
-        
-        # 在后台运行测试
-        background_tasks.add_task(
-            devices["chi"].run_scv_test, 
-            file_name=effective_file_name, 
-            params=params
-        )
-        
-        logger.info(f"SCV测试已在后台启动: {effective_file_name}")
-        return {"error": False, "message": "SCV测试已在后台启动", "file_name": effective_file_name}
-    except Exception as e:
-        logger.error(f"运行SCV测试失败: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"运行SCV测试失败: {str(e)}")
-
-# 运行CP测试
-@app.post("/api/chi/cp")
-async def run_cp_test_endpoint(params: CPAPIParams):
-    """运行计时电位法测试 (CP)"""
-    try:
-        # 记录请求
-        logging.info(f"接收到CP测试请求: {params.dict()}")
-        
-        # 提取文件名或创建默认文件名
-        file_name = params.file_name or f"CP_Test_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-        # 调用适配器运行CP测试
-        result = await devices["chi"].run_cp_test(file_name, params.dict())
+        result = await devices["chi"].run_batch_test(batch_name, steps)
         
         if result:
-            return {"error": False, "message": "CP测试已启动", "file_name": file_name}
+            logger.info(f"CHI批处理宏已启动: {batch_name}，共{len(steps)}个步骤")
+            return {"error": False, "message": "CHI批处理宏已启动", "file_name": batch_name}
         else:
-            return {"error": True, "message": "CP测试启动失败"}
-    
+            return {"error": True, "message": "CHI批处理宏启动失败"}
     except Exception as e:
-        logging.exception("CP测试请求处理失败")
-        return {"error": True, "message": f"处理CP测试请求时出错: {str(e)}"}
+        logger.error(f"运行CHI批处理宏失败: {e}")
+        return {"error": True, "message": f"运行CHI批处理宏失败: {e}"}
 
-# 运行ACV测试
-@app.post("/api/chi/acv")
-async def run_acv_test_endpoint(params: ACVAPIParams):
-    """运行交流伏安法测试 (ACV)"""
-    try:
-        # 记录请求
-        logging.info(f"接收到ACV测试请求: {params.dict()}")
-        
-        # 提取文件名或创建默认文件名
-        file_name = params.file_name or f"ACV_Test_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-        # 调用适配器运行ACV测试
-        result = await devices["chi"].run_acv_test(file_name, params.dict())
-        
-        if result:
-            return {"error": False, "message": "ACV测试已启动", "file_name": file_name}
-        else:
-            return {"error": True, "message": "ACV测试启动失败"}
+# 估算CHI测试时长
+@app.post("/api/chi/estimate")
+async def estimate_chi_test(data: Dict[str, Any]):
+    """根据技术参数和历史实测耗时估算测试时长，供调度和ETA显示使用"""
+    if devices["chi"] is None or not is_chi_initialized():
+        return {"error": True, "message": "CHI工作站未初始化"}
     
+    try:
+        estimate = devices["chi"].estimate_duration(data.get("technique", ""), data.get("params", {}))
+        return {"error": False, **estimate}
     except Exception as e:
-        logging.exception("ACV测试请求处理失败")
-        return {"error": True, "message": f"处理ACV测试请求时出错: {str(e)}"}
+        logger.error(f"估算CHI测试时长失败: {e}")
+        return {"error": True, "message": f"估算CHI测试时长失败: {e}"}
 
 # 停止CHI测试
 @app.post("/api/chi/stop")
@@ -1076,81 +879,6 @@ async def download_chi_result(file: str):
 
 # =========== 辅助函数 ===========
 
-# 后台运行CHI测试
-async def run_chi_test_background(test_type, **kwargs):
-    try:
-        # 更新状态为运行中
-        chi_test_state["status"] = "running"
-        
-        # 根据测试类型调用不同的方法
-        result_file = None
-        if test_type == "cv":
-            # 调用CV测试
-            result_file = await devices["chi"].run_cv_test(**kwargs)
-            
-            # 发送进度更新 - 这里简单模拟进度
-            for i in range(1, 101):
-                if chi_test_state["status"] != "running":
-                    break  # 测试已被停止
-                
-                chi_test_state["progress"] = i / 100.0
-                
-                # 模拟测试耗时，根据循环次数调整
-                cycle_time = 5 * kwargs.get("cycles", 3)
-                await asyncio.sleep(cycle_time / 100)
-        
-        elif test_type == "ca":
-            # 调用CA测试
-            result_file = await devices["chi"].run_ca_test(**kwargs)
-            
-            # 发送进度更新 - 这里使用测试时间来计算进度
-            test_time = kwargs.get("time", 10)
-            start_time = time.time()
-            
-            while time.time() - start_time < test_time:
-                if chi_test_state["status"] != "running":
-                    break  # 测试已被停止
-                
-                elapsed = time.time() - start_time
-                progress = min(elapsed / test_time, 1.0)
-                chi_test_state["progress"] = progress
-                
-                await asyncio.sleep(0.5)
-        
-        elif test_type == "eis":
-            # 调用EIS测试
-            result_file = await devices["chi"].run_eis_test(**kwargs)
-            
-            # 发送进度更新 - EIS测试可能需要较长时间，这里模拟进度
-            estimated_time = 60  # 估计60秒完成
-            start_time = time.time()
-            
-            while time.time() - start_time < estimated_time:
-                if chi_test_state["status"] != "running":
-                    break  # 测试已被停止
-                
-                elapsed = time.time() - start_time
-                progress = min(elapsed / estimated_time, 1.0)
-                chi_test_state["progress"] = progress
-                
-                await asyncio.sleep(1)
-        
-        # 测试完成，更新状态
-        if chi_test_state["status"] == "running":  # 只有当测试仍在运行时才更新为完成状态
-            chi_test_state.update({
-                "status": "completed",
-                "progress": 1.0,
-                "result_file": result_file
-            })
-    
-    except Exception as e:
-        # 测试出错，更新状态
-        logger.error(f"CHI测试出错: {e}")
-        chi_test_state.update({
-            "status": "error",
-            "progress": 0.0
-        })
-
 # 获取CHI文件类型
 def get_chi_file_type(filename):
     """根据文件名推断CHI测试类型"""
@@ -1185,10 +913,15 @@ def load_config():
 
 # 辅助器类实现
 class PrinterAdapter:
-    def __init__(self, moonraker_addr, broadcaster):
+    def __init__(self, moonraker_addr, broadcaster, ws_listener=None):
+        from core_api.single_flight import AsyncSingleFlight
+        # 页面轮询和其他调用方同时查询坐标时共享一次请求（在线程中执行，不阻塞事件循环）
+        self._position_flight = AsyncSingleFlight("printer_adapter_position")
+        self.ws_listener = ws_listener
+        self.toolhead = None  # 监听器推送的最新打印头快照
         try:
             from device_control.control_printer import PrinterControl
-            self.printer = PrinterControl(ip=moonraker_addr.split("//")[1].split(":")[0])
+            self.printer = PrinterControl(ip=moonraker_addr.split("//")[1].split(":")[0], status_listener=ws_listener)
             self.broadcaster = broadcaster
             self.initialized = False
             self.position = {"x": 0, "y": 0, "z": 0}
@@ -1210,6 +943,9 @@ class PrinterAdapter:
             position = self.printer.get_current_position()
             if position:
                 self.position = {"x": position[0], "y": position[1], "z": position[2]}
+            if self.ws_listener is not None:
+                # 位置变化由订阅的状态增量推送给页面，无需轮询
+                self.ws_listener.add_status_callback(self._on_listener_status)
             await self.broadcast_status()
             logger.info("打印机初始化成功")
             return True
@@ -1221,13 +957,31 @@ class PrinterAdapter:
         
     async def close(self):
         self.initialized = False
+        if self.ws_listener is not None:
+            self.ws_listener.remove_status_callback(self._on_listener_status)
+    
+    def _on_listener_status(self, status):
+        """toolhead / motion_report 等对象有增量时，位置或归位状态变化则广播"""
+        if not self.initialized or not any(name in status for name in TOOLHEAD_OBJECTS):
+            return
+        snapshot = self.ws_listener.toolhead
+        if snapshot is None or snapshot.position is None:
+            return
+        x, y, z = snapshot.live_position or snapshot.position
+        position = {"x": x, "y": y, "z": z}
+        previous = self.toolhead
+        self.toolhead = snapshot
+        if (position != self.position or previous is None or previous.homed_axes != snapshot.homed_axes
+                or previous.is_moving != snapshot.is_moving):
+            self.position = position
+            asyncio.get_running_loop().create_task(self.broadcast_status())
         
     async def move_to(self, x, y, z):
         if not self.initialized:
             raise ValueError("打印机未初始化")
         
-        # 移动打印机
-        result = self.printer.move_to(x, y, z)
+        # 移动打印机（阻塞到移动完成，在线程中执行，期间仍可响应紧急停止等请求）
+        result = await asyncio.to_thread(self.printer.move_to, x, y, z)
         
         # 更新位置
         position = self.printer.get_current_position()
@@ -1242,7 +996,7 @@ class PrinterAdapter:
             raise ValueError("打印机未初始化")
         
         # 移动打印机到网格位置
-        result = self.printer.move_to_grid_position(position)
+        result = await asyncio.to_thread(self.printer.move_to_grid_position, position)
         
         # 更新位置
         printer_position = self.printer.get_current_position()
@@ -1257,7 +1011,7 @@ class PrinterAdapter:
             raise ValueError("打印机未初始化")
         
         # 归位打印机
-        result = self.printer.home()
+        result = await asyncio.to_thread(self.printer.home)
         
         # 更新位置
         position = self.printer.get_current_position()
@@ -1267,29 +1021,45 @@ class PrinterAdapter:
         await self.broadcast_status()
         return result
     
+    async def emergency_stop(self):
+        """紧急停止：正在等待的移动/归位立即返回，并停止 Klipper"""
+        if self.printer is None:
+            raise ValueError("打印机控制器不可用")
+        result = await asyncio.to_thread(self.printer.emergency_stop)
+        await self.broadcast_status()
+        return result
+    
     async def get_position(self):
         if not self.initialized:
             raise ValueError("打印机未初始化")
         
-        position = self.printer.get_current_position()
+        position = await self._position_flight.do("toolhead", lambda: asyncio.to_thread(self.printer.get_current_position))
         if position:
             self.position = {"x": position[0], "y": position[1], "z": position[2]}
         
         return self.position
     
     async def broadcast_status(self):
-        await self.broadcaster.broadcast({
+        message = {
             "type": "printer_status",
             "position": self.position,
             "initialized": self.initialized
-        })
+        }
+        if self.toolhead is not None:
+            message["homed_axes"] = self.toolhead.homed_axes
+            message["is_moving"] = self.toolhead.is_moving
+        await self.broadcaster.broadcast(message)
 
 class PumpAdapter:
     def __init__(self, moonraker_addr, broadcaster, ws_listener=None):
         from core_api.pump_proxy import PumpProxy  # 正确导入PumpProxy
         
+        from core_api.pump_progress import PumpProgressTracker
+        
         # 传入WebSocket监听器实例
         self.pump_proxy = PumpProxy(moonraker_addr, listener=ws_listener)
+        # 订阅泵的对象状态，按实际圈数计算进度；没有状态来源时回退到按时间估算
+        self.progress_tracker = PumpProgressTracker(ws_listener)
         self.broadcaster = broadcaster
         self.initialized = False
         self.status = {
@@ -1305,9 +1075,12 @@ class PumpAdapter:
             "raw_response": None         # Moonraker的原始响应日志 (可选)
         }
         self._stop_event = False  # 用于控制进度监控循环的标志
+        self._done_event = asyncio.Event()  # 泵送结束（完成或中断）时置位，供后续步骤等待
+        self._done_event.set()
         
     async def initialize(self):
         self.initialized = True
+        await self.progress_tracker.subscribe()
         # 在初始化时广播一个干净的状态
         self.status = {
             "running": False, "pump_index": 0, "volume": 0, "progress": 0, "direction": 1,
@@ -1325,12 +1098,15 @@ class PumpAdapter:
         self.status.update({"running": False, "progress": self.status.get("progress",0)}) # 保留进度
         await self.broadcast_status()
         
+    @tracing.traced("pump_adapter.dispense_auto")
     async def dispense_auto(self, pump_index, volume, speed, direction=1):
         if not self.initialized:
             logger.error("PumpAdapter未初始化，无法执行dispense_auto")
             raise ValueError("泵未初始化")
         
         self._stop_event = False # 重置停止标志
+        self._done_event.clear()
+        self.progress_tracker.begin(None)  # 在发送命令前记录起始位置
         
         # 记录API调用开始时间点
         api_call_start_time = time.time()
@@ -1375,6 +1151,7 @@ class PumpAdapter:
             actual_pump_duration = proxy_response.get("estimated_duration", 0) # 这是物理泵送的预期总时长
             self.status["rpm"] = proxy_response.get("rpm")
             self.status["revolutions"] = proxy_response.get("revolutions")
+            self.progress_tracker.target_revolutions = self.status["revolutions"]
             self.status["total_duration_seconds"] = actual_pump_duration # UI显示的总时长
             self.status["elapsed_time_seconds"] = 0 # 泵送操作的已过时间，从0开始计数
             self.status["raw_response"] = proxy_response.get("raw_response", "")
@@ -1415,6 +1192,8 @@ class PumpAdapter:
             raise ValueError("泵未初始化")
         
         self._stop_event = False
+        self._done_event.clear()
+        self.progress_tracker.begin(None)
         user_specified_duration = float(duration) # 这是物理泵送的预期总时长
         
         # 记录API调用开始时间点
@@ -1457,6 +1236,8 @@ class PumpAdapter:
 
             # 更新状态中的圈数和原始响应
             self.status["revolutions"] = proxy_response.get("revolutions")
+            # 目标圈数取泵服务实际执行的圈数（对应发送的体积），而不是按转速 × 时长推算
+            self.progress_tracker.target_revolutions = self.status["revolutions"]
             self.status["raw_response"] = proxy_response.get("raw_response", "")
             
             source = proxy_response.get("source", "unknown")
@@ -1524,7 +1305,7 @@ class PumpAdapter:
         
         if current_running_status: # 仅当之前状态为运行时才发送物理停止命令
             try:
-                response = self.pump_proxy.emergency_stop()
+                response = await self.pump_proxy.emergency_stop()
                 logger.info(f"泵 {pump_index} 已发送物理停止命令。响应: {response.get('raw_response','')}")
                 self.status["raw_response"] = response.get('raw_response','已发送停止命令')
             except Exception as e:
@@ -1536,6 +1317,15 @@ class PumpAdapter:
 
         await self.broadcast_status() # 再次广播包含raw_response的最终状态
         return True
+
+    async def emergency_stop(self):
+        """紧急停泵：无论本地状态如何都发送物理停止命令（泵可能由实验控制器等其他途径启动）"""
+        self._stop_event = True
+        self.status["running"] = False
+        response = await self.pump_proxy.emergency_stop()
+        self.status["raw_response"] = response.get('raw_response', '已发送紧急停止命令')
+        await self.broadcast_status()
+        return bool(response.get("success"))
     
     async def get_status(self, pump_index=0): # pump_index 参数在这里暂时未使用，因为我们只有一个共享状态
         if not self.initialized:
@@ -1548,6 +1338,7 @@ class PumpAdapter:
             }
         return self.status # 返回当前缓存的状态
     
+    @tracing.traced("pump_adapter.monitor_progress")
     async def _monitor_pump_progress(self, total_duration_seconds_to_monitor, initial_elapsed_for_progress_calc, total_estimated_for_progress_calc):
         """监控泵送进度
         
@@ -1597,7 +1388,13 @@ class PumpAdapter:
             logger.info(f"[MONITOR Pump {self.status['pump_index']}] Initial broadcast: Progress={self.status['progress']:.2%}, Elapsed={self.status['elapsed_time_seconds']:.2f}s")
             await self.broadcast_status() # Broadcast initial state
             
-            while time.time() - loop_start_time < total_duration_seconds_to_monitor:
+            # 有实际圈数时以泵停止为准（预估时长只作为上限，留出余量防止预估偏短）
+            monitor_limit = total_duration_seconds_to_monitor
+            if self.progress_tracker.available:
+                monitor_limit = total_duration_seconds_to_monitor * 2 + 5.0
+                logger.info(f"泵 {self.status['pump_index']} 使用实际圈数跟踪进度")
+            
+            while time.time() - loop_start_time < monitor_limit:
                 if self._stop_event:
                     logger.info(f"泵 {self.status['pump_index']} 进度监控被外部停止。")
                     self.status["running"] = False
@@ -1606,21 +1403,38 @@ class PumpAdapter:
                 monitor_loop_elapsed_time = time.time() - loop_start_time
                 current_total_elapsed_for_progress = initial_elapsed_for_progress_calc + monitor_loop_elapsed_time
                 
-                progress = current_total_elapsed_for_progress / total_estimated_for_progress_calc
+                actual = self.progress_tracker.snapshot()
+                if actual is not None and actual["progress"] is None:
+                    actual = None   # 没有目标圈数时无法计算进度，按时间估算
+                if actual is not None:
+                    progress = actual["progress"]
+                    self.status["revolutions_done"] = round(actual["revolutions_done"], 3)
+                else:
+                    progress = current_total_elapsed_for_progress / total_estimated_for_progress_calc
                 
                 self.status["progress"] = min(max(progress, 0.0), 1.0)
                 self.status["elapsed_time_seconds"] = round(current_total_elapsed_for_progress, 2)
                 
                 logger.info(f"[MONITOR Pump {self.status['pump_index']}] In Loop: Progress={self.status['progress']:.2%}, Elapsed={self.status['elapsed_time_seconds']:.2f}s. Broadcasting...")
                 await self.broadcast_status()
-                await asyncio.sleep(update_interval)
+                if actual is not None:
+                    # 等待下一次状态更新中泵停止，停止时立即结束而不是等到预估时长
+                    if await self.progress_tracker.wait_until_stopped(timeout=update_interval):
+                        break
+                elif monitor_loop_elapsed_time >= total_duration_seconds_to_monitor:
+                    break
+                else:
+                    await asyncio.sleep(update_interval)
             
             final_elapsed_time_in_loop = time.time() - loop_start_time
             final_total_elapsed_for_progress = initial_elapsed_for_progress_calc + final_elapsed_time_in_loop
         
             if not self._stop_event and self.status["running"]:
                 self.status["progress"] = 1.0
-                self.status["elapsed_time_seconds"] = round(total_estimated_for_progress_calc, 2)
+                if self.progress_tracker.available:
+                    self.status["elapsed_time_seconds"] = round(final_total_elapsed_for_progress, 2)
+                else:
+                    self.status["elapsed_time_seconds"] = round(total_estimated_for_progress_calc, 2)
                 logger.info(f"泵 {self.status['pump_index']} 正常完成: 总时长={total_estimated_for_progress_calc:.2f}秒, 最终进度={self.status['progress']:.2%}")
             else:
                 current_progress = final_total_elapsed_for_progress / total_estimated_for_progress_calc
@@ -1639,7 +1453,19 @@ class PumpAdapter:
             logger.info(f"[MONITOR Pump {self.status['pump_index']}] Final broadcast: Progress={self.status['progress']:.2%}, Elapsed={self.status['elapsed_time_seconds']:.2f}s")
             await self.broadcast_status()
     
+    async def wait_until_done(self, timeout=None):
+        """等待当前泵送结束（完成、中断或失败），超时返回 False"""
+        try:
+            await asyncio.wait_for(self._done_event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
     async def broadcast_status(self):
+        # 每个结束路径（完成、停止、失败）都会广播 running=False 的状态
+        if not self.status.get("running"):
+            self._done_event.set()
+        
         # Create a copy to avoid modifying the original dict during iteration by other tasks potentially
         status_to_broadcast = self.status.copy()
         
@@ -1667,7 +1493,8 @@ class PumpAdapter:
         })
 
 class RelayAdapter:
-    def __init__(self, moonraker_addr, broadcaster):
+    def __init__(self, moonraker_addr, broadcaster, ws_listener=None):
+        self.ws_listener = ws_listener
         try:
             from core_api.relay_proxy import RelayProxy
             self.relay_proxy = RelayProxy(moonraker_addr)
@@ -1689,6 +1516,11 @@ class RelayAdapter:
                 raise ValueError("继电器控制器初始化失败")
                 
             self.initialized = True
+            # 读取继电器实际状态，之后由订阅推送状态变化
+            await self.refresh_states()
+            if self.ws_listener is not None:
+                self.ws_listener.add_status_callback(self._on_listener_status)
+                await self.ws_listener.subscribe_objects(self.relay_proxy.pin_objects(self.states))
             await self.broadcast_status()
             logger.info("继电器初始化成功")
             return True
@@ -1700,6 +1532,55 @@ class RelayAdapter:
         
     async def close(self):
         self.initialized = False
+        if self.ws_listener is not None:
+            self.ws_listener.remove_status_callback(self._on_listener_status)
+    
+    async def refresh_states(self):
+        """通过 output_pin 回读继电器实际状态，读取失败时保留本地状态"""
+        try:
+            actual = await asyncio.to_thread(self.relay_proxy.query_states, list(self.states))
+        except Exception as e:
+            logger.warning(f"回读继电器状态失败，使用本地记录的状态: {e}")
+            return False
+        if actual:
+            self.states.update(actual)
+        return True
+    
+    def _on_listener_status(self, status):
+        """订阅推送的 output_pin 状态变化时更新并广播"""
+        if not self.initialized:
+            return
+        actual = self.relay_proxy.parse_states(status, list(self.states))
+        changed = {idx: on for idx, on in actual.items() if self.states.get(idx) != on}
+        if changed:
+            self.states.update(changed)
+            asyncio.get_running_loop().create_task(self.broadcast_status())
+    
+    async def set_many(self, states):
+        """一次请求设置多个继电器 {relay_id: "on"/"off"/bool}"""
+        if not self.initialized:
+            raise ValueError("继电器未初始化")
+        applied = await asyncio.to_thread(self.relay_proxy.set_many, states)
+        self.states.update(applied)
+        logger.info(f"继电器批量设置: {applied}")
+        await self.broadcast_status()
+        return applied
+        
+    async def run_sequence(self, events):
+        """定时动作序列编译为单个G-code脚本执行（阻塞到最后一个动作完成）"""
+        if not self.initialized:
+            raise ValueError("继电器未初始化")
+        from core_api.choreography import ValveSequence, run_sequence
+        sequence = ValveSequence.from_events(events)
+        result = await asyncio.to_thread(run_sequence, self.relay_proxy, sequence)
+        # 序列结束时每个继电器的最终状态（订阅推送也会更新，这里先行同步）
+        for event in sequence.ordered():
+            if event.command.startswith("RELAY_ON_") or event.command.startswith("RELAY_OFF_"):
+                action, _, idx = event.command[len("RELAY_"):].partition("_")
+                self.states[int(idx)] = action == "ON"
+        logger.info(f"动作序列执行完成: {len(sequence.events)} 个动作，时长 {sequence.duration:.3f} 秒")
+        await self.broadcast_status()
+        return result
         
     async def toggle(self, relay_id, state=None):
         if not self.initialized:
@@ -1730,14 +1611,14 @@ class RelayAdapter:
             logger.error(f"切换继电器失败: {e}")
             raise
     
-    async def get_status(self):
+    async def get_status(self, refresh=False):
         if not self.initialized:
             raise ValueError("继电器未初始化")
         
         try:
-            # 直接使用本地缓存的状态
-            # 注意：对于完整实现，应该添加查询真实硬件状态的功能
-            # 但目前relay_proxy不支持query_status方法
+            # 订阅推送保持本地状态与硬件一致；refresh=True 时再主动回读一次
+            if refresh:
+                await self.refresh_states()
             
             # 日志记录当前状态
             logger.info(f"继电器当前状态: {self.states}")
@@ -1759,7 +1640,21 @@ class RelayAdapter:
             "states": json_states,
             "initialized": self.initialized
         })
-        logger.info(f"广播继电器状态: {{'type': 'relay_status', 'states': {json_states}, 'initialized': {self.initialized}}}")
+        logger.info("广播继电器状态: {'type': 'relay_status', 'states': %s, 'initialized': %s}", json_states, self.initialized)
+
+# 设备适配器注册表：打印机/泵/继电器使用上面的辅助器类，
+# 值为 None 的设备类型使用 backend 适配器，对应模块在首次创建时才导入
+ADAPTER_REGISTRY = {
+    "printer": PrinterAdapter,
+    "pump": PumpAdapter,
+    "relay": RelayAdapter,
+    "chi": None,
+}
+
+def create_adapter(device_type, **kwargs):
+    """按设备类型创建适配器实例"""
+    adapter_class = ADAPTER_REGISTRY.get(device_type) or get_adapter_class(device_type)
+    return adapter_class(**kwargs)
 
 # 在启动时初始化WebSocket监听器
 @app.on_event("startup")
@@ -1813,6 +1708,10 @@ async def shutdown_event():
         except Exception as e:
             logger.error(f"停止WebSocket监听器失败: {e}")
 
+    # 写完队列中剩余的追踪数据和日志
+    tracing.shutdown()
+    stop_logging()
+
 if __name__ == "__main__":
     # 查找可用端口
     port = find_available_port(8001, 10)
@@ -1824,4 +1723,5 @@ if __name__ == "__main__":
     print(f"请使用浏览器访问: http://localhost:{port}")
     
     # 启动FastAPI应用
-    uvicorn.run(app, host="0.0.0.0", port=port) 
\ No newline at end of file
+    # log_config=None：uvicorn 的日志也传递到根日志记录器，经同一个队列写入
+    uvicorn.run(app, host="0.0.0.0", port=port, log_config=None) 
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""步骤参数模板解析基准测试
+
+按 experiment_config.json 的实验序列遍历所有步骤，模拟 _dispatch_step 中的模板解析
+（description、params、chi_params、chi_tests、context_override），电压循环展开为指定点数，
+分别用旧的逐字符串 find/replace 实现和预编译模板实现运行，校验结果一致并输出耗时。
+
+用法:
+    python old/benchmark_templates.py [--config old/experiment_config.json] [--points 100] [--repeat 5]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from old.step_templates import TemplateCompiler
+
+log = logging.getLogger(__name__)
+
+
+class LegacyResolver:
+    """ExperimentController 原有的模板解析实现（每次调用都重新扫描字符串）"""
+
+    def __init__(self, config, configurations):
+        self.config = config
+        self.configurations = configurations
+
+    def resolve(self, template_string, context):
+        if not isinstance(template_string, str):
+            return template_string
+
+        original_template = template_string
+        is_single_placeholder = template_string.startswith("{{") and template_string.endswith("}}") and template_string.count("{{") == 1
+
+        for config_key_prefix in ["config.", "configurations."]:
+            start_idx = 0
+            while True:
+                match_start = template_string.find("{{" + config_key_prefix, start_idx)
+                if match_start == -1:
+                    break
+                match_end = template_string.find("}}", match_start)
+                if match_end == -1:
+                    break
+
+                full_placeholder = template_string[match_start : match_end+2]
+                key_path_str = template_string[match_start+2+len(config_key_prefix) : match_end]
+
+                key_parts = key_path_str.split('[')
+                actual_key = key_parts[0]
+                index = None
+                if len(key_parts) > 1 and key_parts[1].endswith(']'):
+                    try:
+                        index = int(key_parts[1][:-1])
+                    except ValueError:
+                        start_idx = match_end + 2
+                        continue
+
+                value = self.configurations.get(actual_key)
+                if value is not None and index is not None:
+                    if isinstance(value, list) and 0 <= index < len(value):
+                        value = value[index]
+                    else:
+                        value = full_placeholder
+                elif value is None:
+                    value = full_placeholder
+
+                if is_single_placeholder and full_placeholder == original_template:
+                    return value
+                template_string = template_string.replace(full_placeholder, str(value))
+                start_idx = match_start + len(str(value))
+
+        for key, value in context.items():
+            placeholder = f"{{{{{key}}}}}"
+            if placeholder == original_template and is_single_placeholder:
+                return value
+            template_string = template_string.replace(placeholder, str(value))
+
+        for key in ["project_name", "base_path", "moonraker_addr"]:
+            placeholder = f"{{{{{key}}}}}"
+            if placeholder == original_template and is_single_placeholder:
+                return self.config.get(key, placeholder)
+            template_string = template_string.replace(placeholder, str(self.config.get(key, placeholder)))
+
+        return template_string
+
+    def parse_params(self, params_config, context):
+        if params_config is None:
+            return {}
+        parsed_params = {}
+        for key, value in params_config.items():
+            if isinstance(value, str):
+                parsed_params[key] = self.resolve(value, context)
+            elif isinstance(value, dict):
+                parsed_params[key] = self.parse_params(value, context)
+            elif isinstance(value, list):
+                parsed_params[key] = [self.resolve(item, context) if isinstance(item, str) else item for item in value]
+            else:
+                parsed_params[key] = value
+        return parsed_params
+
+
+def walk_steps(resolver, config, steps, context, points, results):
+    """按 _dispatch_step 的顺序解析步骤模板，解析结果追加到 results"""
+    for step in steps:
+        results.append(resolver.resolve(step.get('description', ''), context))
+        results.append(resolver.parse_params(step.get('params', {}), context))
+
+        step_type = step.get('type')
+        if step_type == 'chi_measurement':
+            results.append(resolver.parse_params(step.get('chi_params', {}), context))
+        elif step_type == 'chi_sequence':
+            for test_cfg in step.get('chi_tests', []):
+                results.append(resolver.parse_params(test_cfg.get('params', {}), context))
+        elif step_type == 'sequence':
+            sub_name = step.get('name_in_sub_sequences')
+            actions = config.get('sub_sequences', {}).get(sub_name, {}).get('actions', []) if sub_name else step.get('actions', [])
+            sequence_context = context.copy()
+            overrides = resolver.parse_params(step.get('context_override', {}), context)
+            results.append(overrides)
+            sequence_context.update(overrides)
+            walk_steps(resolver, config, actions, sequence_context, points, results)
+        elif step_type == 'voltage_loop':
+            first_pos = config.get('first_experiment_position', 2)
+            for i in range(points):
+                voltage = round(-1.0 - 0.01 * i, 2)
+                loop_context = context.copy()
+                loop_context['current_voltage'] = voltage
+                loop_context['current_voltage_file_str'] = (f"neg{int(abs(voltage * 10))}" if voltage < 0 else f"{int(voltage * 10)}")
+                loop_context['current_output_position'] = first_pos + i
+                loop_context['loop_index'] = i
+                walk_steps(resolver, config, step.get('loop_sequence', []), loop_context, points, results)
+
+
+def run_once(resolver, config, points):
+    context = {
+        "project_name": config.get('project_name'),
+        "base_path": config.get('base_path'),
+        "project_path": os.path.join(config.get('base_path', ''), config.get('project_name', '')),
+    }
+    results = []
+    start = time.perf_counter()
+    walk_steps(resolver, config, config.get('experiment_sequence', []), context, points, results)
+    return time.perf_counter() - start, results
+
+
+def main():
+    default_config = os.path.join(os.path.dirname(os.path.abspath(__file__)), "experiment_config.json")
+    parser = argparse.ArgumentParser(description="步骤参数模板解析基准测试")
+    parser.add_argument("--config", default=default_config, help="实验配置文件路径")
+    parser.add_argument("--points", type=int, default=100, help="电压循环点数")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数（取最短耗时）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    configurations = config.setdefault('configurations', {})
+
+    legacy = LegacyResolver(config, configurations)
+
+    compile_start = time.perf_counter()
+    compiled = TemplateCompiler(config, configurations)
+    template_count = compiled.precompile([config.get('experiment_sequence', []), config.get('sub_sequences', {})])
+    compile_time = time.perf_counter() - compile_start
+
+    legacy_times, compiled_times = [], []
+    for _ in range(args.repeat):
+        legacy_time, legacy_results = run_once(legacy, config, args.points)
+        compiled_time, compiled_results = run_once(compiled, config, args.points)
+        legacy_times.append(legacy_time)
+        compiled_times.append(compiled_time)
+
+    if legacy_results != compiled_results:
+        mismatches = sum(1 for a, b in zip(legacy_results, compiled_results) if a != b)
+        print(f"结果不一致：{mismatches} / {len(legacy_results)} 项不同")
+        return 1
+
+    legacy_best, compiled_best = min(legacy_times), min(compiled_times)
+    print(f"配置: {args.config}")
+    print(f"电压点数: {args.points}，解析项数: {len(legacy_results)}，预编译模板: {template_count}（{compile_time * 1000:.2f} ms）")
+    print(f"旧实现:   {legacy_best * 1000:8.2f} ms")
+    print(f"预编译:   {compiled_best * 1000:8.2f} ms")
+    print(f"加速比:   {legacy_best / compiled_best:8.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""实验结果Excel报告（内存缓冲，批量写入）
+
+接口与原 ExcelReporter 一致（record_it_result / record_main_plot / add_it_plots_gallery /
+add_summary_info / save_all_workbooks），但每次记录只更新内存中的报告模型，
+按配置的时间间隔或在运行结束时统一写入项目工作簿和中央汇总工作簿：
+- 一次写入中每个工作簿只打开、保存一次，100 个电压点的运行中中央工作簿不再被重写 100 次；
+- 先保存到同目录的临时文件再 os.replace，写入中途退出不会损坏已有工作簿；
+- 项目工作簿完全由内存模型生成（含图像）；
+- 中央工作簿中每个项目占一个工作表，并在“汇总”表中按项目名称更新一行，其他项目的内容保持不变。
+  openpyxl 加载已有工作簿时会丢弃其中的图像，因此中央工作簿中的图以超链接形式写入。
+"""
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+log = logging.getLogger(__name__)
+
+SUMMARY_SHEET = "汇总"
+RESULTS_SHEET = "结果"
+IMAGE_SIZE = (480, 300)         # 图像在工作表中的显示尺寸（像素）
+GALLERY_COLUMNS = 3             # IT 图库每行图像数
+GALLERY_ROW_SPAN = 16           # 图库中每张图占用的行数
+GALLERY_COL_SPAN = 8            # 图库中每张图占用的列数
+
+# 报告调用中使用的锚点键与 layout_map 键的对应关系
+_ANCHOR_ALIASES = {
+    "cv_plot_anchor": "cv_plot",
+    "cv_cdl_plot_anchor": "cv_cdl_plot",
+    "lsv_plot_anchor": "lsv_plot",
+    "it_plots_start_anchor": "it_gallery_start",
+    "central_cv_plot_anchor": "central_cv_plot",
+    "central_cv_cdl_plot_anchor": "central_cv_cdl_plot",
+    "central_lsv_plot_anchor": "central_lsv_plot",
+    "central_it_plots_start_anchor": "central_it_gallery_start",
+}
+
+
+def _sheet_title(name):
+    """生成合法的工作表名（不含 []:*?/\\，最长 31 个字符）"""
+    return re.sub(r'[\[\]:*?/\\]', '_', str(name))[:31] or "Project"
+
+
+def _offset_cell(anchor, rows=0, cols=0):
+    column, row = coordinate_from_string(anchor)
+    return f"{get_column_letter(column_index_from_string(column) + cols)}{row + rows}"
+
+
+class BufferedExcelReport:
+    """缓冲式Excel报告"""
+
+    def __init__(self, project_name, project_excel_path, central_excel_path,
+                 voltages_list, positions_list, layout_map=None, flush_interval=0):
+        """
+        Args:
+            project_name: 项目名称
+            project_excel_path: 项目工作簿路径
+            central_excel_path: 中央汇总工作簿路径
+            voltages_list: 电压点列表
+            positions_list: 与电压点对应的输出位置列表（字符串）
+            layout_map: 图像锚点单元格，如 {'cv_plot': 'E2', 'central_cv_plot': 'H2', ...}
+            flush_interval: 自动写入间隔（秒），0 表示只在 save_all_workbooks() 时写入
+        """
+        self.project_name = project_name
+        self.project_excel_path = project_excel_path
+        self.central_excel_path = central_excel_path
+        self.layout_map = layout_map or {}
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        self.flush_count = 0
+
+        # 内存中的报告模型
+        self.it_rows = {
+            index: {"voltage": voltage, "output_pos": str(position), "result": "", "plot": None}
+            for index, (voltage, position) in enumerate(zip(voltages_list, positions_list))
+        }
+        self.main_plots = {}        # 标签 -> {"path", "project_anchor", "central_anchor"}
+        self.galleries = {}         # "project"/"central" -> (锚点键, [图信息])
+        self.summary = {}
+
+    # ---------- 记录（只更新内存） ----------
+
+    def record_it_result(self, voltage, charge_or_status, output_pos, loop_index, it_plot_path):
+        """记录一个电压点的 i-t 结果"""
+        with self._lock:
+            row = self.it_rows.setdefault(loop_index, {})
+            row.update({
+                "voltage": voltage,
+                "output_pos": str(output_pos),
+                "result": charge_or_status,
+                "plot": it_plot_path,
+            })
+            self._touch()
+
+    def record_main_plot(self, tag_name, png_image_path, project_anchor_key, central_anchor_key):
+        """记录 CV/LSV 等主图"""
+        with self._lock:
+            self.main_plots[tag_name] = {
+                "path": png_image_path,
+                "project_anchor": project_anchor_key,
+                "central_anchor": central_anchor_key,
+            }
+            self._touch()
+
+    def add_it_plots_gallery(self, it_plot_info_list, target_workbook="project", anchor_key="it_plots_start_anchor"):
+        """记录 i-t 图库（按电压点索引排序）"""
+        with self._lock:
+            plots = sorted(it_plot_info_list, key=lambda info: info.get('index', 0))
+            self.galleries[target_workbook] = (anchor_key, plots)
+            self._touch()
+
+    def add_summary_info(self, additional_info=None):
+        """记录实验概要信息"""
+        with self._lock:
+            self.summary.update(additional_info or {})
+            self._touch()
+
+    def save_all_workbooks(self):
+        """将内存中的报告写入项目工作簿和中央工作簿"""
+        self.flush(force=True)
+
+    # ---------- 写入 ----------
+
+    def _touch(self):
+        self._dirty = True
+        if self.flush_interval and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self, force=False):
+        """写入工作簿（没有新内容且未强制时跳过）"""
+        with self._lock:
+            if not self._dirty and not force:
+                return
+            started = time.monotonic()
+            self._write_workbook(self.project_excel_path, central=False)
+            self._write_workbook(self.central_excel_path, central=True)
+            self._dirty = False
+            self._last_flush = time.monotonic()
+            self.flush_count += 1
+            log.info(f"Excel报告已写入（第 {self.flush_count} 次，耗时 {self._last_flush - started:.2f}s）")
+
+    def _anchor(self, anchor_key, default):
+        return self.layout_map.get(_ANCHOR_ALIASES.get(anchor_key, anchor_key), default)
+
+    def _write_workbook(self, path, central):
+        if not central:
+            workbook = Workbook()
+            workbook.active.title = RESULTS_SHEET
+            self._write_results_sheet(workbook.active, central=False)
+            self._save_atomic(workbook, path)
+            return
+
+        if os.path.exists(path):
+            workbook = load_workbook(path)
+        else:
+            workbook = Workbook()
+            workbook.active.title = SUMMARY_SHEET
+        self._write_summary_row(workbook)
+        title = _sheet_title(self.project_name)
+        if title in workbook.sheetnames:
+            del workbook[title]
+        self._write_results_sheet(workbook.create_sheet(title), central=True)
+        self._save_atomic(workbook, path)
+
+    def _write_results_sheet(self, sheet, central):
+        sheet["A1"] = "项目名称"
+        sheet["B1"] = self.project_name
+        sheet["A2"] = "更新时间"
+        sheet["B2"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        row = 3
+        for key, value in self.summary.items():
+            sheet.cell(row=row, column=1, value=key)
+            sheet.cell(row=row, column=2, value=str(value))
+            row += 1
+
+        row += 1
+        for column, header in enumerate(("序号", "电压 (V)", "输出位置", "电荷 (C) / 状态"), 1):
+            sheet.cell(row=row, column=column, value=header)
+        for index in sorted(self.it_rows):
+            entry = self.it_rows[index]
+            row += 1
+            sheet.cell(row=row, column=1, value=index + 1)
+            sheet.cell(row=row, column=2, value=entry.get("voltage"))
+            sheet.cell(row=row, column=3, value=entry.get("output_pos"))
+            sheet.cell(row=row, column=4, value=entry.get("result"))
+
+        for tag, plot in self.main_plots.items():
+            anchor_key = plot["central_anchor"] if central else plot["project_anchor"]
+            self._place_image(sheet, plot["path"], self._anchor(anchor_key, "H2"), tag, central)
+
+        gallery = self.galleries.get("central" if central else "project")
+        if gallery:
+            anchor_key, plots = gallery
+            start = self._anchor(anchor_key, "H20" if central else "E30")
+            for position, info in enumerate(plots):
+                if central:
+                    cell = _offset_cell(start, rows=position)
+                else:
+                    cell = _offset_cell(start,
+                                        rows=(position // GALLERY_COLUMNS) * GALLERY_ROW_SPAN,
+                                        cols=(position % GALLERY_COLUMNS) * GALLERY_COL_SPAN)
+                self._place_image(sheet, info.get('path'), cell, f"i-t {info.get('voltage')}V", central)
+
+    def _write_summary_row(self, workbook):
+        sheet = workbook[SUMMARY_SHEET] if SUMMARY_SHEET in workbook.sheetnames else workbook.create_sheet(SUMMARY_SHEET, 0)
+        headers = ["项目名称", "更新时间", "电压点数", "已完成"] + list(self.summary.keys())
+        existing = [cell.value for cell in sheet[1]] if sheet.max_row >= 1 else []
+        existing = [value for value in existing if value is not None]
+        for header in headers:
+            if header not in existing:
+                existing.append(header)
+        for column, header in enumerate(existing, 1):
+            sheet.cell(row=1, column=column, value=header)
+
+        values = {
+            "项目名称": self.project_name,
+            "更新时间": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "电压点数": len(self.it_rows),
+            "已完成": sum(1 for entry in self.it_rows.values() if entry.get("result") not in ("", None)),
+        }
+        values.update({key: str(value) for key, value in self.summary.items()})
+
+        target_row = sheet.max_row + 1
+        for row in range(2, sheet.max_row + 1):
+            if sheet.cell(row=row, column=1).value == self.project_name:
+                target_row = row
+                break
+        for column, header in enumerate(existing, 1):
+            if header in values:
+                sheet.cell(row=target_row, column=column, value=values[header])
+
+    def _place_image(self, sheet, path, anchor, label, as_link):
+        if not path or not os.path.exists(path):
+            return
+        if as_link:
+            sheet[anchor] = label
+            sheet[anchor].hyperlink = path
+            return
+        try:
+            from openpyxl.drawing.image import Image
+            image = Image(path)
+            image.width, image.height = IMAGE_SIZE
+            sheet.add_image(image, anchor)
+        except Exception as e:
+            # 缺少 Pillow 等情况下只写入文件名
+            log.warning(f"插入图像 {label} 失败，改为写入路径: {e}")
+            sheet[anchor] = f"{label}: {path}"
+
+    @staticmethod
+    def _save_atomic(workbook, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.xlsx.tmp')
+        os.close(fd)
+        try:
+            workbook.save(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -1,30 +1,52 @@
 import os
-import time
 import json
+import asyncio
+import argparse
+import threading
 import logging
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt # 仍然需要matplotlib来生成图表文件
+from typing import TYPE_CHECKING
 
 # 导入你的模块
 from core_api.pump_proxy import PumpProxy # 假设路径正确
-from core_api.relay_proxy import RelayProxy # 假设路径正确
+from core_api.relay_proxy import RelayProxy, _parse_state as _parse_relay_state # 假设路径正确
+from core_api.choreography import ValveSequence, run_sequence
+from core_api.control_core import AbortToken, Aborted
+from core_api.pump_progress import PumpProgressTracker
 from device_control.control_printer import PrinterControl # 假设路径正确
-from device_control.control_chi import Setup as CHI_Setup, CV, LSV, EIS, IT, OCP, CA, run_sequence as chi_run_sequence, stop_all as chi_stop_all # 假设路径正确
-from utils.excel_reporting import ExcelReporter # 假设路径正确
+from device_control.grid_model import GridModel
+from device_control.control_chi import Setup as CHI_Setup, TECHNIQUE_CLASSES as CHI_TECHNIQUE_CLASSES, run_sequence as chi_run_sequence, stop_all as chi_stop_all # 假设路径正确
+from old.excel_report import BufferedExcelReport
 from utils.util_addr import normalize as normalize_moonraker_addr # 假设路径正确
+from old.step_templates import TemplateCompiler
+from old.step_scheduler import ParallelStepExecutor, build_step_graph
+from old.step_journal import StepJournal, config_hash, load_journal
+from old.report_pool import ReportPool, calculate_charge, parse_electrochemical_file
+
+try:
+    from core_api.moonraker_listener import MoonrakerWebsocketListener
+except ImportError:
+    MoonrakerWebsocketListener = None   # 未安装 websockets：泵完成按估算时长等待
+
+if TYPE_CHECKING:
+    import pandas as pd  # 仅用于类型注解，运行时由 report_pool 在解析数据时导入
 
 # --- 日志配置 ---
 log = logging.getLogger(__name__)
 # (在主程序入口处配置日志基础设置)
 
+PUMP_WAIT_FACTOR = 2.0      # 等待泵停止的超时 = 估算时长 × PUMP_WAIT_FACTOR + PUMP_WAIT_MARGIN
+PUMP_WAIT_MARGIN = 10.0
+
 class ExperimentController:
-    def __init__(self, config_file_path: str):
+    def __init__(self, config_file_path: str, resume: bool = False):
         """
         初始化实验控制器。
         :param config_file_path: JSON配置文件的路径。
+        :param resume: 是否从实验日志中断处继续（跳过已完成的步骤）。
         """
         self.config_file_path = config_file_path
+        self.resume = resume
         self.config = self._load_config()
         self._configure_logging()
 
@@ -37,6 +59,9 @@ class ExperimentController:
         os.makedirs(self.project_path, exist_ok=True)
         log.info(f"项目路径: {self.project_path}")
 
+        # 中止信号：所有等待阻塞在它上面，abort() 或打印机急停（ESC）后立即返回
+        self.abort_token = AbortToken("experiment")
+
         # --- Moonraker 和设备代理初始化 ---
         try:
             moonraker_addr = self.config['moonraker_addr']
@@ -44,8 +69,24 @@ class ExperimentController:
             self.moonraker_base_url = base_url
             log.info(f"Moonraker 服务地址: {self.moonraker_base_url}")
 
-            self.printer = PrinterControl(ip=host) # PrinterControl只需要IP
-            self.pump_proxy = PumpProxy(self.moonraker_base_url)
+            # 网格坐标表：启动时从配置加载一次，之后按编号或标签（A1-E10）查表
+            self.grid_model = GridModel.from_config(self.config.get('grid_model'))
+            log.info(f"网格模型: {self.grid_model!r}")
+            # WebSocket 监听器和异步泵代理运行在后台线程的事件循环中，步骤线程通过 _run_device 调用
+            self._device_loop = asyncio.new_event_loop()
+            threading.Thread(target=self._device_loop.run_forever, name="device-loop", daemon=True).start()
+            self.listener = None
+            if MoonrakerWebsocketListener is not None:
+                self.listener = MoonrakerWebsocketListener(f"ws://{host}:{port}/websocket")
+                asyncio.run_coroutine_threadsafe(self.listener.start(), self._device_loop)
+            else:
+                log.warning("未安装 websockets，泵完成检测将按估算时长等待。")
+            self.pump_tracker = PumpProgressTracker(self.listener)
+            self._run_device(self.pump_tracker.subscribe())
+
+            self.printer = PrinterControl(ip=host, grid_model=self.grid_model, status_listener=self.listener)
+            self.printer.abort_token.on_abort(self.abort_token.abort)
+            self.pump_proxy = PumpProxy(self.moonraker_base_url, listener=self.listener)
             self.relay_proxy = RelayProxy(self.moonraker_base_url)
 
             log.info("尝试连接到 Klipper/Moonraker...")
@@ -102,6 +143,11 @@ class ExperimentController:
         self.configurations['voltages_calculated'] = self.voltages.tolist()
         self.configurations['output_positions_calculated'] = self.output_positions
 
+        # --- 预编译步骤参数模板 ---
+        self.templates = TemplateCompiler(self.config, self.configurations)
+        template_count = self.templates.precompile([self.config.get('experiment_sequence', []), self.config.get('sub_sequences', {})])
+        log.info(f"已预编译 {template_count} 个参数模板")
+
         # --- ExcelReporter 初始化 ---
         self.excel_project_path = os.path.join(self.project_path, f'{self.project_name}_results.xlsx')
         self.excel_central_path = os.path.join(self.base_path, 'ALL_Experiments_Summary.xlsx') # 统一文件名
@@ -118,13 +164,15 @@ class ExperimentController:
                 'central_it_gallery_start': self.excel_report_anchors.get('central_it_gallery_start', 'H20')
             }
             
-            self.reporter = ExcelReporter(
+            # 报告先缓存在内存中，按间隔或在运行结束时统一写入工作簿
+            self.reporter = BufferedExcelReport(
                 project_name=self.project_name,
                 project_excel_path=self.excel_project_path,
                 central_excel_path=self.excel_central_path,
-                voltages_list=self.voltages.tolist(), # ExcelReporter需要列表
-                positions_list=[str(p) for p in self.output_positions], # ExcelReporter需要字符串列表
-                layout_map=layout_map  # 添加layout_map参数
+                voltages_list=self.voltages.tolist(),
+                positions_list=[str(p) for p in self.output_positions],
+                layout_map=layout_map,
+                flush_interval=self.config.get('report_flush_interval', 0)
             )
             log.info("ExcelReporter 初始化成功。")
         except Exception as e_reporter:
@@ -133,7 +181,15 @@ class ExperimentController:
             log.warning("Excel报告模块初始化失败，报告功能可能不可用。")
 
         self.it_plot_info_list = [] # 用于收集IT图信息给ExcelReporter的图库功能
-        self.grid_positions_cache = {} # 用于缓存打印机网格位置的实际XYZ坐标
+        self.report_pool = ReportPool(
+            max_workers=self.config.get('report_workers', 2),
+            max_pending=self.config.get('report_queue_size', 8)
+        ) # 绘图进程池与报告写入线程
+
+        # --- 实验日志（断点续跑） ---
+        self.journal_path = os.path.join(self.project_path, f'{self.project_name}_journal.jsonl')
+        self.journal = None
+        self._step_outputs = threading.local() # 当前线程正在执行的步骤产出
 
         log.info("实验控制器初始化完毕。")
 
@@ -162,88 +218,13 @@ class ExperimentController:
         解析字符串中的模板占位符。
         支持 {{variable}}, {{config.key}}, {{configurations.key}}, {{voltages_calculated[i]}} 等。
         如果模板字符串本身就是一个占位符且解析结果不是字符串（例如数字或列表），则返回原始类型。
+        模板在首次使用（或配置加载时）编译并缓存，求值只与占位符数量有关。
         """
-        if not isinstance(template_string, str):
-            return template_string # 如果不是字符串，直接返回
-
-        original_template = template_string
-        
-        # 简单检查是否整个字符串就是一个占位符
-        is_single_placeholder = template_string.startswith("{{") and template_string.endswith("}}") and template_string.count("{{") == 1
-
-        # 替换 {{config.xxx}} 或 {{configurations.xxx}}
-        for config_key_prefix in ["config.", "configurations."]:
-            start_idx = 0
-            while True:
-                match_start = template_string.find("{{" + config_key_prefix, start_idx)
-                if match_start == -1:
-                    break
-                match_end = template_string.find("}}", match_start)
-                if match_end == -1:
-                    break
-                
-                full_placeholder = template_string[match_start : match_end+2]
-                key_path_str = template_string[match_start+2+len(config_key_prefix) : match_end]
-                
-                # 支持简单索引，如 key[0]
-                key_parts = key_path_str.split('[')
-                actual_key = key_parts[0]
-                index = None
-                if len(key_parts) > 1 and key_parts[1].endswith(']'):
-                    try:
-                        index = int(key_parts[1][:-1])
-                    except ValueError:
-                        log.warning(f"模板解析：无法解析索引 '{key_parts[1][:-1]}' 在 '{full_placeholder}'")
-                        start_idx = match_end + 2
-                        continue
-                
-                value = self.configurations.get(actual_key)
-                if value is not None and index is not None:
-                    if isinstance(value, list) and 0 <= index < len(value):
-                        value = value[index]
-                    else:
-                        log.warning(f"模板解析：索引 {index} 超出范围或值不是列表，对于键 '{actual_key}' 在 '{full_placeholder}'")
-                        value = full_placeholder # 无法解析，保留原样
-                elif value is None:
-                     log.warning(f"模板解析：在configurations中未找到键 '{actual_key}' 对于 '{full_placeholder}'")
-                     value = full_placeholder # 无法解析，保留原样
-                
-                if is_single_placeholder and full_placeholder == original_template:
-                    return value # 如果是单个占位符，且解析成功，返回原始类型
-                template_string = template_string.replace(full_placeholder, str(value))
-                start_idx = match_start + len(str(value)) # 更新搜索起始位置
-        
-        # 替换上下文变量 {{variable}}
-        for key, value in context.items():
-            placeholder = f"{{{{{key}}}}}"
-            if placeholder == original_template and is_single_placeholder:
-                 return value # 单个占位符，返回原始类型
-            template_string = template_string.replace(placeholder, str(value))
-            
-        # 替换顶层配置 {{project_name}}, {{base_path}}等
-        for key in ["project_name", "base_path", "moonraker_addr"]: # 可扩展
-            placeholder = f"{{{{{key}}}}}"
-            if placeholder == original_template and is_single_placeholder:
-                return self.config.get(key, placeholder)
-            template_string = template_string.replace(placeholder, str(self.config.get(key, placeholder)))
-
-        return template_string
+        return self.templates.resolve(template_string, context)
 
     def _parse_params(self, params_config: dict, context: dict) -> dict:
-        """解析步骤参数对象，对所有字符串值应用模板解析。"""
-        if params_config is None:
-            return {}
-        parsed_params = {}
-        for key, value in params_config.items():
-            if isinstance(value, str):
-                parsed_params[key] = self._resolve_template(value, context)
-            elif isinstance(value, dict):
-                parsed_params[key] = self._parse_params(value, context) # 递归解析嵌套字典
-            elif isinstance(value, list):
-                parsed_params[key] = [self._resolve_template(item, context) if isinstance(item, str) else item for item in value]
-            else:
-                parsed_params[key] = value
-        return parsed_params
+        """解析步骤参数对象，对所有字符串值应用模板解析。每次返回新的字典。"""
+        return self.templates.parse_params(params_config, context)
 
     # --- 设备控制的封装方法 (与之前版本类似，但参数从JSON获取) ---
     def _wait_and_log(self, step_params: dict, context: dict):
@@ -256,8 +237,58 @@ class ExperimentController:
 
         message = step_params.get('message', "等待中...")
         log.info(f"{self._resolve_template(message, context)} 等待 {wait_duration:.1f} 秒...")
-        time.sleep(wait_duration)
-        return True
+        return self._pause(wait_duration)
+
+    def _run_device(self, coroutine, timeout=None):
+        """在设备事件循环中执行协程并等待结果（步骤线程中调用）"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._device_loop).result(timeout)
+
+    def _close_device_loop(self):
+        """停止 WebSocket 监听器和设备事件循环"""
+        loop = getattr(self, '_device_loop', None)
+        if loop is None or loop.is_closed():
+            return
+        if self.listener is not None:
+            try:
+                self._run_device(self.listener.stop(), timeout=5.0)
+            except Exception as e:
+                log.warning(f"停止WebSocket监听器失败: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+    def _settle(self, wait_key: str) -> bool:
+        """可选的稳定时间（default_wait_times 中配置，默认 0）
+
+        PrinterControl 的移动和归位已阻塞到设备报告完成，这里不再固定等待。
+        """
+        wait_time = float(self.default_wait_times.get(wait_key, 0.0))
+        if wait_time <= 0:
+            return True
+        log.info(f"等待 {wait_time} 秒稳定时间 ({wait_key})...")
+        return self._pause(wait_time)
+
+    def _pause(self, seconds: float) -> bool:
+        """在中止信号上等待（不轮询）；实验被中止时立即返回 False"""
+        if self.abort_token.wait(seconds):
+            return True
+        log.warning(f"等待被中止: {self.abort_token.reason}")
+        return False
+
+    def abort(self, reason: str = "用户中止", emergency: bool = False):
+        """中止实验：正在进行的等待立即返回，后续步骤不再执行
+
+        :param reason: 中止原因（记录到日志）
+        :param emergency: 是否同时紧急停止打印机并结束CHI进程
+        """
+        self.abort_token.abort(reason)
+        if emergency:
+            try:
+                self.printer.emergency_stop()
+            except Exception as e:
+                log.error(f"打印机紧急停止失败: {e}")
+            try:
+                chi_stop_all()
+            except Exception as e:
+                log.error(f"停止CHI进程失败: {e}")
 
     def _log_message(self, step_params: dict, context: dict):
         """记录自定义日志消息"""
@@ -276,7 +307,7 @@ class ExperimentController:
         return True
 
     def _verify_printer_position(self, expected_x=None, expected_y=None, expected_z=None, grid_position_num=None):
-        """验证打印机当前位置，如果网格位置未缓存，则不进行精确XY验证"""
+        """验证打印机当前位置；提供网格号时以网格模型中的坐标为预期值"""
         current_pos_tuple = self.printer.get_current_position()
         if current_pos_tuple is None:
             log.warning("无法获取打印机当前位置进行验证。")
@@ -287,19 +318,11 @@ class ExperimentController:
         target_x, target_y, target_z = expected_x, expected_y, expected_z
 
         if grid_position_num is not None:
-            if grid_position_num in self.grid_positions_cache:
-                cached_x, cached_y, cached_z = self.grid_positions_cache[grid_position_num]
-                target_x, target_y = cached_x, cached_y
-                # Z轴通常是固定的，除非特别指定
-                if target_z is None : target_z = cached_z if cached_z is not None else self.printer.grid_min_pos[2] # 假设PrinterControl有grid_min_pos
-                log.debug(f"网格 {grid_position_num} 缓存目标: (X:{target_x:.2f}, Y:{target_y:.2f}, Z:{target_z:.2f})")
-            else:
-                # 如果网格位置不在缓存中，我们无法验证XY。只验证Z（如果提供）。
-                log.warning(f"网格 {grid_position_num} 不在缓存中。仅验证Z轴（如果提供）。")
-                if target_z is not None and abs(current_z - target_z) > self.position_tolerance:
-                    log.error(f"Z轴位置错误: 当前 {current_z:.2f}, 预期 {target_z:.2f}")
-                    return False
-                return True # 无法验证XY，但Z通过或未提供Z
+            model_x, model_y, model_z = self.grid_model.coordinates(grid_position_num)
+            target_x, target_y = model_x, model_y
+            if target_z is None:
+                target_z = model_z
+            log.debug(f"网格 {grid_position_num} 目标: (X:{target_x:.2f}, Y:{target_y:.2f}, Z:{target_z:.2f})")
 
         position_ok = True
         if target_x is not None and abs(current_x - target_x) > self.position_tolerance:
@@ -385,9 +408,8 @@ class ExperimentController:
             log.error(f"打印机移动到 {description} 失败 (命令发送层面)。")
             return False
         
-        wait_time = self.default_wait_times.get('after_printer_move', 2.0)
-        log.info(f"移动命令已发送，等待 {wait_time} 秒稳定时间...")
-        time.sleep(wait_time)
+        if not self._settle('after_printer_move'):
+            return False
 
         if self._verify_printer_position(expected_x=x, expected_y=y, expected_z=z):
             log.info(f"打印机成功移动到 {description}.")
@@ -400,17 +422,12 @@ class ExperimentController:
         """移动打印机到指定网格位置"""
         # 获取网格位置参数
         if 'grid_num' in step_params:
-            # 网格号直接提供
+            # 网格号直接提供（编号、数字字符串或标签如 "B3"）
             try:
-                grid_num = int(step_params['grid_num'])
-            except ValueError:
-                # 可能是一个模板字符串，已解析但仍为字符串
-                grid_num_str = str(step_params['grid_num'])
-                try:
-                    grid_num = int(float(grid_num_str))
-                except ValueError:
-                    log.error(f"无法将提供的网格号 '{grid_num_str}' 转换为整数")
-                    return False
+                grid_num = self.grid_model.number(step_params['grid_num'])
+            except ValueError as e:
+                log.error(f"无法解析提供的网格号 '{step_params['grid_num']}': {e}")
+                return False
         elif 'grid_num_key' in step_params:
             # 从配置中获取网格号
             grid_num_key = step_params['grid_num_key']
@@ -428,9 +445,9 @@ class ExperimentController:
                 grid_val = self.configurations.get(grid_num_key)
                 if grid_val is not None:
                     try:
-                        grid_num = int(float(str(grid_val)))
+                        grid_num = self.grid_model.number(grid_val)
                     except ValueError:
-                        log.error(f"配置键 '{grid_num_key}' 的值 '{grid_val}' 无法转换为整数")
+                        log.error(f"配置键 '{grid_num_key}' 的值 '{grid_val}' 不是有效的网格号")
                         return False
                 else:
                     log.error(f"配置中未找到键 '{grid_num_key}'")
@@ -440,28 +457,22 @@ class ExperimentController:
             return False
             
         description_suffix = self._resolve_template(step_params.get('description_suffix', ''), context)
-        description = f"网格 {grid_num}{description_suffix}"
+        description = f"网格 {grid_num} ({self.grid_model.label(grid_num)}){description_suffix}"
 
         log.info(f"打印机移动: {description}")
         if not self.printer.move_to_grid_position(grid_num): # 假设 PrinterControl.move_to_grid_position 返回 bool
             log.error(f"打印机移动到 {description} 失败 (命令发送层面)。")
             return False
 
-        wait_time = self.default_wait_times.get('after_printer_move', 2.0)
-        log.info(f"移动命令已发送，等待 {wait_time} 秒稳定时间...")
-        time.sleep(wait_time)
-        
-        # 获取移动后的实际位置并缓存
-        current_pos = self.printer.get_current_position()
-        if current_pos:
-            # 假设网格移动主要关心XY，Z轴由打印机逻辑或后续步骤调整
-            self.grid_positions_cache[grid_num] = (current_pos[0], current_pos[1], current_pos[2])
-            log.debug(f"网格 {grid_num} 坐标已缓存: (X:{current_pos[0]:.2f}, Y:{current_pos[1]:.2f}, Z:{current_pos[2]:.2f})")
-        else:
-            log.warning(f"移动到网格 {grid_num} 后无法获取当前位置以缓存。")
+        if not self._settle('after_printer_move'):
+            return False
+
+        # 网格模型已实测校准（trusted）时跳过位置回读验证
+        if self.grid_model.trusted:
+            log.info(f"打印机已移动到 {description}（网格模型已校准，跳过位置验证）.")
+            return True
 
-        # 验证位置，PrinterControl.move_to_grid_position 内部可能已经有验证
-        # 此处的验证依赖于缓存或对打印机网格逻辑的了解
+        # 以网格模型中的坐标为预期值验证位置
         if self._verify_printer_position(grid_position_num=grid_num):
             log.info(f"打印机成功移动到 {description}.")
             return True
@@ -476,21 +487,18 @@ class ExperimentController:
             log.error("打印机归位失败 (命令发送层面)。")
             return False
 
-        wait_time = self.default_wait_times.get('after_printer_home', self.default_wait_times.get('after_printer_move', 10.0))
-        log.info(f"归位命令已发送，等待 {wait_time} 秒稳定时间...")
-        time.sleep(wait_time)
+        if not self._settle('after_printer_home'):
+            return False
 
         # 归位后的Z轴位置可能不是0，取决于你的打印机配置
         # 0.46 是 experiment_easy.py 中的值，这里作为示例
         expected_z_after_home = float(self.configurations.get("home_z_expected", 0.46))
         if self._verify_printer_position(expected_x=0, expected_y=0, expected_z=expected_z_after_home):
             log.info("打印机归位成功.")
-            self.grid_positions_cache.clear() # 归位后清除网格缓存
             return True
         else:
             # 归位验证失败通常不是致命的，打印一个警告
             log.warning(f"打印机归位后位置验证未完全通过 (Z={expected_z_after_home} vs actual). 可能仍可继续。")
-            self.grid_positions_cache.clear()
             return True # 或者 False，取决于严格程度
 
     def _control_pump_operation(self, step_params: dict, context: dict):
@@ -604,66 +612,48 @@ class ExperimentController:
                  (f" (速度: {speed_rpm} RPM)" if speed_rpm else " (自动速度)"))
 
         # 执行泵操作
-        try:            
-            kw = {'P': port, 'U': unit_id, 'D': direction}
-
-            # 根据是否有速度参数选择不同的方法
+        try:
+            # 泵服务只接受方向参数，P/U 由 Klipper 中的泵配置决定
+            self.pump_tracker.begin(None)  # 在发送命令前记录宏变量中上一次泵送的圈数
             if speed_rpm is not None:
-                response = self.pump_proxy.dispense_speed(volume_ml, speed_rpm, **kw)
+                response = self._run_device(self.pump_proxy.dispense_speed(volume_ml, speed_rpm, direction=direction))
             else:
-                response = self.pump_proxy.dispense_auto(volume_ml, **kw)
+                response = self._run_device(self.pump_proxy.dispense_auto(volume_ml, direction=direction))
 
-            # 检查响应
-            if isinstance(response, dict) and response.get("result") == "ok":
-                # 更精确地估算泵送时间
-                # 假设泵有一个基本速率，例如每毫升约需2秒
-                # 较大体积的液体（如清洗）可以稍微优化等待时间
-                base_time_per_ml = 2.0
-                if volume_ml > 10.0:  # 大体积液体
-                    base_time_per_ml = 1.5
-                elif volume_ml < 2.0:  # 小体积液体可能需要更多时间
-                    base_time_per_ml = 2.5
-                
-                # 如果提供了速度，也可以考虑其影响
-                speed_factor = 1.0
-                if speed_rpm is not None:
-                    # 假设标准速度大约是60 RPM，据此调整
-                    standard_speed = 60.0
-                    speed_factor = standard_speed / speed_rpm
-                    # 限制速度因子的范围，避免极端值
-                    speed_factor = max(0.5, min(speed_factor, 2.0))
-                
-                # 计算估计时间，加上基本启动时间
-                est_time = base_time_per_ml * volume_ml * speed_factor + 2.0
-                # 确保至少有配置的最小等待时间
-                est_time = max(est_time, self.default_wait_times.get('after_pump', 5.0))
-                
-                log.info(f"泵命令已发送，预计需要 {est_time:.1f} 秒完成...")
-                
-                # 等待泵操作完成
-                wait_msg = f"等待泵完成{direction_desc}液体"
-                self._wait_and_log({"message": wait_msg, "seconds": est_time}, context)
-                
-                log.info(f"完成{direction_desc} {volume_ml} mL 液体")
-                return True
-            else:
+            if not (isinstance(response, dict) and response.get("success")):
                 log.error(f"泵操作失败。响应: {response}")
                 return False
-                
+
+            self.pump_tracker.target_revolutions = response.get("revolutions")
+            est_time = response.get("estimated_duration") or 0.0
+            log.info(f"泵命令已发送（参数来源: {response.get('source')}），预计需要 {est_time:.1f} 秒完成...")
+
+            if self.pump_tracker.available:
+                # 泵状态宏可用：泵一停止就继续，估算时长只用于超时
+                timeout = est_time * PUMP_WAIT_FACTOR + PUMP_WAIT_MARGIN
+                try:
+                    stopped = self._run_device(self.abort_token.wait_for(self.pump_tracker.wait_until_stopped(timeout)))
+                except Aborted:
+                    log.warning(f"等待泵{direction_desc}时实验被中止: {self.abort_token.reason}")
+                    return False
+                if not stopped:
+                    log.error(f"泵在 {timeout:.1f} 秒内未报告停止，{direction_desc}可能未完成。")
+                    return False
+            else:
+                # 未订阅到泵状态宏：按估算时长等待
+                log.info(f"泵状态不可用，按估算时长等待 {est_time:.1f} 秒")
+                if not self._pause(est_time):
+                    return False
+
+            log.info(f"完成{direction_desc} {volume_ml} mL 液体")
+            return True
+
         except Exception as e:
             log.error(f"泵操作通信错误或执行错误: {e}", exc_info=True)
             return False
 
-    def _set_valve_state(self, step_params: dict, context: dict):
-        """
-        设置电磁阀状态
-        
-        阀门状态约定（根据实际硬件行为）:
-        - open_to_reservoir=true时，valve_state="ON"：打开阀门到储液瓶通路（适用于泵入液体模式，D=1）
-        - open_to_reservoir=false时，valve_state="OFF"：打开阀门到废液区/取样区通路（适用于移出液体模式，D=0）
-        """
-        open_to_reservoir = bool(step_params['open_to_reservoir'])
-        
+    def _resolve_relay_id(self, step_params: dict, context: dict):
+        """从 relay_id / relay_id_key / 默认 valve_klipper_relay_id 解析继电器ID，失败时返回 None"""
         # 处理relay_id参数
         if 'relay_id' in step_params:
             # 直接提供了relay_id
@@ -671,7 +661,7 @@ class ExperimentController:
                 relay_id = int(step_params['relay_id'])
             except ValueError:
                 log.error(f"无法将relay_id '{step_params['relay_id']}' 转换为整数")
-                return False
+                return None
         elif 'relay_id_key' in step_params:
             # 需要从配置中获取relay_id
             relay_id_key = step_params['relay_id_key']
@@ -681,7 +671,7 @@ class ExperimentController:
                 relay_id = self.config.get('valve_klipper_relay_id')
                 if relay_id is None:
                     log.error("配置中未找到valve_klipper_relay_id")
-                    return False
+                    return None
             # 特殊处理内联模板标记
             elif relay_id_key.startswith('{{') and relay_id_key.endswith('}}'):
                 varname = relay_id_key[2:-2].strip()
@@ -694,25 +684,40 @@ class ExperimentController:
                     
                 if relay_id is None:
                     log.error(f"从上下文或配置中无法获取继电器ID变量 '{varname}'")
-                    return False
+                    return None
             else:
                 # 直接从配置获取值
                 relay_id = self.configurations.get(relay_id_key)
                 if relay_id is None:
                     log.error(f"配置中未找到继电器ID键 '{relay_id_key}'")
-                    return False
+                    return None
                     
             try:
                 relay_id = int(relay_id)
             except ValueError:
                 log.error(f"无法将继电器ID值 '{relay_id}' 转换为整数")
-                return False
+                return None
         else:
             # 使用默认值
             relay_id = self.config.get('valve_klipper_relay_id')
             if relay_id is None:
                 log.error("未提供relay_id或relay_id_key，且配置中没有默认的valve_klipper_relay_id")
-                return False
+                return None
+        return relay_id
+
+    def _set_valve_state(self, step_params: dict, context: dict):
+        """
+        设置电磁阀状态
+        
+        阀门状态约定（根据实际硬件行为）:
+        - open_to_reservoir=true时，valve_state="ON"：打开阀门到储液瓶通路（适用于泵入液体模式，D=1）
+        - open_to_reservoir=false时，valve_state="OFF"：打开阀门到废液区/取样区通路（适用于移出液体模式，D=0）
+        """
+        open_to_reservoir = bool(step_params['open_to_reservoir'])
+        
+        relay_id = self._resolve_relay_id(step_params, context)
+        if relay_id is None:
+            return False
                 
         # 阀门控制状态，与open_to_reservoir状态保持一致
         # 使阀门状态与泵方向一致:
@@ -746,9 +751,7 @@ class ExperimentController:
                 # 等待阀门切换完成
                 wait_time = self.default_wait_times.get('after_relay', 1.5)
                 log.info(f"等待阀门切换完成 ({flow_desc}) 等待 {wait_time} 秒...")
-                time.sleep(wait_time)
-                
-                return True
+                return self._pause(wait_time)
             else:
                 log.error(f"电磁阀切换失败: {response}")
                 return False
@@ -756,6 +759,51 @@ class ExperimentController:
             log.error(f"电磁阀通信错误或执行错误: {e}")
             return False
 
+    def _execute_valve_sequence(self, step_params: dict, context: dict):
+        """
+        执行定时阀门/泵动作序列：编译为带 G4 停顿的单个G-code脚本，一次请求发送，
+        动作间隔由 Klipper 控制，不再逐个切换继电器后在 Python 中等待 after_relay。
+
+        step_params:
+            events: [{"at": 0, "relay_id_key": "valve_klipper_relay_id", "state": "on"},
+                     {"at": 0.25, "pump": {"volume_ml": 2.0, "speed_rpm": 60, "direction": 1}},
+                     {"at": 5.0, "relay_id": 1, "state": "off"}]
+            wait_after: 序列执行完后的额外等待时间（秒），默认 0
+        """
+        events = []
+        for event in step_params.get('events', []):
+            event = self._parse_params(event, context)   # 列表中的字典不会被 _dispatch_step 解析
+            if 'pump' not in event and 'gcode' not in event:
+                relay_id = self._resolve_relay_id(event, context)
+                if relay_id is None:
+                    return False
+                event['relay_id'] = relay_id
+            events.append(event)
+
+        try:
+            sequence = ValveSequence.from_events(events)
+            log.info(f"阀门序列: {len(sequence.events)} 个动作，时长 {sequence.duration:.3f} 秒")
+            for event in sequence.describe():
+                log.info(f"  t+{event['at']:.3f}s {event['label']}")
+            result = run_sequence(self.relay_proxy, sequence)
+        except (ValueError, KeyError) as e:
+            log.error(f"阀门序列配置无效: {e}")
+            return False
+        except Exception as e:
+            log.error(f"阀门序列通信错误或执行错误: {e}")
+            return False
+
+        response = result['response']
+        if not (isinstance(response, dict) and response.get("result") == "ok"):
+            log.error(f"阀门序列执行失败: {response}")
+            return False
+        log.info("阀门序列执行完成。")
+
+        wait_after = float(step_params.get('wait_after', 0.0))
+        if wait_after > 0:
+            return self._wait_and_log({"message": "阀门序列完成后等待", "seconds": wait_after}, context)
+        return True
+
     def _execute_chi_measurement(self, step_config: dict, context: dict):
         """执行单个CHI电化学测试"""
         chi_method_name = step_config['chi_method']
@@ -770,20 +818,9 @@ class ExperimentController:
 
         log.info(f"执行CHI测试: {chi_method_name}, 参数: {parsed_chi_params}")
 
-        # 获取CHI技术类 - 直接使用导入的类，而不是从globals()获取
-        if chi_method_name == "CV":
-            chi_class = CV
-        elif chi_method_name == "LSV":
-            chi_class = LSV
-        elif chi_method_name == "EIS":
-            chi_class = EIS
-        elif chi_method_name == "IT":
-            chi_class = IT
-        elif chi_method_name == "OCP":
-            chi_class = OCP 
-        elif chi_method_name == "CA":
-            chi_class = CA
-        else:
+        # 获取CHI技术类（由技术注册表生成）
+        chi_class = CHI_TECHNIQUE_CLASSES.get(chi_method_name.upper())
+        if chi_class is None:
             log.error(f"未知的CHI方法: {chi_method_name}")
             return False
         
@@ -803,11 +840,13 @@ class ExperimentController:
             # 等待稳定
             stabilization_time = self.default_wait_times.get('chi_stabilization', 0)
             if stabilization_time > 0:
-                 self._wait_and_log({"message": "CHI测量前稳定", "seconds": stabilization_time}, context)
+                if not self._wait_and_log({"message": "CHI测量前稳定", "seconds": stabilization_time}, context):
+                    return False    # 实验已中止，不再启动恒电位仪
 
             # 运行CHI实验 (单个)
             chi_run_sequence([chi_experiment]) # run_sequence期望一个列表
             log.info(f"CHI测试 {chi_method_name} 完成。原始数据文件: {parsed_chi_params['fileName']}.txt") # control_chi会自动加.txt
+            self._note_output({"kind": "chi_data", "method": chi_method_name, "path": os.path.join(self.project_path, f"{parsed_chi_params['fileName']}.txt")})
 
             # 执行后置动作
             if 'actions_after' in step_config:
@@ -851,20 +890,9 @@ class ExperimentController:
 
             log.debug(f"  序列测试 {i+1}: {method_name}, 参数: {parsed_params}")
 
-            # 获取CHI技术类 - 直接使用导入的类，而不是从globals()获取
-            if method_name == "CV":
-                chi_class = CV
-            elif method_name == "LSV":
-                chi_class = LSV
-            elif method_name == "EIS":
-                chi_class = EIS
-            elif method_name == "IT":
-                chi_class = IT
-            elif method_name == "OCP":
-                chi_class = OCP 
-            elif method_name == "CA":
-                chi_class = CA
-            else:
+            # 获取CHI技术类（由技术注册表生成）
+            chi_class = CHI_TECHNIQUE_CLASSES.get(method_name.upper())
+            if chi_class is None:
                 log.error(f"  序列中未知的CHI方法: {method_name}")
                 return False # 中止整个序列
 
@@ -888,12 +916,17 @@ class ExperimentController:
         
         stabilization_time = self.default_wait_times.get('chi_stabilization', 0)
         if stabilization_time > 0:
-                self._wait_and_log({"message": "CHI序列测量前稳定", "seconds": stabilization_time}, context)
+            if not self._wait_and_log({"message": "CHI序列测量前稳定", "seconds": stabilization_time}, context):
+                return False    # 实验已中止，不再启动恒电位仪
 
-        # 运行整个CHI序列
+        # 运行整个CHI序列（默认合并为一个批处理宏，只启动一次CHI软件）
         try:
-            chi_run_sequence(chi_experiment_objects)
+            use_batch = step_config.get('batch', True)
+            batch_name = f"{self.project_name}_{step_config.get('id', 'CHI_SEQUENCE')}_BATCH"
+            chi_run_sequence(chi_experiment_objects, batch=use_batch, batch_name=batch_name)
             log.info("CHI测试序列全部完成。")
+            for detail in test_details_for_processing:
+                self._note_output({"kind": "chi_data", "method": detail["method"], "path": os.path.join(self.project_path, f"{detail['original_file_name_template']}.txt")})
             # 临时将测试详情放入上下文，供后续 process_chi_data 步骤使用（如果它们在序列的actions_after中）
             context['_last_chi_sequence_details'] = test_details_for_processing
         except Exception as e:
@@ -913,89 +946,13 @@ class ExperimentController:
             
         return True
 
-    def _parse_electrochemical_file(self, file_path: str) -> pd.DataFrame:
-        """解析电化学文件 (与之前版本一致)"""
-        log.debug(f"尝试解析电化学文件: {file_path}")
-        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
-            log.warning(f"电化学文件不存在或为空: {file_path}")
-            return pd.DataFrame()
-        try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
-            
-            data_start = -1
-            header_line_type = None # 'potential_current' or 'time_current'
-
-            for i, line in enumerate(lines):
-                line_lower = line.lower().strip()
-                if 'potential/v' in line_lower and 'current/a' in line_lower:
-                    data_start = i + 1
-                    header_line_type = 'potential_current'
-                    break
-                elif 'time/sec' in line_lower and 'current/a' in line_lower: # CHI的i-t曲线通常是Time/sec
-                    data_start = i + 1
-                    header_line_type = 'time_current'
-                    break
-            
-            if data_start == -1:
-                log.warning(f"在文件中未找到可识别的数据头: {file_path}")
-                return pd.DataFrame()
-
-            data_rows = []
-            for line_num, line_content in enumerate(lines[data_start:]):
-                clean_line = line_content.strip()
-                if not clean_line: continue # 跳过空行
-                
-                # 尝试用逗号分割，如果不行再尝试用制表符或多个空格
-                parts = [p.strip() for p in clean_line.split(',') if p.strip()]
-                if len(parts) < 2: # 尝试制表符
-                    parts = [p.strip() for p in clean_line.split('\t') if p.strip()]
-                if len(parts) < 2: # 尝试多个空格
-                    parts = [p.strip() for p in clean_line.split() if p.strip()]
-
-                if len(parts) >= 2:
-                    try:
-                        # 取前两列作为数据
-                        data_rows.append([float(parts[0]), float(parts[1])])
-                    except ValueError:
-                        log.debug(f"跳过无法解析为数字的行 {line_num + data_start} in {file_path}: '{line_content}'")
-            
-            if not data_rows:
-                log.warning(f"未从文件中解析到有效数据行: {file_path}")
-                return pd.DataFrame()
-
-            if header_line_type == 'time_current':
-                df = pd.DataFrame(data_rows, columns=['Time', 'Current'])
-            elif header_line_type == 'potential_current':
-                df = pd.DataFrame(data_rows, columns=['Potential', 'Current'])
-            else: # 不应该发生，但作为回退
-                df = pd.DataFrame() 
-            
-            log.debug(f"成功解析文件 {file_path}, 共 {len(df)} 行数据。列: {df.columns.tolist()}")
-            return df
-        except Exception as e:
-            log.error(f"解析电化学文件 {file_path} 失败: {e}", exc_info=True)
-            return pd.DataFrame()
-
-    def _calculate_charge(self, it_data: pd.DataFrame) -> float:
-        """计算IT曲线的电荷量 (与之前版本一致)"""
-        if not isinstance(it_data, pd.DataFrame) or it_data.empty or \
-           'Time' not in it_data.columns or 'Current' not in it_data.columns:
-            log.warning("IT数据无效或缺少必要列 ('Time', 'Current')，无法计算电荷。")
-            return 0.0
-        if len(it_data) < 2:
-            log.warning("IT数据点不足 (<2)，无法计算电荷。")
-            return 0.0
-        try:
-            # 确保数据按时间排序
-            it_data_sorted = it_data.sort_values('Time').reset_index(drop=True)
-            # 使用梯形法则计算积分（电荷）
-            charge = abs(np.trapz(it_data_sorted['Current'], it_data_sorted['Time']))
-            log.debug(f"计算得到电荷: {charge:.6f} C")
-            return charge
-        except Exception as e:
-            log.error(f"计算电荷时发生错误: {e}", exc_info=True)
-            return 0.0
+    def _parse_electrochemical_file(self, file_path: str) -> 'pd.DataFrame':
+        """解析电化学文件"""
+        return parse_electrochemical_file(file_path)
+
+    def _calculate_charge(self, it_data: 'pd.DataFrame') -> float:
+        """计算IT曲线的电荷量"""
+        return calculate_charge(it_data)
 
     def _process_chi_data(self, step_params: dict, context: dict):
         """通用CHI数据处理步骤"""
@@ -1055,61 +1012,63 @@ class ExperimentController:
                 voltage = float(context.get('current_voltage', 0))
                 output_pos = str(context.get('current_output_position', 'N/A'))
                 loop_idx = int(context.get('loop_index', -1))
-                self.reporter.record_it_result(voltage, "文件缺失", output_pos, loop_idx, None)
+                self.report_pool.submit(None, lambda _: self.reporter.record_it_result(voltage, "文件缺失", output_pos, loop_idx, None))
             return False # 标记此步骤失败
 
-        data_df = self._parse_electrochemical_file(chi_file_path)
-        if data_df.empty:
-            log.warning(f"{data_type} 数据解析为空或失败。")
-            if self.reporter and data_type == "IT":
-                voltage = float(context.get('current_voltage', 0))
-                output_pos = str(context.get('current_output_position', 'N/A'))
-                loop_idx = int(context.get('loop_index', -1))
-                self.reporter.record_it_result(voltage, "数据为空", output_pos, loop_idx, None)
-            return True # 解析为空不一定算失败，但没有图表
-
-        plot_path = None
         plot_filename_base = os.path.splitext(actual_raw_file_name)[0] # 去掉.txt
         plot_file_path = os.path.join(self.project_path, f"{plot_filename_base}_plot.png")
+        title_suffix = f" at {context['current_voltage']:.1f}V" if data_type == "IT" and 'current_voltage' in context else ""
+        job = {
+            "data_type": data_type,
+            "data_file": chi_file_path,
+            "plot_file": plot_file_path,
+            "title": f'{data_type.replace("_", " ")}{title_suffix}',
+        }
+        report_context = {
+            "voltage": float(context.get('current_voltage', 0)),
+            "output_pos": str(context.get('current_output_position', 'N/A')),
+            "loop_index": int(context.get('loop_index', -1)),
+        }
 
-        try:
-            plt.figure(figsize=(8, 5))
-            if data_type == "CV" or data_type == "CV_CDL" or data_type == "LSV":
-                if 'Potential' not in data_df.columns or 'Current' not in data_df.columns:
-                    log.error(f"{data_type} 数据缺少 Potential 或 Current 列。")
-                    plt.close()
-                    return True # 数据列不对，无法绘图
-                plt.plot(data_df['Potential'], data_df['Current'], 'b-', linewidth=1.5)
-                plt.xlabel('Potential (V)')
-            elif data_type == "IT":
-                if 'Time' not in data_df.columns or 'Current' not in data_df.columns:
-                    log.error(f"{data_type} 数据缺少 Time 或 Current 列。")
-                    plt.close()
-                    return True # 数据列不对，无法绘图
-                plt.plot(data_df['Time'], data_df['Current'], 'b-', linewidth=1.5)
-                plt.xlabel('Time (s)')
-            else:
-                log.warning(f"未知数据类型 {data_type} 的绘图逻辑。")
-                plt.close()
-                return True # 无法绘图
-
-            plt.ylabel('Current (A)')
-            title_suffix = f" at {context['current_voltage']:.1f}V" if data_type == "IT" and 'current_voltage' in context else ""
-            plt.title(f'{data_type.replace("_", " ")}{title_suffix}')
-            plt.grid(True)
-            plt.tight_layout()
-            plt.savefig(plot_file_path, dpi=300)
-            plt.close()
-            plot_path = plot_file_path # 标记图表已生成
-            log.info(f"{data_type} 图已保存: {plot_file_path}")
-        except Exception as e:
-            log.error(f"生成 {data_type} 图失败: {e}", exc_info=True)
-            plot_path = None
+        # 解析、绘图在进程池中完成，报告写入由写入线程按顺序执行，仪器流程不等待
+        self.report_pool.submit(job, lambda result: self._record_chi_result(data_type, job, report_context, result))
+        self._note_output({"kind": "plot", "data_type": data_type, "path": plot_file_path})
+        if data_type == "IT":
+            self._note_output({"kind": "it_plot", "voltage": report_context["voltage"], "path": plot_file_path, "index": report_context["loop_index"]})
+        log.info(f"{data_type} 数据处理已加入队列: {plot_file_path}")
+        return True
+
+    def _record_chi_result(self, data_type: str, job: dict, report_context: dict, result: dict):
+        """写入线程中调用：记入实验日志（续跑时重放），并根据绘图结果更新ExcelReporter"""
+        if self.journal:
+            self.journal.report(data_type, job["plot_file"], report_context, result)
+        self._apply_chi_result(data_type, job, report_context, result)
+
+    def _apply_chi_result(self, data_type: str, job: dict, report_context: dict, result: dict):
+        status = result["status"]
+        plot_path = result["plot_path"]
+        voltage = report_context["voltage"]
+        output_pos_str = report_context["output_pos"]
+        loop_idx = report_context["loop_index"]
+
+        if status == "empty":
+            log.warning(f"{data_type} 数据解析为空或失败: {job['data_file']}")
+            if self.reporter and data_type == "IT":
+                self.reporter.record_it_result(voltage, "数据为空", output_pos_str, loop_idx, None)
+            return
+        if status == "bad_columns":
+            log.error(f"{data_type} 数据缺少绘图所需的列: {job['data_file']}")
+            return
+        if status == "unsupported":
+            log.warning(f"未知数据类型 {data_type} 的绘图逻辑。")
+            return
+        if plot_path:
+            log.info(f"{data_type} 图已保存: {plot_path}")
 
         # --- 调用ExcelReporter记录 ---
         if not self.reporter:
             log.warning("ExcelReporter未初始化，跳过Excel记录。")
-            return True # 即使报告失败，数据处理本身可能算成功
+            return
 
         if data_type == "CV":
             # 使用record_main_plot方法记录CV结果
@@ -1136,10 +1095,7 @@ class ExperimentController:
                 central_anchor_key="central_lsv_plot_anchor"
             )
         elif data_type == "IT":
-            voltage = float(context.get('current_voltage', 0))
-            output_pos_str = str(context.get('current_output_position', 'N/A'))
-            loop_idx = int(context.get('loop_index', -1))
-            charge = self._calculate_charge(data_df)
+            charge = result["charge"] or 0.0
             status_for_excel = f"{charge:.6f}" if charge > 0 else "计算电荷失败"
             
             self.reporter.record_it_result(
@@ -1158,15 +1114,16 @@ class ExperimentController:
                 })
         else:
             log.info(f"数据类型 {data_type} 没有特定的Excel记录逻辑。")
-            
-        return True
 
 
-    def _execute_voltage_loop(self, step_config: dict, context: dict):
-        """执行电压循环步骤"""
+    def _voltage_loop_contexts(self, step_config: dict, context: dict):
+        """生成电压循环每个电压点的上下文
+
+        Returns:
+            list | None: 每个电压点的上下文列表，配置错误时返回 None
+        """
         voltage_source_cfg = step_config['voltage_source']
         output_positions_source_cfg = step_config.get('output_positions_source', {})
-        loop_sequence_cfg = step_config['loop_sequence']
 
         # --- 1. 生成电压序列 ---
         voltages_to_loop = []
@@ -1197,14 +1154,14 @@ class ExperimentController:
                 voltages_to_loop = self._resolve_template(f"{{{{config.{key_name}}}}}", context)
                 if not isinstance(voltages_to_loop, list):
                     log.error(f"Voltage loop: configurations中的 '{key_name}' 不是一个列表。")
-                    return False
+                    return None
         else:
             log.error(f"Voltage loop: 未知的voltage_source类型 '{vs_type}'")
-            return False
+            return None
         
         if not voltages_to_loop:
             log.warning("Voltage loop: 生成的电压序列为空，跳过循环。")
-            return True
+            return []
         log.info(f"Voltage loop: 将对以下电压进行迭代: {voltages_to_loop}")
 
         # --- 2. 准备输出位置序列 ---
@@ -1237,33 +1194,55 @@ class ExperimentController:
                 pass
             else:
                 log.error(f"Voltage loop: 输出位置列表长度 ({len(output_positions_for_loop)}) 与电压点数 ({len(voltages_to_loop)}) 不匹配。")
-                return False
+                return None
         log.info(f"Voltage loop: 对应的输出位置序列: {output_positions_for_loop}")
 
-        # --- 3. 执行循环 ---
+        # --- 3. 生成循环上下文 ---
+        loop_contexts = []
         for i, voltage in enumerate(voltages_to_loop):
-            current_output_pos = output_positions_for_loop[i]
-            
-            # 创建/更新循环上下文
             loop_context = context.copy() # 继承父上下文
             loop_context['current_voltage'] = voltage
             loop_context['current_voltage_file_str'] = (f"neg{int(abs(voltage * 10))}" if voltage < 0 else f"{int(voltage * 10)}")
-            loop_context['current_output_position'] = current_output_pos
+            loop_context['current_output_position'] = output_positions_for_loop[i]
             loop_context['loop_index'] = i
+            loop_contexts.append(loop_context)
 
-            log.info(f"[Voltage Loop {i+1}/{len(voltages_to_loop)}] 电压: {voltage:.2f}V, 输出位置: {current_output_pos}")
+        # --- 4. 顺序不限时按最短移动路径排列（loop_index 保持原电压序号，报告和日志键不变） ---
+        if step_config.get('optimize_position_order', False) and len(loop_contexts) > 1:
+            numbers = [self.grid_model.number(c['current_output_position']) for c in loop_contexts]
+            rank = {position: n for n, position in enumerate(self.printer.order_grid_positions(numbers))}
+            order = sorted(range(len(loop_contexts)), key=lambda i: rank[numbers[i]])   # 同一位置保持原顺序
+            loop_contexts = [loop_contexts[i] for i in order]
+            log.info(f"Voltage loop: 按移动路径优化后的输出位置顺序: {[c['current_output_position'] for c in loop_contexts]}")
+        return loop_contexts
+
+    def _execute_voltage_loop(self, step_config: dict, context: dict):
+        """执行电压循环步骤"""
+        loop_sequence_cfg = step_config['loop_sequence']
+        loop_contexts = self._voltage_loop_contexts(step_config, context)
+        if loop_contexts is None:
+            return False
+
+        for loop_context in loop_contexts:
+            i = loop_context['loop_index']
+            voltage = loop_context['current_voltage']
+            log.info(f"[Voltage Loop {i+1}/{len(loop_contexts)}] 电压: {voltage:.2f}V, 输出位置: {loop_context['current_output_position']}")
 
             for sub_step_config in loop_sequence_cfg:
                 if not self._dispatch_step(sub_step_config, loop_context):
                     log.error(f"Voltage loop 在 电压 {voltage:.2f}V (索引 {i}) 时子步骤失败。中止循环。")
                     return False # 子步骤失败，中止整个循环
-            log.info(f"[Voltage Loop {i+1}/{len(voltages_to_loop)}] 电压: {voltage:.2f}V 处理完成。")
+            log.info(f"[Voltage Loop {i+1}/{len(loop_contexts)}] 电压: {voltage:.2f}V 处理完成。")
         
         log.info("Voltage loop 全部完成。")
         return True
 
-    def _execute_sequence_step(self, step_config: dict, context: dict):
-        """执行一个子序列步骤（宏或者内联动作）"""
+    def _sequence_actions(self, step_config: dict, context: dict):
+        """确定子序列步骤要执行的动作列表及其上下文
+
+        Returns:
+            tuple | None: (动作列表, 序列上下文)，子序列未定义时返回 None
+        """
         sub_sequence_name = step_config.get("name_in_sub_sequences")
         inline_actions = step_config.get("actions")
         
@@ -1271,7 +1250,7 @@ class ExperimentController:
         if sub_sequence_name:
             if sub_sequence_name not in self.config.get("sub_sequences", {}):
                 log.error(f"子序列 '{sub_sequence_name}' 未在配置中定义。")
-                return False
+                return None
             sub_seq_def = self.config["sub_sequences"][sub_sequence_name]
             log.info(f"执行子序列: {sub_sequence_name} ({sub_seq_def.get('description', '')})")
             actions_to_execute = sub_seq_def.get("actions", [])
@@ -1280,7 +1259,7 @@ class ExperimentController:
             actions_to_execute = inline_actions
         else:
             log.warning("序列步骤既未指定子序列名称也未包含内联动作。")
-            return True # 空序列算成功
+            return [], context # 空序列算成功
 
         # 如果子序列需要特定的上下文变量，而这些变量在调用时没有（例如dispense_sample_and_clean_cell中的current_output_position）
         # 可以在调用sequence步骤时，通过params传入，然后在子序列的actions中用模板引用
@@ -1294,6 +1273,14 @@ class ExperimentController:
         if context_overrides:
             log.debug(f"  应用上下文覆盖到子序列: {context_overrides}")
             sequence_context.update(context_overrides)
+        return actions_to_execute, sequence_context
+
+    def _execute_sequence_step(self, step_config: dict, context: dict):
+        """执行一个子序列步骤（宏或者内联动作）"""
+        resolved = self._sequence_actions(step_config, context)
+        if resolved is None:
+            return False
+        actions_to_execute, sequence_context = resolved
 
         for sub_action_config in actions_to_execute:
             if not self._dispatch_step(sub_action_config, sequence_context): # 使用序列特定的上下文
@@ -1304,23 +1291,13 @@ class ExperimentController:
         return True
 
 
-    def _dispatch_step(self, step_config: dict, context: dict) -> bool:
-        """
-        根据步骤类型分发任务到相应的执行方法。
-        返回 True 表示成功，False 表示失败。
-        """
+    def _is_step_skipped(self, step_config: dict) -> bool:
+        """检查步骤是否被禁用或因条件标志跳过"""
         step_id = step_config.get('id', '未命名步骤')
-        step_type = step_config.get('type')
-        description = self._resolve_template(step_config.get('description', ''), context)
-
-        log.info(f"--- [开始步骤: {step_id}] {description} (类型: {step_type}) ---")
-
-        # 1. 检查是否启用
         if not step_config.get('enabled', True):
             log.info(f"步骤 {step_id} 已禁用，跳过。")
             return True
 
-        # 2. 检查条件跳过标志
         skip_flag_true_key = step_config.get('skip_if_flag_true')
         if skip_flag_true_key and self.experiment_flags.get(skip_flag_true_key, False):
             log.info(f"步骤 {step_id} 因标志 '{skip_flag_true_key}' 为True而跳过。")
@@ -1330,6 +1307,26 @@ class ExperimentController:
         if skip_flag_false_key and not self.experiment_flags.get(skip_flag_false_key, True): # 标志默认为True以避免意外跳过
             log.info(f"步骤 {step_id} 因标志 '{skip_flag_false_key}' 为False而跳过。")
             return True
+        return False
+
+    def _dispatch_step(self, step_config: dict, context: dict) -> bool:
+        """
+        根据步骤类型分发任务到相应的执行方法。
+        返回 True 表示成功，False 表示失败。
+        """
+        step_id = step_config.get('id', '未命名步骤')
+        step_type = step_config.get('type')
+        description = self._resolve_template(step_config.get('description', ''), context)
+
+        log.info(f"--- [开始步骤: {step_id}] {description} (类型: {step_type}) ---")
+
+        if self.abort_token.aborted:
+            log.error(f"实验已中止 ({self.abort_token.reason})，不再执行步骤 {step_id}。")
+            return False
+
+        # 1-2. 检查是否启用及条件跳过标志
+        if self._is_step_skipped(step_config):
+            return True
 
         # 3. 解析通用参数 (params) 和特定参数 (如 chi_params)
         #   注意：模板解析应该在每个具体执行方法内部进行，因为它们可能需要不同的上下文或对解析结果有不同处理
@@ -1350,6 +1347,8 @@ class ExperimentController:
             success = self._safe_printer_move_to_grid(parsed_params, context)
         elif step_type == "set_valve":
             success = self._set_valve_state(parsed_params, context)
+        elif step_type == "valve_sequence":
+            success = self._execute_valve_sequence(parsed_params, context)
         elif step_type == "pump_liquid":
             success = self._control_pump_operation(parsed_params, context)
         elif step_type == "chi_measurement":
@@ -1378,6 +1377,213 @@ class ExperimentController:
             log.error(f"--- [失败步骤: {step_id}] ---")
         return success
 
+    def _expand_steps(self, steps: list, context: dict, prefix: str = ""):
+        """将步骤列表展开为叶子步骤（voltage_loop 和 sequence 被展开）
+
+        Args:
+            steps: 步骤配置列表
+            context: 当前上下文
+            prefix: 父步骤的键前缀
+
+        Returns:
+            list | None: [(步骤键, 步骤配置, 上下文), ...]，展开失败时返回 None
+        """
+        leaves = []
+        for position, step_config in enumerate(steps):
+            key = f"{prefix}{step_config.get('id') or f'#{position}'}"
+            if self._is_step_skipped(step_config):
+                continue
+            step_type = step_config.get('type')
+            if step_type == "voltage_loop":
+                loop_contexts = self._voltage_loop_contexts(step_config, context)
+                if loop_contexts is None:
+                    return None
+                for loop_context in loop_contexts:
+                    children = self._expand_steps(step_config['loop_sequence'], loop_context, f"{key}[{loop_context['loop_index']}]/")
+                    if children is None:
+                        return None
+                    leaves.extend(children)
+            elif step_type == "sequence":
+                resolved = self._sequence_actions(step_config, context)
+                if resolved is None:
+                    return None
+                actions, sequence_context = resolved
+                children = self._expand_steps(actions, sequence_context, f"{key}/")
+                if children is None:
+                    return None
+                leaves.extend(children)
+            else:
+                leaves.append((key, step_config, context))
+        return leaves
+
+    def _note_output(self, output: dict):
+        """记录当前步骤产生的文件等产出，写入实验日志"""
+        outputs = getattr(self._step_outputs, 'items', None)
+        if outputs is not None:
+            outputs.append(output)
+
+    def _run_leaf_step(self, key: str, step_config: dict, context: dict) -> bool:
+        """执行一个叶子步骤，成功后写入实验日志"""
+        self._step_outputs.items = []
+        try:
+            success = self._dispatch_step(step_config, context)
+            if success and self.journal:
+                self.journal.step_done(key, step_config.get('id'), context.get('loop_index'), self._step_outputs.items)
+            return success
+        finally:
+            self._step_outputs.items = None
+
+    def _run_serial(self, leaves: list) -> bool:
+        """按顺序执行叶子步骤"""
+        for position, (key, step_config, context) in enumerate(leaves, 1):
+            log.info(f"[{position}/{len(leaves)}] {key}")
+            if not self._run_leaf_step(key, step_config, context):
+                log.critical(f"步骤 {key} 执行失败，实验中止。")
+                return False
+        return True
+
+    def _run_parallel(self, leaves: list) -> bool:
+        """按设备资源依赖图并行执行叶子步骤，并报告相对串行基线的耗时"""
+        nodes = build_step_graph(leaves, self.config.get('step_resources'))
+        edges = sum(len(node.dependencies) for node in nodes)
+        log.info(f"[PARALLEL] 实验序列展开为 {len(nodes)} 个步骤，{edges} 条依赖")
+
+        executor = ParallelStepExecutor(nodes, self._run_leaf_step)
+        success = asyncio.run(executor.run())
+        executor.report()
+        if executor.failed is not None:
+            log.critical(f"步骤 {executor.failed.key} 执行失败，实验中止。")
+        return success
+
+    def _prepare_resume(self, leaves: list, current_hash: str):
+        """读取实验日志，恢复已完成步骤的产出并复核设备状态
+
+        Returns:
+            list | None: 尚未完成的叶子步骤，设备状态复核失败时返回 None
+        """
+        state = load_journal(self.journal_path)
+        if not state.completed:
+            log.info(f"[RESUME] 实验日志 {self.journal_path} 中没有已完成的步骤，从头开始。")
+            return leaves
+        if state.config_hash and state.config_hash != current_hash:
+            log.warning("[RESUME] 配置文件在上次运行后已被修改，将按步骤键匹配已完成的步骤。")
+
+        # 数据处理在后台完成，中断时图像或处理结果可能尚未写出：这样的数据处理步骤重新执行
+        reported = {report['plot_file']: report for report in state.reports}
+        for key, record in list(state.completed.items()):
+            plots = [output['path'] for output in record.get('outputs', []) if output.get('kind') == 'plot']
+            if any(not os.path.exists(path) or path not in reported for path in plots):
+                log.info(f"[RESUME] 步骤 {key} 的图像或处理结果缺失，将重新处理。")
+                del state.completed[key]
+
+        completed_leaves = [leaf for leaf in leaves if leaf[0] in state.completed]
+        pending = [leaf for leaf in leaves if leaf[0] not in state.completed]
+        log.info(f"[RESUME] 已完成 {len(completed_leaves)}/{len(leaves)} 个步骤，剩余 {len(pending)} 个。")
+
+        # 重放已完成步骤的处理结果：Excel报告按内存模型重新生成，不重放会清空之前的电荷和主图；
+        # IT图库信息也由重放恢复
+        self.it_plot_info_list = []
+        completed_plots = {output['path'] for output in state.outputs("plot")}
+        for plot_file, report in reported.items():
+            if plot_file in completed_plots:
+                self._apply_chi_result(report['data_type'], {"plot_file": plot_file, "data_file": None},
+                                       report['context'], report['result'])
+        log.info(f"[RESUME] 已将 {len(completed_plots & reported.keys())} 条处理结果恢复到Excel报告。")
+        missing = [output['path'] for output in state.outputs() if output.get('path') and not os.path.exists(output['path'])]
+        if missing:
+            log.warning(f"[RESUME] {len(missing)} 个已记录的产出文件不存在: {missing[:5]}")
+
+        if pending and not self._verify_resume_state(completed_leaves):
+            return None
+        return pending
+
+    def _verify_resume_state(self, completed_leaves: list) -> bool:
+        """续跑前复核设备状态：结束残留的CHI进程，重新归位，并恢复中断时的继电器状态和打印机位置"""
+        log.info("[RESUME] 复核设备状态...")
+        try:
+            chi_stop_all()
+        except Exception as e:
+            log.warning(f"[RESUME] 停止残留CHI进程失败: {e}")
+
+        if self.printer.get_current_position() is None:
+            log.error("[RESUME] 无法获取打印机位置，设备未就绪。")
+            return False
+        if not self._safe_printer_home({}, {}):
+            log.error("[RESUME] 打印机归位失败。")
+            return False
+
+        if not self._restore_relay_states(completed_leaves):
+            return False
+
+        last_move = next((leaf for leaf in reversed(completed_leaves)
+                          if leaf[1].get('type') in ('move_printer_xyz', 'move_printer_grid', 'printer_home')), None)
+        if last_move is not None:
+            key, step_config, context = last_move
+            log.info(f"[RESUME] 恢复打印机位置: 重新执行 {key}")
+            if not self._dispatch_step(step_config, context):
+                log.error(f"[RESUME] 恢复步骤 {key} 失败。")
+                return False
+        return True
+
+    def _final_relay_states(self, completed_leaves: list):
+        """按执行顺序汇总已完成的 set_valve / valve_sequence 步骤，得到中断时各继电器的最终状态
+
+        Returns:
+            dict[int, bool] | None: 继电器ID -> 是否为ON，参数无法解析时返回 None
+        """
+        states = {}
+        for key, step_config, context in completed_leaves:
+            step_type = step_config.get('type')
+            if step_type not in ('set_valve', 'valve_sequence') or not step_config.get('enabled', True):
+                continue
+            params = self._parse_params(step_config.get('params', {}), context)
+            if step_type == 'set_valve':
+                relay_id = self._resolve_relay_id(params, context)
+                if relay_id is None:
+                    return None
+                states[relay_id] = bool(params['open_to_reservoir'])
+                continue
+            # 序列内按时间排序，同一时刻保持配置顺序；泵送和 G-code 动作不影响继电器状态
+            events = [self._parse_params(event, context) for event in params.get('events', [])]
+            for event in sorted(events, key=lambda event: float(event.get('at', 0.0))):
+                if 'pump' in event or 'gcode' in event:
+                    continue
+                relay_id = self._resolve_relay_id(event, context)
+                if relay_id is None:
+                    return None
+                try:
+                    states[relay_id] = _parse_relay_state(event.get('state', 'on'))
+                except ValueError as e:
+                    log.error(f"[RESUME] 步骤 {key} 的继电器状态无效: {e}")
+                    return None
+        return states
+
+    def _restore_relay_states(self, completed_leaves: list) -> bool:
+        """恢复中断时的继电器状态，并通过 output_pin 回读确认"""
+        states = self._final_relay_states(completed_leaves)
+        if states is None:
+            log.error("[RESUME] 无法从已完成步骤解析继电器状态。")
+            return False
+        if not states:
+            return True
+        described = ", ".join(f"{idx}={'ON' if on else 'OFF'}" for idx, on in states.items())
+        log.info(f"[RESUME] 恢复继电器状态: {described}")
+        try:
+            self.relay_proxy.set_many(states)
+            actual = self.relay_proxy.query_states(states.keys())
+        except Exception as e:
+            log.error(f"[RESUME] 恢复继电器状态失败: {e}")
+            return False
+
+        unconfirmed = [idx for idx in states if idx not in actual]
+        if unconfirmed:
+            log.warning(f"[RESUME] 继电器 {unconfirmed} 没有可回读的 output_pin，无法确认状态。")
+        mismatched = {idx: actual[idx] for idx in states if idx in actual and actual[idx] != states[idx]}
+        if mismatched:
+            log.error(f"[RESUME] 继电器状态回读与期望不一致: {mismatched}")
+            return False
+        return self._settle('after_relay')
+
     def run_full_experiment(self):
         """
         从JSON配置执行完整的实验流程。
@@ -1408,11 +1614,22 @@ class ExperimentController:
             if not experiment_sequence_cfg:
                 log.warning("实验序列为空，无操作执行。")
             else:
-                for step_config in experiment_sequence_cfg:
-                    if not self._dispatch_step(step_config, initial_context.copy()): # 传递上下文副本
-                        log.critical(f"步骤 {step_config.get('id', '未定义ID')} 执行失败，实验中止。")
-                        overall_success = False
-                        break # 中止后续步骤
+                # 展开为叶子步骤，每个步骤有固定的键（循环内带电压点索引），用于实验日志和续跑
+                leaves = self._expand_steps(experiment_sequence_cfg, initial_context)
+                current_hash = config_hash(self.config)
+                if leaves is not None and self.resume:
+                    leaves = self._prepare_resume(leaves, current_hash)
+
+                if leaves is None:
+                    log.critical("实验序列展开或续跑前设备状态复核失败，实验中止。")
+                    overall_success = False
+                else:
+                    self.journal = StepJournal(self.journal_path)
+                    self.journal.start_run(current_hash, resume=self.resume, pending_steps=len(leaves))
+                    if self.config.get('parallel_execution', False):
+                        overall_success = self._run_parallel(leaves)
+                    else:
+                        overall_success = self._run_serial(leaves)
             
             if overall_success:
                 log.info(f"[EXPERIMENT FLOW SUCCESS] === 项目: {self.project_name} 所有已启用步骤成功完成。 ===")
@@ -1421,11 +1638,23 @@ class ExperimentController:
 
         except KeyboardInterrupt:
             log.warning("[EXPERIMENT INTERRUPTED] 用户通过 Ctrl+C 中断实验！")
+            self.abort("Ctrl+C")   # 让并行执行中仍在等待的线程立即返回
             overall_success = False
         except Exception as e:
             log.critical(f"[EXPERIMENT FAILED UNHANDLED] 实验流程中发生未捕获的严重错误: {e}", exc_info=True)
             overall_success = False
         finally:
+            # 等待排队中的绘图和报告写入完成
+            try:
+                self.report_pool.shutdown()
+            except Exception as e:
+                log.error(f"[REPORT] 等待绘图/报告任务完成时出错: {e}", exc_info=True)
+
+            if self.journal:
+                self.journal.end_run(overall_success)
+                self.journal.close()
+                self.journal = None
+
             # --- 最终报告生成 (无论成功与否，尝试生成报告) ---
             if self.reporter:
                 try:
@@ -1483,6 +1712,7 @@ class ExperimentController:
             # 如果JSON中没有定义，这里可以做一个默认的
             log.info("[CLEANUP] 开始执行最终清理操作...")
             self._perform_final_cleanup() # 默认的清理方法
+            self._close_device_loop()
 
             log.info(f"[EXPERIMENT END] === 项目: {self.project_name} 执行结束。整体成功: {overall_success} ===")
             
@@ -1670,28 +1900,32 @@ class ExperimentController:
                 # 这不应该导致整个循环失败，所以不设置overall_success = False
                 
             # 每个测试后短暂暂停
-            time.sleep(1.0)
+            if not self._pause(1.0):
+                overall_success = False
+                break
             
         return overall_success
 
 
 # --- 主程序入口 ---
 if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="按JSON配置执行自动化电化学实验")
+    parser.add_argument("--config", default=os.path.join(script_dir, "experiment_config.json"), help="实验配置文件路径")
+    parser.add_argument("--resume", action="store_true", help="根据实验日志跳过已完成的步骤，从中断处继续")
+    args = parser.parse_args()
+
     # 配置基础日志记录器
     logging.basicConfig(
         level=logging.DEBUG, # 默认级别，会被配置文件中的log_level覆盖控制器本身的logger
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
         handlers=[
             logging.StreamHandler(), # 输出到控制台
-            logging.FileHandler("experiment_controller.log", mode='w') # 输出到文件，每次覆盖
+            logging.FileHandler("experiment_controller.log", mode='a' if args.resume else 'w') # 输出到文件，续跑时追加
         ]
     )
 
-    # 配置文件路径 (可以作为命令行参数传入)
-    # config_path = "experiment_config.json" # 假设在同一目录
-    # 更健壮的方式：
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    config_path = os.path.join(script_dir, "experiment_config.json")
+    config_path = args.config
 
 
     if not os.path.exists(config_path):
@@ -1699,7 +1933,7 @@ if __name__ == "__main__":
         exit(1)
 
     try:
-        controller = ExperimentController(config_file_path=config_path)
+        controller = ExperimentController(config_file_path=config_path, resume=args.resume)
         controller.run_full_experiment()
     except ConnectionError:
         log.critical("无法连接到必要的硬件或服务。请检查配置和设备状态。")
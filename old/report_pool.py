@@ -0,0 +1,259 @@
+"""CHI 数据绘图与报告写入的后台池
+
+仪器流程只负责把绘图任务放入队列，随即继续下一步：
+- 解析数据文件、计算电荷、以 300 dpi 渲染 PNG 在进程池中完成，工作进程启动时预先初始化 Agg 后端；
+- 报告写入（ExcelReporter 调用）由单个写入线程按提交顺序执行，报告对象无需线程安全；
+- 排队任务数有上限，积压过多时提交会阻塞，避免内存无限增长；
+- 运行结束时调用 flush() 等待全部任务完成后再生成最终报告。
+"""
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import TYPE_CHECKING
+
+from device_control.chi_analysis import integrate_charge
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+log = logging.getLogger(__name__)
+
+PLOT_DPI = 300
+
+
+def parse_electrochemical_file(file_path: str) -> 'pd.DataFrame':
+    """解析CHI导出的文本数据文件，返回 Potential/Current 或 Time/Current 两列的 DataFrame"""
+    import pandas as pd  # 首次解析数据时才导入，加快控制器启动
+    log.debug(f"尝试解析电化学文件: {file_path}")
+    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        log.warning(f"电化学文件不存在或为空: {file_path}")
+        return pd.DataFrame()
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            lines = f.readlines()
+
+        data_start = -1
+        header_line_type = None # 'potential_current' or 'time_current'
+
+        for i, line in enumerate(lines):
+            line_lower = line.lower().strip()
+            if 'potential/v' in line_lower and 'current/a' in line_lower:
+                data_start = i + 1
+                header_line_type = 'potential_current'
+                break
+            elif 'time/sec' in line_lower and 'current/a' in line_lower: # CHI的i-t曲线通常是Time/sec
+                data_start = i + 1
+                header_line_type = 'time_current'
+                break
+
+        if data_start == -1:
+            log.warning(f"在文件中未找到可识别的数据头: {file_path}")
+            return pd.DataFrame()
+
+        data_rows = []
+        for line_num, line_content in enumerate(lines[data_start:]):
+            clean_line = line_content.strip()
+            if not clean_line: continue # 跳过空行
+
+            # 尝试用逗号分割，如果不行再尝试用制表符或多个空格
+            parts = [p.strip() for p in clean_line.split(',') if p.strip()]
+            if len(parts) < 2: # 尝试制表符
+                parts = [p.strip() for p in clean_line.split('\t') if p.strip()]
+            if len(parts) < 2: # 尝试多个空格
+                parts = [p.strip() for p in clean_line.split() if p.strip()]
+
+            if len(parts) >= 2:
+                try:
+                    # 取前两列作为数据
+                    data_rows.append([float(parts[0]), float(parts[1])])
+                except ValueError:
+                    log.debug(f"跳过无法解析为数字的行 {line_num + data_start} in {file_path}: '{line_content}'")
+
+        if not data_rows:
+            log.warning(f"未从文件中解析到有效数据行: {file_path}")
+            return pd.DataFrame()
+
+        if header_line_type == 'time_current':
+            df = pd.DataFrame(data_rows, columns=['Time', 'Current'])
+        elif header_line_type == 'potential_current':
+            df = pd.DataFrame(data_rows, columns=['Potential', 'Current'])
+        else: # 不应该发生，但作为回退
+            df = pd.DataFrame()
+
+        log.debug(f"成功解析文件 {file_path}, 共 {len(df)} 行数据。列: {df.columns.tolist()}")
+        return df
+    except Exception as e:
+        log.error(f"解析电化学文件 {file_path} 失败: {e}", exc_info=True)
+        return pd.DataFrame()
+
+
+def calculate_charge(it_data: 'pd.DataFrame') -> float:
+    """计算IT曲线的电荷量（梯形积分，时间非单调时才排序）"""
+    import pandas as pd
+    if not isinstance(it_data, pd.DataFrame) or it_data.empty or \
+       'Time' not in it_data.columns or 'Current' not in it_data.columns:
+        log.warning("IT数据无效或缺少必要列 ('Time', 'Current')，无法计算电荷。")
+        return 0.0
+    if len(it_data) < 2:
+        log.warning("IT数据点不足 (<2)，无法计算电荷。")
+        return 0.0
+    try:
+        charge = integrate_charge(it_data['Time'].to_numpy(), it_data['Current'].to_numpy())
+        log.debug(f"计算得到电荷: {charge:.6f} C")
+        return charge
+    except Exception as e:
+        log.error(f"计算电荷时发生错误: {e}", exc_info=True)
+        return 0.0
+
+
+def _init_worker():
+    """工作进程初始化：预先加载无界面的 Agg 后端，避免每个任务首次导入 pyplot 的开销"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot  # noqa: F401
+
+
+def render_chi_plot(job: dict) -> dict:
+    """解析CHI数据文件并渲染图像（在工作进程中执行）
+
+    Args:
+        job: {"data_type", "data_file", "plot_file", "title"}
+
+    Returns:
+        dict: {"status": "ok"/"empty"/"bad_columns"/"unsupported"/"plot_failed",
+               "plot_path": 图像路径或 None, "charge": IT 电荷量或 None}
+    """
+    import matplotlib.pyplot as plt
+
+    data_type = job['data_type']
+    result = {"status": "ok", "plot_path": None, "charge": None}
+
+    data_df = parse_electrochemical_file(job['data_file'])
+    if data_df.empty:
+        result["status"] = "empty"
+        return result
+
+    if data_type in ("CV", "CV_CDL", "LSV"):
+        x_column, x_label = 'Potential', 'Potential (V)'
+    elif data_type == "IT":
+        x_column, x_label = 'Time', 'Time (s)'
+    else:
+        result["status"] = "unsupported"
+        return result
+
+    if x_column not in data_df.columns or 'Current' not in data_df.columns:
+        result["status"] = "bad_columns"
+        return result
+
+    if data_type == "IT":
+        result["charge"] = calculate_charge(data_df)
+
+    try:
+        plt.figure(figsize=(8, 5))
+        plt.plot(data_df[x_column], data_df['Current'], 'b-', linewidth=1.5)
+        plt.xlabel(x_label)
+        plt.ylabel('Current (A)')
+        plt.title(job['title'])
+        plt.grid(True)
+        plt.tight_layout()
+        plt.savefig(job['plot_file'], dpi=PLOT_DPI)
+        result["plot_path"] = job['plot_file']
+    except Exception as e:
+        log.error(f"生成 {data_type} 图失败: {e}", exc_info=True)
+        result["status"] = "plot_failed"
+    finally:
+        plt.close('all')
+    return result
+
+
+class ReportPool:
+    """绘图进程池 + 单写入线程
+
+    submit(job, callback)：job 在进程池中执行 render_chi_plot，结果按提交顺序交给写入线程调用 callback；
+    job 为 None 时只把 callback 排入写入线程（用于不需要绘图的报告记录）。
+    """
+
+    def __init__(self, max_workers=2, max_pending=8):
+        """
+        Args:
+            max_workers: 绘图进程数，为 0 时在调用线程中同步执行（调试用）
+            max_pending: 允许排队的最大任务数，超过后 submit 阻塞
+        """
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._executor = None
+        self._queue = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self.max_workers > 0 and self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+                log.info(f"绘图进程池已启动 ({self.max_workers} 个进程)")
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="report-writer", daemon=True)
+                self._writer.start()
+
+    def submit(self, job, callback):
+        """提交绘图任务，立即返回（队列已满时阻塞等待）"""
+        self._ensure_started()
+        self._slots.acquire()
+        if job is None:
+            future = Future()
+            future.set_result(None)
+        elif self._executor is None:
+            future = Future()
+            try:
+                _init_worker()
+                future.set_result(render_chi_plot(job))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = self._executor.submit(render_chi_plot, job)
+        self._queue.put((future, callback))
+        return future
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            future, callback = item
+            try:
+                result = future.result()
+                callback(result)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                log.error(f"报告任务失败: {e}", exc_info=True)
+            finally:
+                self._slots.release()
+                self._queue.task_done()
+
+    def flush(self):
+        """等待所有已提交的绘图和报告写入完成"""
+        if self._writer is None:
+            return
+        pending = self._queue.qsize()
+        if pending:
+            log.info(f"等待 {pending} 个绘图/报告任务完成...")
+        self._queue.join()
+
+    def shutdown(self):
+        """完成剩余任务并关闭进程池和写入线程"""
+        self.flush()
+        with self._lock:
+            if self._writer is not None:
+                self._queue.put(None)
+                self._writer.join()
+                self._writer = None
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        log.info(f"绘图/报告任务完成 {self.completed} 个，失败 {self.failed} 个")
@@ -0,0 +1,171 @@
+"""实验步骤日志（断点续跑）
+
+只追加的 JSONL 文件，每行一条记录：
+    {"event": "run_start", "run_id": ..., "resume": false, "config_hash": ...}
+    {"event": "step_done", "key": "SUBSEQUENT_07_IT_VOLTAGE_SWEEP[3]/IT_LOOP_MEASUREMENT",
+     "step_id": ..., "loop_index": 3, "outputs": [...]}
+    {"event": "report", "run_id": ..., "data_type": "IT", "plot_file": ..., "context": {...}, "result": {...}}
+    {"event": "run_end", "run_id": ..., "success": true}
+
+步骤键由展开后的步骤路径决定（循环内带 [电压点索引]），同一配置每次运行得到相同的键。
+每条记录写入后立即 flush，os.fsync 按条数/时间批量执行；运行开始和结束记录立即 fsync。
+report 记录数据处理（后台绘图、电荷计算）的结果，续跑时重放到Excel报告中，
+已完成步骤的电荷和图像不会在重新生成工作簿时丢失。
+续跑时只采信最近一次非续跑 run_start 之后的完成记录和 report 记录。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+log = logging.getLogger(__name__)
+
+
+def config_hash(config):
+    """配置内容的哈希，用于续跑时检查配置是否被修改"""
+    payload = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class JournalState:
+    """从日志文件恢复的状态"""
+
+    def __init__(self):
+        self.completed = {}     # 步骤键 -> step_done 记录
+        self.reports = []       # report 记录，按写入顺序
+        self.config_hash = None
+        self.runs = 0
+
+    def outputs(self, kind=None):
+        """按完成顺序返回已记录的产出"""
+        for record in self.completed.values():
+            for output in record.get("outputs", []):
+                if kind is None or output.get("kind") == kind:
+                    yield output
+
+
+def load_journal(path):
+    """读取日志文件
+
+    末尾未写完整的行（进程在写入中途退出）会被忽略。
+
+    Returns:
+        JournalState: 最近一次实验（含其后的续跑）的完成状态
+    """
+    state = JournalState()
+    if not os.path.exists(path):
+        return state
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                log.warning(f"实验日志第 {line_no} 行不完整，已忽略")
+                continue
+
+            event = record.get("event")
+            if event == "run_start":
+                if not record.get("resume"):
+                    state.completed = {}
+                    state.reports = []
+                    state.config_hash = record.get("config_hash")
+                    state.runs = 0
+                state.runs += 1
+            elif event == "step_done":
+                state.completed[record["key"]] = record
+            elif event == "report":
+                state.reports.append(record)
+    return state
+
+
+class StepJournal:
+    """只追加的步骤日志，线程安全（并行执行时多个线程同时记录）"""
+
+    def __init__(self, path, fsync_batch=16, fsync_interval=2.0):
+        """
+        Args:
+            path: 日志文件路径
+            fsync_batch: 累计多少条记录后执行一次 fsync
+            fsync_interval: 距上次 fsync 超过多少秒后执行 fsync
+        """
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.run_id = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        # 上次进程在写入中途退出时，先补一个换行，避免新记录接在残缺行后面
+        if self._file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self._file.write('\n')
+
+    def _append(self, record, sync=False):
+        record.setdefault("ts", time.time())
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + '\n')
+            self._file.flush()
+            self._pending += 1
+            if sync or self._pending >= self.fsync_batch or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync_locked()
+
+    def _sync_locked(self):
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def start_run(self, config_hash_value, resume=False, pending_steps=None):
+        self._append({
+            "event": "run_start",
+            "run_id": self.run_id,
+            "resume": resume,
+            "config_hash": config_hash_value,
+            "pending_steps": pending_steps,
+        }, sync=True)
+
+    def step_done(self, key, step_id, loop_index=None, outputs=None):
+        self._append({
+            "event": "step_done",
+            "run_id": self.run_id,
+            "key": key,
+            "step_id": step_id,
+            "loop_index": loop_index,
+            "outputs": outputs or [],
+        })
+
+    def report(self, data_type, plot_file, context, result):
+        """记录一次数据处理结果（写入线程中调用）"""
+        self._append({
+            "event": "report",
+            "run_id": self.run_id,
+            "data_type": data_type,
+            "plot_file": plot_file,
+            "context": context,
+            "result": result,
+        })
+
+    def end_run(self, success):
+        self._append({"event": "run_end", "run_id": self.run_id, "success": success}, sync=True)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            if self._pending:
+                self._sync_locked()
+            self._file.close()
+            self._file = None
@@ -0,0 +1,225 @@
+"""实验步骤依赖图与设备级并行执行
+
+把展开后的实验步骤（voltage_loop、sequence 已展开为叶子步骤）构造成依赖图：
+每个步骤声明占用的设备资源，后一个步骤依赖于之前最后一个与它争用同一资源的步骤；
+不共享资源的步骤可以重叠执行（例如上一个电压点的数据处理与下一个电压点的泵液）。
+
+资源默认按步骤类型确定（见 DEFAULT_STEP_RESOURCES），可以在配置中覆盖：
+    顶层 "step_resources": {"move_printer_grid": ["printer"]}   按类型覆盖
+    步骤 "resources": ["pump2"]                                 按步骤覆盖
+    步骤 "depends_on": ["STEP_ID", ...]                         显式依赖（最近一次出现的同ID步骤）
+    步骤 "barrier": true                                        屏障：等待之前所有步骤，之后的步骤都等待它
+
+资源 "cell" 按上下文中的输出位置区分（current_output_position 为 5 时为 "cell:5"），
+不同孔位的步骤互不阻塞，下一个孔位的移动、泵液可以与当前孔位的测量重叠；
+没有输出位置的步骤（如初始化）仍使用共同的 "cell"。
+"""
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# 默认资源：孔位（cell）被移动、泵液、等待和测量共同占用，保证同一孔位内的物理操作仍按顺序进行
+DEFAULT_STEP_RESOURCES = {
+    "printer_home": ("printer", "cell"),
+    "move_printer_xyz": ("printer", "cell"),
+    "move_printer_grid": ("printer", "cell"),
+    "pump_liquid": ("pump", "valve", "cell"),
+    "set_valve": ("valve",),
+    "valve_sequence": ("pump", "valve", "cell"),
+    "chi_measurement": ("chi", "cell"),
+    "chi_sequence": ("chi", "cell"),
+    "process_chi_data": ("report",),
+    "wait": ("cell",),
+    "log_message": ("log",),
+}
+
+CELL_RESOURCE = "cell"
+CELL_CONTEXT_KEY = "current_output_position"
+
+# 默认作为屏障的步骤类型；等待步骤只需让本孔位的物理过程稳定下来，默认占用 cell 而不是屏障
+BARRIER_STEP_TYPES = ()
+
+# 数据依赖：步骤读取之前某类步骤产生的文件
+DATA_DEPENDENCIES = {
+    "process_chi_data": ("chi_measurement", "chi_sequence"),
+}
+
+
+class StepNode:
+    """依赖图中的一个叶子步骤"""
+
+    __slots__ = ("index", "key", "step_id", "step_type", "config", "context",
+                 "resources", "barrier", "dependencies", "started", "finished", "success")
+
+    def __init__(self, index, key, config, context, resources, barrier):
+        self.index = index
+        self.key = key
+        self.step_id = config.get('id', '未命名步骤')
+        self.step_type = config.get('type')
+        self.config = config
+        self.context = context
+        self.resources = frozenset(resources)
+        self.barrier = barrier
+        self.dependencies = set()
+        self.started = None
+        self.finished = None
+        self.success = None
+
+    @property
+    def duration(self):
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+def step_resources(step_config, type_overrides=None, context=None):
+    """确定步骤占用的资源集合及是否为屏障
+
+    Returns:
+        tuple: (资源元组, 是否屏障)
+    """
+    step_type = step_config.get('type')
+    barrier = bool(step_config.get('barrier', step_type in BARRIER_STEP_TYPES))
+    if 'resources' in step_config:
+        resources = step_config['resources']
+    elif type_overrides and step_type in type_overrides:
+        resources = type_overrides[step_type]
+    else:
+        resources = DEFAULT_STEP_RESOURCES.get(step_type, ())
+    cell = (context or {}).get(CELL_CONTEXT_KEY)
+    if cell is not None:
+        resources = [f"{CELL_RESOURCE}:{cell}" if resource == CELL_RESOURCE else resource for resource in resources]
+    return tuple(resources), barrier
+
+
+def build_step_graph(leaves, type_overrides=None):
+    """根据资源冲突、数据依赖和显式依赖构造依赖图
+
+    Args:
+        leaves: [(key, step_config, context), ...]，按串行执行顺序排列
+        type_overrides: 按步骤类型覆盖的资源表
+
+    Returns:
+        list[StepNode]: 按原顺序排列的节点，dependencies 为前驱节点下标集合
+    """
+    nodes = []
+    last_user = {}          # 资源 -> 最后占用它的节点下标
+    last_by_type = {}       # 步骤类型 -> 最后一个该类型节点下标
+    last_by_id = {}         # 步骤ID -> 最后一个该ID节点下标
+    last_barrier = None
+    since_barrier = []      # 上一个屏障之后的节点下标
+
+    for index, (key, step_config, context) in enumerate(leaves):
+        resources, barrier = step_resources(step_config, type_overrides, context)
+        node = StepNode(index, key, step_config, context, resources, barrier)
+
+        if barrier:
+            node.dependencies.update(since_barrier)
+            if last_barrier is not None:
+                node.dependencies.add(last_barrier)
+        else:
+            if last_barrier is not None:
+                node.dependencies.add(last_barrier)
+            for resource in node.resources:
+                if resource in last_user:
+                    node.dependencies.add(last_user[resource])
+            for source_type in DATA_DEPENDENCIES.get(node.step_type, ()):
+                if source_type in last_by_type:
+                    node.dependencies.add(last_by_type[source_type])
+
+        for dependency_id in step_config.get('depends_on', []):
+            if dependency_id in last_by_id:
+                node.dependencies.add(last_by_id[dependency_id])
+            else:
+                log.warning(f"步骤 {node.key} 的依赖 '{dependency_id}' 不在它之前，已忽略")
+
+        for resource in node.resources:
+            last_user[resource] = index
+        last_by_type[node.step_type] = index
+        last_by_id[node.step_id] = index
+        if barrier:
+            last_barrier = index
+            since_barrier = []
+        else:
+            since_barrier.append(index)
+        nodes.append(node)
+
+    return nodes
+
+
+class ParallelStepExecutor:
+    """按依赖图并发执行步骤，每个资源一把 asyncio.Lock
+
+    步骤本身（阻塞的设备调用）在线程池中运行；任一步骤失败后不再启动新步骤，
+    等待已开始的步骤结束后返回。
+    """
+
+    def __init__(self, nodes, dispatch):
+        """
+        Args:
+            nodes: build_step_graph 生成的节点列表
+            dispatch: 执行单个步骤的函数 dispatch(key, step_config, context) -> bool
+        """
+        self.nodes = nodes
+        self.dispatch = dispatch
+        self.failed = None
+        self.wall_time = 0.0
+
+    async def _run_node(self, node, done, locks):
+        for dependency in node.dependencies:
+            await done[dependency].wait()
+        if self.failed is not None:
+            done[node.index].set()
+            return
+
+        # 按名称顺序获取资源锁，避免死锁
+        acquired = []
+        try:
+            for resource in sorted(node.resources):
+                await locks[resource].acquire()
+                acquired.append(locks[resource])
+            if self.failed is not None:
+                return
+            node.started = time.monotonic()
+            try:
+                node.success = await asyncio.to_thread(self.dispatch, node.key, node.config, node.context)
+            except Exception as e:
+                log.error(f"步骤 {node.key} 执行异常: {e}", exc_info=True)
+                node.success = False
+            node.finished = time.monotonic()
+            if not node.success and self.failed is None:
+                self.failed = node
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            done[node.index].set()
+
+    async def run(self):
+        """执行全部节点
+
+        Returns:
+            bool: 是否全部成功
+        """
+        done = [asyncio.Event() for _ in self.nodes]
+        locks = {resource: asyncio.Lock() for node in self.nodes for resource in node.resources}
+        start = time.monotonic()
+        await asyncio.gather(*(self._run_node(node, done, locks) for node in self.nodes))
+        self.wall_time = time.monotonic() - start
+        return self.failed is None
+
+    @property
+    def serial_time(self):
+        """串行基线：所有已执行步骤耗时之和"""
+        return sum(node.duration for node in self.nodes)
+
+    def report(self):
+        """输出并行执行耗时与串行基线的对比"""
+        executed = sum(1 for node in self.nodes if node.started is not None)
+        serial = self.serial_time
+        saved = serial - self.wall_time
+        ratio = (saved / serial * 100) if serial > 0 else 0.0
+        log.info(f"[PARALLEL] 已执行 {executed}/{len(self.nodes)} 个步骤，实际耗时 {self.wall_time:.1f}s，"
+                 f"串行基线 {serial:.1f}s，节省 {saved:.1f}s ({ratio:.1f}%)")
+        return {"steps": executed, "wall_time": self.wall_time, "serial_time": serial, "saved": saved}
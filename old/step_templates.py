@@ -0,0 +1,244 @@
+"""实验步骤参数模板的预编译引擎
+
+配置加载时把每个模板字符串编译为「字面量片段 + 占位符闭包」列表，
+运行时按占位符个数求值，无需在每次步骤分发时对字符串反复 find/replace。
+
+支持的占位符与 ExperimentController 原有语义一致：
+    {{config.key}} / {{configurations.key}} / {{config.key[0]}}  -> configurations 中的值
+    {{variable}}                                              -> 上下文变量
+    {{project_name}} / {{base_path}} / {{moonraker_addr}}      -> 上下文缺失时回退到顶层配置
+整个字符串就是单个占位符时返回原始类型（数字、列表等），否则拼接为字符串。
+"""
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+_PLACEHOLDER_RE = re.compile(r'\{\{(.*?)\}\}')
+_CONFIG_PREFIXES = ("config.", "configurations.")
+TOP_LEVEL_TEMPLATE_KEYS = ("project_name", "base_path", "moonraker_addr")
+
+# 配置加载时预编译的字段：参数对象与描述文本
+_PARAM_FIELDS = ("params", "chi_params", "context_override")
+_TEXT_FIELDS = ("description", "description_suffix", "message")
+
+
+class CompiledTemplate:
+    """编译后的模板字符串
+
+    Attributes:
+        source: 原始模板字符串
+        parts: 字面量字符串与占位符求值函数交替组成的列表
+        dependencies: 模板引用的上下文变量名集合
+        single: 整个字符串是否为单个占位符
+        is_constant: 是否不含占位符
+    """
+
+    __slots__ = ("source", "parts", "dependencies", "single", "is_constant")
+
+    def __init__(self, source, parts, dependencies):
+        self.source = source
+        self.parts = parts
+        self.dependencies = frozenset(dependencies)
+        self.single = len(parts) == 1 and not isinstance(parts[0], str)
+        self.is_constant = all(isinstance(part, str) for part in parts)
+
+    def render(self, context):
+        if self.single:
+            return self.parts[0](context)
+        if self.is_constant:
+            return self.source
+        return ''.join(part if isinstance(part, str) else str(part(context)) for part in self.parts)
+
+
+class CompiledParams:
+    """编译后的参数对象（字典），嵌套字典递归编译，列表中只解析字符串元素"""
+
+    __slots__ = ("items", "dependencies")
+
+    def __init__(self, items, dependencies):
+        self.items = items
+        self.dependencies = frozenset(dependencies)
+
+    def render(self, context):
+        parsed = {}
+        for key, kind, payload in self.items:
+            if kind == "template":
+                parsed[key] = payload.render(context)
+            elif kind == "dict":
+                parsed[key] = payload.render(context)
+            elif kind == "list":
+                parsed[key] = [item.render(context) if isinstance(item, CompiledTemplate) else item for item in payload]
+            else:
+                parsed[key] = payload
+        return parsed
+
+
+_EMPTY_PARAMS = CompiledParams((), ())
+
+
+class TemplateCompiler:
+    """模板编译与缓存
+
+    编译结果按模板字符串缓存；参数对象只缓存 precompile() 登记的配置字典（按对象身份，整个运行期间保持不变），
+    分发时临时创建的字典（如 step_config.get('params', {}) 的默认值）每次重新编译，不进入缓存。
+    """
+
+    def __init__(self, config, configurations):
+        """
+        Args:
+            config: 完整的实验配置字典（用于顶层键回退）
+            configurations: configurations 字典（{{config.xxx}} 的取值来源）
+        """
+        self.config = config
+        self.configurations = configurations
+        self._templates = {}
+        self._params = {}
+
+    # ---------- 编译 ----------
+
+    def compile(self, source):
+        """编译模板字符串（带缓存）"""
+        compiled = self._templates.get(source)
+        if compiled is None:
+            compiled = self._compile_string(source)
+            self._templates[source] = compiled
+        return compiled
+
+    def _compile_string(self, source):
+        if '{{' not in source:
+            return CompiledTemplate(source, [source], ())
+
+        parts = []
+        dependencies = set()
+        pos = 0
+        for match in _PLACEHOLDER_RE.finditer(source):
+            if match.start() > pos:
+                parts.append(source[pos:match.start()])
+            node, dependency = self._compile_placeholder(match.group(0), match.group(1))
+            parts.append(node)
+            if dependency:
+                dependencies.add(dependency)
+            pos = match.end()
+        if pos < len(source):
+            parts.append(source[pos:])
+        return CompiledTemplate(source, parts, dependencies)
+
+    def _compile_placeholder(self, placeholder, expression):
+        for prefix in _CONFIG_PREFIXES:
+            if expression.startswith(prefix):
+                return self._compile_config_ref(placeholder, expression[len(prefix):]), None
+        return self._compile_context_ref(placeholder, expression), expression
+
+    def _compile_config_ref(self, placeholder, key_path):
+        # 支持简单索引，如 key[0]
+        key_parts = key_path.split('[')
+        key = key_parts[0]
+        index = None
+        if len(key_parts) > 1 and key_parts[1].endswith(']'):
+            try:
+                index = int(key_parts[1][:-1])
+            except ValueError:
+                log.warning(f"模板解析：无法解析索引 '{key_parts[1][:-1]}' 在 '{placeholder}'")
+                return placeholder
+
+        configurations = self.configurations
+
+        def resolve(context):
+            value = configurations.get(key)
+            if value is None:
+                log.warning(f"模板解析：在configurations中未找到键 '{key}' 对于 '{placeholder}'")
+                return placeholder
+            if index is not None:
+                if isinstance(value, list) and 0 <= index < len(value):
+                    return value[index]
+                log.warning(f"模板解析：索引 {index} 超出范围或值不是列表，对于键 '{key}' 在 '{placeholder}'")
+                return placeholder
+            return value
+
+        return resolve
+
+    def _compile_context_ref(self, placeholder, name):
+        config = self.config
+        top_level = name in TOP_LEVEL_TEMPLATE_KEYS
+
+        def resolve(context):
+            if name in context:
+                return context[name]
+            if top_level:
+                return config.get(name, placeholder)
+            return placeholder
+
+        return resolve
+
+    def compile_params(self, params_config, cache=False):
+        """编译参数对象
+
+        Args:
+            params_config: 参数字典
+            cache: 是否缓存编译结果（precompile() 对配置树中的字典使用）；已缓存的字典总是直接返回缓存
+        """
+        if not params_config:
+            return _EMPTY_PARAMS
+        cached = self._params.get(id(params_config))
+        if cached is not None and cached[0] is params_config:
+            return cached[1]
+
+        items = []
+        dependencies = set()
+        for key, value in params_config.items():
+            if isinstance(value, str):
+                compiled = self.compile(value)
+                items.append((key, "template", compiled))
+                dependencies |= compiled.dependencies
+            elif isinstance(value, dict):
+                compiled = self.compile_params(value, cache)
+                items.append((key, "dict", compiled))
+                dependencies |= compiled.dependencies
+            elif isinstance(value, list):
+                compiled_items = [self.compile(item) if isinstance(item, str) else item for item in value]
+                for item in compiled_items:
+                    if isinstance(item, CompiledTemplate):
+                        dependencies |= item.dependencies
+                items.append((key, "list", compiled_items))
+            else:
+                items.append((key, "value", value))
+
+        compiled = CompiledParams(items, dependencies)
+        if cache:
+            # 保存原对象引用，避免对象被回收后 id 被复用
+            self._params[id(params_config)] = (params_config, compiled)
+        return compiled
+
+    def precompile(self, node):
+        """预编译配置树中所有步骤的参数对象和描述文本
+
+        Returns:
+            int: 已编译的模板数量
+        """
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in _PARAM_FIELDS and isinstance(value, dict):
+                    self.compile_params(value, cache=True)
+                elif key in _TEXT_FIELDS and isinstance(value, str):
+                    self.compile(value)
+                else:
+                    self.precompile(value)
+        elif isinstance(node, list):
+            for item in node:
+                self.precompile(item)
+        return len(self._templates)
+
+    # ---------- 求值 ----------
+
+    def resolve(self, template_string, context):
+        """解析单个模板字符串，非字符串原样返回"""
+        if not isinstance(template_string, str):
+            return template_string
+        return self.compile(template_string).render(context)
+
+    def parse_params(self, params_config, context):
+        """解析参数对象中的所有模板，返回新的字典"""
+        if params_config is None:
+            return {}
+        return self.compile_params(params_config).render(context)
@@ -0,0 +1,105 @@
+"""启动耗时基准测试
+
+在新的解释器中用 `python -X importtime` 导入指定模块（默认 device_tester），统计总导入耗时、
+耗时最多的模块，并检查不应在启动时加载的重型模块（pandas、matplotlib、psutil、
+device_control.control_chi 等）是否被提前导入。总耗时超过预算或出现被禁止的模块时返回非零退出码，
+可以在实验室电脑上或提交前运行，防止冷启动时间回退。
+
+子进程在临时目录中运行，导入时产生的日志文件不会写入仓库目录。
+
+用法:
+    python startup_benchmark.py [--module device_tester] [--budget 3.0] [--runs 3] [--top 15]
+    python startup_benchmark.py --module old.experiment_controller --allow device_control.control_chi
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_FORBIDDEN = ["pandas", "matplotlib", "psutil", "device_control.control_chi"]
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_import(module):
+    """在新解释器中导入模块
+
+    Returns:
+        tuple: (墙钟耗时秒, {模块名: (自身耗时us, 累计耗时us, 嵌套深度)})
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=workdir, env=env, capture_output=True, text=True, encoding="utf-8", errors="replace",
+        )
+        elapsed = time.perf_counter() - started
+    if proc.returncode != 0:
+        errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"导入 {module} 失败:\n" + "\n".join(errors[-15:]))
+
+    modules = {}
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), (len(indent) - 1) // 2)
+    return elapsed, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时基准测试（基于 python -X importtime）")
+    parser.add_argument("--module", default="device_tester", help="要导入的模块")
+    parser.add_argument("--budget", type=float, default=3.0, help="导入耗时预算（秒），按多次运行中的最小值比较")
+    parser.add_argument("--runs", type=int, default=3, help="运行次数（第一次为冷启动）")
+    parser.add_argument("--top", type=int, default=15, help="列出累计耗时最多的模块数")
+    parser.add_argument("--forbid", nargs="*", default=DEFAULT_FORBIDDEN, help="启动时不应导入的模块")
+    parser.add_argument("--allow", nargs="*", default=[], help="从禁止列表中排除的模块")
+    args = parser.parse_args()
+
+    timings = []
+    modules = {}
+    for _ in range(max(1, args.runs)):
+        try:
+            elapsed, modules = measure_import(args.module)
+        except RuntimeError as e:
+            print(e)
+            return 2
+        timings.append(elapsed)
+
+    import_total = sum(self_us for self_us, _, _ in modules.values()) / 1e6
+    best = min(timings)
+    print(f"模块: {args.module}")
+    print(f"冷启动: {timings[0]:.3f} s，最佳: {best:.3f} s（{len(timings)} 次），导入耗时合计: {import_total:.3f} s，"
+          f"已导入模块: {len(modules)} 个")
+
+    top_level = sorted(((name, info) for name, info in modules.items() if info[2] == 0),
+                       key=lambda item: item[1][1], reverse=True)
+    print(f"\n累计耗时最多的顶层导入（前 {args.top} 个）:")
+    for name, (self_us, cumulative_us, _) in top_level[:args.top]:
+        print(f"  {cumulative_us / 1000:9.1f} ms  (自身 {self_us / 1000:7.1f} ms)  {name}")
+
+    forbidden = [name for name in args.forbid if name not in args.allow]
+    loaded = [blocked for blocked in forbidden
+              if any(name == blocked or name.startswith(blocked + ".") for name in modules)]
+    ok = True
+    if loaded:
+        ok = False
+        print(f"\n启动时导入了应延迟加载的模块: {', '.join(loaded)}")
+    if best > args.budget:
+        ok = False
+        print(f"\n启动耗时 {best:.3f} s 超出预算 {args.budget:.3f} s")
+    print("\n结果: " + ("通过" if ok else "未通过"))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())